@@ -1,10 +1,15 @@
-import os
 import logging
-from typing import List, Dict, Optional
+import time
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
-from openai import OpenAI, AsyncOpenAI
+from config import PRO_RESERVE_TEXT_COST
 from database import Database
 from financial_module import FinancialModule
+from llm_gateway import llm
+from financial_context import context_store
+from metrics import observe, stage_timer
+from response_stream import MESSAGE_BREAK
+from rule_parser import has_reminder_cues
 import json
 import asyncio
 try:
@@ -13,21 +18,46 @@ except ImportError:
     # Agar dateutil yo'q bo'lsa, oddiy parse funksiyasi
     parse_date = lambda x: None
 
-# OpenAI API key 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "your_api_key_here")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-
-# OpenRouter API (biznes uchun arzon variant)
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-openrouter_client = OpenAI(
-    api_key=OPENROUTER_API_KEY,
-    base_url="https://openrouter.ai/api/v1"
-) if OPENROUTER_API_KEY else openai_client
-
 # Initialize logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Promptga qo'shiladigan oxirgi xabarlar soni
+CHAT_HISTORY_WINDOW = 30
+# Xulosaga qo'shilmagan xabarlar oynadan shuncha ko'p bo'lsa, eskilari xulosaga siqiladi
+CHAT_SUMMARY_CHUNK = 20
+# Xulosaga kirmagan bo'lsa ham shundan eski xabarlar o'chiriladi (kun)
+CHAT_HISTORY_RETENTION_DAYS = 90
+# Eslatmalar shu tariflarda aniqlanadi
+REMINDER_TARIFFS = ('PLUS', 'PRO')
+WEEKDAY_NAMES = ['dushanba', 'seshanba', 'chorshanba', 'payshanba', 'juma', 'shanba', 'yakshanba']
+PRO_LIMIT_MESSAGE = (
+    "⚠️ **Xarajat limiti tugadi!**\n\n"
+    "Hozirgi oyda API xarajatlari 40,000 so'mdan oshdi.\n"
+    "Keyingi oyni kutishingiz kerak. Yoki Plus paketga o'ting."
+)
+RESPONSE_ERROR_MESSAGE = "Kechirasiz, javob berishda xatolik yuz berdi. Iltimos, qayta urinib ko'ring."
+REMINDER_SYSTEM_PROMPT = "Sen DONA AI - eslatmalarni aniqlash yordamchisisiz. Xabardan sana, vaqt, joy, shaxs va vazifani aniqlab, JSON formatida qaytarasan. Faqat JSON qaytarasan. MUHIM: Agar xabarda 'ertaga', 'bugun', 'borishim', 'ketishim', 'ko'rishisim', 'ko'rishish', 'meeting', 'eslatasan', 'eslat', 'kerak', vaqt (masalan: 20:00, 12:00) yoki joy (masalan: Dastuchi, Duxtir) bo'lsa, bu ESLATMA! Har doim has_reminder: true qaytarasan."
+
+BUSINESS_SYSTEM_PROMPT = """Sen Balans AI Biznes yordamchisisiz. Biznes egasiga moliyaviy maslahat va tahlil berasiz.
+
+QOIDALAR:
+1. O'zbek tilida javob ber
+2. Qisqa va aniq javob ber (max 5-6 gap)
+3. Raqamlarni formatlangan ko'rinishda ko'rsat (1,000,000)
+4. Amaliy tavsiyalar ber
+5. Agar ma'lumot yetarli bo'lmasa, shuni ayt
+6. Hech qachon formatlash belgilarini ishlatma (**, ##, va h.k.)
+7. Emoji ishlatishni yaxshi ko'rasan (2-3 ta)
+
+SEN QILA OLASIZ:
+- Moliyaviy tahlil qilish
+- Foyda/zarar hisoblash
+- Xarajatlarni optimallashtirish bo'yicha maslahat berish
+- Ombor tahlili qilish
+- Qarzlar holati haqida ma'lumot berish
+- Biznes strategiyasi bo'yicha maslahat berish"""
+
 
 class AIChat:
     """AI chat klassi - moliyaviy savollar va maslahatlar uchun (MAX tarif uchun)"""
@@ -35,8 +65,10 @@ class AIChat:
     def __init__(self, db=None):
         # Agar db berilmasa, yangi Database yaratish
         self.db = db if db else Database()
-        self.openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+        self.openai_client = llm.client('openai')
         self.financial_module = FinancialModule()  # AI orqali tranzaksiya aniqlash uchun
+        # Hozir xulosasi yangilanayotgan foydalanuvchilar
+        self._compacting = set()
         self.system_prompt = """Sen Balans AI ning shaxsiy buxgalter va do'stisiz. PRO tarifda.
 
 MUHIM 1: Hech qachon formatlash belgilarini ishlatma (#, **, vs). Faqat oddiy, insoniy matn.
@@ -222,8 +254,8 @@ Tillar:
                 SELECT COUNT(*) 
                 FROM transactions 
                 WHERE user_id = %s 
-                AND MONTH(created_at) = MONTH(NOW())
-                AND YEAR(created_at) = YEAR(NOW())
+                AND created_at >= DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY)
+                AND created_at < DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY) + INTERVAL 1 MONTH
                 """,
                 (user_id,)
             )
@@ -237,8 +269,8 @@ Tillar:
     async def _analyze_balance_response(self, text: str) -> Dict:
         """Balans javobini AI bilan tahlil qilish"""
         try:
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
+            response = await llm.complete(
+                'onboarding',
                 messages=[
                     {
                         "role": "system",
@@ -277,7 +309,7 @@ Javob: "500 ming"
                 temperature=0.7
             )
             
-            result_text = response.choices[0].message.content.strip()
+            result_text = response.strip()
             
             # JSON parse
             import json
@@ -306,8 +338,8 @@ Javob: "500 ming"
     async def _parse_debt_info(self, text: str) -> Dict:
         """Qarz ma'lumotlarini AI bilan parse qilish"""
         try:
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
+            response = await llm.complete(
+                'onboarding',
                 messages=[
                     {
                         "role": "system",
@@ -342,7 +374,7 @@ JSON: {"person": "Do'st", "amount": 500000, "due_date": null}"""
                 temperature=0
             )
             
-            result_text = response.choices[0].message.content.strip()
+            result_text = response.strip()
             
             # JSON parse
             import json
@@ -379,8 +411,8 @@ JSON: {"person": "Do'st", "amount": 500000, "due_date": null}"""
     async def _check_name(self, name: str) -> Dict:
         """Ismni AI bilan tekshirish - yomon so'z yoki haqorat bilan bo'lishini"""
         try:
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
+            response = await llm.complete(
+                'onboarding',
                 messages=[
                     {
                         "role": "system",
@@ -394,355 +426,55 @@ JSON: {"person": "Do'st", "amount": 500000, "due_date": null}"""
                 max_tokens=10,
                 temperature=0
             )
-            result = response.choices[0].message.content.strip().lower()
+            result = response.strip().lower()
             return {"is_valid": "valid" in result}
         except:
             # Xatolik bo'lsa ham valid qilamiz
             return {"is_valid": True}
     
     async def get_user_financial_context(self, user_id: int) -> Dict:
-        """Foydalanuvchining moliyaviy kontekstini olish"""
+        """Foydalanuvchining moliyaviy kontekstini olish (snapshot - financial_context.py)"""
         try:
-            # Balanslar
-            balances = await self.db.get_balances(user_id)
-            
-            # Oxirgi tranzaksiyalar
-            recent_transactions = await self.db.execute_query(
-                """
-                SELECT t.*
-                FROM transactions t
-                WHERE t.user_id = %s
-                ORDER BY t.created_at DESC
-                LIMIT 20
-                """,
-                (user_id,)
-            )
-            
-            # Qarzlar
-            debts = await self.db.execute_query(
-                """
-                SELECT * FROM debts 
-                WHERE user_id = %s AND status != 'paid'
-                ORDER BY created_at DESC
-                """,
-                (user_id,)
-            )
-            
-            # Oy statistikasi
-            month_stats = await self.db.execute_query(
-                """
-                SELECT 
-                    SUM(CASE WHEN transaction_type = 'income' THEN amount ELSE 0 END) as total_income,
-                    SUM(CASE WHEN transaction_type = 'expense' THEN amount ELSE 0 END) as total_expense,
-                    COUNT(*) as transaction_count
-                FROM transactions
-                WHERE user_id = %s 
-                AND MONTH(created_at) = MONTH(CURRENT_DATE)
-                AND YEAR(created_at) = YEAR(CURRENT_DATE)
-                """,
-                (user_id,)
-            )
-            
-            # Bugungi xarajatlar
-            today_expenses = await self.db.execute_query(
-                """
-                SELECT SUM(amount) as today_total
-                FROM transactions
-                WHERE user_id = %s AND transaction_type = 'expense'
-                AND DATE(created_at) = CURDATE()
-                """,
-                (user_id,)
-            )
-            
-            # O'tgan kunga nisbatan o'sish/kamayish
-            yesterday_expenses = await self.db.execute_query(
-                """
-                SELECT SUM(amount) as yesterday_total
-                FROM transactions
-                WHERE user_id = %s AND transaction_type = 'expense'
-                AND DATE(created_at) = DATE_SUB(CURDATE(), INTERVAL 1 DAY)
-                """,
-                (user_id,)
-            )
-            
-            # Bugungi kategoriyalar bo'yicha xarajatlar (takrorlanishni aniqlash uchun)
-            today_by_category = await self.db.execute_query(
-                """
-                SELECT category, COUNT(*) as count, SUM(amount) as total
-                FROM transactions
-                WHERE user_id = %s AND transaction_type = 'expense'
-                AND DATE(created_at) = CURDATE()
-                GROUP BY category
-                ORDER BY total DESC
-                """,
-                (user_id,)
-            )
-            
-            # Haftalik statistikalar
-            week_stats = await self.db.execute_query(
-                """
-                SELECT 
-                    SUM(CASE WHEN transaction_type = 'income' THEN amount ELSE 0 END) as total_income,
-                    SUM(CASE WHEN transaction_type = 'expense' THEN amount ELSE 0 END) as total_expense,
-                    COUNT(*) as transaction_count
-                FROM transactions
-                WHERE user_id = %s 
-                AND created_at >= DATE_SUB(CURDATE(), INTERVAL 7 DAY)
-                """,
-                (user_id,)
-            )
-            
-            # Haftalik kategoriyalar bo'yicha xarajatlar
-            week_by_category = await self.db.execute_query(
-                """
-                SELECT category, SUM(amount) as total, COUNT(*) as count
-                FROM transactions
-                WHERE user_id = %s AND transaction_type = 'expense'
-                AND created_at >= DATE_SUB(CURDATE(), INTERVAL 7 DAY)
-                GROUP BY category
-                ORDER BY total DESC
-                LIMIT 10
-                """,
-                (user_id,)
-            )
-            
-            # Eng katta xarajatlar (top 5)
-            top_expenses = await self.db.execute_query(
-                """
-                SELECT amount, category, description, created_at
-                FROM transactions
-                WHERE user_id = %s AND transaction_type = 'expense'
-                ORDER BY amount DESC
-                LIMIT 5
-                """,
-                (user_id,)
-            )
-            
-            # Eng katta daromadlar (top 5)
-            top_incomes = await self.db.execute_query(
-                """
-                SELECT amount, category, description, created_at
-                FROM transactions
-                WHERE user_id = %s AND transaction_type = 'income'
-                ORDER BY amount DESC
-                LIMIT 5
-                """,
-                (user_id,)
-            )
-            
-            # Oylik kategoriyalar bo'yicha xarajatlar
-            month_by_category = await self.db.execute_query(
-                """
-                SELECT category, SUM(amount) as total, COUNT(*) as count
-                FROM transactions
-                WHERE user_id = %s AND transaction_type = 'expense'
-                AND MONTH(created_at) = MONTH(CURRENT_DATE)
-                AND YEAR(created_at) = YEAR(CURRENT_DATE)
-                GROUP BY category
-                ORDER BY total DESC
-                """,
-                (user_id,)
-            )
-            
-            # month_stats tuple bo'lishi mumkin, uni dict ga o'tkazish kerak
-            month_stats_dict = {}
-            if month_stats and month_stats[0]:
-                stat = month_stats[0]
-                if isinstance(stat, tuple):
-                    # (total_income, total_expense, transaction_count)
-                    month_stats_dict = {
-                        'total_income': float(stat[0]) if len(stat) > 0 and stat[0] else 0,
-                        'total_expense': float(stat[1]) if len(stat) > 1 and stat[1] else 0,
-                        'transaction_count': int(stat[2]) if len(stat) > 2 and stat[2] else 0,
-                    }
-                elif isinstance(stat, dict):
-                    month_stats_dict = stat
-                else:
-                    month_stats_dict = {}
-            
-            # today_expenses tuple
-            today_exp = 0
-            if today_expenses and today_expenses[0]:
-                exp = today_expenses[0]
-                if isinstance(exp, tuple):
-                    today_exp = float(exp[0]) if len(exp) > 0 and exp[0] else 0
-                elif isinstance(exp, dict):
-                    today_exp = exp.get('today_total', 0) or 0
-            
-            # yesterday_expenses tuple
-            yesterday_exp = 0
-            if yesterday_expenses and yesterday_expenses[0]:
-                exp = yesterday_expenses[0]
-                if isinstance(exp, tuple):
-                    yesterday_exp = float(exp[0]) if len(exp) > 0 and exp[0] else 0
-                elif isinstance(exp, dict):
-                    yesterday_exp = exp.get('yesterday_total', 0) or 0
-            
-            # today_by_category ni dict ga o'tkazish
-            today_category_data = {}
-            if today_by_category:
-                for item in today_by_category:
-                    if isinstance(item, tuple):
-                        category = item[0] if len(item) > 0 else ''
-                        count = item[1] if len(item) > 1 else 0
-                        total = float(item[2]) if len(item) > 2 and item[2] else 0
-                    elif isinstance(item, dict):
-                        category = item.get('category', '')
-                        count = item.get('count', 0)
-                        total = float(item.get('total', 0)) or 0
-                    else:
-                        continue
-                    if category:
-                        today_category_data[category] = {'count': count, 'total': total}
-            
-            # week_stats ni dict ga o'tkazish
-            week_stats_dict = {}
-            if week_stats and week_stats[0]:
-                stat = week_stats[0]
-                if isinstance(stat, tuple):
-                    week_stats_dict = {
-                        'total_income': float(stat[0]) if len(stat) > 0 and stat[0] else 0,
-                        'total_expense': float(stat[1]) if len(stat) > 1 and stat[1] else 0,
-                        'transaction_count': int(stat[2]) if len(stat) > 2 and stat[2] else 0,
-                    }
-                elif isinstance(stat, dict):
-                    week_stats_dict = stat
-            
-            # week_by_category ni list ga o'tkazish
-            week_category_data = []
-            if week_by_category:
-                for item in week_by_category:
-                    if isinstance(item, tuple):
-                        week_category_data.append({
-                            'category': item[0] if len(item) > 0 else '',
-                            'total': float(item[1]) if len(item) > 1 and item[1] else 0,
-                            'count': int(item[2]) if len(item) > 2 and item[2] else 0,
-                        })
-                    elif isinstance(item, dict):
-                        week_category_data.append({
-                            'category': item.get('category', ''),
-                            'total': float(item.get('total', 0)) or 0,
-                            'count': int(item.get('count', 0)) or 0,
-                        })
-            
-            # top_expenses ni list ga o'tkazish
-            top_expenses_list = []
-            if top_expenses:
-                for item in top_expenses:
-                    if isinstance(item, tuple):
-                        top_expenses_list.append({
-                            'amount': float(item[0]) if len(item) > 0 and item[0] else 0,
-                            'category': item[1] if len(item) > 1 else '',
-                            'description': item[2] if len(item) > 2 else '',
-                            'created_at': item[3] if len(item) > 3 else None,
-                        })
-                    elif isinstance(item, dict):
-                        top_expenses_list.append({
-                            'amount': float(item.get('amount', 0)) or 0,
-                            'category': item.get('category', ''),
-                            'description': item.get('description', ''),
-                            'created_at': item.get('created_at'),
-                        })
-            
-            # top_incomes ni list ga o'tkazish
-            top_incomes_list = []
-            if top_incomes:
-                for item in top_incomes:
-                    if isinstance(item, tuple):
-                        top_incomes_list.append({
-                            'amount': float(item[0]) if len(item) > 0 and item[0] else 0,
-                            'category': item[1] if len(item) > 1 else '',
-                            'description': item[2] if len(item) > 2 else '',
-                            'created_at': item[3] if len(item) > 3 else None,
-                        })
-                    elif isinstance(item, dict):
-                        top_incomes_list.append({
-                            'amount': float(item.get('amount', 0)) or 0,
-                            'category': item.get('category', ''),
-                            'description': item.get('description', ''),
-                            'created_at': item.get('created_at'),
-                        })
-            
-            # month_by_category ni list ga o'tkazish
-            month_category_data = []
-            if month_by_category:
-                for item in month_by_category:
-                    if isinstance(item, tuple):
-                        month_category_data.append({
-                            'category': item[0] if len(item) > 0 else '',
-                            'total': float(item[1]) if len(item) > 1 and item[1] else 0,
-                            'count': int(item[2]) if len(item) > 2 and item[2] else 0,
-                        })
-                    elif isinstance(item, dict):
-                        month_category_data.append({
-                            'category': item.get('category', ''),
-                            'total': float(item.get('total', 0)) or 0,
-                            'count': int(item.get('count', 0)) or 0,
-                        })
-            
-            context = {
-                "balances": balances,
-                "recent_transactions": recent_transactions if recent_transactions else [],
-                "debts": debts if debts else [],
-                "month_stats": month_stats_dict,
-                "week_stats": week_stats_dict,
-                "today_expenses": today_exp,
-                "yesterday_expenses": yesterday_exp,
-                "today_category_data": today_category_data,
-                "week_category_data": week_category_data,
-                "month_category_data": month_category_data,
-                "top_expenses": top_expenses_list,
-                "top_incomes": top_incomes_list,
-            }
-            
-            return context
-            
+            return await context_store(self.db).get(user_id)
         except Exception as e:
             logger.error(f"Error getting financial context: {e}")
             return {}
 
-    async def get_chat_history(self, user_id: int, limit: int = None) -> List[Dict]:
-        """Chat tarixini olish - Pro tarifda barcha xabarlarni"""
+    async def get_chat_history(self, user_id: int, limit: int = CHAT_HISTORY_WINDOW,
+                               after_id: int = 0) -> List[Dict]:
+        """Chat tarixidan oxirgi limit ta xabar (after_id dan keyingilari), eskisidan boshlab"""
         try:
-            # Pro tarifda limit yo'q - barcha xabarlar
-            if limit is None:
-                history = await self.db.execute_query(
-                    """
-                    SELECT role, content, created_at
-                    FROM ai_chat_history
-                    WHERE user_id = %s
-                    ORDER BY created_at ASC
-                    """,
-                    (user_id,)
-                )
-            else:
-                history = await self.db.execute_query(
-                    """
-                    SELECT role, content, created_at
-                    FROM ai_chat_history
-                    WHERE user_id = %s
-                    ORDER BY created_at DESC
-                    LIMIT %s
-                    """,
-                    (user_id, limit)
-                )
-                if history:
-                    history_list = list(history)
-                    history_list.reverse()
-                    history = history_list
-            
-            if not history:
-                return []
-            
+            history = await self.db.execute_query(
+                """
+                SELECT id, role, content, created_at
+                FROM ai_chat_history
+                WHERE user_id = %s AND id > %s
+                ORDER BY id DESC
+                LIMIT %s
+                """,
+                (user_id, after_id, limit)
+            )
             return [
-                {"role": h[0], "content": h[1], "created_at": h[2]} 
-                for h in history
+                {"id": h["id"], "role": h["role"], "content": h["content"], "created_at": h["created_at"]}
+                for h in reversed(history or [])
             ]
             
         except Exception as e:
             logger.error(f"Error getting chat history: {e}")
             return []
     
+    async def get_chat_summary(self, user_id: int) -> Dict:
+        """Eski xabarlar xulosasi: {'summary', 'summarized_until_id'}"""
+        try:
+            row = await self.db.execute_one(
+                "SELECT summary, summarized_until_id FROM ai_chat_summaries WHERE user_id = %s",
+                (user_id,)
+            )
+        except Exception as e:
+            logger.error(f"Error getting chat summary: {e}")
+            row = None
+        return row or {"summary": "", "summarized_until_id": 0}
+    
     async def save_to_history(self, user_id: int, role: str, content: str):
         """Chat tarixiga saqlash"""
         try:
@@ -756,102 +488,321 @@ JSON: {"person": "Do'st", "amount": 500000, "due_date": null}"""
         except Exception as e:
             logger.error(f"Error saving to history: {e}")
     
-    async def generate_response(self, user_id: int, question: str) -> List[str]:
-        """AI javob generatsiya qilish - Pro tarif uchun optimallashtirilgan"""
+    async def save_turn_to_history(self, user_id: int, question: str, answer: str):
+        """Savol va javobni bitta INSERT bilan saqlash"""
         try:
-            # 40,000 so'm limitini tekshirish
-            from datetime import datetime
-            month_year = datetime.now().strftime('%Y-%m')
-            usage = await self.db.get_or_create_pro_usage(user_id, month_year)
-            
-            if usage['total_cost'] >= 40000:
-                return [
-                    f"⚠️ **Xarajat limiti tugadi!**\n\n"
-                    f"Hozirgi oyda API xarajatlari 40,000 so'mdan oshdi.\n"
-                    f"Keyingi oyni kutishingiz kerak. Yoki Plus paketga o'ting."
-                ]
-            
-            # Foydalanuvchi ma'lumotlari
-            user_info = await self.get_user_info(user_id)
-            user_name = user_info.get("name", "Do'st")
-            
-            # Tranzaksiya aniqlash va saqlash
-            transaction = await self.detect_and_save_transaction(question, user_id)
-            
-            # Eslatma aniqlash va saqlash
-            reminder = await self.detect_and_save_reminder(user_id, question)
+            await self.db.execute_query(
+                """
+                INSERT INTO ai_chat_history (user_id, role, content, created_at)
+                VALUES (%s, 'user', %s, NOW()), (%s, 'assistant', %s, NOW())
+                """,
+                (user_id, question, user_id, answer)
+            )
+        except Exception as e:
+            logger.error(f"Error saving to history: {e}")
+    
+    async def compact_chat_history(self, user_id: int, summary: str, old_messages: List[Dict]):
+        """Oynadan chiqqan xabarlarni xulosaga qo'shish va ularni jadvaldan o'chirish"""
+        if user_id in self._compacting:
+            return
+        self._compacting.add(user_id)
+        try:
+            dialogue = "\n".join(
+                f"{'Foydalanuvchi' if m['role'] == 'user' else 'Bot'}: {m['content'][:500]}"
+                for m in old_messages
+            )
+            with llm.track_usage() as usage:
+                new_summary = await llm.complete(
+                    'chat_summary',
+                    [
+                        {"role": "system", "content": (
+                            "Foydalanuvchi va moliyaviy bot suhbatining yig'ma xulosasini yangila. "
+                            "Faqat keyingi suhbatlar uchun foydali faktlarni saqla: odatlar, rejalar, "
+                            "maqsadlar, qarzlar, muhim xarajatlar, foydalanuvchi afzalliklari. "
+                            "Oddiy matn, 800 belgidan oshmasin."
+                        )},
+                        {"role": "user", "content": f"Hozirgi xulosa:\n{summary or '-'}\n\nYangi xabarlar:\n{dialogue}"}
+                    ],
+                    max_tokens=300,
+                    temperature=0.2
+                )
+            # Xulosa ham Pro xarajatiga kiradi (alohida xabar sifatida sanalmaydi)
+            await self.db.charge_llm_usage(user_id, usage, 'text', count=0)
+            until_id = old_messages[-1]["id"]
+            await self.db.execute_query(
+                """
+                INSERT INTO ai_chat_summaries (user_id, summary, summarized_until_id) VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE summary = VALUES(summary), summarized_until_id = VALUES(summarized_until_id)
+                """,
+                (user_id, new_summary.strip(), until_id)
+            )
+            # Xulosaga kirgan xabarlar endi o'qilmaydi
+            await self.db.execute_query(
+                "DELETE FROM ai_chat_history WHERE user_id = %s AND id <= %s",
+                (user_id, until_id)
+            )
+        except Exception as e:
+            logger.error(f"Error compacting chat history for {user_id}: {e}")
+        finally:
+            self._compacting.discard(user_id)
+    
+    async def purge_chat_history(self, retention_days: int = CHAT_HISTORY_RETENTION_DAYS,
+                                 batch_size: int = 5000) -> int:
+        """Retention: eski xabarlarni partiyalab o'chirish. O'chirilgan qatorlar sonini qaytaradi"""
+        cutoff = datetime.now() - timedelta(days=retention_days)
+        deleted = 0
+        while True:
+            count = await self.db.execute_update(
+                "DELETE FROM ai_chat_history WHERE created_at < %s LIMIT %s",
+                (cutoff, batch_size)
+            )
+            deleted += count
+            if count < batch_size:
+                return deleted
+            await asyncio.sleep(0.1)
+    
+    async def _load_chat(self, user_id: int) -> Tuple[Dict, List[Dict]]:
+        """Eski suhbatlar xulosasi + xulosaga kirmagan oxirgi xabarlar"""
+        chat_summary = await self.get_chat_summary(user_id)
+        chat_history = await self.get_chat_history(
+            user_id,
+            limit=CHAT_HISTORY_WINDOW + CHAT_SUMMARY_CHUNK,
+            after_id=chat_summary["summarized_until_id"]
+        )
+        return chat_summary, chat_history
+    
+    async def _detect_for_user(self, user_id: int, message: str, today: datetime) -> Tuple[Optional[Dict], Optional[Dict]]:
+        """Tarifni aniqlab, tranzaksiya va eslatmani aniqlash (saqlamasdan)"""
+        tariff = await self.db.get_active_tariff(user_id)
+        return await self.detect_intents(message, tariff in REMINDER_TARIFFS, today)
+    
+    async def _prepare_turn(self, user_id: int, question: str, timings: Dict) -> Optional[Dict]:
+        """Asosiy javobgacha bo'lgan bosqichlar. Oylik limit tugagan bo'lsa None
+        
+        - prepare: limitdan band qilish (reserve_pro_usage), keyin ism, chat tarixi va
+          kontekst snapshoti parallel; shu vaqtda tranzaksiya+eslatma aniqlash so'rovi ham ketadi
+        - detect: aniqlash so'rovining qolgan qismi
+        - save: tranzaksiya va eslatma parallel saqlanadi
+        - context: snapshot (yangi tranzaksiya joyida qo'shilgan) va matn
+        """
+        today = datetime.now()
+        month_year = today.strftime('%Y-%m')
+        
+        # Aniqlash eng uzun bosqich - birinchi bo'lib fonda boshlanadi
+        detection = asyncio.create_task(self._detect_for_user(user_id, question, today))
+        reserved = False
+        try:
+            with stage_timer('ai_chat.prepare', timings):
+                # Oylik limit SQL da tekshiriladi - parallel xabarlar eskirgan o'qishdan o'tmaydi
+                reserved = await self.db.reserve_pro_usage(user_id, 'text', PRO_RESERVE_TEXT_COST, month_year)
+                if not reserved:
+                    return None
+                user_info, (chat_summary, chat_history), _ = await asyncio.gather(
+                    self.get_user_info(user_id),
+                    self._load_chat(user_id),
+                    # Snapshotni isitish - context bosqichida bazaga bormaydi
+                    self.get_user_financial_context(user_id),
+                )
             
-            # Moliyaviy kontekstni olish
+            with stage_timer('ai_chat.detect', timings):
+                extraction, reminder_result = await detection
+        except Exception:
+            if reserved:
+                await self._release_turn(user_id, month_year, {})
+            raise
+        finally:
+            if not detection.done():
+                detection.cancel()
+        
+        user_name = user_info.get("name", "Do'st")
+        
+        # Tranzaksiya va eslatmani saqlash
+        with stage_timer('ai_chat.save', timings):
+            transaction, reminder = await asyncio.gather(
+                self._save_detected_transaction(question, user_id, extraction),
+                self._save_detected_reminder(user_id, question, reminder_result, today),
+                return_exceptions=True
+            )
+        if isinstance(reminder, Exception):
+            logger.error(f"Error saving reminder: {reminder}")
+            reminder = None
+        
+        # Moliyaviy kontekstni olish va matn shakliga o'tkazish
+        with stage_timer('ai_chat.context', timings):
             context = await self.get_user_financial_context(user_id)
-            
-            # Kontekstni matn shakliga o'tkazish
             context_text = self._format_context(context)
-            
-            # BARCHA chat history ni olish (limit yo'q - barcha xabarlar)
-            chat_history = await self.get_chat_history(user_id, limit=None)
-            
-            # Messages tayyorlash
-            messages = [{"role": "system", "content": self.system_prompt}]
-            
-            # Kontekstni qo'shish
+        
+        # Messages tayyorlash
+        messages = [{"role": "system", "content": self.system_prompt}]
+        
+        # Kontekstni qo'shish
+        messages.append({
+            "role": "system", 
+            "content": f"Foydalanuvchi ismi: {user_name}\n\nFoydalanuvchining joriy moliyaviy holati:\n{context_text}"
+        })
+        
+        if chat_summary["summary"]:
             messages.append({
-                "role": "system", 
-                "content": f"Foydalanuvchi ismi: {user_name}\n\nFoydalanuvchining joriy moliyaviy holati:\n{context_text}"
+                "role": "system",
+                "content": f"Oldingi suhbatlar xulosasi:\n{chat_summary['summary']}"
             })
+        
+        # Oxirgi xabarlarni qo'shish - AI yaqin suhbatni eslab qolishi uchun
+        for hist in chat_history[-CHAT_HISTORY_WINDOW:]:
+            messages.append({
+                "role": hist["role"],
+                "content": hist["content"]
+            })
+        
+        # Foydalanuvchi savolini qo'shish
+        messages.append({"role": "user", "content": question})
+        
+        return {
+            "messages": messages,
+            "month_year": month_year,
+            "chat_summary": chat_summary,
+            "chat_history": chat_history,
+            "reminder": reminder,
+        }
+    
+    async def _finish_turn(self, user_id: int, question: str, turn: Dict, ai_response: str, timings: Dict,
+                           usage: Dict):
+        """Javobdan keyin: xarajat va chat tarixi (persist), kerak bo'lsa xulosaga siqish
+        
+        usage - xabar davomidagi llm.track_usage() lug'ati (aniqlash + javob):
+        _prepare_turn da band qilingan summa haqiqiy token narxiga almashtiriladi.
+        """
+        with stage_timer('ai_chat.persist', timings):
+            await asyncio.gather(
+                self.db.charge_llm_usage(user_id, usage, 'text', month_year=turn["month_year"],
+                                         reserved=PRO_RESERVE_TEXT_COST),
+                self.save_turn_to_history(user_id, question, ai_response)
+            )
+        
+        # Oynadan chiqqan xabarlar yetarli to'plangan bo'lsa - fonda xulosaga siqish
+        chat_history = turn["chat_history"]
+        if len(chat_history) >= CHAT_HISTORY_WINDOW + CHAT_SUMMARY_CHUNK:
+            asyncio.create_task(self.compact_chat_history(
+                user_id, turn["chat_summary"]["summary"], chat_history[:-CHAT_HISTORY_WINDOW]
+            ))
+    
+    async def _release_turn(self, user_id: int, month_year: str, usage: Dict):
+        """Javob berilmadi: band qilingan summa o'rniga faqat haqiqiy sarf yoziladi (xabar sanalmaydi)"""
+        try:
+            await self.db.charge_llm_usage(user_id, usage, 'text', month_year=month_year,
+                                           reserved=PRO_RESERVE_TEXT_COST, count=0)
+        except Exception as e:
+            logger.error(f"Error releasing Pro reservation: {e}")
+    
+    @staticmethod
+    def _reminder_note(reminder: Dict) -> str:
+        return f"✅ Eslatmalarga qo'shdim: {reminder.get('title', 'Eslatma')} - {reminder.get('days_text', 'bugun')} eslataman."
+    
+    @staticmethod
+    def _log_timings(user_id: int, timings: Dict, started: float):
+        """Bosqichlar vaqti: ai_chat.total gistogrammasi va xabar bo'yicha bitta log qatori"""
+        total_ms = (time.perf_counter() - started) * 1000
+        observe('ai_chat.total', total_ms)
+        stages = ", ".join(f"{stage.split('.', 1)[1]} {ms:.0f}ms" for stage, ms in timings.items())
+        logger.info(f"AI chat {user_id}: {stages}; jami {total_ms:.0f}ms")
+    
+    async def generate_response(self, user_id: int, question: str) -> List[str]:
+        """AI javob generatsiya qilish - Pro tarif uchun optimallashtirilgan
+        
+        Bosqichlar (_prepare_turn, completion, _finish_turn) ai_chat.*
+        gistogrammalariga yoziladi va xabar bo'yicha bitta log qatorida chiqadi.
+        """
+        timings = {}
+        started = time.perf_counter()
+        try:
+            with llm.track_usage() as usage:
+                turn = await self._prepare_turn(user_id, question, timings)
+                if turn is None:
+                    return [PRO_LIMIT_MESSAGE]
+                
+                # 'chat' vazifasi uchun eng arzon mos model
+                try:
+                    with stage_timer('ai_chat.completion', timings):
+                        ai_response = await llm.complete(
+                            'chat',
+                            turn["messages"],
+                            max_tokens=300,  # Qisqa javob uchun kamaytirildi
+                            temperature=0.8
+                        )
+                except Exception:
+                    await self._release_turn(user_id, turn["month_year"], usage)
+                    raise
             
-            # BARCHA chat history ni qo'shish - AI eski xabarlarni eslab qolishi uchun
-            for hist in chat_history[-50:]:  # Oxirgi 50 ta xabarni qo'shish (token limit uchun)
-                messages.append({
-                    "role": hist["role"],
-                    "content": hist["content"]
-                })
-            
-            # Foydalanuvchi savolini qo'shish
-            messages.append({"role": "user", "content": question})
-            
-            # OpenAI API chaqiruvi
-            def call_openai():
-                response = openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=messages,
-                    max_tokens=300,  # Qisqa javob uchun kamaytirildi
-                    temperature=0.8
-                )
-                return response.choices[0].message.content
-            
-            loop = asyncio.get_event_loop()
-            ai_response = await loop.run_in_executor(None, call_openai)
-            
-            # API xarajatini hisoblash (taxminan 1 matn xabari = 10-50 so'm)
-            # GPT-4o-mini narxi: input $0.15/1M tokens, output $0.60/1M tokens
-            # 1 token ≈ 4 belgi, 1 xabar ≈ 100 token = $0.00006 ≈ 0.6 so'm
-            # Lekin xavfsiz uchun 10 so'm deb olamiz
-            estimated_cost = 10.0
-            
-            # Xarajatni saqlash
-            await self.db.increment_pro_usage(user_id, 'text', estimated_cost, month_year)
-            
-            # Chat history ga saqlash
-            await self.save_to_history(user_id, "user", question)
-            await self.save_to_history(user_id, "assistant", ai_response)
+            await self._finish_turn(user_id, question, turn, ai_response, timings, usage)
             
             # AI o'zi bir nechta xabar kerakligini tushunsin - smart splitting
             messages_list = self._split_response_smart(ai_response, question)
             
             # Agar eslatma qo'shilgan bo'lsa, xabar qo'shish
-            if reminder:
-                reminder_text = f"✅ Eslatmalarga qo'shdim: {reminder.get('title', 'Eslatma')} - {reminder.get('days_text', 'bugun')} eslataman."
-                messages_list.append(reminder_text)
+            if turn["reminder"]:
+                messages_list.append(self._reminder_note(turn["reminder"]))
             
             return messages_list
             
         except Exception as e:
             logger.error(f"Error generating response: {e}")
-            return ["Kechirasiz, javob berishda xatolik yuz berdi. Iltimos, qayta urinib ko'ring."]
+            return [RESPONSE_ERROR_MESSAGE]
+        finally:
+            self._log_timings(user_id, timings, started)
     
-    def _split_response_smart(self, response: str, question: str) -> List[str]:
-        """AI javobini smart bo'lish - faqat kerakli vaqtda ko'p xabar"""
-        # Formatlash belgilarini olib tashlash
+    async def generate_response_stream(self, user_id: int, question: str) -> AsyncIterator[str]:
+        """generate_response ning oqimli varianti - javob matni bo'laklari
+        
+        Eslatma matni alohida xabar sifatida MESSAGE_BREAK dan keyin keladi.
+        Bo'lish uchun TelegramStreamer ga split_final=_split_response_smart va
+        split_stable=_split_response_stable beriladi. Birinchi token vaqti
+        ai_chat.first_token gistogrammasiga yoziladi.
+        """
+        timings = {}
+        started = time.perf_counter()
+        try:
+            # Token sarfi oqimning oxirgi bo'lagida keladi - blok oqim tugagach yopiladi
+            with llm.track_usage() as usage:
+                try:
+                    turn = await self._prepare_turn(user_id, question, timings)
+                except Exception as e:
+                    logger.error(f"Error generating response: {e}")
+                    yield RESPONSE_ERROR_MESSAGE
+                    return
+                if turn is None:
+                    yield PRO_LIMIT_MESSAGE
+                    return
+                
+                parts = []
+                try:
+                    with stage_timer('ai_chat.completion', timings):
+                        async for delta in llm.stream_chat(
+                            turn["messages"],
+                            task='chat',
+                            max_tokens=300,
+                            temperature=0.8
+                        ):
+                            if not parts:
+                                timings['ai_chat.first_token'] = (time.perf_counter() - started) * 1000
+                                observe('ai_chat.first_token', timings['ai_chat.first_token'])
+                            parts.append(delta)
+                            yield delta
+                except Exception as e:
+                    logger.error(f"Error streaming response: {e}")
+                    if not parts:
+                        await self._release_turn(user_id, turn["month_year"], usage)
+                        yield RESPONSE_ERROR_MESSAGE
+                        return
+            
+            await self._finish_turn(user_id, question, turn, "".join(parts), timings, usage)
+            if turn["reminder"]:
+                yield MESSAGE_BREAK + self._reminder_note(turn["reminder"])
+        finally:
+            self._log_timings(user_id, timings, started)
+    
+    @staticmethod
+    def _clean_response(response: str) -> str:
+        """Formatlash belgilarini olib tashlash"""
         cleaned = response
         cleaned = cleaned.replace('### ', '')
         cleaned = cleaned.replace('**', '')
@@ -859,15 +810,40 @@ JSON: {"person": "Do'st", "amount": 500000, "due_date": null}"""
         cleaned = cleaned.replace('Tahlil:', '')
         cleaned = cleaned.replace('Taklif:', '')
         cleaned = cleaned.replace('Tavsiya:', '')
-        cleaned = cleaned.strip()
+        return cleaned.strip()
+    
+    @staticmethod
+    def _split_sentences(cleaned: str) -> Tuple[List[str], str]:
+        """Qatorlarni ajratish (. ! ? dan keyin): (tugagan gaplar, oxirgi tugamagan qism)"""
+        sentences = []
+        current = ""
+        
+        for char in cleaned:
+            current += char
+            if char in '.!?' and len(current.strip()) > 15:
+                sent = current.strip()
+                sent = sent.replace('###', '').replace('**', '')
+                if sent:
+                    sentences.append(sent)
+                current = ""
+        return sentences, current
+    
+    @staticmethod
+    def _is_greeting(question: str) -> bool:
+        greeting_keywords = ['qalaysiz', 'nima yangiliklar', 'qanday yordam', 'salom', 'assalomu alaykum', 'hello', 'hi']
+        return any(keyword in question.lower() for keyword in greeting_keywords)
+    
+    def _split_response_smart(self, response: str, question: str) -> List[str]:
+        """AI javobini smart bo'lish - faqat kerakli vaqtda ko'p xabar"""
+        # Formatlash belgilarini olib tashlash
+        cleaned = self._clean_response(response)
         
         # Agar javob qisqa bo'lsa (100 belgidan kam), bitta xabar
         if len(cleaned) <= 100:
             return [cleaned]
         
         # Salomlashish yoki oddiy suhbat savoli bo'lsa - 1 xabar
-        greeting_keywords = ['qalaysiz', 'nima yangiliklar', 'qanday yordam', 'salom', 'assalomu alaykum', 'hello', 'hi']
-        if any(keyword in question.lower() for keyword in greeting_keywords):
+        if self._is_greeting(question):
             # Qisqa javob
             sentences = cleaned.split('.')
             if sentences:
@@ -882,17 +858,7 @@ JSON: {"person": "Do'st", "amount": 500000, "due_date": null}"""
             return [cleaned]
         
         # Qatorlarni ajratish (. ! ? dan keyin)
-        sentences = []
-        current = ""
-        
-        for char in cleaned:
-            current += char
-            if char in '.!?' and len(current.strip()) > 15:
-                sent = current.strip()
-                sent = sent.replace('###', '').replace('**', '')
-                if sent:
-                    sentences.append(sent)
-                current = ""
+        sentences, current = self._split_sentences(cleaned)
         
         if current.strip():
             sent = current.strip()
@@ -921,42 +887,43 @@ JSON: {"person": "Do'st", "amount": 500000, "due_date": null}"""
         
         return messages if messages else [cleaned]
     
+    def _split_response_stable(self, partial: str, question: str) -> Tuple[List[str], str]:
+        """Oqim davomida _split_response_smart: (endi o'zgarmaydigan xabarlar, qolgan matn)
+        
+        Xabar faqat javob davomi qanday bo'lmasin _split_response_smart
+        natijasining boshi bo'lib qoladigan holatda yakunlanadi: salomlashish
+        emas, matn 200 belgidan uzun va kamida 3 ta tugagan gap bor. Shunda
+        gaplar ikkitadan guruhlanadi - tugagan har bir juftlik tayyor xabar.
+        """
+        cleaned = self._clean_response(partial)
+        if self._is_greeting(question) or len(cleaned) <= 200:
+            return [], cleaned
+        sentences, current = self._split_sentences(cleaned)
+        if len(sentences) < 3:
+            return [], cleaned
+        ready = len(sentences) // 2 * 2
+        messages = [
+            " ".join(sentences[i:i + 2]).replace('###', '').replace('**', '').strip()
+            for i in range(0, ready, 2)
+        ]
+        rest = " ".join(sentences[ready:] + [current.strip()]).strip()
+        return messages, rest
+    
     def _split_response(self, response: str) -> List[str]:
         """Eski metod - backwards compatibility"""
         return self._split_response_smart(response, "")
     
-    async def detect_and_save_reminder(self, user_id: int, message: str) -> Optional[Dict]:
-        """Xabardan eslatmani aniqlash va saqlash - AI orqali (DONA AI)
+    def _reminder_prompt(self, message: str, today: datetime) -> str:
+        """DONA AI eslatma prompti - sana, vaqt, joy, shaxs, vazifani ajratish"""
+        current_date = today.strftime('%Y-%m-%d')
+        current_time = today.strftime('%H:%M')
+        current_weekday = WEEKDAY_NAMES[today.weekday()]
         
-        Misol xabarlar:
-        - "Ertaga soat 11:00 do'stim bilan Hamkor bankka boramiz"
-        - "Har dushanba 19:00 darsim bor"
-        - "28-dekabr mijoz bilan uchrashuv"
-        """
-        try:
-            from datetime import datetime, timedelta
-            import re
-            
-            # Tarifni tekshirish
-            tariff = await self.db.get_active_tariff(user_id)
-            
-            # Plus va Pro uchun eslatmalar
-            if tariff not in ('PLUS', 'PRO'):
-                # Free tarif uchun eslatma yo'q
-                return None
-            
-            # DONA AI eslatma prompt - sana, vaqt, joy, shaxs, vazifani ajratish
-            today = datetime.now()
-            current_date = today.strftime('%Y-%m-%d')
-            current_time = today.strftime('%H:%M')
-            weekday_names = ['dushanba', 'seshanba', 'chorshanba', 'payshanba', 'juma', 'shanba', 'yakshanba']
-            current_weekday = weekday_names[today.weekday()]
-            
-            # Sana hisoblash
-            tomorrow = (today + timedelta(days=1))
-            tomorrow_str = tomorrow.strftime('%Y-%m-%d')
-            
-            reminder_prompt = f"""Xabardan eslatma bor-yo'qligini aniqlab, agar bor bo'lsa JSON qaytaring.
+        # Sana hisoblash
+        tomorrow = (today + timedelta(days=1))
+        tomorrow_str = tomorrow.strftime('%Y-%m-%d')
+        
+        return f"""Xabardan eslatma bor-yo'qligini aniqlab, agar bor bo'lsa JSON qaytaring.
 
 XABAR: "{message}"
 
@@ -1027,23 +994,105 @@ VAQT QOIDALARI:
 AGAR ES LATMA BO'LMASA: {{"has_reminder": false}}
 
 FAQAT JSON QAYTARING, HECH QANDAY IZOH YOZMA."""
+    
+    @staticmethod
+    def _parse_json_response(ai_response: str) -> Dict:
+        """LLM javobidan JSON obyektini ajratish (```json bloklari va izohlarsiz)"""
+        if "```json" in ai_response:
+            ai_response = ai_response.split("```json")[1].split("```")[0].strip()
+        elif "```" in ai_response:
+            ai_response = ai_response.split("```")[1].split("```")[0].strip()
+        
+        if "{" in ai_response and "}" in ai_response:
+            start = ai_response.index("{")
+            end = ai_response.rindex("}") + 1
+            ai_response = ai_response[start:end]
+        return json.loads(ai_response)
+    
+    async def detect_intents(self, message: str, reminders_enabled: bool,
+                             today: datetime = None) -> Tuple[Optional[Dict], Optional[Dict]]:
+        """Tranzaksiya va eslatmani aniqlash (saqlamasdan): (ajratish natijasi, eslatma JSON)
+        
+        Ikkala vazifa bitta gpt-4o-mini so'rovida (JSON rejimi) bajariladi - avval
+        ikkita alohida so'rov edi. LLM faqat rule parser yoki ajratish keshi
+        tranzaksiyani topgan va xabarda eslatma belgisi bo'lmagan holda
+        chaqirilmaydi - belgilar ro'yxati to'liq emas, shuning uchun noma'lum
+        xabarlar eslatma aniqlashidan o'tkazib yuborilmaydi.
+        """
+        today = today or datetime.now()
+        known = await self.financial_module.extract_without_llm(message)
+        if not reminders_enabled:
+            if known:
+                return known, None
+            return await self.financial_module._extract_financial_data_with_gpt4(message), None
+        if known and not has_reminder_cues(message):
+            return known, None
+        
+        merged_prompt = f"""Xabarni ikki vazifa bo'yicha tahlil qiling va BITTA JSON obyekt qaytaring:
+{{"transactions": [...], "total_confidence": 0.0, "reminder": {{...}}}}
+
+1. "transactions" va "total_confidence" - yuqoridagi tranzaksiya qoidalari bo'yicha (tranzaksiya bo'lmasa bo'sh ro'yxat).
+2. "reminder" - quyidagi eslatma qoidalari bo'yicha obyekt.
+
+{self._reminder_prompt(message, today)}"""
+        try:
+            ai_response = await llm.complete(
+                'detection',
+                [
+                    {"role": "system", "content": self.financial_module._extraction_system_prompt()},
+                    {"role": "user", "content": merged_prompt}
+                ],
+                max_tokens=900,
+                temperature=0.1,
+                response_format={"type": "json_object"}
+            )
+            data = self._parse_json_response(ai_response)
+        except Exception as e:
+            logger.error(f"Error in merged transaction/reminder detection: {e}")
+            return known, None
+        
+        logger.info(f"Merged detection result: {data}")
+        reminder_result = data.get('reminder')
+        if not isinstance(reminder_result, dict):
+            reminder_result = None
+        if known:
+            return known, reminder_result
+        extraction = {
+            "transactions": data.get('transactions') or [],
+            "total_confidence": data.get('total_confidence', 0)
+        }
+        return extraction, reminder_result
+    
+    async def detect_and_save_reminder(self, user_id: int, message: str) -> Optional[Dict]:
+        """Xabardan eslatmani aniqlash va saqlash - AI orqali (DONA AI)
+        
+        Misol xabarlar:
+        - "Ertaga soat 11:00 do'stim bilan Hamkor bankka boramiz"
+        - "Har dushanba 19:00 darsim bor"
+        - "28-dekabr mijoz bilan uchrashuv"
+        """
+        try:
+            # Tarifni tekshirish
+            tariff = await self.db.get_active_tariff(user_id)
+            
+            # Plus va Pro uchun eslatmalar
+            if tariff not in REMINDER_TARIFFS:
+                # Free tarif uchun eslatma yo'q
+                return None
+            
+            today = datetime.now()
+            reminder_prompt = self._reminder_prompt(message, today)
             
-            # AsyncOpenAI dan to'g'ri foydalanish
             try:
-                if not self.openai_client:
-                    logger.warning("OpenAI client yo'q, eslatma aniqlash mumkin emas")
-                    return None
-                
-                response = await self.openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "Sen DONA AI - eslatmalarni aniqlash yordamchisisiz. Xabardan sana, vaqt, joy, shaxs va vazifani aniqlab, JSON formatida qaytarasan. Faqat JSON qaytarasan. MUHIM: Agar xabarda 'ertaga', 'bugun', 'borishim', 'ketishim', 'ko'rishisim', 'ko'rishish', 'meeting', 'eslatasan', 'eslat', 'kerak', vaqt (masalan: 20:00, 12:00) yoki joy (masalan: Dastuchi, Duxtir) bo'lsa, bu ESLATMA! Har doim has_reminder: true qaytarasan."},
+                ai_response = await llm.complete(
+                    'reminder',
+                    [
+                        {"role": "system", "content": REMINDER_SYSTEM_PROMPT},
                         {"role": "user", "content": reminder_prompt}
                     ],
                     max_tokens=500,
                     temperature=0.1
                 )
-                ai_response = response.choices[0].message.content
                 logger.info(f"Reminder AI response: {ai_response}")
                 print(f"DEBUG: Reminder AI response: {ai_response}")
             except Exception as e:
@@ -1060,137 +1109,12 @@ FAQAT JSON QAYTARING, HECH QANDAY IZOH YOZMA."""
                 return None
             
             # JSON ni parse qilish
-            import json
             print(f"DEBUG: Parsing reminder AI response: {ai_response[:200]}")
-            
-            if "```json" in ai_response:
-                ai_response = ai_response.split("```json")[1].split("```")[0].strip()
-            elif "```" in ai_response:
-                ai_response = ai_response.split("```")[1].split("```")[0].strip()
-            
-            if "{" in ai_response and "}" in ai_response:
-                start = ai_response.index("{")
-                end = ai_response.rindex("}") + 1
-                ai_response = ai_response[start:end]
-            
             try:
-                result = json.loads(ai_response)
-                
+                result = self._parse_json_response(ai_response)
                 logger.info(f"Parsed reminder result: {result}")
                 print(f"DEBUG: Parsed reminder result: {result}")
-                
-                if not result.get('has_reminder'):
-                    logger.info(f"Reminder not detected - has_reminder is False: {result}")
-                    print(f"DEBUG: Reminder not detected - has_reminder is False: {result}")
-                    return None
-                
-                # Sana aniqlash
-                reminder_date_str = result.get('date', current_date)
-                reminder_date = None
-                
-                try:
-                    # Sana formatlarini aniqlash
-                    today_date = today.date()
-                    
-                    if reminder_date_str.lower() == 'bugun':
-                        reminder_date = today_date
-                    elif reminder_date_str.lower() == 'ertaga':
-                        reminder_date = today_date + timedelta(days=1)
-                    elif 'kun' in reminder_date_str.lower() and 'keyin' in reminder_date_str.lower():
-                        # "5 kundan keyin" formatida
-                        days_match = re.search(r'(\d+)\s*kun', reminder_date_str.lower())
-                        if days_match:
-                            days = int(days_match.group(1))
-                            reminder_date = today_date + timedelta(days=days)
-                        else:
-                            reminder_date = today_date
-                    else:
-                        # YYYY-MM-DD formatida
-                        try:
-                            reminder_date = datetime.strptime(reminder_date_str, '%Y-%m-%d').date()
-                        except:
-                            # Agar parse qilishda xatolik bo'lsa, default bugun
-                            reminder_date = today_date
-                except:
-                    reminder_date = today.date()  # Default: bugun
-                
-                # Vaqt aniqlash
-                reminder_time_str = result.get('time', '09:00')
-                if not reminder_time_str:
-                    reminder_time_str = '09:00'
-                
-                # Eslatmani saqlash
-                reminder_id = await self.db.create_reminder(
-                    user_id=user_id,
-                    reminder_type=result.get('reminder_type', 'other'),
-                    title=result.get('title', 'Eslatma')[:255],
-                    reminder_date=reminder_date,
-                    description=result.get('description', message[:500]),
-                    amount=result.get('amount'),
-                    currency=result.get('currency', 'UZS'),
-                    person_name=result.get('person_name'),
-                    reminder_time=reminder_time_str,
-                    location=result.get('location'),
-                    is_recurring=result.get('is_recurring', False),
-                    recurrence_pattern=result.get('recurrence_pattern'),
-                    recurrence_day=result.get('recurrence_day')
-                )
-                
-                # Kuni aniqlash
-                days_diff = (reminder_date - today.date()).days
-                if days_diff == 0:
-                    days_text = f"bugun soat {reminder_time_str}"
-                elif days_diff == 1:
-                    days_text = f"ertaga soat {reminder_time_str}"
-                elif days_diff > 1:
-                    days_text = f"{days_diff} kundan keyin ({reminder_date.strftime('%d.%m')}) soat {reminder_time_str}"
-                else:
-                    days_text = f"bugun soat {reminder_time_str}"
-                
-                # Takrorlanadigan eslatma uchun
-                if result.get('is_recurring'):
-                    pattern = result.get('recurrence_pattern')
-                    if pattern == 'daily':
-                        days_text += " (har kuni)"
-                    elif pattern == 'weekly':
-                        day_num = result.get('recurrence_day', 0)
-                        day_name = weekday_names[day_num] if 0 <= day_num <= 6 else ''
-                        days_text += f" (har {day_name})"
-                    elif pattern == 'monthly':
-                        day_num = result.get('recurrence_day', 1)
-                        days_text += f" (har oyning {day_num}-ida)"
-                
-                # Xabar matni
-                title = result.get('title', 'Eslatma')
-                person = result.get('person_name', '')
-                location = result.get('location', '')
-                amount = result.get('amount', 0)
-                
-                message_parts = [f"✅ Eslatma qo'shildi!"]
-                message_parts.append(f"📌 {title}")
-                if person:
-                    message_parts.append(f"👤 {person}")
-                if location:
-                    message_parts.append(f"📍 {location}")
-                if amount and amount > 0:
-                    currency = result.get('currency', 'UZS')
-                    message_parts.append(f"💰 {amount:,.0f} {currency}")
-                message_parts.append(f"⏰ {days_text}")
-                
-                message_text = "\n".join(message_parts)
-                
-                return {
-                    "id": reminder_id,
-                    "title": title,
-                    "date": reminder_date,
-                    "time": reminder_time_str,
-                    "days_text": days_text,
-                    "location": location,
-                    "person_name": person,
-                    "is_recurring": result.get('is_recurring', False),
-                    "message": message_text
-                }
-                
+                return await self._save_detected_reminder(user_id, message, result, today)
             except Exception as e:
                 logger.error(f"Error parsing reminder JSON: {e}, response: {ai_response}")
                 print(f"DEBUG: Error parsing reminder JSON: {e}, response: {ai_response}")
@@ -1205,12 +1129,138 @@ FAQAT JSON QAYTARING, HECH QANDAY IZOH YOZMA."""
             logger.error(f"Reminder detection error traceback: {traceback.format_exc()}")
             return None
     
+    async def _save_detected_reminder(self, user_id: int, message: str, result: Optional[Dict],
+                                      today: datetime) -> Optional[Dict]:
+        """Aniqlangan eslatmani saqlash va foydalanuvchiga ko'rsatiladigan ma'lumot"""
+        if not result:
+            return None
+        if not result.get('has_reminder'):
+            logger.info(f"Reminder not detected - has_reminder is False: {result}")
+            return None
+        
+        import re
+        current_date = today.strftime('%Y-%m-%d')
+        
+        # Sana aniqlash
+        reminder_date_str = result.get('date', current_date)
+        reminder_date = None
+
+        try:
+            # Sana formatlarini aniqlash
+            today_date = today.date()
+
+            if reminder_date_str.lower() == 'bugun':
+                reminder_date = today_date
+            elif reminder_date_str.lower() == 'ertaga':
+                reminder_date = today_date + timedelta(days=1)
+            elif 'kun' in reminder_date_str.lower() and 'keyin' in reminder_date_str.lower():
+                # "5 kundan keyin" formatida
+                days_match = re.search(r'(\d+)\s*kun', reminder_date_str.lower())
+                if days_match:
+                    days = int(days_match.group(1))
+                    reminder_date = today_date + timedelta(days=days)
+                else:
+                    reminder_date = today_date
+            else:
+                # YYYY-MM-DD formatida
+                try:
+                    reminder_date = datetime.strptime(reminder_date_str, '%Y-%m-%d').date()
+                except:
+                    # Agar parse qilishda xatolik bo'lsa, default bugun
+                    reminder_date = today_date
+        except:
+            reminder_date = today.date()  # Default: bugun
+
+        # Vaqt aniqlash
+        reminder_time_str = result.get('time', '09:00')
+        if not reminder_time_str:
+            reminder_time_str = '09:00'
+
+        # Eslatmani saqlash
+        reminder_id = await self.db.create_reminder(
+            user_id=user_id,
+            reminder_type=result.get('reminder_type', 'other'),
+            title=result.get('title', 'Eslatma')[:255],
+            reminder_date=reminder_date,
+            description=result.get('description', message[:500]),
+            amount=result.get('amount'),
+            currency=result.get('currency', 'UZS'),
+            person_name=result.get('person_name'),
+            reminder_time=reminder_time_str,
+            location=result.get('location'),
+            is_recurring=result.get('is_recurring', False),
+            recurrence_pattern=result.get('recurrence_pattern'),
+            recurrence_day=result.get('recurrence_day')
+        )
+
+        # Kuni aniqlash
+        days_diff = (reminder_date - today.date()).days
+        if days_diff == 0:
+            days_text = f"bugun soat {reminder_time_str}"
+        elif days_diff == 1:
+            days_text = f"ertaga soat {reminder_time_str}"
+        elif days_diff > 1:
+            days_text = f"{days_diff} kundan keyin ({reminder_date.strftime('%d.%m')}) soat {reminder_time_str}"
+        else:
+            days_text = f"bugun soat {reminder_time_str}"
+
+        # Takrorlanadigan eslatma uchun
+        if result.get('is_recurring'):
+            pattern = result.get('recurrence_pattern')
+            if pattern == 'daily':
+                days_text += " (har kuni)"
+            elif pattern == 'weekly':
+                day_num = result.get('recurrence_day', 0)
+                day_name = WEEKDAY_NAMES[day_num] if 0 <= day_num <= 6 else ''
+                days_text += f" (har {day_name})"
+            elif pattern == 'monthly':
+                day_num = result.get('recurrence_day', 1)
+                days_text += f" (har oyning {day_num}-ida)"
+
+        # Xabar matni
+        title = result.get('title', 'Eslatma')
+        person = result.get('person_name', '')
+        location = result.get('location', '')
+        amount = result.get('amount', 0)
+
+        message_parts = [f"✅ Eslatma qo'shildi!"]
+        message_parts.append(f"📌 {title}")
+        if person:
+            message_parts.append(f"👤 {person}")
+        if location:
+            message_parts.append(f"📍 {location}")
+        if amount and amount > 0:
+            currency = result.get('currency', 'UZS')
+            message_parts.append(f"💰 {amount:,.0f} {currency}")
+        message_parts.append(f"⏰ {days_text}")
+
+        message_text = "\n".join(message_parts)
+
+        return {
+            "id": reminder_id,
+            "title": title,
+            "date": reminder_date,
+            "time": reminder_time_str,
+            "days_text": days_text,
+            "location": location,
+            "person_name": person,
+            "is_recurring": result.get('is_recurring', False),
+            "message": message_text
+        }
+    
     async def detect_and_save_transaction(self, message: str, user_id: int) -> Optional[Dict]:
         """Xabardan tranzaksiyani aniqlash va saqlash - AI orqali (PRO tarif)"""
         try:
             # AI orqali tranzaksiyani aniqlash
             ai_result = await self.financial_module._extract_financial_data_with_gpt4(message)
-            
+            return await self._save_detected_transaction(message, user_id, ai_result)
+        except Exception as e:
+            logger.error(f"Error detecting transaction: {e}")
+            return None
+    
+    async def _save_detected_transaction(self, message: str, user_id: int, ai_result: Optional[Dict]) -> Optional[Dict]:
+        """Aniqlangan birinchi tranzaksiyani PRO kategoriyalariga o'tkazib saqlash"""
+        try:
             if not ai_result or 'transactions' not in ai_result or not ai_result['transactions']:
                 return None
             
@@ -1279,7 +1329,7 @@ FAQAT JSON QAYTARING, HECH QANDAY IZOH YOZMA."""
             }
             
         except Exception as e:
-            logger.error(f"Error detecting transaction: {e}")
+            logger.error(f"Error saving detected transaction: {e}")
             return None
     
     async def analyze_transaction(self, user_id: int, transaction_type: str, amount: float, description: str = "") -> str:
@@ -1319,20 +1369,15 @@ Sen Balans AI ning hazil va do'stona buxgalterisiz. Foydalanuvchiga:
 - Agar kam xarajat qilsa - maqtash 🧘
 - Qisqa (1-2 gap, max 100 so'z)"""
 
-            def call_openai():
-                response = openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": self.system_prompt},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=150,
-                    temperature=0.9
-                )
-                return response.choices[0].message.content
-            
-            loop = asyncio.get_event_loop()
-            ai_response = await loop.run_in_executor(None, call_openai)
+            ai_response = await llm.complete(
+                'transaction_comment',
+                [
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=150,
+                temperature=0.9
+            )
             
             return ai_response
             
@@ -1500,42 +1545,50 @@ Sen Balans AI ning hazil va do'stona buxgalterisiz. Foydalanuvchiga:
     async def generate_business_response(self, user_id: int, question: str, context: str = "") -> str:
         """Biznes tarif uchun AI javob generatsiya qilish"""
         try:
-            system_prompt = """Sen Balans AI Biznes yordamchisisiz. Biznes egasiga moliyaviy maslahat va tahlil berasiz.
-
-QOIDALAR:
-1. O'zbek tilida javob ber
-2. Qisqa va aniq javob ber (max 5-6 gap)
-3. Raqamlarni formatlangan ko'rinishda ko'rsat (1,000,000)
-4. Amaliy tavsiyalar ber
-5. Agar ma'lumot yetarli bo'lmasa, shuni ayt
-6. Hech qachon formatlash belgilarini ishlatma (**, ##, va h.k.)
-7. Emoji ishlatishni yaxshi ko'rasan (2-3 ta)
-
-SEN QILA OLASIZ:
-- Moliyaviy tahlil qilish
-- Foyda/zarar hisoblash
-- Xarajatlarni optimallashtirish bo'yicha maslahat berish
-- Ombor tahlili qilish
-- Qarzlar holati haqida ma'lumot berish
-- Biznes strategiyasi bo'yicha maslahat berish"""
-
             user_prompt = f"Kontekst:\n{context}\n\nSavol: {question}"
             
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=500,
-                temperature=0.3
-            )
+            with llm.track_usage() as usage:
+                response = await llm.complete(
+                    'business_chat',
+                    [
+                        {"role": "system", "content": BUSINESS_SYSTEM_PROMPT},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    max_tokens=500,
+                    temperature=0.3
+                )
+            # Biznes tarifida limit yo'q - faqat llm_usage hisobiga
+            await self.db.charge_llm_usage(user_id, usage, pro=False)
             
-            return response.choices[0].message.content.strip()
+            return response.strip()
             
         except Exception as e:
             logger.error(f"Business AI response error: {e}")
             return None
+    
+    async def generate_business_response_stream(self, user_id: int, question: str, context: str = "") -> AsyncIterator[str]:
+        """generate_business_response ning oqimli varianti - javob matni bo'laklari (xatolikda oqim to'xtaydi)"""
+        started = time.perf_counter()
+        user_prompt = f"Kontekst:\n{context}\n\nSavol: {question}"
+        first = True
+        try:
+            with llm.track_usage() as usage:
+                async for delta in llm.stream_chat(
+                    [
+                        {"role": "system", "content": BUSINESS_SYSTEM_PROMPT},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    task='business_chat',
+                    max_tokens=500,
+                    temperature=0.3
+                ):
+                    if first:
+                        observe('ai_chat.business.first_token', (time.perf_counter() - started) * 1000)
+                        first = False
+                    yield delta
+            await self.db.charge_llm_usage(user_id, usage, pro=False)
+        except Exception as e:
+            logger.error(f"Business AI stream error: {e}")
 
 
 class AIChatFree:
@@ -1618,12 +1671,8 @@ class AIChatFree:
         """Tranzaksiya limitini kamaytirish (faqat tracking uchun) - marker yozuv qo'shish"""
         try:
             # Faqat "attempt" belgisi sifatida marker yozuv qo'shamiz
-            await self.db.execute_query(
-                """
-                INSERT INTO transactions (user_id, transaction_type, amount, category, description, created_at)
-                VALUES (%s, %s, %s, %s, %s, NOW())
-                """,
-                (user_id, 'expense', 0, 'free_limit_used', 'Free tariff attempt tracked')
+            await self.db.insert_transaction(
+                user_id, 'expense', 0, 'free_limit_used', description='Free tariff attempt tracked'
             )
         except Exception as e:
             logger.error(f"Error tracking transaction limit: {e}")
@@ -1636,8 +1685,8 @@ class AIChatFree:
                 SELECT COUNT(*) 
                 FROM transactions 
                 WHERE user_id = %s 
-                AND MONTH(created_at) = MONTH(NOW())
-                AND YEAR(created_at) = YEAR(NOW())
+                AND created_at >= DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY)
+                AND created_at < DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY) + INTERVAL 1 MONTH
                 """,
                 (user_id,)
             )
@@ -1667,45 +1716,20 @@ Examples:
 
 JSON: """
 
-            def call_openai():
-                try:
-                    # Mistral-7B-Instruct bilan urinib ko'ramiz (arzon)
-                    response = openrouter_client.chat.completions.create(
-                        model="mistralai/mistral-7b-instruct",
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": user_prompt}
-                        ],
-                        max_tokens=50,  # Yaxshiroq javob uchun
-                        temperature=0.0
-                    )
-                    return {"content": response.choices[0].message.content, "provider": "mistral"}
-                except Exception as e:
-                    logger.error(f"Mistral-7B xatolik: {e}")
-                    # Fallback: gpt-3.5-turbo
-                    try:
-                        response = openai_client.chat.completions.create(
-                            model="gpt-3.5-turbo",
-                            messages=[
-                                {"role": "system", "content": system_prompt},
-                                {"role": "user", "content": user_prompt}
-                            ],
-                            max_tokens=40,
-                            temperature=0.0
-                        )
-                        return {"content": response.choices[0].message.content, "provider": "openai"}
-                    except Exception as e2:
-                        logger.error(f"OpenAI xatolik: {e2}")
-                        return None
-            
-            loop = asyncio.get_event_loop()
-            ai_result = await loop.run_in_executor(None, call_openai)
+            # 'extraction' zanjiri: eng arzon model (Mistral-7B), xatolikda keyingisi
+            ai_result = await llm.chat_with_fallback(
+                [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                max_tokens=50,
+                temperature=0.0
+            )
             
             if not ai_result:
                 return None
             
-            ai_response = ai_result.get("content") if isinstance(ai_result, dict) else ai_result
-            provider = ai_result.get("provider") if isinstance(ai_result, dict) else "unknown"
+            ai_response, provider = ai_result
             
             # Debug log
             logger.info(f"AI Response for '{message}': {ai_response}")
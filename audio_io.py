@@ -0,0 +1,44 @@
+"""
+Ovozli xabarlarni xotiraga yuklab olish
+
+Telegram ovozli xabari diskka yozilmaydi: bot.download_file() BytesIO
+qaytaradi va baytlar to'g'ridan-to'g'ri Google / Whisper / ElevenLabs ga
+uzatiladi. Faqat AUDIO_MEMORY_LIMIT dan katta (uzun) audio vaqtinchalik
+faylga yoziladi va qayta ishlangandan keyin discard_audio() bilan o'chiriladi.
+"""
+
+import logging
+import os
+import tempfile
+from typing import Union
+
+# Shu hajmgacha audio xotirada saqlanadi (Google inline recognize chegarasi ~10 MB)
+AUDIO_MEMORY_LIMIT = 10 * 1024 * 1024
+
+AudioSource = Union[bytes, str]
+
+
+async def download_audio(bot, file, user_id: int) -> AudioSource:
+    """Telegram faylini yuklab olish: kichik audio - bytes, katta audio - vaqtinchalik fayl yo'li"""
+    if file.file_size is not None and file.file_size <= AUDIO_MEMORY_LIMIT:
+        buffer = await bot.download_file(file.file_path)
+        return buffer.getvalue()
+
+    fd, path = tempfile.mkstemp(prefix=f"audio_{user_id}_", suffix=".ogg")
+    os.close(fd)
+    try:
+        await bot.download_file(file.file_path, path)
+    except Exception:
+        discard_audio(path)
+        raise
+    logging.info(f"Katta audio ({file.file_size} bayt) vaqtinchalik faylga yozildi: {path}")
+    return path
+
+
+def discard_audio(audio: AudioSource):
+    """Diskka yozilgan audio bo'lsa o'chirish (bytes uchun hech narsa qilmaydi)"""
+    if isinstance(audio, str):
+        try:
+            os.remove(audio)
+        except OSError:
+            pass
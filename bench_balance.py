@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Balans so'rovlari benchmarki
+Eski (har bir summa uchun alohida SUM) va yangi (user_balances) usullarni
+lokal MySQL'da solishtiradi: so'rovlar soni va kechikish.
+
+Ishga tushirish:
+    python3 bench_balance.py [tranzaksiyalar_soni] [takrorlar]
+"""
+
+import asyncio
+import random
+import sys
+import time
+
+from database import db
+
+BENCH_USER_ID = 900000000001
+CURRENCIES = ['UZS', 'UZS', 'UZS', 'USD', 'EUR', 'RUB', 'TRY']
+
+
+class QueryCounter:
+    """db.execute_one / execute_query chaqiruvlarini sanash"""
+
+    def __init__(self):
+        self.count = 0
+        self._orig_one = db.execute_one
+        self._orig_query = db.execute_query
+
+    def __enter__(self):
+        async def counted_one(query, params=None):
+            self.count += 1
+            return await self._orig_one(query, params)
+
+        async def counted_query(query, params=None):
+            self.count += 1
+            return await self._orig_query(query, params)
+
+        db.execute_one = counted_one
+        db.execute_query = counted_query
+        return self
+
+    def __exit__(self, *exc):
+        db.execute_one = self._orig_one
+        db.execute_query = self._orig_query
+
+
+async def legacy_get_balance(user_id):
+    """Eski get_balance: 4 ta alohida SUM so'rov"""
+    totals = {}
+    conditions = {
+        'income': "transaction_type = 'income'",
+        'expense': "transaction_type = 'expense'",
+        'borrowed': "transaction_type = 'debt' AND debt_direction = 'borrowed'",
+        'lent': "transaction_type = 'debt' AND debt_direction = 'lent'",
+    }
+    for key, cond in conditions.items():
+        row = await db.execute_one(
+            f"SELECT COALESCE(SUM(amount), 0) as total FROM transactions WHERE user_id = %s AND {cond}",
+            (user_id,)
+        )
+        totals[key] = float(row.get('total', 0)) if row else 0.0
+    return totals
+
+
+async def legacy_get_balance_multi_currency(user_id):
+    """Eski get_balance_multi_currency: har bir valyuta uchun 4 ta so'rov"""
+    await db.get_currency_rates()
+    result = {}
+    for currency in ['UZS', 'USD', 'EUR', 'RUB', 'TRY']:
+        totals = {}
+        conditions = {
+            'income': "transaction_type = 'income'",
+            'expense': "transaction_type = 'expense'",
+            'borrowed': "transaction_type = 'debt' AND debt_direction = 'borrowed'",
+            'lent': "transaction_type = 'debt' AND debt_direction = 'lent'",
+        }
+        for key, cond in conditions.items():
+            row = await db.execute_one(
+                f"SELECT COALESCE(SUM(amount), 0) as total FROM transactions "
+                f"WHERE user_id = %s AND {cond} AND COALESCE(currency, 'UZS') = %s",
+                (user_id, currency)
+            )
+            totals[key] = float(row.get('total', 0)) if row else 0.0
+        result[currency] = totals
+    return result
+
+
+async def seed(transactions_count: int):
+    """Benchmark foydalanuvchisi va tranzaksiyalarini yaratish"""
+    await db.execute_query(
+        "INSERT IGNORE INTO users (user_id, username, first_name) VALUES (%s, 'bench', 'Bench')",
+        (BENCH_USER_ID,)
+    )
+    await db.execute_query("DELETE FROM transactions WHERE user_id = %s", (BENCH_USER_ID,))
+
+    rows = []
+    for _ in range(transactions_count):
+        trans_type = random.choice(['income', 'expense', 'expense', 'debt'])
+        direction = random.choice(['lent', 'borrowed']) if trans_type == 'debt' else None
+        rows.append((BENCH_USER_ID, trans_type, round(random.uniform(1000, 500000), 2),
+                     'Boshqa', random.choice(CURRENCIES), direction))
+
+    async with db.pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.executemany(
+                "INSERT INTO transactions (user_id, transaction_type, amount, category, currency, debt_direction) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                rows
+            )
+    # Yig'ma jadval to'g'ridan-to'g'ri INSERT dan keyin qayta hisoblanadi
+    await db.rebuild_user_balances(BENCH_USER_ID)
+
+
+async def measure(name: str, func, repeats: int):
+    """Funksiyani bir necha marta ishlatib, o'rtacha vaqt va so'rovlar sonini chiqarish"""
+    with QueryCounter() as counter:
+        started = time.perf_counter()
+        for _ in range(repeats):
+            await func(BENCH_USER_ID)
+        elapsed = time.perf_counter() - started
+    print(f"   {name:<40} {counter.count / repeats:>5.1f} so'rov   {elapsed / repeats * 1000:>8.2f} ms")
+
+
+async def main():
+    transactions_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    print("🚀 Balans benchmarki")
+    print("=" * 70)
+    await db.create_pool()
+    try:
+        print(f"🌱 {transactions_count} ta tranzaksiya yaratilmoqda...")
+        await seed(transactions_count)
+
+        print(f"\n📊 Natijalar ({repeats} takror, o'rtacha):")
+        await measure("Eski get_balance (4 ta SUM)", legacy_get_balance, repeats)
+        await measure("Yangi get_balance (user_balances)", db.get_balance, repeats)
+        await measure("Eski get_balance_multi_currency (20 SUM)", legacy_get_balance_multi_currency, repeats)
+        await measure("Yangi get_balance_multi_currency", db.get_balance_multi_currency, repeats)
+    finally:
+        await db.execute_query("DELETE FROM transactions WHERE user_id = %s", (BENCH_USER_ID,))
+        await db.execute_query("DELETE FROM users WHERE user_id = %s", (BENCH_USER_ID,))
+        await db.close_pool()
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
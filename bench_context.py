@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+AI chat prompt konteksti benchmarki
+Eski usul (12 ta so'rov ketma-ket), snapshot qurish (so'rovlar parallel),
+issiq snapshot va yangi tranzaksiyadan keyingi (joyida yangilangan) snapshot
+kechikishini lokal MySQL'da solishtiradi. Kontekst matni (_format_context)
+ham o'lchanadi - bu promptni qurishning to'liq vaqti.
+
+Ishga tushirish:
+    python3 bench_context.py [tranzaksiyalar_soni] [takrorlar]
+"""
+
+import asyncio
+import random
+import sys
+import time
+
+from ai_chat import AIChat
+from database import db
+from financial_context import FinancialContextStore
+
+BENCH_USER_ID = 900000000002
+CATEGORIES = ['Oziq-ovqat', 'Transport', 'Kafe', 'Kommunal', 'Kiyim', 'Boshqa']
+
+
+async def seed(transactions_count: int):
+    """Benchmark foydalanuvchisi va oxirgi 60 kunlik tranzaksiyalar"""
+    await db.execute_query(
+        "INSERT IGNORE INTO users (user_id, username, first_name) VALUES (%s, 'bench', 'Bench')",
+        (BENCH_USER_ID,)
+    )
+    await db.execute_query("DELETE FROM transactions WHERE user_id = %s", (BENCH_USER_ID,))
+    rows = []
+    for _ in range(transactions_count):
+        rows.append((
+            BENCH_USER_ID,
+            random.choice(['income', 'expense', 'expense', 'expense']),
+            round(random.uniform(1000, 500000), 2),
+            random.choice(CATEGORIES),
+            f"-{random.randint(0, 60 * 24 * 60)}",
+        ))
+    async with db.pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.executemany(
+                "INSERT INTO transactions (user_id, transaction_type, amount, category, currency, created_at) "
+                "VALUES (%s, %s, %s, %s, 'UZS', DATE_ADD(NOW(), INTERVAL %s MINUTE))",
+                rows
+            )
+    await db.rebuild_user_balances(BENCH_USER_ID)
+
+
+async def legacy_context(store: FinancialContextStore, user_id: int):
+    """Eski get_user_financial_context: bir xil so'rovlar, ketma-ket"""
+    return [await query for query in store._queries(user_id)]
+
+
+async def measure(name: str, func, repeats: int):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await func()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    print(f"   {name:<44} avg {sum(timings) / repeats:>8.2f} ms   p95 {timings[int(repeats * 0.95) - 1]:>8.2f} ms")
+
+
+async def main():
+    transactions_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    print("🚀 AI kontekst benchmarki")
+    print("=" * 78)
+    await db.create_pool()
+    try:
+        print(f"🌱 {transactions_count} ta tranzaksiya yaratilmoqda...")
+        await seed(transactions_count)
+        ai = AIChat(db=db)
+        store = FinancialContextStore(db)
+
+        async def legacy():
+            await legacy_context(store, BENCH_USER_ID)
+
+        async def cold():
+            store.snapshots.clear()
+            ai._format_context(await store.get(BENCH_USER_ID))
+
+        async def warm():
+            ai._format_context(await store.get(BENCH_USER_ID))
+
+        async def after_insert():
+            await db.insert_transaction(BENCH_USER_ID, 'expense', 25000, 'Kafe', description='kofe')
+            started = time.perf_counter()
+            ai._format_context(await store.get(BENCH_USER_ID))
+            return (time.perf_counter() - started) * 1000
+
+        print(f"\n📊 Natijalar ({repeats} takror):")
+        await measure("Eski: 12 so'rov ketma-ket", legacy, repeats)
+        await measure("Snapshot qurish (parallel) + format", cold, repeats)
+        await measure("Issiq snapshot + format", warm, repeats)
+
+        await store.get(BENCH_USER_ID)
+        timings = sorted([await after_insert() for _ in range(repeats)])
+        print(f"   {'Yangi tranzaksiyadan keyin (joyida) + format':<44} "
+              f"avg {sum(timings) / repeats:>8.2f} ms   p95 {timings[int(repeats * 0.95) - 1]:>8.2f} ms")
+        print(f"\n   {store.stats()}")
+    finally:
+        await db.execute_query("DELETE FROM transactions WHERE user_id = %s", (BENCH_USER_ID,))
+        await db.execute_query("DELETE FROM user_balances WHERE user_id = %s", (BENCH_USER_ID,))
+        await db.execute_query("DELETE FROM users WHERE user_id = %s", (BENCH_USER_ID,))
+        await db.close_pool()
+    print("=" * 78)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
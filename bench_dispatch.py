@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Handler tanlash (dispatch) benchmarki
+main.py dagi to'liq handlerlar to'plami bilan bitta yangilanish uchun
+handler topish vaqtini solishtiradi:
+
+- eski usul: aiogram kabi barcha handlerlar ro'yxatdagi tartibda, har
+  birining filtri (lambda, holat) ketma-ket chaqiriladi
+- DispatchTable: exact/prefix/holat indeksi, faqat nomzodlar tekshiriladi
+
+Namunalar har bir handler kaliti (callback_data, reply-klaviatura matni,
+FSM holati) va oddiy matnli xabarlardan yig'iladi. Ikkala usul bir xil
+handlerni tanlashi ham tekshiriladi.
+
+Ishga tushirish:
+    python3 bench_dispatch.py [takrorlar]
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+
+from aiogram.dispatcher.event.handler import FilterObject, HandlerObject
+from aiogram.types import CallbackQuery, Chat, Message, User
+
+import main as bot_app
+
+BENCH_USER = User(id=900000000001, is_bot=False, first_name='Bench')
+BENCH_CHAT = Chat(id=900000000001, type='private')
+FREE_TEXTS = ["bugun 25 ming so'mga tushlik qildim", "oylik tushdi 8 mln", "salom"]
+
+
+def callback(data: str) -> CallbackQuery:
+    return CallbackQuery(id='1', from_user=BENCH_USER, chat_instance='bench', data=data)
+
+
+def message(text: str) -> Message:
+    return Message(message_id=1, date=0, chat=BENCH_CHAT, from_user=BENCH_USER, text=text)
+
+
+def samples(table, make) -> list:
+    """(yangilanish, holat) juftlari: har bir handler uchun bittadan"""
+    result = []
+    for route in table.routes:
+        for key in route.keys[:1] or [prefix + '1' for prefix in route.prefixes[:1]]:
+            result.append((make(key), route.state))
+        if not route.keys and not route.prefixes and route.state:
+            result.append((make(FREE_TEXTS[0]), route.state))
+    return result
+
+
+def legacy_handlers(table) -> list:
+    """Eski ro'yxat: har bir handler o'z kalit filtri (lambda) va holat filtri bilan"""
+    handlers = []
+    for route in table.routes:
+        filters = []
+        if route.keys:
+            filters.append(lambda event, keys=route.keys: table.key(event) in keys)
+        if route.prefixes:
+            filters.append(lambda event, prefixes=route.prefixes, exclude=route.exclude:
+                           (table.key(event) or '').startswith(prefixes) and table.key(event) not in exclude)
+        if route.exclude_prefix:
+            filters.append(lambda event, excluded=route.exclude_prefix: not (table.key(event) or '').startswith(excluded))
+        if route.state:
+            filters.append(lambda event, raw_state, state=route.state: raw_state == state)
+        handler = HandlerObject(callback=route.handler.callback,
+                                filters=[FilterObject(f) for f in filters] + list(route.handler.filters or []))
+        handlers.append((route, handler))
+    return handlers
+
+
+async def legacy_resolve(handlers: list, event, raw_state):
+    for route, handler in handlers:
+        matched, _ = await handler.check(event, raw_state=raw_state, bot=bot_app.bot)
+        if matched:
+            return route
+    return None
+
+
+async def table_resolve(table, event, raw_state):
+    route, _ = await table.resolve(event, raw_state=raw_state, bot=bot_app.bot)
+    return route
+
+
+async def measure(name: str, resolve, updates: list, repeats: int) -> list:
+    timings = []
+    for _ in range(repeats):
+        for event, raw_state in updates:
+            started = time.perf_counter()
+            await resolve(event, raw_state)
+            timings.append((time.perf_counter() - started) * 1_000_000)
+    timings.sort()
+    print(f"   {name:<34} avg {statistics.mean(timings):7.1f} µs   p95 {timings[int(len(timings) * 0.95) - 1]:7.1f} µs")
+    return timings
+
+
+async def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    print("🚀 Dispatch benchmarki")
+    print("=" * 78)
+    for name, table, make in (
+        ("callback_query", bot_app.callbacks, callback),
+        ("message", bot_app.messages, message),
+    ):
+        updates = samples(table, make) + [(make(text), None) for text in FREE_TEXTS]
+        handlers = legacy_handlers(table)
+        mismatches = 0
+        for event, raw_state in updates:
+            if await legacy_resolve(handlers, event, raw_state) is not await table_resolve(table, event, raw_state):
+                mismatches += 1
+        print(f"\n📊 {name}: {len(table.routes)} handler, {len(updates)} namuna, {repeats} takror "
+              f"(farqli tanlovlar: {mismatches})")
+        legacy = await measure("Eski: ketma-ket filtrlar", lambda e, s: legacy_resolve(handlers, e, s),
+                               updates, repeats)
+        indexed = await measure("DispatchTable", lambda e, s: table_resolve(table, e, s), updates, repeats)
+        print(f"   Tezlashish: {statistics.mean(legacy) / statistics.mean(indexed):.1f}x")
+    await bot_app.bot.session.close()
+    print("=" * 78)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
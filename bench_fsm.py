@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+FSM storage benchmarki
+Bitta update da odatiy holat ishlatilishi (get_state, get_data, update_data,
+set_state) ni MemoryStorage va MySQLStorage da solishtiradi: bitta update
+uchun o'rtacha va p95 kechikish. DB_HOST sozlangan bo'lsa MySQLStorage
+haqiqiy bazaga ulanadi - sovuq o'qish (lokal kesh bo'sh) va write-behind
+flush vaqti ham o'lchanadi.
+
+Ishga tushirish:
+    python3 bench_fsm.py [foydalanuvchilar_soni] [takrorlar]
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config import MYSQL_CONFIG
+from database import db
+from fsm_storage import MySQLStorage
+
+BENCH_BOT_ID = 900000000
+BENCH_USER_BASE = 900000000000
+
+
+async def one_update(storage, key: StorageKey, step: int):
+    """Onboarding handleri kabi: holatni o'qish, ma'lumotni yangilash, keyingi holat"""
+    await storage.get_state(key)
+    data = await storage.get_data(key)
+    data.update(step=step, initial_cash=step * 1000)
+    await storage.set_data(key, data)
+    await storage.set_state(key, f"UserStates:step_{step % 5}")
+
+
+async def bench(storage, users: int, rounds: int) -> list:
+    keys = [StorageKey(bot_id=BENCH_BOT_ID, chat_id=BENCH_USER_BASE + i, user_id=BENCH_USER_BASE + i)
+            for i in range(users)]
+    timings = []
+    for step in range(rounds):
+        for key in keys:
+            started = time.perf_counter()
+            await one_update(storage, key, step)
+            timings.append((time.perf_counter() - started) * 1_000_000)
+    return timings
+
+
+def report(name: str, timings: list):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{name:<28} {len(timings):>7} update  avg {statistics.mean(timings):8.1f} µs  p95 {p95:8.1f} µs")
+
+
+async def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    report("MemoryStorage", await bench(MemoryStorage(), users, rounds))
+
+    if MYSQL_CONFIG['host']:
+        await db.create_pool()
+        await db.create_tables()
+    else:
+        print("DB_HOST sozlanmagan - MySQLStorage faqat lokal (bazasiz) rejimda o'lchanadi")
+
+    storage = MySQLStorage(db)
+    report("MySQLStorage (issiq kesh)", await bench(storage, users, rounds))
+
+    if db.pool:
+        started = time.perf_counter()
+        pending = len(storage._dirty)
+        await storage.flush()
+        print(f"Flush: {pending} kalit, {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        # Boshqa worker yoki qayta ishga tushish: lokal kesh bo'sh, holat bazadan o'qiladi
+        cold = MySQLStorage(db)
+        report("MySQLStorage (sovuq kesh)", await bench(cold, users, 1))
+        print(f"Bazadan o'qishlar: {cold.db_reads}")
+        await cold.close()
+
+        await db.execute_query(
+            "DELETE FROM fsm_storage WHERE storage_key LIKE %s", (f"{BENCH_BOT_ID}:%",)
+        )
+    await storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Qoidaga asoslangan tezkor parser benchmarki
+Belgilangan korpus bo'yicha: LLM siz hal qilingan xabarlar ulushi (hit rate),
+aniqlik (noto'g'ri natija = 0 bo'lishi kerak) va p50/p99 kechikish.
+
+Ishga tushirish:
+    python3 bench_parser.py [takrorlar]
+"""
+
+import statistics
+import sys
+import time
+
+from rule_parser import FAST_PATH_CONFIDENCE, parse_transaction
+
+# (xabar, kutilgan natija). None - parser LLM ga qoldirishi kerak
+CORPUS = [
+    ("taksi 20 ming", {'type': 'expense', 'amount': 20000, 'category': 'Taksi', 'currency': 'UZS'}),
+    ("ovqatga 50k", {'type': 'expense', 'amount': 50000, 'category': 'Ovqat', 'currency': 'UZS'}),
+    ("ish haqi 5 mln tushdi", {'type': 'income', 'amount': 5000000, 'category': 'Ish haqi', 'currency': 'UZS'}),
+    ("80k somsa", {'type': 'expense', 'amount': 80000, 'category': 'Ovqat', 'currency': 'UZS'}),
+    ("restoranda 200k", {'type': 'expense', 'amount': 200000, 'category': 'Restoran', 'currency': 'UZS'}),
+    ("kafeda 50k", {'type': 'expense', 'amount': 50000, 'category': 'Kafe', 'currency': 'UZS'}),
+    ("oylik 3mln", {'type': 'income', 'amount': 3000000, 'category': 'Ish haqi', 'currency': 'UZS'}),
+    ("bonus 500k tushdi", {'type': 'income', 'amount': 500000, 'category': 'Bonus', 'currency': 'UZS'}),
+    ("do'konimdan 2mln daromad", {'type': 'income', 'amount': 2000000, 'category': "Do'kon", 'currency': 'UZS'}),
+    ("taksi 50k", {'type': 'expense', 'amount': 50000, 'category': 'Taksi', 'currency': 'UZS'}),
+    ("benzin 300k", {'type': 'expense', 'amount': 300000, 'category': 'Benzin', 'currency': 'UZS'}),
+    ("kiyim 500k", {'type': 'expense', 'amount': 500000, 'category': 'Kiyim', 'currency': 'UZS'}),
+    ("poyabzal 400k", {'type': 'expense', 'amount': 400000, 'category': 'Poyabzal', 'currency': 'UZS'}),
+    ("kvartira 5mln", {'type': 'expense', 'amount': 5000000, 'category': 'Kvartira', 'currency': 'UZS'}),
+    ("mebel 2mln", {'type': 'expense', 'amount': 2000000, 'category': 'Mebel', 'currency': 'UZS'}),
+    ("elektr 200k", {'type': 'expense', 'amount': 200000, 'category': 'Elektr', 'currency': 'UZS'}),
+    ("dori 100k", {'type': 'expense', 'amount': 100000, 'category': 'Dori', 'currency': 'UZS'}),
+    ("shifokor 300k", {'type': 'expense', 'amount': 300000, 'category': 'Shifokor', 'currency': 'UZS'}),
+    ("maktab 2mln", {'type': 'expense', 'amount': 2000000, 'category': 'Maktab', 'currency': 'UZS'}),
+    ("kitob 50k", {'type': 'expense', 'amount': 50000, 'category': 'Kitob', 'currency': 'UZS'}),
+    ("kino 50k", {'type': 'expense', 'amount': 50000, 'category': 'Kino', 'currency': 'UZS'}),
+    ("sayohat 3mln", {'type': 'expense', 'amount': 3000000, 'category': 'Sayohat', 'currency': 'UZS'}),
+    ("samolyot 2mln", {'type': 'expense', 'amount': 2000000, 'category': 'Samolyot', 'currency': 'UZS'}),
+    ("kredit 1mln", {'type': 'expense', 'amount': 1000000, 'category': 'Kredit', 'currency': 'UZS'}),
+    ("internet 100k", {'type': 'expense', 'amount': 100000, 'category': 'Internet', 'currency': 'UZS'}),
+    ("telefon 50k", {'type': 'expense', 'amount': 50000, 'category': 'Telefon', 'currency': 'UZS'}),
+    ("fitnes 300k", {'type': 'expense', 'amount': 300000, 'category': 'Fitnes', 'currency': 'UZS'}),
+    ("parikmaxona 100k", {'type': 'expense', 'amount': 100000, 'category': 'Parikmaxona', 'currency': 'UZS'}),
+    ("non 5 ming", {'type': 'expense', 'amount': 5000, 'category': 'Non', 'currency': 'UZS'}),
+    ("20 ming so'mga non oldim", {'type': 'expense', 'amount': 20000, 'category': 'Non', 'currency': 'UZS'}),
+    ("yigirma ming so'mga non oldim", {'type': 'expense', 'amount': 20000, 'category': 'Non', 'currency': 'UZS'}),
+    ("yigirma besh ming so'mga lavash oldim", {'type': 'expense', 'amount': 25000, 'category': 'Ovqat', 'currency': 'UZS'}),
+    ("taksiga 15 000 so'm", {'type': 'expense', 'amount': 15000, 'category': 'Taksi', 'currency': 'UZS'}),
+    ("maosh 4.5 mln keldi", {'type': 'income', 'amount': 4500000, 'category': 'Ish haqi', 'currency': 'UZS'}),
+    ("oylik oldim 6 mln", {'type': 'income', 'amount': 6000000, 'category': 'Ish haqi', 'currency': 'UZS'}),
+    ("50 dollar xarajat", {'type': 'expense', 'amount': 50, 'category': 'Boshqa', 'currency': 'USD'}),
+    ("100 dollar kirim", {'type': 'income', 'amount': 100, 'category': 'Boshqa', 'currency': 'USD'}),
+    ("5000 rubl tushdi", {'type': 'income', 'amount': 5000, 'category': 'Boshqa', 'currency': 'RUB'}),
+    ("1000 lira xarajat", {'type': 'expense', 'amount': 1000, 'category': 'Boshqa', 'currency': 'TRY'}),
+    ("$50 xarajat", {'type': 'expense', 'amount': 50, 'category': 'Boshqa', 'currency': 'USD'}),
+    ("50 dollor xarajat", {'type': 'expense', 'amount': 50, 'category': 'Boshqa', 'currency': 'USD'}),
+    ("100 evro kirim", {'type': 'income', 'amount': 100, 'category': 'Boshqa', 'currency': 'EUR'}),
+    ("benzinga 200 ming sarfladim", {'type': 'expense', 'amount': 200000, 'category': 'Benzin', 'currency': 'UZS'}),
+    ("internetga 80k to'ladim", {'type': 'expense', 'amount': 80000, 'category': 'Internet', 'currency': 'UZS'}),
+    ("Hasanga 500k qarz berdim", {'type': 'debt_lent', 'amount': 500000, 'category': 'Qarz berish', 'currency': 'UZS'}),
+    ("Komildan 200k qarz oldim", {'type': 'debt_borrowed', 'amount': 200000, 'category': 'Qarz olish', 'currency': 'UZS'}),
+    ("Ali dan 300 ming qarz oldim", {'type': 'debt_borrowed', 'amount': 300000, 'category': 'Qarz olish', 'currency': 'UZS'}),
+    ("ikki yuz ming so'mga krossovka oldim", {'type': 'expense', 'amount': 200000, 'category': 'Poyabzal', 'currency': 'UZS'}),
+    ("bir million freelance daromad", {'type': 'income', 'amount': 1000000, 'category': 'Freelance', 'currency': 'UZS'}),
+    # LLM ga qoldirilishi kerak bo'lganlar
+    ("ok", None),
+    ("salom", None),
+    ("pul ketdi", None),
+    ("taksi uchun", None),
+    ("sovg'a uchun ichimlik sotib oldim", None),
+    ("Bugun 20:00 da Dastuchi bilan ko'rishisim kerak esalatasan", None),
+    ("Ertaga 11:00 da Duxtirga borishim kerak eslatasan", None),
+    ("taksi 20k va ovqat 50k", None),
+    ("100 000 so'm ishchimga ish haqqini berdim", None),
+    ("Hasanga 500k berdim", None),
+    ("Ali dan 100 000 sum qarz oldim keyingi yil 31-dekabrga qayttarishim kerak", None),
+    ("Hasan 500k qarzini qaytardi", None),
+    ("oylik 5 mln tushdi, kommunalga 400 ming to'ladim", None),
+    ("100k xarajat qildim do'stim bilan", None),
+    ("5 kg go'sht 400 ming", None),
+]
+
+
+def matches(result, expected) -> bool:
+    if expected is None:
+        return result is None
+    if not result:
+        return False
+    tx = result['transactions'][0]
+    return (tx['type'] == expected['type'] and abs(tx['amount'] - expected['amount']) < 0.01
+            and tx['category'] == expected['category'] and tx['currency'] == expected['currency'])
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    print("⚡ Rule parser benchmarki")
+    print("=" * 70)
+    hits = wrong = missed = 0
+    for text, expected in CORPUS:
+        result = parse_transaction(text)
+        if result and result['total_confidence'] < FAST_PATH_CONFIDENCE:
+            # Chaqiruvchilar kabi: shubhali summa LLM ga o'tadi
+            result = None
+        if result:
+            hits += 1
+        if result and not matches(result, expected):
+            wrong += 1
+            got = result['transactions'][0]
+            print(f"   ❌ noto'g'ri: {text!r} → {got}")
+        elif not result and expected:
+            missed += 1
+            print(f"   ➖ LLM ga o'tdi: {text!r}")
+
+    latencies = []
+    for _ in range(repeats):
+        for text, _ in CORPUS:
+            started = time.perf_counter()
+            parse_transaction(text)
+            latencies.append((time.perf_counter() - started) * 1_000_000)
+    latencies.sort()
+    p50 = statistics.median(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+
+    total = len(CORPUS)
+    parseable = sum(1 for _, expected in CORPUS if expected)
+    print(f"\n📊 Korpus: {total} ta xabar ({parseable} tasi oddiy tranzaksiya)")
+    print(f"   Hit rate (LLM siz):      {hits / total:.0%} umumiy, {(hits - wrong) / parseable:.0%} oddiy xabarlardan")
+    print(f"   Noto'g'ri natijalar:     {wrong}")
+    print(f"   LLM ga o'tgan oddiylar:  {missed}")
+    print(f"   Kechikish: p50 {p50:.1f} µs, p99 {p99:.1f} µs")
+    print("=" * 70)
+    return wrong == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -3,10 +3,11 @@ BALANS AI BIZNES — AI-powered Voice & Text Mini CRM
 Foydalanuvchi faqat yozish yoki gapirish orqali biznesini boshqaradi
 AI esa nima ekanini tushunib, to'g'ri modulga saqlaydi
 """
+import asyncio
 import logging
 import json
 import re
-from typing import Dict, List, Optional, Tuple
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
 from aiogram import types
 from aiogram.types import (
@@ -16,6 +17,9 @@ from aiogram.types import (
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
+from llm_gateway import llm
+from rule_parser import FAST_PATH_CONFIDENCE, parse_business_transaction
+
 logger = logging.getLogger(__name__)
 
 # Business states
@@ -86,6 +90,15 @@ class BusinessAIParser:
             'confidence': float
         }
         """
+        # Oddiy kirim/chiqim - LLM siz, qoidalar bilan
+        fast = parse_business_transaction(
+            message, self.EXPENSE_CATEGORIES, self.INCOME_CATEGORIES,
+            self.DEBT_KEYWORDS, self.WAREHOUSE_KEYWORDS
+        )
+        if fast and fast['confidence'] >= FAST_PATH_CONFIDENCE:
+            logger.info(f"Business rule parsed: {fast}")
+            return fast
+
         try:
             # AI orqali tahlil qilish
             system_prompt = """Sen biznes xabarlarini tahlil qiluvchi AI assistentsan.
@@ -120,8 +133,8 @@ O'zbek va rus tillarini tushun. Faqat JSON qaytar, boshqa hech narsa yo'q."""
 
             user_prompt = f"Xabar: {message}"
             
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
+            response = await llm.complete(
+                'business_parse',
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
@@ -130,7 +143,7 @@ O'zbek va rus tillarini tushun. Faqat JSON qaytar, boshqa hech narsa yo'q."""
                 temperature=0.1
             )
             
-            result_text = response.choices[0].message.content.strip()
+            result_text = response.strip()
             
             # JSON parse
             if result_text.startswith("```"):
@@ -158,11 +171,8 @@ O'zbek va rus tillarini tushun. Faqat JSON qaytar, boshqa hech narsa yo'q."""
             date_str = data.get('date', datetime.now().strftime('%Y-%m-%d'))
             
             # Tranzaksiya saqlash
-            transaction_id = await self.db.execute_query(
-                """INSERT INTO transactions 
-                (user_id, amount, transaction_type, category, description, created_at) 
-                VALUES (%s, %s, 'income', %s, %s, %s)""",
-                (user_id, amount, category, description, date_str)
+            transaction_id = await self.db.insert_transaction(
+                user_id, 'income', amount, category, description=description, created_at=date_str
             )
             
             return {
@@ -187,11 +197,8 @@ O'zbek va rus tillarini tushun. Faqat JSON qaytar, boshqa hech narsa yo'q."""
             date_str = data.get('date', datetime.now().strftime('%Y-%m-%d'))
             
             # Tranzaksiya saqlash
-            await self.db.execute_query(
-                """INSERT INTO transactions 
-                (user_id, amount, transaction_type, category, description, created_at) 
-                VALUES (%s, %s, 'expense', %s, %s, %s)""",
-                (user_id, amount, category, description, date_str)
+            await self.db.insert_transaction(
+                user_id, 'expense', amount, category, description=description, created_at=date_str
             )
             
             return {
@@ -236,6 +243,7 @@ O'zbek va rus tillarini tushun. Faqat JSON qaytar, boshqa hech narsa yo'q."""
                         WHERE id = %s""",
                         (new_paid, new_status, debt['id'])
                     )
+                    self.db.notify_financial_change(user_id)
                     
                     remaining = debt['amount'] - new_paid
                     return {
@@ -262,6 +270,7 @@ O'zbek va rus tillarini tushun. Faqat JSON qaytar, boshqa hech narsa yo'q."""
                     VALUES (%s, %s, %s, %s, 'active', %s)""",
                     (user_id, person_name, amount, debt_direction, date_str)
                 )
+                self.db.notify_financial_change(user_id)
                 
                 debt_text = "berildi" if debt_type == 'given' else "olindi"
                 return {
@@ -534,24 +543,24 @@ class BusinessModule:
             # Kirimlar
             income_result = await self.db.execute_query(
                 """SELECT COALESCE(SUM(amount), 0) as total FROM transactions 
-                WHERE user_id = %s AND transaction_type = 'income' AND DATE(created_at) = %s""",
-                (user_id, date_str)
+                WHERE user_id = %s AND transaction_type = 'income' AND created_at >= %s AND created_at < DATE_ADD(%s, INTERVAL 1 DAY)""",
+                (user_id, date_str, date_str)
             )
             total_income = income_result[0]['total'] if income_result and isinstance(income_result[0], dict) else 0
             
             # Chiqimlar
             expense_result = await self.db.execute_query(
                 """SELECT COALESCE(SUM(amount), 0) as total FROM transactions 
-                WHERE user_id = %s AND transaction_type = 'expense' AND DATE(created_at) = %s""",
-                (user_id, date_str)
+                WHERE user_id = %s AND transaction_type = 'expense' AND created_at >= %s AND created_at < DATE_ADD(%s, INTERVAL 1 DAY)""",
+                (user_id, date_str, date_str)
             )
             total_expense = expense_result[0]['total'] if expense_result else 0
             
             # Tranzaksiyalar soni
             count_result = await self.db.execute_query(
                 """SELECT COUNT(*) as count FROM transactions 
-                WHERE user_id = %s AND DATE(created_at) = %s""",
-                (user_id, date_str)
+                WHERE user_id = %s AND created_at >= %s AND created_at < DATE_ADD(%s, INTERVAL 1 DAY)""",
+                (user_id, date_str, date_str)
             )
             tx_count = count_result[0]['count'] if count_result else 0
             
@@ -835,16 +844,15 @@ class BusinessModule:
     
     # ================== AI CHAT ==================
     
-    async def ai_chat_response(self, user_id: int, question: str) -> str:
-        """AI Chat - biznes savollarga javob"""
-        try:
-            # Biznes ma'lumotlarini yig'ish
-            daily_report = await self.get_daily_report(user_id)
-            monthly_report = await self.get_monthly_report(user_id)
-            debts_report = await self.get_debts_report(user_id)
-            warehouse_stats = await self.get_warehouse_stats(user_id)
-            
-            context = f"""Biznes ma'lumotlari:
+    async def _ai_chat_context(self, user_id: int) -> str:
+        """AI Chat uchun biznes ma'lumotlari (hisobotlar parallel yig'iladi)"""
+        daily_report, monthly_report, debts_report, warehouse_stats = await asyncio.gather(
+            self.get_daily_report(user_id),
+            self.get_monthly_report(user_id),
+            self.get_debts_report(user_id),
+            self.get_warehouse_stats(user_id),
+        )
+        return f"""Biznes ma'lumotlari:
 
 {daily_report}
 
@@ -854,6 +862,12 @@ class BusinessModule:
 
 {warehouse_stats}
 """
+    
+    async def ai_chat_response(self, user_id: int, question: str) -> str:
+        """AI Chat - biznes savollarga javob"""
+        try:
+            # Biznes ma'lumotlarini yig'ish
+            context = await self._ai_chat_context(user_id)
             
             # AI dan javob olish
             response = await self.ai_chat.generate_business_response(user_id, question, context)
@@ -864,6 +878,21 @@ class BusinessModule:
             logger.error(f"AI chat error: {e}")
             return "❌ AI javob berishda xatolik"
     
+    async def ai_chat_response_stream(self, user_id: int, question: str) -> AsyncIterator[str]:
+        """ai_chat_response ning oqimli varianti - javob bo'laklari"""
+        try:
+            context = await self._ai_chat_context(user_id)
+        except Exception as e:
+            logger.error(f"AI chat error: {e}")
+            yield "❌ AI javob berishda xatolik"
+            return
+        answered = False
+        async for delta in self.ai_chat.generate_business_response_stream(user_id, question, context):
+            answered = True
+            yield delta
+        if not answered:
+            yield "🤔 Javob berishda xatolik. Qaytadan urinib ko'ring."
+    
     async def ai_warehouse_analysis(self, user_id: int) -> str:
         """AI Ombor tahlili"""
         try:
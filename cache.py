@@ -0,0 +1,74 @@
+"""
+Jarayon ichidagi TTL + LRU kesh
+
+Har bir xabarda takrorlanadigan so'rovlar (foydalanuvchi profili, aktiv tarif)
+natijalarini qisqa muddat saqlash uchun. Yozish operatsiyalari kalitni
+invalidate() orqali aniq o'chiradi, TTL esa qolgan holatlarda eskirishni cheklaydi.
+"""
+
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class TTLCache:
+    """Kalit bo'yicha TTL va LRU chegarali kesh, hit/miss metrikalari bilan"""
+
+    def __init__(self, maxsize: int = 5000, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        # Har bir invalidate() da oshadi - yuklash paytida o'chirilgan kalit
+        # eski qiymat bilan qayta yozilmasligi uchun
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.queries_saved = 0
+
+    def epoch(self) -> int:
+        """Yuklashdan oldin olinadi va set() ga uzatiladi"""
+        return self._epoch
+
+    def get(self, key):
+        """Qiymatni olish; topilmasa yoki muddati o'tgan bo'lsa MISSING"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        value, cost, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        self.queries_saved += cost
+        return value
+
+    def set(self, key, value, cost: int = 1, epoch: int = None):
+        """Qiymatni saqlash. cost - keshsiz holatda ketadigan so'rovlar soni"""
+        if epoch is not None and epoch != self._epoch:
+            return
+        self._data[key] = (value, cost, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._epoch += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._epoch += 1
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'queries_saved': self.queries_saved,
+        }
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Tez-tez ishlatiladigan so'rovlar indeksdan foydalanishini EXPLAIN orqali tekshirish
+
+Migratsiyalar qo'llanilgan va ma'lumotlar bor bazada ishga tushiring
+(bo'sh jadvallarda MySQL optimizatori to'liq skanerlashni tanlashi mumkin).
+
+Ishga tushirish:
+    python3 check_indexes.py [user_id]
+"""
+
+import asyncio
+import sys
+
+from database import db
+from migrations import run_migrations
+
+MONTH_START = "DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY)"
+
+TRANSACTION_INDEXES = {'idx_user_created', 'idx_user_type_created'}
+
+# (nomi, so'rov, parametrlar soni, kutilgan indekslar)
+HOT_QUERIES = [
+    (
+        "FREE oylik limit (process_financial_message)",
+        f"""SELECT COUNT(*) as count FROM transactions
+            WHERE user_id = %s
+            AND created_at >= {MONTH_START}
+            AND created_at < {MONTH_START} + INTERVAL 1 MONTH""",
+        1, TRANSACTION_INDEXES,
+    ),
+    (
+        "get_monthly_stats",
+        """SELECT DATE_FORMAT(created_at, '%%Y-%%m') as month, transaction_type, SUM(amount) as total
+           FROM transactions
+           WHERE user_id = %s AND created_at >= DATE_SUB(NOW(), INTERVAL 6 MONTH)
+           GROUP BY month, transaction_type""",
+        1, TRANSACTION_INDEXES,
+    ),
+    (
+        "get_category_stats",
+        """SELECT category, transaction_type, SUM(amount) as total, COUNT(*) as count
+           FROM transactions
+           WHERE user_id = %s AND created_at >= DATE_SUB(NOW(), INTERVAL 30 DAY)
+           GROUP BY category, transaction_type""",
+        1, TRANSACTION_INDEXES,
+    ),
+    (
+        "Kunlik hisobot: bugungi tranzaksiyalar",
+        """SELECT COUNT(*) as count FROM transactions
+           WHERE user_id = %s AND created_at >= CURDATE() AND created_at < CURDATE() + INTERVAL 1 DAY""",
+        1, TRANSACTION_INDEXES,
+    ),
+    (
+        "Tungi tahlil: kechagi chiqimlar kategoriyalar bo'yicha",
+        """SELECT category, SUM(amount) as total, COUNT(*) as count
+           FROM transactions
+           WHERE user_id = %s AND transaction_type = 'expense'
+           AND created_at >= DATE_SUB(CURDATE(), INTERVAL 1 DAY) AND created_at < CURDATE()
+           GROUP BY category""",
+        1, {'idx_user_type_created'},
+    ),
+]
+
+
+async def pick_user_id() -> int:
+    """Eng ko'p tranzaksiyasi bor foydalanuvchini tanlash"""
+    row = await db.execute_one(
+        "SELECT user_id FROM transactions GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1"
+    )
+    return row.get('user_id') if row else 0
+
+
+async def check_indexes(user_id: int) -> bool:
+    """Har bir so'rov uchun EXPLAIN natijasini tekshirish"""
+    all_ok = True
+    for name, query, params_count, expected in HOT_QUERIES:
+        plan = await db.execute_query(f"EXPLAIN {query}", (user_id,) * params_count)
+        row = plan[0] if plan else {}
+        key = row.get('key')
+        access = row.get('type')
+        ok = key in expected
+        all_ok = all_ok and ok
+        status = "✅" if ok else "❌"
+        print(f"   {status} {name}")
+        print(f"      key={key} type={access} rows={row.get('rows')} (kutilgan: {', '.join(sorted(expected))})")
+    return all_ok
+
+
+async def main():
+    print("🔍 Indekslar tekshirilmoqda...")
+    print("=" * 60)
+    await db.create_pool()
+    try:
+        await run_migrations(db)
+        user_id = int(sys.argv[1]) if len(sys.argv) > 1 else await pick_user_id()
+        print(f"👤 user_id = {user_id}\n")
+        success = await check_indexes(user_id)
+    finally:
+        await db.close_pool()
+
+    print("=" * 60)
+    print("🎉 Barcha so'rovlar indeksdan foydalanmoqda!" if success else "❌ Ba'zi so'rovlar indeksdan foydalanmayapti!")
+    return success
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    sys.exit(0 if success else 1)
@@ -103,6 +103,54 @@ TARIFF_PRICES = {
     'BUSINESS_MAX': 1999900,  # 19,999 so'm (199,990 kopek)
 }
 
+# Pro tarifida oylik API xarajatlari limiti (so'm)
+PRO_MONTHLY_COST_LIMIT = 40000
+# Pro: ish boshlanishidan oldin limitdan band qilinadigan taxminiy xarajat (so'm),
+# ish tugagach haqiqiy token/STT narxi bilan almashtiriladi
+PRO_RESERVE_TEXT_COST = float(os.getenv('PRO_RESERVE_TEXT_COST', '20'))
+PRO_RESERVE_VOICE_COST = float(os.getenv('PRO_RESERVE_VOICE_COST', '200'))
+# LLM/STT narxlarini so'mga o'tkazish kursi (1 USD)
+USD_TO_UZS = float(os.getenv('USD_TO_UZS', '12750'))
+# Google Speech-to-Text narxi (USD / daqiqa)
+STT_PRICE_USD_PER_MINUTE = float(os.getenv('STT_PRICE_USD_PER_MINUTE', '0.016'))
+
+# Ovozli xabar: Google ishonchi shundan yuqori bo'lsa transkript LLM bilan tuzatilmaydi
+VOICE_DIRECT_CONFIDENCE = float(os.getenv('VOICE_DIRECT_CONFIDENCE', '0.85'))
+# Foydalanuvchilarning necha foizi birlashgan (tuzatish + ajratish bitta so'rovda) rejimda,
+# qolganlari eski ikki bosqichli rejimda - A/B taqqoslash uchun
+VOICE_MERGED_PERCENT = int(os.getenv('VOICE_MERGED_PERCENT', '50'))
+
+# Tranzaksiya ajratish keshi: true bo'lsa natijalar MySQL orqali barcha bot replikalari bilan bo'lishiladi
+EXTRACTION_CACHE_SHARED = os.getenv('EXTRACTION_CACHE_SHARED', 'false').lower() == 'true'
+
+# AI chat javoblari (PRO, Biznes) Telegram'ga oqim bilan - xabar token kelishi bilan tahrirlanadi.
+# Oqim ishlamasa javob oqimsiz olinadi (llm_gateway.stream_chat); AI_STREAMING=false - butunlay o'chirish
+AI_STREAMING = os.getenv('AI_STREAMING', 'true').lower() == 'true'
+
+# FSM holatlari: mysql - fsm_storage jadvali (qayta ishga tushish va workerlar orasida saqlanadi), memory - faqat jarayon ichida
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'mysql').lower()
+
+# Webhook rejimi (webhook_server.py): Telegram yangilanishlari WEBHOOK_WORKERS ta jarayonga user_id bo'yicha taqsimlanadi
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL')  # masalan https://your-domain.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8001'))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', str(os.cpu_count() or 2)))
+# Har bir worker navbati sig'imi - to'lsa Telegram'ga 503 qaytariladi va u keyinroq qayta yuboradi
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+# Bitta workerda bir vaqtda qayta ishlanadigan yangilanishlar (turli foydalanuvchilar)
+WEBHOOK_WORKER_CONCURRENCY = int(os.getenv('WEBHOOK_WORKER_CONCURRENCY', '32'))
+
+# Mini ilova to'lov xabarlari (payment_notify_server.py)
+PAYMENT_NOTIFY_PORT = int(os.getenv('PAYMENT_NOTIFY_PORT', '5005'))
+# Yuborilishini kutayotgan xabarlar navbati - to'lsa mini ilovaga 503 qaytariladi
+PAYMENT_NOTIFY_QUEUE_SIZE = int(os.getenv('PAYMENT_NOTIFY_QUEUE_SIZE', '1000'))
+# Takroriy xabarni aniqlash oynasi (soniya): bir xil to'lov ID si (idempotency kaliti) shu vaqt ichida qayta yuborilmaydi
+PAYMENT_NOTIFY_IDEMPOTENCY_TTL = int(os.getenv('PAYMENT_NOTIFY_IDEMPOTENCY_TTL', '86400'))
+# To'lov ID si bo'lmasa: bir xil user_id/amount/status faqat shu soniyalar ichida takroriy hisoblanadi
+# (mini ilovaning qayta urinishlari), ya'ni bir xil summadagi ikkinchi haqiqiy to'lov yo'qolmaydi
+PAYMENT_NOTIFY_DUPLICATE_WINDOW = int(os.getenv('PAYMENT_NOTIFY_DUPLICATE_WINDOW', '10'))
+
 # Chegirma foizlari (muddat bo'yicha)
 DISCOUNT_RATES = {
     1: 0,    # 1 oy - chegirma yo'q
@@ -1,12 +1,24 @@
 import aiomysql
 import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime
-from config import MYSQL_CONFIG
+from typing import Optional
+from config import MYSQL_CONFIG, PRO_MONTHLY_COST_LIMIT, USD_TO_UZS
+from cache import TTLCache, MISSING
+from migrations import run_migrations, schema_is_current
 import logging
 
 class Database:
     def __init__(self):
         self.pool = None
+        # Har bir xabarda o'qiladigan profil va aktiv tarif uchun kesh
+        self.user_cache = TTLCache(maxsize=5000, ttl=60)
+        self.tariff_cache = TTLCache(maxsize=5000, ttl=60)
+        self.messages_processed = 0
+        # Eslatma yaratilganda/o'zgarganda xabardor qilinadiganlar (reminder_scheduler)
+        self.reminder_listeners = []
+        # Tranzaksiya/qarz o'zgarganda chaqiriladiganlar (financial_context snapshotlari)
+        self.financial_listeners = []
         
     async def create_pool(self):
         """Ma'lumotlar bazasi ulanishini yaratish.
@@ -65,9 +77,45 @@ class Database:
                 await cursor.execute(query, params)
                 return cursor.lastrowid
 
+    async def execute_update(self, query, params=None):
+        """UPDATE/DELETE so'rovi - o'zgargan qatorlar sonini qaytaradi"""
+        if not self.pool:
+            raise RuntimeError("Database pool mavjud emas. Avval create_pool() chaqirilishi kerak.")
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(query, params)
+                return cursor.rowcount
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Bitta ulanishda BEGIN/COMMIT bilan so'rovlar bajarish - DictCursor beradi.
+        
+        Xatolik bo'lsa ROLLBACK qilinadi va istisno qayta ko'tariladi.
+        """
+        if not self.pool:
+            raise RuntimeError("Database pool mavjud emas. Avval create_pool() chaqirilishi kerak.")
+        async with self.pool.acquire() as conn:
+            await conn.begin()
+            try:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    yield cursor
+                await conn.commit()
+            except BaseException:
+                await conn.rollback()
+                raise
+
     async def create_tables(self):
-        """Jadvallarni yaratish"""
+        """Jadvallarni yaratish.
+        
+        Sxema allaqachon so'nggi versiyada bo'lsa (schema_version), DDL qayta
+        bajarilmaydi - ishlayotgan jadvallarda metadata lock ushlanmaydi.
+        True qaytaradi, agar tekshiruv tez yo'l bilan tugagan bo'lsa.
+        """
         try:
+            if await schema_is_current(self):
+                logging.info("Sxema dolzarb, jadvallar yaratish o'tkazib yuborildi")
+                return True
+            
             # Users jadvali
             await self.execute_query("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -87,16 +135,6 @@ class Database:
                 )
             """)
 
-            # Ensure existing installations support new ENUM values and default
-            try:
-                await self.execute_query(
-                    "ALTER TABLE users MODIFY COLUMN tariff "
-                    "ENUM('NONE', 'FREE', 'PLUS', 'PRO', 'FAMILY', 'FAMILY_PLUS', 'FAMILY_PRO', 'BUSINESS', 'BUSINESS_PLUS', 'BUSINESS_PRO', 'EMPLOYEE') "
-                    "DEFAULT 'NONE'"
-                )
-            except Exception as e:
-                logging.debug(f"Users tariff enum alter skipped: {e}")
-            
             # Transactions jadvali
             await self.execute_query("""
                 CREATE TABLE IF NOT EXISTS transactions (
@@ -115,16 +153,21 @@ class Database:
                 )
             """)
             
-            # category_contact_id ustunini qo'shish (agar mavjud bo'lmasa)
-            try:
-                await self.execute_query("""
-                    ALTER TABLE transactions 
-                    ADD COLUMN category_contact_id INT NULL,
-                    ADD FOREIGN KEY (category_contact_id) REFERENCES contacts(id) ON DELETE SET NULL
-                """)
-            except Exception as e:
-                if "Duplicate column name" not in str(e) and "Duplicate key name" not in str(e):
-                    logging.info(f"category_contact_id ustuni allaqachon mavjud yoki xatolik: {e}")
+            # User balances jadvali - tranzaksiyalar bo'yicha yig'ma summalar (yozishda yangilanadi)
+            # debt_direction NULL o'rniga '' saqlanadi (PRIMARY KEY uchun)
+            await self.execute_query("""
+                CREATE TABLE IF NOT EXISTS user_balances (
+                    user_id BIGINT NOT NULL,
+                    currency VARCHAR(10) NOT NULL DEFAULT 'UZS',
+                    transaction_type ENUM('income', 'expense', 'debt') NOT NULL,
+                    debt_direction VARCHAR(10) NOT NULL DEFAULT '',
+                    total DECIMAL(20,2) NOT NULL DEFAULT 0,
+                    tx_count INT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, currency, transaction_type, debt_direction),
+                    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+                )
+            """)
             
             # Categories jadvali
             await self.execute_query("""
@@ -169,24 +212,6 @@ class Database:
                 )
             """)
             
-            # account_type ustunini qo'shish (SHI, OILA, BIZNES)
-            try:
-                await self.execute_query("ALTER TABLE users ADD COLUMN account_type VARCHAR(20) DEFAULT 'SHI'")
-                logging.info("Ustun account_type qo'shildi")
-            except Exception as e:
-                logging.info(f"Ustun account_type allaqachon mavjud: {e}")
-                pass
-            
-            # Yangi ustunlarni qo'shish (agar mavjud bo'lmasa)
-            await self.add_missing_columns()
-            
-            # manager_id ustunini qo'shish (agar mavjud bo'lmasa)
-            try:
-                await self.execute_query("ALTER TABLE users ADD COLUMN manager_id BIGINT NULL")
-                await self.execute_query("ALTER TABLE users ADD FOREIGN KEY (manager_id) REFERENCES users(user_id) ON DELETE SET NULL")
-            except Exception:
-                pass  # Ustun allaqachon mavjud
-            
             # User steps jadvali - onboarding bosqichlari uchun
             await self.execute_query("""
                 CREATE TABLE IF NOT EXISTS user_steps (
@@ -334,31 +359,6 @@ class Database:
                 )
             """)
             
-            # contact_type va category_name ustunlarini qo'shish (agar mavjud bo'lmasa)
-            try:
-                await self.execute_query("""
-                    ALTER TABLE contacts 
-                    ADD COLUMN contact_type ENUM('person', 'category') DEFAULT 'person',
-                    ADD COLUMN category_name VARCHAR(100) NULL,
-                    ADD COLUMN transaction_type ENUM('income', 'expense', 'both') NULL
-                """)
-            except Exception as e:
-                if "Duplicate column name" not in str(e):
-                    logging.info(f"Contacts jadvali ustunlari allaqachon mavjud yoki xatolik: {e}")
-            
-            # Index'larni qo'shish (agar mavjud bo'lmasa)
-            try:
-                await self.execute_query("CREATE INDEX idx_contact_type ON contacts(contact_type)")
-            except Exception as e:
-                if "Duplicate key name" not in str(e):
-                    logging.debug(f"Index idx_contact_type yaratish xatolik: {e}")
-            
-            try:
-                await self.execute_query("CREATE INDEX idx_category_name ON contacts(category_name)")
-            except Exception as e:
-                if "Duplicate key name" not in str(e):
-                    logging.debug(f"Index idx_category_name yaratish xatolik: {e}")
-            
             # User settings jadvali - foydalanuvchi sozlamalari
             await self.execute_query("""
                 CREATE TABLE IF NOT EXISTS user_settings (
@@ -404,6 +404,7 @@ class Database:
                     user_id BIGINT NOT NULL,
                     transaction_id INT NULL,
                     reminder_date DATE,
+                    sent_at DATETIME NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
                     FOREIGN KEY (transaction_id) REFERENCES transactions(id) ON DELETE CASCADE
@@ -440,30 +441,6 @@ class Database:
                 )
             """)
             
-            # Reminders jadvaliga yangi ustunlar qo'shish (agar mavjud bo'lmasa)
-            reminder_columns = [
-                ("location", "VARCHAR(255) NULL"),
-                ("is_recurring", "BOOLEAN DEFAULT FALSE"),
-                ("recurrence_pattern", "ENUM('daily', 'weekly', 'monthly', 'yearly') NULL"),
-                ("recurrence_day", "INT NULL"),
-                ("notification_30min_sent", "BOOLEAN DEFAULT FALSE"),
-                ("notification_exact_sent", "BOOLEAN DEFAULT FALSE")
-            ]
-            for col_name, col_def in reminder_columns:
-                try:
-                    await self.execute_query(f"ALTER TABLE reminders ADD COLUMN {col_name} {col_def}")
-                except Exception:
-                    pass  # Ustun allaqachon mavjud
-            
-            # reminder_type ni yangilash (yangi qiymatlar qo'shish)
-            try:
-                await self.execute_query("""
-                    ALTER TABLE reminders MODIFY COLUMN reminder_type 
-                    ENUM('debt_give', 'debt_receive', 'payment', 'meeting', 'event', 'task', 'other') NOT NULL
-                """)
-            except Exception:
-                pass
-            
             # Warehouse (Ombor) jadvallari - Biznes tarif uchun
             # Tovarlar jadvali
             await self.execute_query("""
@@ -565,6 +542,20 @@ class Database:
                 )
             """)
             
+            # Valyuta kurslari jadvali
+            await self.execute_query("""
+                CREATE TABLE IF NOT EXISTS currency_rates (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    currency_code VARCHAR(10) NOT NULL,
+                    rate_to_uzs DECIMAL(20,6) NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    UNIQUE KEY unique_currency (currency_code)
+                )
+            """)
+            
+            # Eski o'rnatishlar uchun ustunlar, indekslar va ma'lumot tuzatishlari
+            await run_migrations(self)
+            
             # Boshlang'ich qiymatlarni qo'shish
             await self.execute_query("""
                 INSERT IGNORE INTO config (key_name, value) VALUES
@@ -580,269 +571,60 @@ class Database:
             
         except Exception as e:
             logging.error(f"Jadvallar yaratishda xatolik: {e}")
+        return False
 
-    async def add_missing_columns(self):
-        """Eski jadvallarga yangi ustunlarni qo'shish"""
-        try:
-            # Users jadvaliga yangi ustunlar qo'shish
-            columns_to_add = [
-                ("phone", "VARCHAR(20)"),
-                ("name", "VARCHAR(255) DEFAULT 'Xojayin'"),
-                ("source", "VARCHAR(50)"),
-                ("tariff_expires_at", "DATETIME NULL")
-            ]
-            
-            for column_name, column_definition in columns_to_add:
-                try:
-                    await self.execute_query(f"ALTER TABLE users ADD COLUMN {column_name} {column_definition}")
-                    logging.info(f"Ustun {column_name} qo'shildi")
-                except Exception as e:
-                    if "Duplicate column name" in str(e):
-                        logging.info(f"Ustun {column_name} allaqachon mavjud")
-                    else:
-                        logging.error(f"Ustun {column_name} qo'shishda xatolik: {e}")
-            
-            # Tarif enum ni yangilash
-            try:
-                await self.execute_query(
-                    "ALTER TABLE users MODIFY COLUMN tariff "
-                    "ENUM('NONE', 'FREE', 'PLUS', 'PRO', 'FAMILY', 'FAMILY_PLUS', 'FAMILY_PRO', "
-                    "'BUSINESS', 'BUSINESS_PLUS', 'BUSINESS_PRO', 'EMPLOYEE') DEFAULT 'NONE'"
-                )
-                logging.info("Tarif enum yangilandi")
-            except Exception as e:
-                logging.error(f"Tarif enum yangilashda xatolik: {e}")
-            
-            # User subscriptions jadvalini yangilash
-            try:
-                await self.execute_query("ALTER TABLE user_subscriptions MODIFY COLUMN tariff ENUM('PLUS', 'BUSINESS', 'PRO', 'FAMILY', 'FAMILY_PLUS', 'FAMILY_PRO', 'BUSINESS_PLUS', 'BUSINESS_PRO', 'EMPLOYEE') NOT NULL")
-                logging.info("User subscriptions tariff enum yangilandi")
-            except Exception as e:
-                logging.error(f"User subscriptions tariff enum yangilashda xatolik: {e}")
-
-            # Plus paketlar jadvaliga expires_at ustunini qo'shish
-            try:
-                await self.execute_query("ALTER TABLE plus_package_purchases ADD COLUMN expires_at DATETIME NULL")
-                logging.info("plus_package_purchases jadvaliga expires_at ustuni qo'shildi")
-            except Exception as e:
-                if "Duplicate column name" in str(e):
-                    logging.info("expires_at ustuni allaqachon mavjud")
-                else:
-                    logging.error(f"expires_at ustunini qo'shishda xatolik: {e}")
-
-            # Plus paketlar jadvalidagi status enum qiymatlarini standartlashtirish
-            try:
-                await self.execute_query(
-                    "ALTER TABLE plus_package_purchases "
-                    "MODIFY COLUMN status ENUM('active','completed') DEFAULT 'active'"
-                )
-                await self.execute_query(
-                    "UPDATE plus_package_purchases "
-                    "SET status = LOWER(status) "
-                    "WHERE status IS NOT NULL"
-                )
-                logging.info("plus_package_purchases status enum yangilandi")
-            except Exception as e:
-                logging.error(f"plus_package_purchases status enum yangilashda xatolik: {e}")
-
-            
-            # Payments jadvalini yangilash
-            try:
-                await self.execute_query("ALTER TABLE payments MODIFY COLUMN tariff ENUM('FREE', 'PLUS', 'PRO', 'FAMILY', 'FAMILY_PLUS', 'FAMILY_PRO', 'BUSINESS', 'BUSINESS_PLUS', 'BUSINESS_PRO', 'EMPLOYEE') NOT NULL")
-                logging.info("Payments tariff enum yangilandi")
-            except Exception as e:
-                logging.error(f"Payments tariff enum yangilashda xatolik: {e}")
-            
-            # Payments jadvaliga merchant_trans_id maydonini to'g'rilash
-            # KUCHLI USUL: ustunni DROP qilib qayta yaratish
-            try:
-                # Avval ustunni o'chiramiz (agar mavjud bo'lsa)
-                try:
-                    await self.execute_query("ALTER TABLE payments DROP COLUMN merchant_trans_id")
-                    logging.info("merchant_trans_id ustuni o'chirildi")
-                except Exception as drop_err:
-                    # Ustun yo'q bo'lishi mumkin, davom etamiz
-                    pass
-                
-                # Yangi ustun qo'shamiz - NULL va DEFAULT NULL bilan
-                await self.execute_query("ALTER TABLE payments ADD COLUMN merchant_trans_id VARCHAR(255) NULL DEFAULT NULL")
-                logging.info("merchant_trans_id ustuni qayta yaratildi (NULL DEFAULT NULL)")
-            except Exception as e:
-                logging.error(f"merchant_trans_id ustunini qayta yaratishda xatolik: {e}")
-            
-            # Premium tarifli foydalanuvchilarni FREE ga o'zgartirish
-            try:
-                await self.execute_query("UPDATE users SET tariff = 'FREE' WHERE tariff = 'PREMIUM'")
-                await self.execute_query("UPDATE payments SET tariff = 'FREE' WHERE tariff = 'PREMIUM'")
-                await self.execute_query("UPDATE user_subscriptions SET tariff = 'FREE' WHERE tariff = 'PREMIUM'")
-                logging.info("Premium tarifli foydalanuvchilar FREE ga o'zgartirildi")
-            except Exception as e:
-                logging.error(f"Premium tarifni FREE ga o'zgartirishda xatolik: {e}")
-
-            # Transactions jadvaliga yangi ustunlar
-            trans_columns = [
-                ("due_date", "DATE NULL"),
-                ("debt_direction", "ENUM('lent','borrowed') NULL")
-            ]
-            for column_name, column_definition in trans_columns:
-                try:
-                    await self.execute_query(f"ALTER TABLE transactions ADD COLUMN {column_name} {column_definition}")
-                    logging.info(f"transactions.{column_name} qo'shildi")
-                except Exception as e:
-                    if "Duplicate column name" in str(e):
-                        logging.info(f"transactions.{column_name} allaqachon mavjud")
-                    else:
-                        logging.error(f"transactions.{column_name} qo'shishda xatolik: {e}")
-            
-            # Warehouse_products ga unit ustunini qo'shish
-            try:
-                await self.execute_query("ALTER TABLE warehouse_products ADD COLUMN unit VARCHAR(50) DEFAULT 'dona'")
-                logging.info("warehouse_products.unit qo'shildi")
-            except Exception as e:
-                if "Duplicate column name" in str(e):
-                    logging.info("warehouse_products.unit allaqachon mavjud")
-                else:
-                    logging.error(f"warehouse_products.unit qo'shishda xatolik: {e}")
-            
-            # Warehouse_movements ga reason ustunini qo'shish
-            try:
-                await self.execute_query("ALTER TABLE warehouse_movements ADD COLUMN reason VARCHAR(100) DEFAULT 'other'")
-                logging.info("warehouse_movements.reason qo'shildi")
-            except Exception as e:
-                if "Duplicate column name" in str(e):
-                    logging.info("warehouse_movements.reason allaqachon mavjud")
-                else:
-                    logging.error(f"warehouse_movements.reason qo'shishda xatolik: {e}")
-            
-            # Debts jadvaliga paid_amount ustunini qo'shish
-            try:
-                await self.execute_query("ALTER TABLE debts ADD COLUMN paid_amount DECIMAL(15,2) DEFAULT 0")
-                logging.info("debts.paid_amount qo'shildi")
-            except Exception as e:
-                if "Duplicate column name" in str(e):
-                    logging.info("debts.paid_amount allaqachon mavjud")
-                else:
-                    logging.error(f"debts.paid_amount qo'shishda xatolik: {e}")
-            
-            # contact_id ustunini qo'shish
-            try:
-                await self.execute_query("ALTER TABLE debts ADD COLUMN contact_id INT NULL")
-                logging.info("debts.contact_id qo'shildi")
-            except Exception as e:
-                if "Duplicate column name" in str(e):
-                    logging.info("debts.contact_id allaqachon mavjud")
-                else:
-                    logging.error(f"debts.contact_id qo'shishda xatolik: {e}")
-            
-            # contact_id uchun foreign key qo'shish (mavjud bo'lmasa)
-            try:
-                await self.execute_query("""
-                    ALTER TABLE debts 
-                    ADD CONSTRAINT fk_debts_contact 
-                    FOREIGN KEY (contact_id) REFERENCES contacts(id) ON DELETE SET NULL
-                """)
-                logging.info("debts.contact_id foreign key qo'shildi")
-            except Exception as e:
-                if "Duplicate foreign key" in str(e) or "already exists" in str(e).lower() or "Duplicate key name" in str(e):
-                    logging.info("debts.contact_id foreign key allaqachon mavjud")
-                else:
-                    logging.error(f"debts.contact_id foreign key qo'shishda xatolik: {e}")
-
-            # Debts jadvaliga currency ustunini qo'shish
-            try:
-                await self.execute_query("ALTER TABLE debts ADD COLUMN currency VARCHAR(10) DEFAULT 'UZS'")
-                logging.info("debts.currency qo'shildi")
-            except Exception as e:
-                if "Duplicate column name" in str(e):
-                    logging.info("debts.currency allaqachon mavjud")
-                else:
-                    logging.error(f"debts.currency qo'shishda xatolik: {e}")
+    def invalidate_user_cache(self, user_id):
+        """users, user_subscriptions yoki plus_package_purchases o'zgarganda chaqiriladi"""
+        self.user_cache.invalidate(user_id)
+        self.tariff_cache.invalidate(user_id)
 
-            # Debts jadvaliga description ustunini qo'shish (agar yo'q bo'lsa)
+    async def notify_reminder_changed(self, reminder_id: int, removed: bool = False):
+        """Eslatma rejalashtiruvchilarini yangilash (xatolik asosiy amalni buzmaydi)"""
+        for listener in self.reminder_listeners:
             try:
-                await self.execute_query("ALTER TABLE debts ADD COLUMN description TEXT NULL")
-                logging.info("debts.description qo'shildi")
+                await listener(reminder_id, removed)
             except Exception as e:
-                if "Duplicate column name" in str(e):
-                    logging.info("debts.description allaqachon mavjud")
-                else:
-                    logging.error(f"debts.description qo'shishda xatolik: {e}")
+                logging.warning(f"Eslatma {reminder_id} rejalashtiruvchiga yetkazilmadi: {e}")
 
-            # Transactions jadvaliga currency ustunini qo'shish
+    def notify_financial_change(self, user_id: int, transaction: dict = None):
+        """transactions/debts yozilgandan keyin chaqiriladi. transaction - yangi qo'shilgan qator"""
+        for listener in self.financial_listeners:
             try:
-                await self.execute_query("ALTER TABLE transactions ADD COLUMN currency VARCHAR(10) DEFAULT 'UZS'")
-                logging.info("transactions.currency qo'shildi")
+                listener(user_id, transaction)
             except Exception as e:
-                if "Duplicate column name" in str(e):
-                    logging.info("transactions.currency allaqachon mavjud")
-                else:
-                    logging.error(f"transactions.currency qo'shishda xatolik: {e}")
+                logging.warning(f"Moliyaviy kontekst yangilanmadi (user {user_id}): {e}")
 
-            # Valyuta kurslari jadvali
-            try:
-                await self.execute_query("""
-                    CREATE TABLE IF NOT EXISTS currency_rates (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        currency_code VARCHAR(10) NOT NULL,
-                        rate_to_uzs DECIMAL(20,6) NOT NULL,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                        UNIQUE KEY unique_currency (currency_code)
-                    )
-                """)
-                
-                # Default kurslarni qo'shish
-                default_rates = [
-                    ('UZS', 1.0),
-                    ('USD', 12750.0),
-                    ('EUR', 13800.0),
-                    ('RUB', 135.0),
-                    ('TRY', 370.0)
-                ]
-                for code, rate in default_rates:
-                    await self.execute_query("""
-                        INSERT INTO currency_rates (currency_code, rate_to_uzs) 
-                        VALUES (%s, %s)
-                        ON DUPLICATE KEY UPDATE rate_to_uzs = VALUES(rate_to_uzs)
-                    """, (code, rate))
-                logging.info("currency_rates jadvali yaratildi va default kurslar qo'shildi")
-            except Exception as e:
-                logging.error(f"currency_rates jadvalini yaratishda xatolik: {e}")
+    def count_message(self):
+        """Kesh metrikalari uchun qayta ishlangan xabarlar soni"""
+        self.messages_processed += 1
 
-            # Qarz eslatmalari jadvali
-            try:
-                await self.execute_query("""
-                    CREATE TABLE IF NOT EXISTS debt_reminders (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        user_id BIGINT NOT NULL,
-                        transaction_id INT NOT NULL,
-                        reminder_date DATE NOT NULL,
-                        sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        UNIQUE KEY uniq_user_tx_date (user_id, transaction_id, reminder_date),
-                        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
-                        FOREIGN KEY (transaction_id) REFERENCES transactions(id) ON DELETE CASCADE
-                    )
-                """)
-            except Exception as e:
-                logging.error(f"debt_reminders jadvalini yaratishda xatolik: {e}")
-            
-            # Plus package purchases jadvalidagi noto'g'ri status qiymatlarini tozalash
-            try:
-                # Noto'g'ri status qiymatlarini tozalash
-                await self.execute_query("""
-                    UPDATE plus_package_purchases 
-                    SET status = 'active' 
-                    WHERE status NOT IN ('active', 'completed') 
-                    OR status IS NULL
-                """)
-                logging.info("Plus package purchases status qiymatlari tozalandi")
-            except Exception as e:
-                logging.error(f"Plus package purchases status tozalashda xatolik: {e}")
-                
-        except Exception as e:
-            logging.error(f"Ustunlar qo'shishda xatolik: {e}")
+    def cache_stats(self) -> dict:
+        """Kesh hit ratio va bitta xabarga to'g'ri keladigan tejalgan so'rovlar"""
+        user = self.user_cache.stats()
+        tariff = self.tariff_cache.stats()
+        hits = user['hits'] + tariff['hits']
+        lookups = hits + user['misses'] + tariff['misses']
+        saved = user['queries_saved'] + tariff['queries_saved']
+        return {
+            'user': user,
+            'tariff': tariff,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+            'queries_saved': saved,
+            'messages': self.messages_processed,
+            'queries_saved_per_message': saved / self.messages_processed if self.messages_processed else 0.0,
+        }
 
     async def get_user_data(self, user_id):
-        """Foydalanuvchi ma'lumotlarini olish"""
+        """Foydalanuvchi ma'lumotlarini olish (keshdan, bo'lmasa bazadan)"""
+        cached = self.user_cache.get(user_id)
+        if cached is not MISSING:
+            return dict(cached) if cached else None
+        epoch = self.user_cache.epoch()
+        data = await self._load_user_data(user_id)
+        self.user_cache.set(user_id, data, cost=1, epoch=epoch)
+        return dict(data) if data else None
+
+    async def _load_user_data(self, user_id):
         query = """
         SELECT user_id, username, first_name, last_name, phone, name, source, tariff, created_at, tariff_expires_at
         FROM users 
@@ -925,11 +707,159 @@ class Database:
                 description=description
             )
         
-        query = """
-        INSERT INTO transactions (user_id, transaction_type, amount, category, currency, description, debt_direction, due_date)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        return await self.insert_transaction(
+            user_id, transaction_type, amount, category, currency=currency,
+            description=description, debt_direction=debt_direction, due_date=due_date
+        )
+
+    async def insert_transaction(self, user_id, transaction_type, amount, category, currency='UZS',
+                                 description=None, debt_direction=None, due_date=None, created_at=None):
+        """transactions jadvaliga yozish va user_balances ni shu tranzaksiyada yangilash.
+        
+        transactions ga to'g'ridan-to'g'ri INSERT o'rniga shu metoddan foydalaning,
+        aks holda yig'ma balans bilan farq paydo bo'ladi.
         """
-        return await self.execute_insert(query, (user_id, transaction_type, amount, category, currency, description, debt_direction, due_date))
+        columns = ['user_id', 'transaction_type', 'amount', 'category', 'currency',
+                   'description', 'debt_direction', 'due_date']
+        params = [user_id, transaction_type, amount, category, currency,
+                  description, debt_direction, due_date]
+        if created_at is not None:
+            columns.append('created_at')
+            params.append(created_at)
+        query = f"""
+        INSERT INTO transactions ({', '.join(columns)})
+        VALUES ({', '.join(['%s'] * len(columns))})
+        """
+        async with self.transaction() as cursor:
+            await cursor.execute(query, tuple(params))
+            transaction_id = cursor.lastrowid
+            await self._apply_balance_delta(
+                cursor, user_id, transaction_type, debt_direction, currency, amount, 1
+            )
+        self.notify_financial_change(user_id, {
+            'id': transaction_id, 'user_id': user_id, 'transaction_type': transaction_type,
+            'amount': amount, 'category': category, 'currency': currency, 'description': description,
+            'debt_direction': debt_direction, 'due_date': due_date, 'created_at': created_at,
+        })
+        return transaction_id
+
+    async def _apply_balance_delta(self, cursor, user_id, transaction_type, debt_direction,
+                                   currency, amount, count_delta):
+        """user_balances dagi bitta qatorni o'zgartirish (ochiq tranzaksiya cursori ichida)"""
+        if transaction_type not in ('income', 'expense', 'debt'):
+            return
+        direction = debt_direction if transaction_type == 'debt' and debt_direction in ('lent', 'borrowed') else ''
+        await cursor.execute(
+            """
+            INSERT INTO user_balances (user_id, currency, transaction_type, debt_direction, total, tx_count)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                total = total + VALUES(total),
+                tx_count = tx_count + VALUES(tx_count)
+            """,
+            (user_id, currency or 'UZS', transaction_type, direction, amount or 0, count_delta)
+        )
+
+    async def update_transaction_amount(self, transaction_id: int, user_id: int, amount: float) -> bool:
+        """Tranzaksiya summasini o'zgartirish (user_balances bilan birga)"""
+        async with self.transaction() as cursor:
+            await cursor.execute(
+                """
+                SELECT transaction_type, debt_direction, currency, amount
+                FROM transactions WHERE id = %s AND user_id = %s FOR UPDATE
+                """,
+                (transaction_id, user_id)
+            )
+            trans = await cursor.fetchone()
+            if not trans:
+                return False
+            await cursor.execute(
+                "UPDATE transactions SET amount = %s WHERE id = %s AND user_id = %s",
+                (amount, transaction_id, user_id)
+            )
+            delta = float(amount) - float(trans.get('amount') or 0)
+            await self._apply_balance_delta(
+                cursor, user_id, trans.get('transaction_type'), trans.get('debt_direction'),
+                trans.get('currency'), delta, 0
+            )
+        self.notify_financial_change(user_id)
+        return True
+
+    async def rebuild_user_balances(self, user_id: int = None) -> None:
+        """user_balances ni transactions jadvalidan qayta hisoblash (bitta yoki barcha foydalanuvchi)"""
+        where = "WHERE user_id = %s" if user_id is not None else ""
+        params = (user_id,) if user_id is not None else None
+        async with self.transaction() as cursor:
+            await cursor.execute(f"DELETE FROM user_balances {where}", params)
+            await cursor.execute(
+                f"""
+                INSERT INTO user_balances (user_id, currency, transaction_type, debt_direction, total, tx_count)
+                SELECT user_id, COALESCE(currency, 'UZS'), transaction_type,
+                       CASE WHEN transaction_type = 'debt' AND debt_direction IN ('lent', 'borrowed')
+                            THEN debt_direction ELSE '' END,
+                       COALESCE(SUM(amount), 0), COUNT(*)
+                FROM transactions
+                {where}
+                GROUP BY user_id, COALESCE(currency, 'UZS'), transaction_type,
+                         CASE WHEN transaction_type = 'debt' AND debt_direction IN ('lent', 'borrowed')
+                              THEN debt_direction ELSE '' END
+                """,
+                params
+            )
+        logging.info(f"user_balances qayta hisoblandi (user_id={user_id if user_id is not None else 'hammasi'})")
+
+    async def verify_user_balances(self, user_id: int = None) -> list:
+        """user_balances va transactions o'rtasidagi farqlarni topish.
+        
+        Qaytadi: [{'user_id', 'currency', 'transaction_type', 'debt_direction',
+        'stored', 'actual', 'stored_count', 'actual_count'}] - faqat farq bor qatorlar.
+        """
+        where = "WHERE user_id = %s" if user_id is not None else ""
+        params = (user_id,) if user_id is not None else None
+        actual_rows = await self.execute_query(
+            f"""
+            SELECT user_id, COALESCE(currency, 'UZS') as currency, transaction_type,
+                   CASE WHEN transaction_type = 'debt' AND debt_direction IN ('lent', 'borrowed')
+                        THEN debt_direction ELSE '' END as debt_direction,
+                   COALESCE(SUM(amount), 0) as total, COUNT(*) as tx_count
+            FROM transactions
+            {where}
+            GROUP BY user_id, COALESCE(currency, 'UZS'), transaction_type,
+                     CASE WHEN transaction_type = 'debt' AND debt_direction IN ('lent', 'borrowed')
+                          THEN debt_direction ELSE '' END
+            """,
+            params
+        )
+        stored_rows = await self.execute_query(
+            f"SELECT user_id, currency, transaction_type, debt_direction, total, tx_count FROM user_balances {where}",
+            params
+        )
+        
+        def _key(row):
+            return (row.get('user_id'), row.get('currency'), row.get('transaction_type'), row.get('debt_direction') or '')
+        
+        actual = {_key(r): r for r in actual_rows}
+        stored = {_key(r): r for r in stored_rows}
+        drift = []
+        for key in set(actual) | set(stored):
+            a = actual.get(key) or {}
+            b = stored.get(key) or {}
+            a_total = float(a.get('total') or 0)
+            b_total = float(b.get('total') or 0)
+            a_count = int(a.get('tx_count') or 0)
+            b_count = int(b.get('tx_count') or 0)
+            if abs(a_total - b_total) > 0.005 or a_count != b_count:
+                drift.append({
+                    'user_id': key[0],
+                    'currency': key[1],
+                    'transaction_type': key[2],
+                    'debt_direction': key[3],
+                    'stored': b_total,
+                    'actual': a_total,
+                    'stored_count': b_count,
+                    'actual_count': a_count,
+                })
+        return drift
 
     async def delete_transaction(self, transaction_id: int, user_id: int) -> dict:
         """Tranzaksiyani o'chirish (debts va kontakt balansini ham yangilaydi)"""
@@ -999,11 +929,18 @@ class Database:
                         # Kontaktning umumiy balansini yangilash
                         await self.update_contact_totals(contact_id)
             
-            # Tranzaksiyani o'chirish
-            await self.execute_query(
-                "DELETE FROM transactions WHERE id = %s AND user_id = %s",
-                (transaction_id, user_id)
-            )
+            # Tranzaksiyani o'chirish (user_balances bilan bitta tranzaksiyada)
+            async with self.transaction() as cursor:
+                await cursor.execute(
+                    "DELETE FROM transactions WHERE id = %s AND user_id = %s",
+                    (transaction_id, user_id)
+                )
+                if cursor.rowcount:
+                    await self._apply_balance_delta(
+                        cursor, user_id, trans_type, debt_direction, currency, -amount, -1
+                    )
+            
+            self.notify_financial_change(user_id)
             
             return {
                 'success': True,
@@ -1073,7 +1010,7 @@ class Database:
                 if due_date:
                     # Eslatma yaratish
                     await self.execute_query(
-                        "INSERT INTO debt_reminders (user_id, transaction_id, reminder_date) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE reminder_date = %s",
+                        "INSERT INTO debt_reminders (user_id, transaction_id, reminder_date) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE reminder_date = %s, sent_at = NULL",
                         (user_id, transaction_id, due_date, due_date)
                     )
                 else:
@@ -1091,6 +1028,7 @@ class Database:
             
             update_query = f"UPDATE transactions SET {', '.join(updates)} WHERE id = %s AND user_id = %s"
             await self.execute_query(update_query, tuple(params))
+            self.notify_financial_change(user_id)
             
             return {
                 'success': True,
@@ -1101,26 +1039,51 @@ class Database:
             logging.error(f"Tranzaksiyani yangilashda xatolik: {e}")
             return {'success': False, 'message': f'Xatolik: {str(e)}'}
 
-    async def get_balance(self, user_id):
-        """Foydalanuvchi balansini olish"""
-        # Kirimlar
-        income_query = "SELECT COALESCE(SUM(amount), 0) as total FROM transactions WHERE user_id = %s AND transaction_type = 'income'"
-        income_result = await self.execute_one(income_query, (user_id,))
-        income = float(income_result.get('total', 0)) if income_result else 0.0
-        
-        # Chiqimlar
-        expense_query = "SELECT COALESCE(SUM(amount), 0) as total FROM transactions WHERE user_id = %s AND transaction_type = 'expense'"
-        expense_result = await self.execute_one(expense_query, (user_id,))
-        expense = float(expense_result.get('total', 0)) if expense_result else 0.0
-        
-        # Qarzlar (yo'nalma bo'yicha)
-        borrowed_query = "SELECT COALESCE(SUM(amount), 0) as total FROM transactions WHERE user_id = %s AND transaction_type = 'debt' AND debt_direction = 'borrowed'"
-        borrowed_result = await self.execute_one(borrowed_query, (user_id,))
-        borrowed = float(borrowed_result.get('total', 0)) if borrowed_result else 0.0
+    async def get_balance_aggregates(self, user_id) -> dict:
+        """Balans uchun yagona agregatsiya - user_balances dan bitta so'rov.
 
-        lent_query = "SELECT COALESCE(SUM(amount), 0) as total FROM transactions WHERE user_id = %s AND transaction_type = 'debt' AND debt_direction = 'lent'"
-        lent_result = await self.execute_one(lent_query, (user_id,))
-        lent = float(lent_result.get('total', 0)) if lent_result else 0.0
+        get_balance, get_balance_multi_currency va ReportsModule.get_balance_report
+        shu natijadan hisoblaydi. Qaytadi: {valyuta: {'income', 'expense',
+        'borrowed', 'lent', 'debt'}}, bu yerda 'debt' - yo'nalishidan qat'i nazar
+        barcha qarzlar yig'indisi.
+        """
+        # user_balances yozishda yangilanadi - transactions tarixini skanerlash shart emas
+        query = """
+        SELECT transaction_type, debt_direction, currency, total
+        FROM user_balances
+        WHERE user_id = %s
+        """
+        rows = await self.execute_query(query, (user_id,))
+        
+        aggregates = {}
+        for row in rows:
+            currency = row.get('currency') or 'UZS'
+            trans_type = row.get('transaction_type')
+            direction = row.get('debt_direction')
+            total = float(row.get('total') or 0)
+            bucket = aggregates.setdefault(currency, {
+                'income': 0.0, 'expense': 0.0, 'borrowed': 0.0, 'lent': 0.0, 'debt': 0.0
+            })
+            if trans_type == 'income':
+                bucket['income'] += total
+            elif trans_type == 'expense':
+                bucket['expense'] += total
+            elif trans_type == 'debt':
+                bucket['debt'] += total
+                if direction in ('borrowed', 'lent'):
+                    bucket[direction] += total
+        return aggregates
+
+    async def get_balance(self, user_id, aggregates: dict = None):
+        """Foydalanuvchi balansini olish"""
+        if aggregates is None:
+            aggregates = await self.get_balance_aggregates(user_id)
+        
+        # Valyutadan qat'i nazar xom summalar (avvalgi xatti-harakat saqlanadi)
+        income = sum(b['income'] for b in aggregates.values())
+        expense = sum(b['expense'] for b in aggregates.values())
+        borrowed = sum(b['borrowed'] for b in aggregates.values())
+        lent = sum(b['lent'] for b in aggregates.values())
 
         # Naqd balans: kirim + olingan qarz - chiqim - berilgan qarz
         cash_balance = income + borrowed - expense - lent
@@ -1261,7 +1224,9 @@ class Database:
         ON DUPLICATE KEY UPDATE 
         is_active = TRUE, expires_at = VALUES(expires_at)
         """
-        return await self.execute_query(query, (user_id, tariff, expires_at))
+        result = await self.execute_query(query, (user_id, tariff, expires_at))
+        self.invalidate_user_cache(user_id)
+        return result
     
     async def get_user_subscriptions(self, user_id):
         """Foydalanuvchining barcha tariflarini olish"""
@@ -1297,6 +1262,7 @@ class Database:
             "UPDATE users SET tariff = %s, tariff_expires_at = %s WHERE user_id = %s",
             (tariff, expires_at, user_id)
         )
+        self.invalidate_user_cache(user_id)
     
     # Plus paketlari funksiyalari
     async def create_plus_package_purchase(self, user_id, package_code, text_limit, voice_limit):
@@ -1316,7 +1282,9 @@ class Database:
         INSERT INTO plus_package_purchases (user_id, package_code, text_limit, voice_limit, text_used, voice_used, status)
         VALUES (%s, %s, %s, %s, 0, 0, 'active')
         """
-        return await self.execute_insert(query, (user_id, package_code, text_limit, voice_limit))
+        purchase_id = await self.execute_insert(query, (user_id, package_code, text_limit, voice_limit))
+        self.invalidate_user_cache(user_id)
+        return purchase_id
     
     async def get_active_plus_package(self, user_id):
         """Foydalanuvchining hozirgi aktiv Plus paketini olish"""
@@ -1372,134 +1340,72 @@ class Database:
             package['status'] = 'active' if (remaining_text > 0 or remaining_voice > 0) else 'completed'
         return package
     
-    async def increment_plus_usage(self, user_id, usage_type: str):
-        """Plus paketi bo'yicha foydalanishni oshirish"""
-        package = await self.get_active_plus_package(user_id)
-        if not package:
-            return False, None
+    async def increment_plus_usage(self, user_id, usage_type: str) -> bool:
+        """Plus paketi bo'yicha foydalanishni bitta atomar UPDATE bilan oshirish.
         
+        Limit WHERE shartida tekshiriladi, shuning uchun parallel xabarlar
+        limitdan ortiq sarflay olmaydi. Kvota berilgan bo'lsa True qaytaradi.
+        """
         if usage_type not in ('text', 'voice'):
-            return False, package
-        
-        if usage_type == 'text':
-            if package['text_used'] >= package['text_limit']:
-                return False, package
-            new_used = package['text_used'] + 1
-            # Status ni to'g'ri formatlash - faqat 'active' yoki 'completed'
-            if new_used >= package['text_limit'] and package['voice_used'] >= package['voice_limit']:
-                new_status = 'completed'
-            else:
-                new_status = 'active'
-            
-            # Xavfsizlik uchun status ni tekshirish
-            if new_status not in ('active', 'completed'):
-                new_status = 'active'
-            
-            try:
-                # Avval bazadagi status ni to'g'ri formatlash - faqat text_used ni yangilash
-                # Status ni keyinroq alohida yangilaymiz
-                await self.execute_query(
-                    """
-                    UPDATE plus_package_purchases
-                    SET text_used = %s, updated_at = NOW()
-                    WHERE id = %s
-                    """,
-                    (new_used, package['id'])
-                )
-                
-                # Status ni alohida yangilash - faqat to'g'ri qiymat bilan
-                try:
-                    await self.execute_query(
-                        """
-                        UPDATE plus_package_purchases
-                        SET status = %s
-                        WHERE id = %s
-                        """,
-                        (new_status, package['id'])
-                    )
-                except Exception as status_error:
-                    # Agar status yangilashda xatolik bo'lsa, bazadagi status ni to'g'ri formatlash
-                    logging.warning(f"Status yangilashda xatolik, bazadagi status ni to'g'rilaymiz: {status_error}")
-                    try:
-                        await self.execute_query(
-                            """
-                            UPDATE plus_package_purchases
-                            SET status = CASE 
-                                WHEN text_used >= text_limit AND voice_used >= voice_limit THEN 'completed'
-                                ELSE 'active'
-                            END
-                            WHERE id = %s
-                            """,
-                            (package['id'],)
-                        )
-                    except Exception as e3:
-                        logging.error(f"Status to'g'rilashda xatolik: {e3}")
-                
-                package['text_used'] = new_used
-                package['status'] = new_status
-            except Exception as e:
-                logging.error(f"Error updating plus usage (text): {e}")
-                return False, package
-        else:
-            if package['voice_used'] >= package['voice_limit']:
-                return False, package
-            new_used = package['voice_used'] + 1
-            # Status ni to'g'ri formatlash - faqat 'active' yoki 'completed'
-            if new_used >= package['voice_limit'] and package['text_used'] >= package['text_limit']:
-                new_status = 'completed'
-            else:
-                new_status = 'active'
-            
-            # Xavfsizlik uchun status ni tekshirish
-            if new_status not in ('active', 'completed'):
-                new_status = 'active'
-            
-            try:
-                # Avval voice_used ni yangilash
-                await self.execute_query(
-                    """
-                    UPDATE plus_package_purchases
-                    SET voice_used = %s, updated_at = NOW()
-                    WHERE id = %s
-                    """,
-                    (new_used, package['id'])
-                )
-                
-                # Status ni alohida yangilash - faqat to'g'ri qiymat bilan
-                try:
-                    await self.execute_query(
-                        """
-                        UPDATE plus_package_purchases
-                        SET status = %s
-                        WHERE id = %s
-                        """,
-                        (new_status, package['id'])
-                    )
-                except Exception as status_error:
-                    # Agar status yangilashda xatolik bo'lsa, bazadagi status ni to'g'ri formatlash
-                    logging.warning(f"Status yangilashda xatolik, bazadagi status ni to'g'rilaymiz: {status_error}")
-                    try:
-                        await self.execute_query(
-                            """
-                            UPDATE plus_package_purchases
-                            SET status = CASE 
-                                WHEN text_used >= text_limit AND voice_used >= voice_limit THEN 'completed'
-                                ELSE 'active'
-                            END
-                            WHERE id = %s
-                            """,
-                            (package['id'],)
-                        )
-                    except Exception as e3:
-                        logging.error(f"Status to'g'rilashda xatolik: {e3}")
-                
-                package['voice_used'] = new_used
-                package['status'] = new_status
-            except Exception as e:
-                logging.error(f"Error updating plus usage (voice): {e}")
-                return False, package
+            return False
+        used_col = f"{usage_type}_used"
+        limit_col = f"{usage_type}_limit"
+        
+        # MySQL SET ni chapdan o'ngga bajaradi - status yangi qiymatlar bo'yicha hisoblanadi.
+        # LAST_INSERT_ID(expr) paket tugaganini (1/0) shu so'rovning o'zidan qaytaradi.
+        query = f"""
+        UPDATE plus_package_purchases
+        SET {used_col} = {used_col} + 1,
+            status = IF(LAST_INSERT_ID(text_used >= text_limit AND voice_used >= voice_limit), 'completed', 'active'),
+            updated_at = NOW()
+        WHERE user_id = %s AND status = 'active'
+          AND {used_col} < {limit_col}
+          AND (expires_at IS NULL OR expires_at > NOW())
+        ORDER BY purchased_at DESC
+        LIMIT 1
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(query, (user_id,))
+                    granted = cursor.rowcount > 0
+                    completed = granted and cursor.lastrowid == 1
+        except Exception as e:
+            logging.error(f"Error updating plus usage ({usage_type}): {e}")
+            return False
         
-        return True, package
+        # Paket tugasa (yoki kvota berilmasa), aktiv tarif PLUS dan boshqasiga o'tishi mumkin
+        if completed or not granted:
+            self.invalidate_user_cache(user_id)
+        return granted
+    
+    async def release_plus_usage(self, user_id, usage_type: str) -> bool:
+        """increment_plus_usage bilan band qilingan birlikni qaytarish (ish bajarilmadi).
+        
+        Birlik foydalanuvchining muddati o'tmagan eng yangi paketiga qaytadi va
+        paket yana aktiv bo'ladi - bir nechta paket bo'lsa ham qolgan birliklar soni saqlanadi.
+        """
+        if usage_type not in ('text', 'voice'):
+            return False
+        used_col = f"{usage_type}_used"
+        query = f"""
+        UPDATE plus_package_purchases
+        SET {used_col} = {used_col} - 1,
+            status = 'active',
+            updated_at = NOW()
+        WHERE user_id = %s AND status IN ('active', 'completed')
+          AND {used_col} > 0
+          AND (expires_at IS NULL OR expires_at > NOW())
+        ORDER BY purchased_at DESC
+        LIMIT 1
+        """
+        try:
+            released = await self.execute_update(query, (user_id,)) > 0
+        except Exception as e:
+            logging.error(f"Error releasing plus usage ({usage_type}): {e}")
+            return False
+        self.invalidate_user_cache(user_id)
+        return released
     
     async def get_plus_usage_summary(self, user_id):
         """Plus paketi bo'yicha foydalanish statistikasini olish"""
@@ -1573,7 +1479,17 @@ class Database:
         return step_fields.get(step_number, "unknown")
     
     async def get_active_tariff(self, user_id):
-        """Foydalanuvchining hozirgi aktiv tarifini olish"""
+        """Foydalanuvchining hozirgi aktiv tarifini olish (keshdan, bo'lmasa bazadan)"""
+        cached = self.tariff_cache.get(user_id)
+        if cached is not MISSING:
+            return cached
+        epoch = self.tariff_cache.epoch()
+        tariff, queries = await self._resolve_active_tariff(user_id)
+        self.tariff_cache.set(user_id, tariff, cost=queries, epoch=epoch)
+        return tariff
+
+    async def _resolve_active_tariff(self, user_id):
+        """Tarifni bazadan aniqlash - (tarif, bajarilgan so'rovlar soni)"""
         tariff_map = {'BIZNES': 'BUSINESS', 'BUSINESS': 'BUSINESS', 'PLUS': 'PLUS', 'PRO': 'PRO'}
         
         # 1. Avval users jadvalidan tekshirish (BUSINESS/PRO birinchi)
@@ -1589,7 +1505,7 @@ class Database:
             if user_tariff in ('BUSINESS', 'PRO'):
                 from datetime import datetime
                 if expires_at is None or expires_at > datetime.now():
-                    return user_tariff
+                    return user_tariff, 1
         
         # 2. user_subscriptions dan tekshirish
         query = """
@@ -1601,12 +1517,12 @@ class Database:
         result = await self.execute_one(query, (user_id,))
         if result and result.get('tariff'):
             tariff = result.get('tariff', '').upper()
-            return tariff_map.get(tariff, tariff)
+            return tariff_map.get(tariff, tariff), 2
         
         # 3. Plus paketlarini tekshiramiz (eng oxirida)
         package = await self.get_active_plus_package(user_id)
         if package:
-            return 'PLUS'
+            return 'PLUS', 3
         
         # 4. users jadvalidagi PLUS tarifni tekshirish
         if user_result and user_result.get('tariff'):
@@ -1616,9 +1532,9 @@ class Database:
             if user_tariff == 'PLUS':
                 from datetime import datetime
                 if expires_at is None or expires_at > datetime.now():
-                    return 'PLUS'
+                    return 'PLUS', 3
         
-        return "FREE"
+        return "FREE", 3
     
     # Reminders funksiyalari
     async def create_reminder(self, user_id: int, reminder_type: str, title: str, 
@@ -1636,7 +1552,9 @@ class Database:
         params = (user_id, reminder_type, title, description, reminder_date, 
                  reminder_time, amount, currency, person_name, location,
                  is_recurring, recurrence_pattern, recurrence_day)
-        return await self.execute_insert(query, params)
+        reminder_id = await self.execute_insert(query, params)
+        await self.notify_reminder_changed(reminder_id)
+        return reminder_id
     
     async def get_today_reminders(self, user_id: int = None):
         """Bugungi eslatmalarni olish"""
@@ -1675,6 +1593,7 @@ class Database:
         WHERE id = %s
         """
         await self.execute_query(query, (reminder_id,))
+        await self.notify_reminder_changed(reminder_id, removed=True)
     
     async def get_user_reminders(self, user_id: int, include_completed: bool = False):
         """Foydalanuvchining barcha eslatmalarini olish"""
@@ -1701,7 +1620,7 @@ class Database:
         WHERE r.is_completed = FALSE 
         AND r.notification_30min_sent = FALSE
         AND r.reminder_date = CURDATE()
-        AND TIMESTAMPDIFF(MINUTE, NOW(), CONCAT(r.reminder_date, ' ', r.reminder_time)) BETWEEN 0 AND 30
+        AND r.reminder_time BETWEEN CURTIME() AND ADDTIME(CURTIME(), '00:30:00')
         ORDER BY r.reminder_time ASC
         """
         return await self.execute_query(query)
@@ -1715,26 +1634,72 @@ class Database:
         WHERE r.is_completed = FALSE 
         AND r.notification_exact_sent = FALSE
         AND r.reminder_date = CURDATE()
-        AND TIMESTAMPDIFF(MINUTE, NOW(), CONCAT(r.reminder_date, ' ', r.reminder_time)) BETWEEN -5 AND 5
+        AND r.reminder_time BETWEEN SUBTIME(CURTIME(), '00:05:00') AND ADDTIME(CURTIME(), '00:05:00')
         ORDER BY r.reminder_time ASC
         """
         return await self.execute_query(query)
     
-    async def mark_notification_30min_sent(self, reminder_id: int):
-        """30 minut oldin bildirishnoma yuborilganini belgilash"""
+    async def get_pending_reminders_between(self, date_from, date_to):
+        """Bildirishnomasi qolgan eslatmalar sana oralig'ida (idx_notification bo'yicha diapazon)"""
+        query = """
+        SELECT r.*, u.first_name, u.name as user_name
+        FROM reminders r
+        JOIN users u ON r.user_id = u.user_id
+        WHERE r.reminder_date BETWEEN %s AND %s
+        AND r.is_completed = FALSE
+        AND (r.notification_30min_sent = FALSE OR r.notification_exact_sent = FALSE)
+        """
+        return await self.execute_query(query, (date_from, date_to))
+    
+    async def get_pending_reminder(self, reminder_id: int):
+        """Bitta eslatma (foydalanuvchi ismi bilan) - rejalashtiruvchini yangilash uchun"""
+        query = """
+        SELECT r.*, u.first_name, u.name as user_name
+        FROM reminders r
+        JOIN users u ON r.user_id = u.user_id
+        WHERE r.id = %s AND r.is_completed = FALSE
+        """
+        return await self.execute_one(query, (reminder_id,))
+    
+    async def mark_notification_30min_sent(self, reminder_id: int) -> bool:
+        """30 minut oldin bildirishnoma yuborilganini belgilash.
+        
+        Faqat hali belgilanmagan bo'lsa True - bir nechta replika bitta eslatmani ikki marta yubormaydi.
+        """
         query = """
         UPDATE reminders SET notification_30min_sent = TRUE 
-        WHERE id = %s
+        WHERE id = %s AND notification_30min_sent = FALSE
         """
-        await self.execute_query(query, (reminder_id,))
+        return await self.execute_update(query, (reminder_id,)) > 0
     
-    async def mark_notification_exact_sent(self, reminder_id: int):
-        """Aniq vaqtda bildirishnoma yuborilganini belgilash"""
+    async def mark_notification_exact_sent(self, reminder_id: int) -> bool:
+        """Aniq vaqtda bildirishnoma yuborilganini belgilash (faqat birinchi marta True)"""
         query = """
         UPDATE reminders SET notification_exact_sent = TRUE 
-        WHERE id = %s
+        WHERE id = %s AND notification_exact_sent = FALSE
         """
-        await self.execute_query(query, (reminder_id,))
+        return await self.execute_update(query, (reminder_id,)) > 0
+    
+    async def unmark_notification_sent(self, reminder_id: int, exact: bool):
+        """Yuborilmay qolgan bildirishnoma bayrog'ini qaytarish (qayta urinish uchun)"""
+        column = 'notification_exact_sent' if exact else 'notification_30min_sent'
+        await self.execute_update(
+            f"UPDATE reminders SET {column} = FALSE WHERE id = %s", (reminder_id,)
+        )
+    
+    async def mark_debt_reminder_sent(self, reminder_id: int) -> bool:
+        """Qarz eslatmasini yuborilgan deb belgilash (faqat birinchi marta True)"""
+        query = """
+        UPDATE debt_reminders SET sent_at = NOW()
+        WHERE id = %s AND sent_at IS NULL
+        """
+        return await self.execute_update(query, (reminder_id,)) > 0
+    
+    async def unmark_debt_reminder_sent(self, reminder_id: int):
+        """Yuborilmay qolgan qarz eslatmasini keyingi ishga tushishga qaytarish"""
+        await self.execute_update(
+            "UPDATE debt_reminders SET sent_at = NULL WHERE id = %s", (reminder_id,)
+        )
     
     async def create_next_recurring_reminder(self, reminder_id: int):
         """Takrorlanadigan eslatma uchun keyingi eslatmani yaratish"""
@@ -1775,7 +1740,7 @@ class Database:
                               is_recurring, recurrence_pattern, recurrence_day)
         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
-        return await self.execute_insert(query, (
+        next_id = await self.execute_insert(query, (
             reminder.get('user_id'),
             reminder.get('reminder_type'),
             reminder.get('title'),
@@ -1790,6 +1755,8 @@ class Database:
             pattern,
             recurrence_day
         ))
+        await self.notify_reminder_changed(next_id)
+        return next_id
     
     # Pro tarifi xarajatlari funksiyalari
     async def get_or_create_pro_usage(self, user_id: int, month_year: str = None):
@@ -1798,80 +1765,174 @@ class Database:
             from datetime import datetime
             month_year = datetime.now().strftime('%Y-%m')
         
-        result = await self.execute_one(
-            """
-            SELECT id, text_cost, voice_cost, total_cost, text_count, voice_count
-            FROM pro_usage_tracking
-            WHERE user_id = %s AND month_year = %s
-            """,
-            (user_id, month_year)
-        )
-        
-        if result:
-            return {
-                'id': result.get('id'),
-                'text_cost': float(result.get('text_cost', 0)) if result.get('text_cost') else 0,
-                'voice_cost': float(result.get('voice_cost', 0)) if result.get('voice_cost') else 0,
-                'total_cost': float(result.get('total_cost', 0)) if result.get('total_cost') else 0,
-                'text_count': result.get('text_count', 0) if result.get('text_count') else 0,
-                'voice_count': result.get('voice_count', 0) if result.get('voice_count') else 0,
-            }
+        query = """
+        SELECT id, text_cost, voice_cost, total_cost, text_count, voice_count
+        FROM pro_usage_tracking
+        WHERE user_id = %s AND month_year = %s
+        """
+        result = await self.execute_one(query, (user_id, month_year))
+        if not result:
+            # Parallel chaqiruvlarda unique_user_month to'qnashmasligi uchun INSERT IGNORE
+            await self._ensure_pro_usage_row(user_id, month_year)
+            result = await self.execute_one(query, (user_id, month_year))
         
-        # Yangi yozuv yaratish
-        insert_id = await self.execute_insert(
+        result = result or {}
+        return {
+            'id': result.get('id'),
+            'text_cost': float(result.get('text_cost') or 0),
+            'voice_cost': float(result.get('voice_cost') or 0),
+            'total_cost': float(result.get('total_cost') or 0),
+            'text_count': result.get('text_count') or 0,
+            'voice_count': result.get('voice_count') or 0,
+        }
+    
+    async def _ensure_pro_usage_row(self, user_id: int, month_year: str):
+        await self.execute_query(
             """
-            INSERT INTO pro_usage_tracking (user_id, month_year, text_cost, voice_cost, total_cost, text_count, voice_count)
+            INSERT IGNORE INTO pro_usage_tracking (user_id, month_year, text_cost, voice_cost, total_cost, text_count, voice_count)
             VALUES (%s, %s, 0, 0, 0, 0, 0)
             """,
             (user_id, month_year)
         )
-        
-        return {
-            'id': insert_id,
-            'text_cost': 0,
-            'voice_cost': 0,
-            'total_cost': 0,
-            'text_count': 0,
-            'voice_count': 0,
-        }
     
-    async def increment_pro_usage(self, user_id: int, usage_type: str, cost: float, month_year: str = None):
-        """Pro tarifida xarajatlarni oshirish"""
+    async def increment_pro_usage(self, user_id: int, usage_type: str, cost: float, month_year: str = None, *,
+                                  cost_limit: Optional[float], count: int = 1) -> bool:
+        """Pro tarifida xarajatlarni bitta atomar UPDATE bilan oshirish.
+        
+        Oylik limit (cost_limit) WHERE shartida tekshiriladi - chaqiruvchi uni aniq
+        berishi shart (odatda PRO_MONTHLY_COST_LIMIT). cost_limit=None bo'lsa
+        shartsiz yoziladi. count - xabarlar soniga qo'shiladigan qiymat (bitta
+        xabarning qo'shimcha xarajati uchun 0). Xarajat yozilgan bo'lsa True,
+        limit tufayli rad etilsa False qaytaradi va bu log qilinadi.
+        """
+        if usage_type not in ('text', 'voice'):
+            logging.warning(f"Pro xarajati yozilmadi (user {user_id}): noma'lum usage_type {usage_type!r}")
+            return False
         if not month_year:
             from datetime import datetime
             month_year = datetime.now().strftime('%Y-%m')
         
-        usage = await self.get_or_create_pro_usage(user_id, month_year)
+        query = f"""
+        UPDATE pro_usage_tracking
+        SET {usage_type}_cost = {usage_type}_cost + %s,
+            {usage_type}_count = {usage_type}_count + %s,
+            total_cost = total_cost + %s,
+            updated_at = NOW()
+        WHERE user_id = %s AND month_year = %s
+        """
+        params = [cost, count, cost, user_id, month_year]
+        if cost_limit is not None:
+            query += " AND total_cost < %s"
+            params.append(cost_limit)
         
-        if usage_type == 'text':
-            new_text_cost = usage['text_cost'] + cost
-            new_text_count = usage['text_count'] + 1
-            new_total = new_text_cost + usage['voice_cost']
-            
-            await self.execute_query(
-                """
-                UPDATE pro_usage_tracking
-                SET text_cost = %s, text_count = %s, total_cost = %s, updated_at = NOW()
-                WHERE id = %s
-                """,
-                (new_text_cost, new_text_count, new_total, usage['id'])
-            )
-        elif usage_type == 'voice':
-            new_voice_cost = usage['voice_cost'] + cost
-            new_voice_count = usage['voice_count'] + 1
-            new_total = usage['text_cost'] + new_voice_cost
-            
-            await self.execute_query(
-                """
-                UPDATE pro_usage_tracking
-                SET voice_cost = %s, voice_count = %s, total_cost = %s, updated_at = NOW()
-                WHERE id = %s
-                """,
-                (new_voice_cost, new_voice_count, new_total, usage['id'])
+        granted = await self.execute_update(query, params)
+        if not granted:
+            # Oyning birinchi xarajati bo'lsa, qator hali yo'q
+            row = await self.execute_one(
+                "SELECT id FROM pro_usage_tracking WHERE user_id = %s AND month_year = %s",
+                (user_id, month_year)
             )
+            if row:
+                logging.warning(f"Pro xarajati limit ({cost_limit}) tufayli yozilmadi: user {user_id}, "
+                                f"{month_year}, {usage_type} {cost:.2f} so'm")
+                return False
+            await self._ensure_pro_usage_row(user_id, month_year)
+            granted = await self.execute_update(query, params)
+        return granted > 0
+    
+    async def reserve_pro_usage(self, user_id: int, usage_type: str, cost: float, month_year: str = None) -> bool:
+        """Ish boshlanishidan oldin Pro limitidan taxminiy xarajatni band qilish.
+        
+        Limit increment_pro_usage ning WHERE shartida tekshiriladi - parallel xabarlar
+        eskirgan o'qish orqali limitdan o'tib keta olmaydi. False bo'lsa so'rov rad etiladi.
+        Band qilingan summa keyin charge_llm_usage(reserved=...) bilan haqiqiy narxga almashtiriladi.
+        """
+        return await self.increment_pro_usage(user_id, usage_type, cost, month_year,
+                                              cost_limit=PRO_MONTHLY_COST_LIMIT, count=0)
+    
+    # LLM sarfi (llm_gateway.track_usage lug'ati asosida)
+    async def charge_llm_usage(self, user_id: int, usage: dict, usage_type: str = 'text',
+                               extra_cost: float = 0.0, month_year: str = None, pro: bool = True,
+                               count: int = 1, reserved: float = 0.0) -> float:
+        """Haqiqiy LLM sarfini llm_usage ga yozish va Pro xarajatiga qo'shish.
         
-        # Yangilangan xarajatlarni qaytarish
-        return await self.get_or_create_pro_usage(user_id, month_year)
+        usage - llm.track_usage() lug'ati, extra_cost - LLM dan tashqari xarajat
+        (so'm, masalan speech-to-text). reserved - reserve_pro_usage bilan band
+        qilingan summa: Pro xarajatiga faqat farq qo'shiladi. Limit band qilishda
+        tekshirilgan, bajarilgan ish xarajati shartsiz yoziladi. Yozilgan so'm qaytadi.
+        """
+        if not month_year:
+            from datetime import datetime
+            month_year = datetime.now().strftime('%Y-%m')
+        rows = [
+            (user_id, month_year, task, model, row['calls'], row['prompt_tokens'],
+             row['completion_tokens'], row['cost_usd'] * USD_TO_UZS)
+            for (task, model), row in usage.get('tasks', {}).items()
+        ]
+        if rows:
+            async with self.transaction() as cursor:
+                await cursor.executemany(
+                    """
+                    INSERT INTO llm_usage
+                        (user_id, month_year, task, model, calls, prompt_tokens, completion_tokens, cost_uzs)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                        calls = calls + VALUES(calls),
+                        prompt_tokens = prompt_tokens + VALUES(prompt_tokens),
+                        completion_tokens = completion_tokens + VALUES(completion_tokens),
+                        cost_uzs = cost_uzs + VALUES(cost_uzs)
+                    """,
+                    rows
+                )
+        cost = usage.get('cost_uzs', 0.0) + extra_cost
+        if pro:
+            await self.increment_pro_usage(user_id, usage_type, cost - reserved, month_year,
+                                           cost_limit=None, count=count)
+        return cost
+    
+    async def get_llm_usage_by_task(self, month_year: str) -> list:
+        """Oy bo'yicha vazifa/model kesimidagi LLM sarfi (eng qimmati birinchi)"""
+        return await self.execute_query(
+            """
+            SELECT task, model, SUM(calls) as calls, SUM(prompt_tokens) as prompt_tokens,
+                   SUM(completion_tokens) as completion_tokens, SUM(cost_uzs) as cost_uzs,
+                   COUNT(DISTINCT user_id) as users
+            FROM llm_usage
+            WHERE month_year = %s
+            GROUP BY task, model
+            ORDER BY cost_uzs DESC
+            """,
+            (month_year,)
+        )
+    
+    async def get_llm_top_users(self, month_year: str, limit: int = 10) -> list:
+        """Oy bo'yicha eng ko'p LLM sarfi bo'lgan foydalanuvchilar"""
+        return await self.execute_query(
+            """
+            SELECT l.user_id, u.first_name, u.tariff, SUM(l.calls) as calls, SUM(l.cost_uzs) as cost_uzs,
+                   p.total_cost as pro_total_cost
+            FROM llm_usage l
+            LEFT JOIN users u ON u.user_id = l.user_id
+            LEFT JOIN pro_usage_tracking p ON p.user_id = l.user_id AND p.month_year = l.month_year
+            WHERE l.month_year = %s
+            GROUP BY l.user_id, u.first_name, u.tariff, p.total_cost
+            ORDER BY cost_uzs DESC
+            LIMIT %s
+            """,
+            (month_year, limit)
+        )
+    
+    async def get_user_llm_usage(self, user_id: int, month_year: str) -> list:
+        """Foydalanuvchining oy bo'yicha vazifa/model kesimidagi LLM sarfi"""
+        return await self.execute_query(
+            """
+            SELECT task, model, calls, prompt_tokens, completion_tokens, cost_uzs
+            FROM llm_usage
+            WHERE user_id = %s AND month_year = %s
+            ORDER BY cost_uzs DESC
+            """,
+            (user_id, month_year)
+        )
     
     # Warehouse (Ombor) funksiyalari - Biznes tarif uchun
     async def add_warehouse_product(self, user_id: int, name: str, category: str = None, 
@@ -2203,9 +2264,11 @@ class Database:
         rate = rates.get(currency, 1.0)
         return amount * rate
     
-    async def get_balance_multi_currency(self, user_id: int) -> dict:
+    async def get_balance_multi_currency(self, user_id: int, aggregates: dict = None) -> dict:
         """Foydalanuvchi balansini har bir valyutada va umumiy so'mda olish"""
         rates = await self.get_currency_rates()
+        if aggregates is None:
+            aggregates = await self.get_balance_aggregates(user_id)
         
         # Har bir valyuta uchun balanslarni olish
         currencies = ['UZS', 'USD', 'EUR', 'RUB', 'TRY']
@@ -2215,41 +2278,13 @@ class Database:
         }
         
         for currency in currencies:
-            # COALESCE yordamida NULL valyutalarni UZS deb qabul qilish
-            # Kirimlar
-            income_query = """
-                SELECT COALESCE(SUM(amount), 0) as total 
-                FROM transactions 
-                WHERE user_id = %s AND transaction_type = 'income' AND COALESCE(currency, 'UZS') = %s
-            """
-            income_result = await self.execute_one(income_query, (user_id, currency))
-            income = float(income_result.get('total', 0)) if income_result else 0.0
-            
-            # Chiqimlar
-            expense_query = """
-                SELECT COALESCE(SUM(amount), 0) as total 
-                FROM transactions 
-                WHERE user_id = %s AND transaction_type = 'expense' AND COALESCE(currency, 'UZS') = %s
-            """
-            expense_result = await self.execute_one(expense_query, (user_id, currency))
-            expense = float(expense_result.get('total', 0)) if expense_result else 0.0
-            
-            # Qarzlar
-            borrowed_query = """
-                SELECT COALESCE(SUM(amount), 0) as total 
-                FROM transactions 
-                WHERE user_id = %s AND transaction_type = 'debt' AND debt_direction = 'borrowed' AND COALESCE(currency, 'UZS') = %s
-            """
-            borrowed_result = await self.execute_one(borrowed_query, (user_id, currency))
-            borrowed = float(borrowed_result.get('total', 0)) if borrowed_result else 0.0
-            
-            lent_query = """
-                SELECT COALESCE(SUM(amount), 0) as total 
-                FROM transactions 
-                WHERE user_id = %s AND transaction_type = 'debt' AND debt_direction = 'lent' AND COALESCE(currency, 'UZS') = %s
-            """
-            lent_result = await self.execute_one(lent_query, (user_id, currency))
-            lent = float(lent_result.get('total', 0)) if lent_result else 0.0
+            bucket = aggregates.get(currency)
+            if not bucket:
+                continue
+            income = bucket['income']
+            expense = bucket['expense']
+            borrowed = bucket['borrowed']
+            lent = bucket['lent']
             
             # Agar bu valyutada hech narsa yo'q bo'lsa, qo'shmaslik
             if income > 0 or expense > 0 or borrowed > 0 or lent > 0:
@@ -2283,11 +2318,9 @@ class Database:
     async def add_transaction_with_currency(self, user_id, transaction_type, amount, category, 
                                             currency='UZS', description=None):
         """Yangi tranzaksiya qo'shish (valyuta bilan)"""
-        query = """
-        INSERT INTO transactions (user_id, transaction_type, amount, category, currency, description)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        """
-        return await self.execute_insert(query, (user_id, transaction_type, amount, category, currency, description))
+        return await self.insert_transaction(
+            user_id, transaction_type, amount, category, currency=currency, description=description
+        )
 
     # ============ KONTAKTLAR FUNKSIYALARI ============
     
@@ -2421,6 +2454,7 @@ class Database:
                         (amount, contact_id)
                     )
             
+            self.notify_financial_change(user_id)
             return debt_id
         except Exception as e:
             logging.error(f"Qarz qo'shishda xatolik: {e}")
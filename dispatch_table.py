@@ -0,0 +1,151 @@
+"""
+callback_data va reply-klaviatura matnlari bo'yicha dispatch jadvali
+
+aiogram har bir yangilanishda handlerlarni ro'yxatdagi tartibda sinaydi:
+main.py dagi yuzdan ortiq `lambda c: c.data == ...` filtrlari har bir
+callback uchun ketma-ket chaqirilardi. DispatchTable handlerlarni kalit
+(callback_data yoki xabar matni) bo'yicha indekslaydi:
+
+- exact   - aniq qiymat, dict orqali O(1)
+- prefix  - boshlanish (trans_, biz_, warehouse_ ...), prefiks daraxti orqali
+  kalit uzunligicha qadam
+- state   - faqat FSM holati bo'yicha handlerlar, holat bo'yicha dict
+- any     - qolgan filtrlar (ovozli xabar, to'lov, umumiy handlerlar)
+
+Topilgan nomzodlar ro'yxatga olingan tartibda tekshiriladi - birinchi mos
+kelgani ishlaydi, ya'ni natija avvalgi ketma-ket filtrlar bilan bir xil.
+Jadval aiogram'ga bitta handler sifatida ro'yxatdan o'tadi (register()).
+"""
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiogram.dispatcher.event.handler import FilterObject, HandlerObject
+from aiogram.filters import Command
+from aiogram.fsm.state import State
+
+
+class Route:
+    """Jadvaldagi bitta handler: ro'yxatga olish tartibi, kalitlar, holat va qo'shimcha filtrlar"""
+
+    __slots__ = ('order', 'keys', 'prefixes', 'state', 'exclude', 'exclude_prefix', 'handler')
+
+    def __init__(self, order: int, callback: Callable, keys: Iterable[str] = (), prefixes: Iterable[str] = (),
+                 state: Optional[State] = None, filters: Iterable = (), exclude: Iterable[str] = (),
+                 exclude_prefix: Iterable[str] = ()):
+        self.order = order
+        self.keys = tuple(keys)
+        self.prefixes = tuple(prefixes)
+        self.state = state.state if state is not None else None
+        self.exclude = frozenset(exclude)
+        self.exclude_prefix = tuple(exclude_prefix)
+        self.handler = HandlerObject(callback=callback, filters=[FilterObject(f) for f in filters])
+
+    async def check(self, key: Optional[str], event, raw_state: Optional[str], data: dict):
+        """Mos kelsa filtrlar natijasi bilan to'ldirilgan data, aks holda None"""
+        if self.state is not None and raw_state != self.state:
+            return None
+        if key is not None and (key in self.exclude or (self.exclude_prefix and key.startswith(self.exclude_prefix))):
+            return None
+        matched, data = await self.handler.check(event, **data)
+        return data if matched else None
+
+
+class _PrefixNode:
+    __slots__ = ('children', 'routes')
+
+    def __init__(self):
+        self.children: Dict[str, '_PrefixNode'] = {}
+        self.routes: List[Route] = []
+
+
+class DispatchTable:
+    """Kalit bo'yicha handler tanlash (key - yangilanishdan kalitni oluvchi funksiya)"""
+
+    def __init__(self, key: Callable[[Any], Optional[str]]):
+        self.key = key
+        self.routes: List[Route] = []
+        self._exact: Dict[str, List[Route]] = {}
+        self._prefixes = _PrefixNode()
+        self._by_state: Dict[str, List[Route]] = {}
+        self._wildcards: List[Route] = []
+
+    def _route(self, callback: Callable, **kwargs) -> Route:
+        route = Route(len(self.routes), callback, **kwargs)
+        self.routes.append(route)
+        return route
+
+    def exact(self, *values: str, state: State = None):
+        """Kalit aynan shu qiymatlardan biriga teng bo'lsa"""
+        def decorator(callback):
+            route = self._route(callback, keys=values, state=state)
+            for value in values:
+                self._exact.setdefault(value, []).append(route)
+            return callback
+        return decorator
+
+    def prefix(self, *prefixes: str, state: State = None, exclude: Iterable[str] = (), filters: Iterable = ()):
+        """Kalit shu prefikslardan biri bilan boshlansa (exclude - chiqarib tashlanadigan aniq qiymatlar)"""
+        def decorator(callback):
+            route = self._route(callback, prefixes=prefixes, state=state, exclude=exclude, filters=filters)
+            for prefix in prefixes:
+                node = self._prefixes
+                for char in prefix:
+                    node = node.children.setdefault(char, _PrefixNode())
+                node.routes.append(route)
+            return callback
+        return decorator
+
+    def command(self, *commands: str, state: State = None):
+        """Command filtri: "/buyruq" prefiksi bo'yicha indekslanadi, keyin Command bilan tekshiriladi"""
+        return self.prefix(*(f"/{command}" for command in commands), state=state,
+                           filters=(Command(*commands),))
+
+    def any(self, *filters, state: State = None, exclude_prefix: Iterable[str] = ()):
+        """Kalitdan qat'i nazar: holat bo'yicha yoki har bir yangilanishda tekshiriladigan handler"""
+        def decorator(callback):
+            route = self._route(callback, state=state, filters=filters, exclude_prefix=exclude_prefix)
+            if route.state is not None:
+                self._by_state.setdefault(route.state, []).append(route)
+            else:
+                self._wildcards.append(route)
+            return callback
+        return decorator
+
+    def candidates(self, key: Optional[str], raw_state: Optional[str]) -> List[Route]:
+        """Kalit va holatga mos bo'lishi mumkin bo'lgan handlerlar, ro'yxatga olingan tartibda"""
+        found = list(self._wildcards)
+        found += self._by_state.get(raw_state, ())
+        if key is not None:
+            found += self._exact.get(key, ())
+            node = self._prefixes
+            for char in key:
+                node = node.children.get(char)
+                if node is None:
+                    break
+                found += node.routes
+        found.sort(key=lambda route: route.order)
+        return found
+
+    async def resolve(self, event, raw_state: Optional[str] = None, **data) -> Tuple[Optional[Route], dict]:
+        """Birinchi mos handler va uning data si (topilmasa (None, data))"""
+        key = self.key(event)
+        data['raw_state'] = raw_state
+        for route in self.candidates(key, raw_state):
+            matched = await route.check(key, event, raw_state, data)
+            if matched is not None:
+                return route, matched
+        return None, data
+
+    async def _filter(self, event, **data):
+        route, data = await self.resolve(event, **data)
+        if route is None:
+            return False
+        return {**data, 'dispatch_route': route}
+
+    @staticmethod
+    async def _dispatch(event, dispatch_route: Route, **data):
+        return await dispatch_route.handler.call(event, **data)
+
+    def register(self, observer):
+        """Jadvalni aiogram observer'ga (router.message, router.callback_query) bitta handler qilib ulash"""
+        observer.register(self._dispatch, self._filter)
@@ -0,0 +1,189 @@
+"""
+Tranzaksiya ajratish natijalari uchun normallashtirilgan kesh
+
+Foydalanuvchilar har kuni deyarli bir xil xabar yozadi ("kofe 25 ming",
+"Kofe 25000 so'm"). Kalit matnning normallashtirilgan ko'rinishi: kichik harf,
+summalar bitta raqamga keltirilgan, so'm (default valyuta) olib tashlangan,
+"bugun/kecha/ertaga" aniq sanaga aylantirilgan. Shu kalit bo'yicha LLM
+ajratish natijasi qayta ishlatiladi.
+
+Jarayon ichida TTLCache (LRU + TTL) ishlatiladi; EXTRACTION_CACHE_SHARED=true
+bo'lsa natijalar extraction_cache jadvali orqali barcha bot replikalari bilan
+bo'lishiladi.
+
+Tejalgan xarajat taxmin qilinmaydi: keshga tushmagan har bir LLM ajratishning
+llm.track_usage() dagi haqiqiy narxi yig'iladi, hit lar shu o'rtacha narxga
+ko'paytiriladi.
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from cache import TTLCache, MISSING
+from config import EXTRACTION_CACHE_SHARED
+from database import db
+from rule_parser import CURRENCY_ALIASES, CURRENCY_SUFFIXES, extract_amounts, normalize
+
+DEFAULT_TTL = 12 * 3600
+DEFAULT_MAXSIZE = 10000
+
+# Umumiy jadvaldan muddati o'tgan yozuvlarni har N ta yozishda tozalash
+SHARED_PURGE_EVERY = 500
+
+# Nisbiy sana so'zlari → bugundan farq (kun)
+RELATIVE_DAYS = {
+    'bugun': 0, 'bugungi': 0, 'сегодня': 0,
+    'kecha': -1, 'kechagi': -1, 'вчера': -1,
+    'ertaga': 1, 'ertangi': 1, 'завтра': 1,
+    'indinga': 2, 'индин': 2,
+}
+
+# Valyuta so'zining barcha shakllari → kod ("so'mga" → UZS)
+_CURRENCY_FORMS = {
+    alias + suffix: code
+    for code, aliases in CURRENCY_ALIASES.items()
+    for alias in aliases
+    for suffix in CURRENCY_SUFFIXES
+}
+
+_TOKEN_RE = re.compile(r"[a-zа-яё'$€-]+|\d+(?:\.\d+)?")
+
+
+def _format_amount(value: float) -> str:
+    return str(int(value)) if value == int(value) else f"{value:g}"
+
+
+def cache_key(text: str, today: datetime = None) -> str:
+    """Matnning normallashtirilgan kaliti.
+
+    "Kofe 25000 so'm" va "kofe 25 ming" → "kofe 25000"
+    """
+    normalized = normalize(text)
+    # Summalarni oxiridan boshlab almashtirish - oldingi indekslar siljimasin
+    for value, start, end in sorted(extract_amounts(normalized), key=lambda a: a[1], reverse=True):
+        normalized = f"{normalized[:start]} {_format_amount(value)} {normalized[end:]}"
+
+    today = today or datetime.now()
+    tokens = []
+    for token in _TOKEN_RE.findall(normalized):
+        currency = _CURRENCY_FORMS.get(token)
+        if currency == 'UZS':
+            # So'm default valyuta - "25 ming" va "25 ming so'm" bir xil
+            continue
+        if currency:
+            token = currency.lower()
+        elif token in RELATIVE_DAYS:
+            token = (today + timedelta(days=RELATIVE_DAYS[token])).strftime('%Y-%m-%d')
+        tokens.append(token)
+    return ' '.join(tokens)
+
+
+def is_cacheable(result: Dict[str, Any]) -> bool:
+    """Faqat aniq, sanaga bog'liq bo'lmagan LLM natijalari saqlanadi"""
+    transactions = result.get('transactions') if result else None
+    if not transactions or result.get('error'):
+        return False
+    # "keyingi yil 31-dekabr" kabi muddatlar bugungi sanaga bog'liq
+    return not any(tx.get('due_date') for tx in transactions)
+
+
+class ExtractionCache:
+    """Ajratish natijalari keshi, hit rate va tejalgan LLM xarajati metrikalari bilan"""
+
+    def __init__(self, maxsize: int = DEFAULT_MAXSIZE, ttl: float = DEFAULT_TTL, shared: bool = False):
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._shared_writes = 0
+        # Keshga tushmagan LLM ajratishlar va ularning o'lchangan narxi (so'm)
+        self.llm_extractions = 0
+        self.llm_cost_uzs = 0.0
+
+    def key(self, text: str) -> str:
+        return cache_key(text)
+
+    @staticmethod
+    def _digest(key: str) -> str:
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Keshdagi natija nusxasi yoki None"""
+        value = self.local.get(key)
+        if value is MISSING and self.shared and db.pool:
+            value = await self._shared_get(key)
+            if value is not MISSING:
+                self.shared_hits += 1
+                self.local.set(key, value)
+        if value is MISSING:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Validatsiya natijani o'zgartiradi - keshdagi asl nusxa saqlanib qolsin
+        return copy.deepcopy(value)
+
+    async def set(self, key: str, result: Dict[str, Any]):
+        if not is_cacheable(result):
+            return
+        value = copy.deepcopy(result)
+        self.local.set(key, value)
+        if self.shared and db.pool:
+            await self._shared_set(key, value)
+
+    def record_llm_cost(self, usage: Dict[str, Any]):
+        """Bitta LLM ajratishning sarfi (llm.track_usage() lug'ati)"""
+        if not usage['calls']:
+            return
+        self.llm_extractions += 1
+        self.llm_cost_uzs += usage['cost_uzs']
+
+    async def _shared_get(self, key: str):
+        try:
+            row = await db.execute_one(
+                "SELECT result FROM extraction_cache WHERE cache_key = %s AND expires_at > NOW()",
+                (self._digest(key),)
+            )
+        except Exception as e:
+            logging.warning(f"Umumiy ajratish keshini o'qishda xatolik: {e}")
+            return MISSING
+        return json.loads(row['result']) if row else MISSING
+
+    async def _shared_set(self, key: str, value: Dict[str, Any]):
+        expires_at = datetime.now() + timedelta(seconds=self.ttl)
+        try:
+            await db.execute_query(
+                """
+                INSERT INTO extraction_cache (cache_key, result, expires_at) VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE result = VALUES(result), expires_at = VALUES(expires_at)
+                """,
+                (self._digest(key), json.dumps(value, ensure_ascii=False), expires_at)
+            )
+            self._shared_writes += 1
+            if self._shared_writes % SHARED_PURGE_EVERY == 0:
+                await db.execute_query("DELETE FROM extraction_cache WHERE expires_at < NOW()")
+        except Exception as e:
+            logging.warning(f"Umumiy ajratish keshiga yozishda xatolik: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        cost_per_extraction = self.llm_cost_uzs / self.llm_extractions if self.llm_extractions else 0.0
+        return {
+            'size': self.local.stats()['size'],
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'llm_extractions': self.llm_extractions,
+            'llm_cost_per_extraction': cost_per_extraction,
+            'llm_cost_saved': self.hits * cost_per_extraction,
+        }
+
+
+extraction_cache = ExtractionCache(shared=EXTRACTION_CACHE_SHARED)
@@ -0,0 +1,292 @@
+"""
+AI chat uchun foydalanuvchi moliyaviy konteksti snapshoti
+
+AIChat.get_user_financial_context avval har bir chat xabarida ~12 ta so'rovni
+ketma-ket bajarardi. Endi natija foydalanuvchi bo'yicha snapshot sifatida
+saqlanadi:
+
+- snapshot versiya bilan saqlanadi; Database.financial_listeners orqali
+  har bir o'zgarishda versiya oshadi
+- yangi tranzaksiya (eng ko'p uchraydigan o'zgarish) snapshotga joyida
+  qo'shiladi: oxirgi tranzaksiyalar, bugungi/haftalik/oylik yig'indilar,
+  kategoriyalar va top ro'yxatlar. Faqat balans qayta o'qiladi (user_balances
+  dan bitta so'rov)
+- o'chirish, tahrirlash va qarz o'zgarishlari snapshotni bekor qiladi
+- snapshot yo'q bo'lsa barcha so'rovlar asyncio.gather bilan parallel
+- sana o'zgarsa (bugun/kecha oynalari siljiydi) snapshot qayta quriladi
+"""
+
+import asyncio
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from cache import TTLCache, MISSING
+
+SNAPSHOT_TTL = 600
+SNAPSHOT_MAXSIZE = 5000
+RECENT_LIMIT = 20
+TOP_LIMIT = 5
+WEEK_CATEGORY_LIMIT = 10
+
+_MONTH_START = "DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY)"
+
+
+def _stats(row: Optional[dict]) -> dict:
+    row = row or {}
+    return {
+        'total_income': float(row.get('total_income') or 0),
+        'total_expense': float(row.get('total_expense') or 0),
+        'transaction_count': int(row.get('transaction_count') or 0),
+    }
+
+
+def _categories(rows: List[dict]) -> List[dict]:
+    return [
+        {'category': row.get('category', ''), 'total': float(row.get('total') or 0), 'count': int(row.get('count') or 0)}
+        for row in rows or []
+    ]
+
+
+def _top(rows: List[dict]) -> List[dict]:
+    return [
+        {
+            'amount': float(row.get('amount') or 0),
+            'category': row.get('category', ''),
+            'description': row.get('description', ''),
+            'created_at': row.get('created_at'),
+        }
+        for row in rows or []
+    ]
+
+
+class FinancialContextStore:
+    """Foydalanuvchi moliyaviy konteksti snapshotlari (versiya bilan)"""
+
+    def __init__(self, db, ttl: float = SNAPSHOT_TTL, maxsize: int = SNAPSHOT_MAXSIZE):
+        self.db = db
+        self.snapshots = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._versions: Dict[int, int] = {}
+        self.builds = 0
+        self.incremental_updates = 0
+        self.invalidations = 0
+        if self.on_change not in db.financial_listeners:
+            db.financial_listeners.append(self.on_change)
+
+    def version(self, user_id: int) -> int:
+        return self._versions.get(user_id, 0)
+
+    def on_change(self, user_id: int, transaction: dict = None):
+        """Database yozuvidan keyin chaqiriladi. transaction - yangi qo'shilgan tranzaksiya"""
+        snapshot = self.snapshots.get(user_id)
+        version = self._versions.get(user_id, 0) + 1
+        self._versions[user_id] = version
+        if (transaction is not None and snapshot is not MISSING
+                and snapshot['version'] == version - 1 and self._apply(snapshot, transaction)):
+            snapshot['version'] = version
+            self.incremental_updates += 1
+            return
+        self.invalidations += 1
+        self.snapshots.invalidate(user_id)
+
+    async def get(self, user_id: int) -> dict:
+        """Kontekst lug'ati (AIChat._format_context formati)"""
+        snapshot = self.snapshots.get(user_id)
+        if snapshot is not MISSING and snapshot['built_on'] == date.today():
+            if snapshot['context']['balances'] is None:
+                version = snapshot['version']
+                balances = await self.db.get_balances(user_id)
+                if snapshot['version'] == version:
+                    snapshot['context']['balances'] = balances
+                return {**snapshot['context'], 'balances': balances}
+            return snapshot['context']
+
+        version = self.version(user_id)
+        context = await self._build(user_id)
+        self.builds += 1
+        if self.version(user_id) == version:
+            self.snapshots.set(user_id, {'version': version, 'built_on': date.today(), 'context': context})
+        return context
+
+    def _queries(self, user_id: int) -> list:
+        """Snapshot so'rovlari (korutinalar) - _build ularni parallel bajaradi"""
+        q = self.db.execute_query
+        return [
+            self.db.get_balances(user_id),
+            q("""
+                SELECT t.* FROM transactions t
+                WHERE t.user_id = %s
+                ORDER BY t.created_at DESC
+                LIMIT %s
+            """, (user_id, RECENT_LIMIT)),
+            q("""
+                SELECT * FROM debts
+                WHERE user_id = %s AND status != 'paid'
+                ORDER BY created_at DESC
+            """, (user_id,)),
+            q(f"""
+                SELECT
+                    SUM(CASE WHEN transaction_type = 'income' THEN amount ELSE 0 END) as total_income,
+                    SUM(CASE WHEN transaction_type = 'expense' THEN amount ELSE 0 END) as total_expense,
+                    COUNT(*) as transaction_count
+                FROM transactions
+                WHERE user_id = %s
+                AND created_at >= {_MONTH_START}
+                AND created_at < {_MONTH_START} + INTERVAL 1 MONTH
+            """, (user_id,)),
+            q("""
+                SELECT SUM(amount) as total FROM transactions
+                WHERE user_id = %s AND transaction_type = 'expense'
+                AND created_at >= CURDATE() AND created_at < CURDATE() + INTERVAL 1 DAY
+            """, (user_id,)),
+            q("""
+                SELECT SUM(amount) as total FROM transactions
+                WHERE user_id = %s AND transaction_type = 'expense'
+                AND created_at >= DATE_SUB(CURDATE(), INTERVAL 1 DAY) AND created_at < CURDATE()
+            """, (user_id,)),
+            q("""
+                SELECT category, COUNT(*) as count, SUM(amount) as total
+                FROM transactions
+                WHERE user_id = %s AND transaction_type = 'expense'
+                AND created_at >= CURDATE() AND created_at < CURDATE() + INTERVAL 1 DAY
+                GROUP BY category
+                ORDER BY total DESC
+            """, (user_id,)),
+            q("""
+                SELECT
+                    SUM(CASE WHEN transaction_type = 'income' THEN amount ELSE 0 END) as total_income,
+                    SUM(CASE WHEN transaction_type = 'expense' THEN amount ELSE 0 END) as total_expense,
+                    COUNT(*) as transaction_count
+                FROM transactions
+                WHERE user_id = %s AND created_at >= DATE_SUB(CURDATE(), INTERVAL 7 DAY)
+            """, (user_id,)),
+            q("""
+                SELECT category, SUM(amount) as total, COUNT(*) as count
+                FROM transactions
+                WHERE user_id = %s AND transaction_type = 'expense'
+                AND created_at >= DATE_SUB(CURDATE(), INTERVAL 7 DAY)
+                GROUP BY category
+                ORDER BY total DESC
+                LIMIT %s
+            """, (user_id, WEEK_CATEGORY_LIMIT)),
+            q("""
+                SELECT amount, category, description, created_at FROM transactions
+                WHERE user_id = %s AND transaction_type = 'expense'
+                ORDER BY amount DESC
+                LIMIT %s
+            """, (user_id, TOP_LIMIT)),
+            q("""
+                SELECT amount, category, description, created_at FROM transactions
+                WHERE user_id = %s AND transaction_type = 'income'
+                ORDER BY amount DESC
+                LIMIT %s
+            """, (user_id, TOP_LIMIT)),
+            q(f"""
+                SELECT category, SUM(amount) as total, COUNT(*) as count
+                FROM transactions
+                WHERE user_id = %s AND transaction_type = 'expense'
+                AND created_at >= {_MONTH_START}
+                AND created_at < {_MONTH_START} + INTERVAL 1 MONTH
+                GROUP BY category
+                ORDER BY total DESC
+            """, (user_id,)),
+        ]
+
+    async def _build(self, user_id: int) -> dict:
+        (balances, recent_transactions, debts, month_stats, today_expenses, yesterday_expenses,
+         today_by_category, week_stats, week_by_category, top_expenses, top_incomes,
+         month_by_category) = await asyncio.gather(*self._queries(user_id))
+        return {
+            "balances": balances,
+            "recent_transactions": list(recent_transactions or []),
+            "debts": list(debts or []),
+            "month_stats": _stats(month_stats[0] if month_stats else None),
+            "week_stats": _stats(week_stats[0] if week_stats else None),
+            "today_expenses": float((today_expenses[0] if today_expenses else {}).get('total') or 0),
+            "yesterday_expenses": float((yesterday_expenses[0] if yesterday_expenses else {}).get('total') or 0),
+            "today_category_data": {
+                row['category']: {'count': row['count'], 'total': row['total']}
+                for row in _categories(today_by_category) if row['category']
+            },
+            "week_category_data": _categories(week_by_category),
+            "month_category_data": _categories(month_by_category),
+            "top_expenses": _top(top_expenses),
+            "top_incomes": _top(top_incomes),
+        }
+
+    def _apply(self, snapshot: dict, transaction: dict) -> bool:
+        """Yangi tranzaksiyani snapshotga qo'shish. Qo'shib bo'lmasa False (qayta qurish kerak)"""
+        created_at = transaction.get('created_at') or datetime.now()
+        today = date.today()
+        if snapshot['built_on'] != today or created_at.date() != today:
+            # Orqa sanali tranzaksiya kechagi/haftalik oynalarga tushadi
+            return False
+        context = snapshot['context']
+        t_type = transaction.get('transaction_type')
+        amount = float(transaction.get('amount') or 0)
+        category = transaction.get('category') or ''
+
+        if t_type == 'expense':
+            week = {c['category']: c for c in context['week_category_data']}
+            if category not in week and len(week) >= WEEK_CATEGORY_LIMIT:
+                # Yangi kategoriya top-10 ga kiradimi - faqat bazadan bilish mumkin
+                return False
+
+        context['recent_transactions'] = [{**transaction, 'created_at': created_at}] + \
+            context['recent_transactions'][:RECENT_LIMIT - 1]
+        for stats in (context['month_stats'], context['week_stats']):
+            stats['transaction_count'] += 1
+            if t_type == 'income':
+                stats['total_income'] += amount
+            elif t_type == 'expense':
+                stats['total_expense'] += amount
+
+        if t_type == 'expense':
+            context['today_expenses'] += amount
+            today_category = context['today_category_data'].setdefault(category, {'count': 0, 'total': 0.0})
+            today_category['count'] += 1
+            today_category['total'] += amount
+            for key in ('week_category_data', 'month_category_data'):
+                rows = context[key]
+                row = next((c for c in rows if c['category'] == category), None)
+                if row is None:
+                    row = {'category': category, 'total': 0.0, 'count': 0}
+                    rows.append(row)
+                row['total'] += amount
+                row['count'] += 1
+                rows.sort(key=lambda c: c['total'], reverse=True)
+
+        top_key = {'expense': 'top_expenses', 'income': 'top_incomes'}.get(t_type)
+        if top_key:
+            top = context[top_key]
+            top.append({
+                'amount': amount,
+                'category': category,
+                'description': transaction.get('description', ''),
+                'created_at': created_at,
+            })
+            top.sort(key=lambda t: t['amount'], reverse=True)
+            del top[TOP_LIMIT:]
+
+        # Balans user_balances dan keyingi o'qishda olinadi
+        context['balances'] = None
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'size': self.snapshots.stats()['size'],
+            'hit_ratio': self.snapshots.stats()['hit_ratio'],
+            'builds': self.builds,
+            'incremental_updates': self.incremental_updates,
+            'invalidations': self.invalidations,
+        }
+
+
+_stores: Dict[object, FinancialContextStore] = {}
+
+
+def context_store(db) -> FinancialContextStore:
+    """Database uchun yagona snapshot ombori (AIChat har safar yangidan yaratilishi mumkin)"""
+    store = _stores.get(db)
+    if store is None:
+        store = _stores[db] = FinancialContextStore(db)
+    return store
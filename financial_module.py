@@ -1,35 +1,41 @@
+import os
 import re
+import time
 import logging
 import json
 import aiofiles
 import requests
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime
 
-from openai import OpenAI, AsyncOpenAI
 from google.cloud import speech_v1p1beta1 as speech
 import asyncio
 
 from config import (
     OPENAI_API_KEY,
-    OPENROUTER_API_KEY,
     ELEVENLABS_API_KEY,
     GOOGLE_CLOUD_PROJECT,
     GOOGLE_APPLICATION_CREDENTIALS,
     CATEGORIES,
     ACTIVE_SPEECH_MODELS,
+    VOICE_DIRECT_CONFIDENCE,
+    VOICE_MERGED_PERCENT,
 )
+from audio_io import AUDIO_MEMORY_LIMIT, AudioSource
 from database import db
+from extraction_cache import extraction_cache
+from llm_gateway import llm
+from metrics import record_variant, stage_timer
 from models import Transaction, TransactionType
+from rule_parser import FAST_PATH_CONFIDENCE, parse_transaction
+
+# Bitta Google recognize() so'rovi uchun maksimal vaqt (soniya)
+GOOGLE_RECOGNIZE_TIMEOUT = 30.0
+
 
 class FinancialModule:
     def __init__(self):
-        self.openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-        # OpenRouter uchun sync client (Bepul tarifda ishlaganidek)
-        self.openrouter_client = OpenAI(
-            api_key=OPENROUTER_API_KEY,
-            base_url="https://openrouter.ai/api/v1"
-        ) if OPENROUTER_API_KEY else None
+        self.openai_client = llm.client('openai')
         self.speech_client = None
 
     def _format_amount_with_sign(self, amount: float, trans_type: str, currency: str = 'UZS') -> str:
@@ -83,7 +89,7 @@ class FinancialModule:
         month_name = uz_months.get(dt.month, "")
         return f"{dt.day:02d}-{month_name}, {dt.year}".strip().replace("- ,", "-")
 
-    def _ensure_speech_client(self) -> speech.SpeechClient:
+    def _ensure_speech_client(self) -> speech.SpeechAsyncClient:
         if self.speech_client is None:
             if not GOOGLE_APPLICATION_CREDENTIALS:
                 raise RuntimeError(
@@ -100,14 +106,30 @@ class FinancialModule:
             # Environment variable o'rnatish
             os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = GOOGLE_APPLICATION_CREDENTIALS
             
-            self.speech_client = speech.SpeechClient()
+            # Asinxron (grpc.aio) client - recognize() event loop ni bloklamaydi
+            self.speech_client = speech.SpeechAsyncClient()
         return self.speech_client
     
-    async def process_audio_input(self, audio_file_path: str, user_id: int) -> Dict[str, Any]:
+    async def process_audio_input(self, audio: AudioSource, user_id: int) -> Dict[str, Any]:
+        """Ovozli xabarni qayta ishlash.
+
+        audio - xotiradagi baytlar yoki (katta audio uchun) vaqtinchalik fayl yo'li.
+        """
         try:
-            print(f"DEBUG: Processing audio file: {audio_file_path}")
+            if isinstance(audio, str):
+                print(f"DEBUG: Processing audio file: {audio}")
+                # Katta audio faqat Whisper ga fayl sifatida uzatiladi
+                audio_content = None
+                if os.path.getsize(audio) <= AUDIO_MEMORY_LIMIT:
+                    async with aiofiles.open(audio, "rb") as audio_file:
+                        audio_content = await audio_file.read()
+            else:
+                audio_content = bytes(audio)
+                print(f"DEBUG: Processing in-memory audio, size: {len(audio_content)} bytes")
             
             transcribed_text = None
+            # Google ishonch darajasi (Whisper bermaydi - 0)
+            transcript_confidence = 0.0
             
             # Google Cloud Speech-to-Text (asosiy)
             google_enabled = ACTIVE_SPEECH_MODELS.get('GOOGLE', True)
@@ -120,16 +142,14 @@ class FinancialModule:
                     client = self._ensure_speech_client()
                     print(f"DEBUG: Google Speech client created: {client is not None}")
                     
-                    if client:
-                        with open(audio_file_path, "rb") as audio_file:
-                            audio_content = audio_file.read()
-                        print(f"DEBUG: Audio file read, size: {len(audio_content)} bytes")
-                        
-                        google_text = await self._transcribe_with_google(client, audio_content)
-                        print(f"DEBUG: Google Speech transcription: {google_text}")
+                    if client and audio_content:
+                        with stage_timer('stt.google'):
+                            google_text, google_confidence = await self._transcribe_with_google(client, audio_content)
+                        print(f"DEBUG: Google Speech transcription: {google_text} ({google_confidence:.2f})")
                         
                         if google_text and google_text.strip():
                             transcribed_text = google_text
+                            transcript_confidence = google_confidence
                     else:
                         print("DEBUG: Google Speech client olinmadi - kredensiallar yo'q")
                 except RuntimeError as google_error:
@@ -143,7 +163,10 @@ class FinancialModule:
             # Whisper API - asosiy va eng ishonchli (agar Google ishlamasa)
             if not transcribed_text:
                 try:
-                    whisper_text = await self._transcribe_with_whisper(audio_file_path)
+                    with stage_timer('stt.whisper'):
+                        whisper_text = await self._transcribe_with_whisper(
+                            audio_content if audio_content is not None else audio
+                        )
                     print(f"DEBUG: Whisper transcription: {whisper_text}")
                     
                     if whisper_text and whisper_text.strip():
@@ -159,16 +182,7 @@ class FinancialModule:
                     "message": "❌ Ovozli xabarni qayta ishlashda xatolik. Iltimos, qaytadan urinib ko'ring."
                 }
             
-            # Transkriptni AI orqali yaxshilash (uzbek tilini yaxshi tushunish uchun)
-            improved_text = await self._improve_transcription_with_ai(transcribed_text)
-            print(f"DEBUG: Improved transcription: {improved_text}")
-            
-            # Yaxshilangan matnni text kabi qayta ishlash (process_ai_input_advanced)
-            # Bu text xabarlar bilan bir xil kod ishlatiladi
-            result = await self.process_ai_input_advanced(improved_text, user_id)
-            
-            # Natijani qaytarish (text bilan bir xil format)
-            return result
+            return await self._process_transcript(transcribed_text, transcript_confidence, user_id)
 
         except Exception as e:
             logging.error(f"Audio qayta ishlashda xatolik: {e}")
@@ -177,8 +191,105 @@ class FinancialModule:
                 "message": "❌ Audio faylni qayta ishlashda xatolik yuz berdi."
             }
 
-    async def _transcribe_with_google(self, client: speech.SpeechClient, audio_content: bytes) -> Optional[str]:
-        """Google Cloud Speech orqali transkripti olish"""
+    async def _process_transcript(self, transcript: str, confidence: float, user_id: int) -> Dict[str, Any]:
+        """Transkriptdan tranzaksiyalar.
+
+        - direct: Google ishonchi yuqori yoki qoidalar parseri tushundi - tuzatishsiz ajratish
+        - merged: tuzatish va ajratish bitta LLM so'rovida
+        - two_pass: eski yo'l - gpt-4o bilan tuzatish, keyin alohida ajratish
+        merged / two_pass foydalanuvchi bo'yicha VOICE_MERGED_PERCENT ulushda taqsimlanadi
+        (A/B), har bir xabarning kechikishi va token sarfi metrics ga yoziladi.
+        """
+        started = time.perf_counter()
+        with llm.track_usage() as usage:
+            fast = parse_transaction(transcript)
+            if confidence >= VOICE_DIRECT_CONFIDENCE or (fast and fast['total_confidence'] >= FAST_PATH_CONFIDENCE):
+                variant = 'direct'
+                with stage_timer('audio.extraction'):
+                    result = await self.process_ai_input_advanced(transcript, user_id)
+            elif user_id % 100 < VOICE_MERGED_PERCENT:
+                variant = 'merged'
+                result = await self._process_transcript_merged(transcript, user_id)
+            else:
+                variant = 'two_pass'
+                # Transkriptni AI orqali yaxshilash (uzbek tilini yaxshi tushunish uchun)
+                with stage_timer('stt.improve'):
+                    improved_text = await self._improve_transcription_with_ai(transcript)
+                print(f"DEBUG: Improved transcription: {improved_text}")
+                # Yaxshilangan matn text xabarlar bilan bir xil kod orqali qayta ishlanadi
+                with stage_timer('audio.extraction'):
+                    result = await self.process_ai_input_advanced(improved_text, user_id)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        record_variant('voice_pipeline', variant, elapsed_ms, usage)
+        logging.info(
+            f"Ovozli xabar ({variant}): {elapsed_ms:.0f} ms, {usage['calls']} LLM so'rov, "
+            f"{usage['prompt_tokens'] + usage['completion_tokens']} token, ${usage['cost_usd']:.5f}"
+        )
+        return result
+
+    async def _process_transcript_merged(self, transcript: str, user_id: int) -> Dict[str, Any]:
+        """Transkriptni tuzatish va tranzaksiyalarni ajratish - bitta LLM so'rovi"""
+        with stage_timer('audio.merged'):
+            data = await self._extract_from_transcript(transcript)
+        if data is None:
+            # Birlashgan so'rov ishlamadi - ikki bosqichli yo'lga qaytish
+            improved_text = await self._improve_transcription_with_ai(transcript)
+            return await self.process_ai_input_advanced(improved_text, user_id)
+        text = data.pop('text', None) or transcript
+        print(f"DEBUG: Merged transcription: {text}")
+        try:
+            return await self._handle_extracted_data(data, text, user_id)
+        except Exception as e:
+            logging.error(f"AI qayta ishlashda xatolik: {e}")
+            return {
+                "success": False,
+                "message": "❌ Ma'lumotni qayta ishlashda xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring."
+            }
+
+    async def _extract_from_transcript(self, transcript: str) -> Optional[Dict[str, Any]]:
+        """Audio transkriptni tuzatib, tranzaksiyalarni ajratish.
+
+        {"text": tuzatilgan matn, "transactions": [...], "total_confidence": ...}
+        yoki xatolikda None qaytaradi.
+        """
+        system_prompt = self._extraction_system_prompt() + """
+
+OVOZLI XABAR REJIMI:
+Xabar - audio transkript. Unda tanib olish xatolari, rus/qozoq so'zlari va so'z bilan yozilgan
+summalar bo'lishi mumkin ("sakkiz yuz ming som", "двадцать пять тысяч сом").
+1. Avval transkriptni to'g'ri o'zbek tiliga tuzat, tabiiy nutqni saqla. SUMMALARNI HECH QACHON YO'QOTMA.
+2. Keyin tuzatilgan matndan tranzaksiyalarni yuqoridagi qoidalar bo'yicha ajrat.
+3. Javobga tuzatilgan matnni "text" maydonida qo'sh:
+{"text":"tuzatilgan matn","transactions":[{...}],"total_confidence":0.9}"""
+        try:
+            response = await llm.complete(
+                'voice_extraction',
+                [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": f'Transkript: "{transcript}"\n\nJSON:'}
+                ],
+                max_tokens=800,
+                temperature=0.0,
+                response_format={"type": "json_object"}
+            )
+            data = json.loads(response)
+        except Exception as e:
+            logging.warning(f"Birlashgan transkript tahlili xatolik: {e}")
+            return None
+        if not isinstance(data, dict) or not isinstance(data.get('transactions'), list):
+            return None
+        if not data['transactions']:
+            data.update({"total_confidence": 0, "error": "tushunish_e_madi"})
+        return data
+
+    async def _transcribe_with_google(self, client: speech.SpeechAsyncClient,
+                                      audio_content: bytes) -> Tuple[Optional[str], float]:
+        """Google Cloud Speech orqali transkripti olish.
+
+        Til konfiguratsiyalari parallel yuboriladi: birinchi bo'sh bo'lmagan
+        transkript qaytariladi, qolgan so'rovlar bekor qilinadi.
+        (transkript, Google confidence) qaytaradi.
+        """
         audio = speech.RecognitionAudio(content=audio_content)
 
         speech_context = speech.SpeechContext(
@@ -219,57 +330,60 @@ class FinancialModule:
             },
         ]
 
-        for cfg in configs:
+        async def recognize(cfg: dict) -> Optional[Tuple[str, float]]:
+            recognition_config = speech.RecognitionConfig(
+                encoding=speech.RecognitionConfig.AudioEncoding.OGG_OPUS,
+                sample_rate_hertz=48000,
+                language_code=cfg["language_code"],
+                alternative_language_codes=cfg.get("alternative_language_codes", []),
+                enable_automatic_punctuation=True,
+                enable_word_time_offsets=False,
+                speech_contexts=[speech_context],
+            )
             try:
-                recognition_config = speech.RecognitionConfig(
-                    encoding=speech.RecognitionConfig.AudioEncoding.OGG_OPUS,
-                    sample_rate_hertz=48000,
-                    language_code=cfg["language_code"],
-                    alternative_language_codes=cfg.get("alternative_language_codes", []),
-                    enable_automatic_punctuation=True,
-                    enable_word_time_offsets=False,
-                    speech_contexts=[speech_context],
-                )
-
-                response = client.recognize(config=recognition_config, audio=audio)
-                if response.results:
-                    best_alternative = response.results[0].alternatives[0]
-                    transcript = best_alternative.transcript.strip()
-                    if transcript:
-                        logging.info(
-                            f"Google Speech muvaffaqiyatli (lang={cfg['language_code']}): {transcript}"
-                        )
-                        return transcript
-
+                with stage_timer(f"stt.google.{cfg['language_code']}"):
+                    response = await client.recognize(
+                        config=recognition_config, audio=audio, timeout=GOOGLE_RECOGNIZE_TIMEOUT
+                    )
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 logging.warning(
                     f"Google Speech konfiguratsiya sinovi muvaffaqiyatsiz (lang={cfg['language_code']}): {e}"
                 )
+                return None
+            if response.results:
+                best_alternative = response.results[0].alternatives[0]
+                transcript = best_alternative.transcript.strip()
+                if transcript:
+                    logging.info(
+                        f"Google Speech muvaffaqiyatli (lang={cfg['language_code']}, "
+                        f"confidence={best_alternative.confidence:.2f}): {transcript}"
+                    )
+                    return transcript, best_alternative.confidence
+            return None
 
-        return None
+        tasks = [asyncio.create_task(recognize(cfg)) for cfg in configs]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                if result:
+                    return result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return None, 0.0
     
-    async def _transcribe_with_whisper(self, audio_file_path: str) -> Optional[str]:
+    async def _transcribe_with_whisper(self, audio: AudioSource) -> Optional[str]:
         """OpenAI Whisper API orqali transkripti olish"""
         try:
             if not OPENAI_API_KEY:
                 logging.warning("OpenAI API key yo'q, Whisper ishlatib bo'lmaydi")
                 return None
             
-            # OpenAI Whisper API uchun faylni ochish
-            from openai import OpenAI
-            openai_client = OpenAI(api_key=OPENAI_API_KEY)
-            
-            def call_whisper():
-                with open(audio_file_path, "rb") as audio_file:
-                    response = openai_client.audio.transcriptions.create(
-                        model="whisper-1",
-                        file=audio_file
-                        # language parametrini olib tashladik - Whisper avtomatik aniqlaydi
-                    )
-                    return response.text
-            
-            loop = asyncio.get_event_loop()
-            transcript = await loop.run_in_executor(None, call_whisper)
+            # language parametri berilmaydi - Whisper avtomatik aniqlaydi
+            transcript = await llm.transcribe(audio, model="whisper-1")
             
             if transcript and transcript.strip():
                 logging.info(f"Whisper transcription muvaffaqiyatli: {transcript}")
@@ -333,22 +447,7 @@ class FinancialModule:
             # financial_data = await self._ensure_ai_guess(financial_data, extract_base)
             # print(f"DEBUG AI after ensure_guess: {financial_data}")
             
-            # 3-bosqich: Ma'lumotlarni validatsiya qilish
-            validation_result = await self._validate_extracted_data(financial_data, text)
-            
-            if not validation_result['is_valid']:
-                # Agar FORCE_AI_ANALYSIS flag bo'lsa, _force_ai_analysis ni chaqiramiz
-                if validation_result.get('message') == "FORCE_AI_ANALYSIS":
-                    # Moliyaviy harakat bor, lekin tranzaksiya topilmadi - majburiy tahlil
-                    return await self._force_ai_analysis(text, user_id)
-                
-                return {
-                    "success": False,
-                    "message": validation_result['message']
-                }
-            
-            # 4-bosqich: Tranzaksiyalarni tahlil qilish va ko'rsatish
-            return await self._analyze_and_show_transactions(validation_result['data'], user_id, text)
+            return await self._handle_extracted_data(financial_data, text, user_id)
             
         except Exception as e:
             logging.error(f"AI qayta ishlashda xatolik: {e}")
@@ -357,11 +456,30 @@ class FinancialModule:
                 "message": "❌ Ma'lumotni qayta ishlashda xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring."
             }
 
+    async def _handle_extracted_data(self, financial_data: Dict[str, Any], text: str, user_id: int) -> Dict[str, Any]:
+        """Ajratilgan ma'lumotlarni validatsiya qilish va foydalanuvchiga ko'rsatish"""
+        # 3-bosqich: Ma'lumotlarni validatsiya qilish
+        validation_result = await self._validate_extracted_data(financial_data, text)
+        
+        if not validation_result['is_valid']:
+            # Agar FORCE_AI_ANALYSIS flag bo'lsa, _force_ai_analysis ni chaqiramiz
+            if validation_result.get('message') == "FORCE_AI_ANALYSIS":
+                # Moliyaviy harakat bor, lekin tranzaksiya topilmadi - majburiy tahlil
+                return await self._force_ai_analysis(text, user_id)
+            
+            return {
+                "success": False,
+                "message": validation_result['message']
+            }
+        
+        # 4-bosqich: Tranzaksiyalarni tahlil qilish va ko'rsatish
+        return await self._analyze_and_show_transactions(validation_result['data'], user_id, text)
+
     async def _improve_transcription_with_ai(self, text: str) -> str:
         """AI orqali transkriptni yaxshilash va to'g'rilash"""
         try:
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-4o",  # Eng kuchli model
+            improved = await llm.complete(
+                'transcript_improve',  # Eng kuchli model (TIER_PREMIUM)
                 messages=[
                     {
                         "role": "system",
@@ -458,7 +576,7 @@ Faqat yaxshilangan matnni bering:"""
                 max_tokens=1200
             )
             
-            improved = response.choices[0].message.content.strip()
+            improved = (improved or "").strip()
             return improved if improved else text
             
         except Exception as e:
@@ -468,8 +586,8 @@ Faqat yaxshilangan matnni bering:"""
     async def _refine_transcription_context(self, text: str) -> str:
         """Tabiiy nutqni chuqurroq anglash uchun qo'shimcha kontekstli qayta ishlash"""
         try:
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
+            refined = await llm.complete(
+                'voice_extraction',
                 messages=[
                     {
                         "role": "system",
@@ -493,26 +611,25 @@ QOIDALAR:
                 max_tokens=800
             )
 
-            refined = response.choices[0].message.content.strip()
+            refined = (refined or "").strip()
             return refined if refined else text
 
         except Exception as e:
             logging.warning(f"Refine context xatolik: {e}")
             return text
 
-    async def _extract_financial_data_with_gpt4(self, text: str) -> Dict[str, Any]:
-        """Mistral bilan moliyaviy ma'lumotlarni ajratish - tez va arzon (PLUS tarif)"""
-        try:
-            # Bugungi sana va vaqt ma'lumotlari
-            from datetime import datetime
-            today = datetime.now()
-            current_date = today.strftime('%Y-%m-%d')
-            current_year = today.year
-            current_month = today.month
-            current_day = today.day
-            
-            # System prompt - soddalashtirilgan va optimallashtirilgan
-            system_prompt = f"""Sen tranzaksiya aniqlovchisan. JSON formatda javob ber.
+    def _extraction_system_prompt(self) -> str:
+        """Tranzaksiya ajratish system prompti (matn va ovozli xabar rejimlari uchun umumiy)"""
+        # Bugungi sana va vaqt ma'lumotlari
+        from datetime import datetime
+        today = datetime.now()
+        current_date = today.strftime('%Y-%m-%d')
+        current_year = today.year
+        current_month = today.month
+        current_day = today.day
+        
+        # System prompt - soddalashtirilgan va optimallashtirilgan
+        return f"""Sen tranzaksiya aniqlovchisan. JSON formatda javob ber.
 
 BUGUNGI SANGA: {current_date} ({current_year}-yil, {current_month}-oy, {current_day}-sana)
 
@@ -750,42 +867,47 @@ MUHIM: Agar sizda SHUBHA bo'lsa, confidence ni PASAYTIRING! Yuqori confidence fa
 
 FORMAT: {{"transactions":[{{...}}],"total_confidence":0.9}}"""
 
+    async def extract_without_llm(self, text: str) -> Optional[Dict[str, Any]]:
+        """Rule parser yoki ajratish keshi - LLM siz natija bo'lmasa None"""
+        # Oddiy xabarlar ("taksi 20 ming") LLM ga yuborilmaydi
+        fast = parse_transaction(text)
+        if fast and fast['total_confidence'] >= FAST_PATH_CONFIDENCE:
+            logging.info(f"Rule parser: {fast['transactions'][0]}")
+            return fast
+        # Takroriy xabarlar ("kofe 25 ming" / "Kofe 25000 so'm") - oldingi LLM natijasi
+        extraction_key = extraction_cache.key(text)
+        cached = await extraction_cache.get(extraction_key)
+        if cached:
+            logging.info(f"Ajratish keshidan: {extraction_key!r}")
+            return cached
+        return None
+
+    async def _extract_financial_data_with_gpt4(self, text: str) -> Dict[str, Any]:
+        """Mistral bilan moliyaviy ma'lumotlarni ajratish - tez va arzon (PLUS tarif)"""
+        known = await self.extract_without_llm(text)
+        if known:
+            return known
+        extraction_key = extraction_cache.key(text)
+        try:
+            system_prompt = self._extraction_system_prompt()
+
             user_prompt = f'Message: "{text}"\n\nJSON:'
 
-            # Mistral-7B-Instruct orqali (OpenRouter) - sync client bilan
-            def call_ai():
-                try:
-                    if self.openrouter_client:
-                        response = self.openrouter_client.chat.completions.create(
-                            model="mistralai/mistral-7b-instruct",
-                            messages=[
-                                {"role": "system", "content": system_prompt},
-                                {"role": "user", "content": user_prompt}
-                            ],
-                            max_tokens=600,  # Ko'paytirildi: bir nechta tranzaksiya uchun etarli
-                            temperature=0.0
-                        )
-                        return response.choices[0].message.content
-                    else:
-                        raise Exception("OpenRouter client not available")
-                except Exception as e:
-                    logging.warning(f"Mistral xatolik, GPT-3.5 ga o'tilmoqda: {e}")
-                    # Fallback: GPT-3.5-turbo (sync)
-                    from openai import OpenAI
-                    openai_sync = OpenAI(api_key=OPENAI_API_KEY)
-                    response = openai_sync.chat.completions.create(
-                        model="gpt-3.5-turbo",
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": user_prompt}
-                        ],
-                        max_tokens=600,  # Ko'paytirildi: bir nechta tranzaksiya uchun etarli
-                        temperature=0.0
-                    )
-                    return response.choices[0].message.content
-            
-            loop = asyncio.get_event_loop()
-            ai_response = await loop.run_in_executor(None, call_ai)
+            # 'extraction' zanjiri: eng arzon model (Mistral-7B), xatolikda keyingisi
+            with llm.track_usage() as usage:
+                ai_result = await llm.chat_with_fallback(
+                    [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    max_tokens=600,  # Ko'paytirildi: bir nechta tranzaksiya uchun etarli
+                    temperature=0.0
+                )
+            # Kesh hit lari shu o'lchangan narx bo'yicha tejalgan deb hisoblanadi
+            extraction_cache.record_llm_cost(usage)
+            if not ai_result:
+                raise Exception("Barcha LLM provayderlar javob bermadi")
+            ai_response, _provider = ai_result
             
             logging.info(f"AI moliyaviy javob: {ai_response}")
             print(f"DEBUG AI raw response: {ai_response}")
@@ -828,6 +950,7 @@ FORMAT: {{"transactions":[{{...}}],"total_confidence":0.9}}"""
                 if not data.get('transactions'):
                     return {"transactions": [], "total_confidence": 0, "error": "tushunish_e_madi"}
                 
+                await extraction_cache.set(extraction_key, data)
                 return data
                 
             except json.JSONDecodeError as e:
@@ -1672,20 +1795,10 @@ FORMAT: {{"transactions":[{{...}}],"total_confidence":0.9}}"""
     async def get_user_balance(self, user_id: int) -> Dict[str, float]:
         """Foydalanuvchi balansini hisoblash"""
         try:
-            # Kirimlar
-            income_query = "SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE user_id = %s AND transaction_type = 'income'"
-            income_result = await db.execute_one(income_query, (user_id,))
-            total_income = income_result[0] if income_result else 0.0
-            
-            # Chiqimlar
-            expense_query = "SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE user_id = %s AND transaction_type = 'expense'"
-            expense_result = await db.execute_one(expense_query, (user_id,))
-            total_expense = expense_result[0] if expense_result else 0.0
-            
-            # Qarzlar
-            debt_query = "SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE user_id = %s AND transaction_type = 'debt'"
-            debt_result = await db.execute_one(debt_query, (user_id,))
-            total_debt = debt_result[0] if debt_result else 0.0
+            aggregates = await db.get_balance_aggregates(user_id)
+            total_income = sum(b['income'] for b in aggregates.values())
+            total_expense = sum(b['expense'] for b in aggregates.values())
+            total_debt = sum(b['debt'] for b in aggregates.values())
             
             balance = total_income - total_expense
             
@@ -1804,8 +1917,8 @@ FORMAT: {{"transactions":[{{...}}],"total_confidence":0.9}}"""
             return data
 
         try:
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-4o",
+            ai_response = await llm.complete(
+                'ai_guess',
                 messages=[
                     {
                         "role": "system",
@@ -1827,7 +1940,7 @@ QOIDALAR:
                 max_tokens=1000,
             )
 
-            ai_response = response.choices[0].message.content.strip()
+            ai_response = (ai_response or "").strip()
             if "```json" in ai_response:
                 ai_response = ai_response.split("```json")[1].split("```")[0]
             elif "```" in ai_response:
@@ -0,0 +1,270 @@
+"""
+MySQL asosidagi aiogram FSM storage
+
+MemoryStorage da UserStates / BusinessStates holatlari (onboarding,
+tranzaksiyani tahrirlash va h.k.) bot qayta ishga tushganda yo'qolardi va
+bir nechta worker o'rtasida bo'lishilmasdi. MySQLStorage holatlarni
+fsm_storage jadvalida saqlaydi:
+
+- o'qish: avval yozilmagan o'zgarishlar, keyin lokal TTLCache, keyin baza
+- yozish: lokal keshga darhol, bazaga write-behind - FLUSH_INTERVAL da yoki
+  FLUSH_BATCH_SIZE ta kalit yig'ilganda bitta ko'p qatorli upsert bilan
+- TTL: har bir yozuv STATE_TTL dan keyin eskiradi, eskirganlari vaqti-vaqti
+  bilan o'chiriladi
+
+Lokal kesh LOCAL_TTL soniya yashaydi: bitta foydalanuvchi yangilanishlari
+bitta workerga tushsa (webhook workerlari user_id bo'yicha taqsimlaydi),
+o'qishlar bazaga bormaydi. FSM_STORAGE=memory bo'lsa eski MemoryStorage.
+
+data JSON'ga tur belgilari bilan yoziladi (dumps_data / loads_data): date,
+datetime, time, timedelta, Decimal, tuple, set va satr bo'lmagan kalitli
+dict'lar bazadan xuddi MemoryStorage dagidek qaytadi.
+"""
+
+import asyncio
+import json
+import logging
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from cache import TTLCache, MISSING
+from config import FSM_STORAGE
+
+# Yozilmagan o'zgarishlarni bazaga yozish oralig'i (soniya)
+FLUSH_INTERVAL = 0.5
+# Shuncha kalit yig'ilsa navbatdagi intervalni kutmasdan yoziladi
+FLUSH_BATCH_SIZE = 500
+# Holat oxirgi yozuvdan keyin shuncha vaqt saqlanadi
+STATE_TTL = timedelta(days=7)
+# Lokal o'qish keshi
+LOCAL_TTL = 30.0
+LOCAL_MAXSIZE = 20000
+# Eskirgan qatorlarni har N ta flush da tozalash
+PURGE_EVERY = 1000
+
+_EMPTY = {'state': None, 'data': {}}
+
+# Tur belgisi kaliti: {"__fsm__": "<tur>", "v": <qiymat>}
+_TAG = '__fsm__'
+
+
+def _encode(value):
+    """JSON'da yo'q turlarni belgilangan lug'atga aylantirish (rekursiv)"""
+    if isinstance(value, dict):
+        if all(isinstance(k, str) for k in value) and _TAG not in value:
+            return {k: _encode(v) for k, v in value.items()}
+        return {_TAG: 'dict', 'v': [[_encode(k), _encode(v)] for k, v in value.items()]}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, tuple):
+        return {_TAG: 'tuple', 'v': [_encode(v) for v in value]}
+    if isinstance(value, (set, frozenset)):
+        return {_TAG: 'set', 'v': [_encode(v) for v in value]}
+    # datetime date ning vorisi - avval tekshiriladi
+    if isinstance(value, datetime):
+        return {_TAG: 'datetime', 'v': value.isoformat()}
+    if isinstance(value, date):
+        return {_TAG: 'date', 'v': value.isoformat()}
+    if isinstance(value, time):
+        return {_TAG: 'time', 'v': value.isoformat()}
+    if isinstance(value, timedelta):
+        return {_TAG: 'timedelta', 'v': value.total_seconds()}
+    if isinstance(value, Decimal):
+        return {_TAG: 'decimal', 'v': str(value)}
+    return value
+
+
+_DECODERS = {
+    'dict': lambda v: {k: val for k, val in v},
+    'tuple': tuple,
+    'set': set,
+    'datetime': datetime.fromisoformat,
+    'date': date.fromisoformat,
+    'time': time.fromisoformat,
+    'timedelta': lambda v: timedelta(seconds=v),
+    'decimal': Decimal,
+}
+
+
+def _decode(obj: dict):
+    tag = obj.get(_TAG)
+    if tag in _DECODERS and set(obj) == {_TAG, 'v'}:
+        return _DECODERS[tag](obj['v'])
+    return obj
+
+
+def dumps_data(data: Dict[str, Any]) -> str:
+    """FSM data ni turlarini saqlagan holda JSON ga"""
+    def fallback(value):
+        logging.warning(f"FSM data: {type(value).__name__} turini saqlab bo'lmaydi, satr sifatida yozildi")
+        return str(value)
+
+    return json.dumps(_encode(data), ensure_ascii=False, default=fallback)
+
+
+def loads_data(raw: Optional[str]) -> Dict[str, Any]:
+    """dumps_data ning teskarisi"""
+    return json.loads(raw, object_hook=_decode) if raw else {}
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class MySQLStorage(BaseStorage):
+    """fsm_storage jadvali ustidagi write-behind FSM storage"""
+
+    def __init__(self, db, flush_interval: float = FLUSH_INTERVAL, state_ttl: timedelta = STATE_TTL,
+                 local_ttl: float = LOCAL_TTL):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.state_ttl = state_ttl
+        self.local = TTLCache(maxsize=LOCAL_MAXSIZE, ttl=local_ttl)
+        # Bazaga hali yozilmagan yozuvlar va hozir yozilayotgan partiya
+        self._dirty: Dict[str, dict] = {}
+        self._flushing: Dict[str, dict] = {}
+        self._flush_now = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self.db_reads = 0
+        self.flushes = 0
+        self.rows_written = 0
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or 0}:{key.destiny}"
+
+    async def _record(self, key: StorageKey) -> dict:
+        storage_key = self._key(key)
+        record = self._dirty.get(storage_key) or self._flushing.get(storage_key)
+        if record is not None:
+            return record
+        record = self.local.get(storage_key)
+        if record is MISSING:
+            epoch = self.local.epoch()
+            record = await self._fetch(storage_key)
+            self.local.set(storage_key, record, epoch=epoch)
+        return record
+
+    async def _fetch(self, storage_key: str) -> dict:
+        if not self.db.pool:
+            return _EMPTY
+        self.db_reads += 1
+        row = await self.db.execute_one(
+            "SELECT state, data FROM fsm_storage WHERE storage_key = %s AND expires_at > NOW()",
+            (storage_key,)
+        )
+        if not row:
+            return _EMPTY
+        return {'state': row.get('state'), 'data': loads_data(row.get('data'))}
+
+    def _write(self, key: StorageKey, record: dict):
+        storage_key = self._key(key)
+        self._dirty[storage_key] = record
+        self.local.set(storage_key, record)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+        if len(self._dirty) >= FLUSH_BATCH_SIZE:
+            self._flush_now.set()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        self._write(key, {'state': _state_name(state), 'data': record['data']})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key))['state']
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._record(key)
+        self._write(key, {'state': record['state'], 'data': data.copy()})
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._record(key))['data'].copy()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"FSM holatlarini bazaga yozishda xatolik: {e}")
+
+    async def flush(self):
+        """Yozilmagan o'zgarishlarni bitta partiyada bazaga yozish"""
+        if not self._dirty or not self.db.pool:
+            return
+        self._flushing, self._dirty = self._dirty, {}
+        try:
+            await self._write_batch(self._flushing)
+        except Exception:
+            # Keyingi flush da qayta uriniladi (yangiroq yozuvlar ustun)
+            for storage_key, record in self._flushing.items():
+                self._dirty.setdefault(storage_key, record)
+            raise
+        finally:
+            self._flushing = {}
+
+    async def _write_batch(self, batch: Dict[str, dict]):
+        expires_at = datetime.now() + self.state_ttl
+        deleted = [k for k, record in batch.items() if record['state'] is None and not record['data']]
+        upserts = [(k, record) for k, record in batch.items() if record['state'] is not None or record['data']]
+
+        async with self.db.transaction() as cursor:
+            if deleted:
+                placeholders = ', '.join(['%s'] * len(deleted))
+                await cursor.execute(f"DELETE FROM fsm_storage WHERE storage_key IN ({placeholders})", deleted)
+            if upserts:
+                values = ', '.join(['(%s, %s, %s, %s)'] * len(upserts))
+                params = []
+                for storage_key, record in upserts:
+                    params.extend((
+                        storage_key,
+                        record['state'],
+                        dumps_data(record['data']),
+                        expires_at,
+                    ))
+                await cursor.execute(
+                    f"""
+                    INSERT INTO fsm_storage (storage_key, state, data, expires_at) VALUES {values}
+                    ON DUPLICATE KEY UPDATE state = VALUES(state), data = VALUES(data),
+                                            expires_at = VALUES(expires_at)
+                    """,
+                    params
+                )
+        self.flushes += 1
+        self.rows_written += len(batch)
+        if self.flushes % PURGE_EVERY == 0:
+            await self.db.execute_query("DELETE FROM fsm_storage WHERE expires_at < NOW() LIMIT 5000")
+
+    def stats(self) -> dict:
+        return {
+            'local': self.local.stats(),
+            'db_reads': self.db_reads,
+            'pending': len(self._dirty),
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+        }
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error(f"FSM holatlarini yopishda yozib bo'lmadi: {e}")
+
+
+def create_fsm_storage(db) -> BaseStorage:
+    """FSM_STORAGE sozlamasi bo'yicha storage: mysql (default) yoki memory"""
+    if FSM_STORAGE == 'memory':
+        return MemoryStorage()
+    return MySQLStorage(db)
@@ -0,0 +1,299 @@
+"""
+Yagona asinxron LLM shlyuzi
+
+Barcha modullar (AIChat, FinancialModule, BusinessModule) shu yerdagi
+umumiy AsyncOpenAI clientlaridan foydalanadi: har bir provayder uchun bitta
+doimiy HTTP ulanishlar puli, parallel so'rovlar cheklovi va timeout.
+stream_chat() javobni token bo'laklari bilan qaytaradi (Telegram xabarini
+bosqichma-bosqich tahrirlash uchun).
+
+Model tanlash: har bir vazifa (TASK_TIERS) uchun sifat darajasi beriladi,
+route() shu darajadan past bo'lmagan, kaliti bor modellarni narx bo'yicha
+saralab qaytaradi - eng arzoni birinchi, keyingilari fallback. complete()
+va chat_with_fallback() shu zanjir bo'yicha ishlaydi.
+
+track_usage() bloki ichidagi barcha so'rovlarning API javobidagi haqiqiy
+token soni va narxi (USD va so'm) bitta lug'atga, vazifa/model bo'yicha
+ham, yig'iladi. Ichma-ich bloklar tashqi blokka qo'shiladi.
+"""
+
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Optional, Sequence, Tuple, Union
+
+from openai import AsyncOpenAI
+
+from config import OPENAI_API_KEY, OPENROUTER_API_KEY, USD_TO_UZS
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+# Provayder bo'yicha bir vaqtda bajariladigan so'rovlar soni
+PROVIDER_CONCURRENCY = {
+    'openai': 32,
+    'openrouter': 16,
+}
+
+DEFAULT_TIMEOUT = 30.0
+
+# Model narxlari, USD / 1M token: (kirish, chiqish)
+MODEL_PRICES = {
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-3.5-turbo': (0.50, 1.50),
+    'mistralai/mistral-7b-instruct': (0.03, 0.055),
+}
+
+# Sifat darajalari
+TIER_BASIC = 1      # qisqa JSON ajratish
+TIER_STANDARD = 2   # suhbat, tahlil, o'zbekcha matn
+TIER_PREMIUM = 3    # ovozli transkriptni tuzatish, qiyin taxminlar
+
+# (provayder, model, daraja)
+MODEL_CATALOG = (
+    ('openrouter', 'mistralai/mistral-7b-instruct', TIER_BASIC),
+    ('openai', 'gpt-3.5-turbo', TIER_BASIC),
+    ('openai', 'gpt-4o-mini', TIER_STANDARD),
+    ('openai', 'gpt-4o', TIER_PREMIUM),
+)
+
+# Vazifa -> kerakli sifat darajasi (ro'yxatda yo'q vazifa - TIER_STANDARD)
+TASK_TIERS = {
+    'extraction': TIER_BASIC,
+    'detection': TIER_STANDARD,
+    'reminder': TIER_STANDARD,
+    'chat': TIER_STANDARD,
+    'chat_summary': TIER_STANDARD,
+    'business_chat': TIER_STANDARD,
+    'voice_extraction': TIER_STANDARD,
+    'salary_parse': TIER_STANDARD,
+    'transaction_comment': TIER_STANDARD,
+    'business_parse': TIER_STANDARD,
+    'onboarding': TIER_STANDARD,
+    'transcript_improve': TIER_PREMIUM,
+    'ai_guess': TIER_PREMIUM,
+}
+
+# Zanjirdagi modellar soni (eng arzoni + fallback)
+ROUTE_LENGTH = 2
+# Narx bo'yicha saralashda chiqish tokenlari ulushi (odatiy so'rov ~4:1)
+OUTPUT_TOKEN_SHARE = 0.2
+# Provayder oqimda usage qaytarmasa tokenlar matn uzunligidan taxmin qilinadi
+CHARS_PER_TOKEN = 4
+
+# Joriy track_usage() bloki hisoblagichi (asyncio task'lariga ham meros bo'ladi)
+_current_usage: ContextVar[Optional[dict]] = ContextVar('llm_usage', default=None)
+
+
+def _blended_price(model: str) -> float:
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return input_price * (1 - OUTPUT_TOKEN_SHARE) + output_price * OUTPUT_TOKEN_SHARE
+
+
+def _new_usage() -> dict:
+    return {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost_usd': 0.0, 'cost_uzs': 0.0,
+            'tasks': {}}
+
+
+def _add_usage(target: dict, task: str, model: str, calls: int, prompt_tokens: int,
+               completion_tokens: int, cost_usd: float):
+    target['calls'] += calls
+    target['prompt_tokens'] += prompt_tokens
+    target['completion_tokens'] += completion_tokens
+    target['cost_usd'] += cost_usd
+    target['cost_uzs'] += cost_usd * USD_TO_UZS
+    row = target['tasks'].setdefault(
+        (task, model), {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost_usd': 0.0}
+    )
+    row['calls'] += calls
+    row['prompt_tokens'] += prompt_tokens
+    row['completion_tokens'] += completion_tokens
+    row['cost_usd'] += cost_usd
+
+
+class LLMGateway:
+    """Provayderlar uchun umumiy clientlar, semaforlar va fallback siyosati"""
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self._clients = {}
+        self._semaphores = {}
+
+    def is_available(self, provider: str) -> bool:
+        return bool(self._api_key(provider))
+
+    def _api_key(self, provider: str) -> Optional[str]:
+        return {'openai': OPENAI_API_KEY, 'openrouter': OPENROUTER_API_KEY}.get(provider)
+
+    def client(self, provider: str = 'openai') -> AsyncOpenAI:
+        """Provayder uchun doimiy AsyncOpenAI client (birinchi chaqiruvda yaratiladi)"""
+        client = self._clients.get(provider)
+        if client is None:
+            kwargs = {'api_key': self._api_key(provider), 'timeout': self.timeout, 'max_retries': 1}
+            if provider == 'openrouter':
+                kwargs['base_url'] = OPENROUTER_BASE_URL
+            client = AsyncOpenAI(**kwargs)
+            self._clients[provider] = client
+        return client
+
+    def route(self, task: str) -> Tuple[Tuple[str, str], ...]:
+        """Vazifa uchun (provayder, model) zanjiri: darajaga mos, kaliti bor, eng arzoni birinchi"""
+        tier = TASK_TIERS.get(task, TIER_STANDARD)
+        candidates = sorted(
+            (entry for entry in MODEL_CATALOG if entry[2] >= tier and self.is_available(entry[0])),
+            key=lambda entry: _blended_price(entry[1])
+        )
+        return tuple((provider, model) for provider, model, _tier in candidates[:ROUTE_LENGTH])
+
+    @contextmanager
+    def track_usage(self):
+        """Blok ichidagi LLM so'rovlari sarfi.
+
+        {'calls', 'prompt_tokens', 'completion_tokens', 'cost_usd', 'cost_uzs',
+         'tasks': {(vazifa, model): {'calls', 'prompt_tokens', 'completion_tokens', 'cost_usd'}}}
+        """
+        parent = _current_usage.get()
+        usage = _new_usage()
+        token = _current_usage.set(usage)
+        try:
+            yield usage
+        finally:
+            _current_usage.reset(token)
+            if parent is not None:
+                for (task, model), row in usage['tasks'].items():
+                    _add_usage(parent, task, model, row['calls'], row['prompt_tokens'],
+                               row['completion_tokens'], row['cost_usd'])
+
+    @staticmethod
+    def _record_usage(model: str, response_usage, task: str = 'other'):
+        usage = _current_usage.get()
+        if usage is None or response_usage is None:
+            return
+        if isinstance(response_usage, dict):
+            # Eski openai SDK oqim bo'lagidagi usage ni lug'at sifatida qoldiradi
+            prompt_tokens = response_usage.get('prompt_tokens') or 0
+            completion_tokens = response_usage.get('completion_tokens') or 0
+        else:
+            prompt_tokens = response_usage.prompt_tokens or 0
+            completion_tokens = response_usage.completion_tokens or 0
+        input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+        cost_usd = (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+        _add_usage(usage, task, model, 1, prompt_tokens, completion_tokens, cost_usd)
+
+    def _semaphore(self, provider: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(provider)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(PROVIDER_CONCURRENCY.get(provider, 8))
+            self._semaphores[provider] = semaphore
+        return semaphore
+
+    async def chat(self, messages: list, model: str = 'gpt-4o-mini', provider: str = 'openai',
+                   timeout: float = None, task: str = 'other', **params) -> str:
+        """Bitta chat.completions so'rovi - javob matnini qaytaradi"""
+        async with self._semaphore(provider):
+            response = await self.client(provider).chat.completions.create(
+                model=model,
+                messages=messages,
+                timeout=timeout or self.timeout,
+                **params
+            )
+        self._record_usage(model, response.usage, task)
+        return response.choices[0].message.content
+
+    async def complete(self, task: str, messages: list, timeout: float = None, **params) -> str:
+        """Vazifa darajasiga mos eng arzon model bilan so'rov (xatolikda zanjirdagi keyingisi)"""
+        result = await self.chat_with_fallback(messages, task=task, timeout=timeout, **params)
+        if result is None:
+            raise RuntimeError(f"LLM: '{task}' vazifasi uchun barcha modellar javob bermadi")
+        return result[0]
+
+    async def stream_chat(self, messages: list, model: str = None, provider: str = None,
+                          timeout: float = None, task: str = 'other', **params) -> AsyncIterator[str]:
+        """chat() ning oqimli varianti - javob matni bo'laklarini kelishi bilan qaytaradi.
+
+        model berilmasa vazifa zanjiridagi birinchi model. Token sarfi oxirgi
+        bo'lakdagi usage dan yoziladi (stream_options extra_body orqali - o'rnatilgan
+        openai SDK bu parametrni bilmaydi). Provayder usage qaytarmasa sarf matn
+        uzunligidan taxminan hisoblanadi. Oqim birinchi bo'lakdan oldin xatolik
+        bersa javob oqimsiz complete() bilan olinadi.
+        """
+        if model is None:
+            provider, model = (self.route(task) or (('openai', 'gpt-4o-mini'),))[0]
+        provider = provider or 'openai'
+        parts = []
+        usage_seen = False
+        try:
+            async with self._semaphore(provider):
+                stream = await self.client(provider).chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    timeout=timeout or self.timeout,
+                    stream=True,
+                    extra_body={'stream_options': {'include_usage': True}},
+                    **params
+                )
+                async for chunk in stream:
+                    chunk_usage = getattr(chunk, 'usage', None)
+                    if chunk_usage is not None:
+                        usage_seen = True
+                        self._record_usage(model, chunk_usage, task)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        yield parts[-1]
+        except Exception as e:
+            if parts:
+                raise
+            logging.warning(f"LLM oqimi {provider}/{model} ishlamadi, oqimsiz so'rovga o'tilmoqda: {e}")
+            yield await self.complete(task, messages, timeout=timeout, **params)
+            return
+        if not usage_seen:
+            prompt_chars = sum(len(str(message.get('content') or '')) for message in messages)
+            self._record_usage(model, {'prompt_tokens': prompt_chars // CHARS_PER_TOKEN,
+                                       'completion_tokens': len(''.join(parts)) // CHARS_PER_TOKEN}, task)
+
+    async def chat_with_fallback(self, messages: list, chain: Sequence[Tuple[str, str]] = None,
+                                 timeout: float = None, task: str = 'extraction',
+                                 **params) -> Optional[Tuple[str, str]]:
+        """Zanjirdagi modellarni navbat bilan sinash (chain berilmasa route(task)).
+
+        (javob, provayder) qaytaradi; hammasi muvaffaqiyatsiz bo'lsa None.
+        Kaliti yo'q provayder o'tkazib yuboriladi.
+        """
+        for provider, model in chain or self.route(task):
+            if not self.is_available(provider):
+                continue
+            try:
+                content = await self.chat(messages, model=model, provider=provider, timeout=timeout,
+                                          task=task, **params)
+                return content, provider
+            except Exception as e:
+                logging.warning(f"LLM {provider}/{model} xatolik, keyingisiga o'tilmoqda: {e}")
+        return None
+
+    async def transcribe(self, audio: Union[bytes, str], model: str = 'whisper-1', timeout: float = 60.0) -> str:
+        """OpenAI audio transkripsiyasi (Whisper).
+
+        audio - xotiradagi OGG baytlari yoki fayl yo'li (katta audio uchun).
+        """
+        if isinstance(audio, str):
+            with open(audio, "rb") as audio_file:
+                return await self._transcribe(audio_file, model, timeout)
+        return await self._transcribe(("audio.ogg", audio), model, timeout)
+
+    async def _transcribe(self, file, model: str, timeout: float) -> str:
+        async with self._semaphore('openai'):
+            response = await self.client('openai').audio.transcriptions.create(
+                model=model,
+                file=file,
+                timeout=timeout
+            )
+        return response.text
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.close()
+        self._clients.clear()
+
+
+llm = LLMGateway()
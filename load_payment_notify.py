@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Payment notify server yuklama testi
+Lokal soxta Telegram API (sendMessage) va PaymentNotifier ni alohida
+jarayonlarda ishga tushiradi, keyin /payment-notify ga berilgan tezlikda (standart
+1000/s) so'rovlar yuboradi. Har bir DUPLICATE_EVERY-so'rov oldingi kalitni
+takrorlaydi - takroriy xabar Telegram'ga ikkinchi marta bormasligi tekshiriladi.
+
+O'lchanadi: so'rov kechikishi (p50/p95/p99), qabul qilingan / takroriy /
+503 javoblar, navbat bo'shaguncha vaqt va soxta Telegram'ga yetgan
+sendMessage soni (qabul qilingan noyob xabarlar soniga teng bo'lishi kerak).
+
+Ishga tushirish:
+    BOT_TOKEN=123456:TEST python3 load_payment_notify.py [xabarlar_soni] [soniyadagi_tezlik]
+"""
+
+import asyncio
+import multiprocessing
+import statistics
+import sys
+import time
+
+from aiohttp import ClientSession, TCPConnector, web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+LOAD_TOKEN = '123456:LOADTEST'
+TELEGRAM_PORT = 18081
+NOTIFY_PORT = 18082
+# Har shunchanchi so'rov oldingi idempotency kalitini takrorlaydi
+DUPLICATE_EVERY = 10
+# Soxta Telegram'da sendMessage javobi kechikishi (soniya)
+TELEGRAM_LATENCY = 0.02
+# Yuboruvchi workerlar: TELEGRAM_LATENCY da tezlikka yetishi uchun
+LOAD_WORKERS = 100
+
+
+def fake_telegram(delivered: dict) -> web.Application:
+    """Faqat sendMessage ni biladigan soxta Bot API (GET /delivered - yetgan xabarlar)"""
+
+    async def send_message(request: web.Request) -> web.Response:
+        data = await request.post()
+        chat_id = int(data['chat_id'])
+        delivered[chat_id] = delivered.get(chat_id, 0) + 1
+        await asyncio.sleep(TELEGRAM_LATENCY)
+        return web.json_response({'ok': True, 'result': {
+            'message_id': sum(delivered.values()), 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'}, 'text': data.get('text', ''),
+        }})
+
+    async def delivered_stats(request: web.Request) -> web.Response:
+        return web.json_response({
+            'total': sum(delivered.values()),
+            'twice': sum(1 for count in delivered.values() if count > 1),
+        })
+
+    app = web.Application()
+    app.router.add_post(f'/bot{LOAD_TOKEN}/sendMessage', send_message)
+    app.router.add_get('/delivered', delivered_stats)
+    return app
+
+
+def run_telegram():
+    web.run_app(fake_telegram({}), host='127.0.0.1', port=TELEGRAM_PORT, access_log=None, print=None)
+
+
+def run_notify_server(rate: float):
+    from payment_notify_server import PaymentNotifier
+
+    bot = Bot(token=LOAD_TOKEN, session=AiohttpSession(
+        api=TelegramAPIServer.from_base(f'http://127.0.0.1:{TELEGRAM_PORT}')))
+    # Soxta API uchun Telegram limiti emas, server va navbatning o'zi o'lchanadi
+    notifier = PaymentNotifier(bot=bot, workers=LOAD_WORKERS, rate=rate * 2, per_chat_interval=0)
+    app = notifier.create_app()
+    app.on_cleanup.append(lambda app: bot.session.close())
+    web.run_app(app, host='127.0.0.1', port=NOTIFY_PORT, access_log=None, print=None)
+
+
+async def wait_ready(session: ClientSession, url: str):
+    for _ in range(100):
+        try:
+            async with session.get(url):
+                return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} ishga tushmadi")
+
+
+async def run_load(total: int, rate: float):
+    base = f'http://127.0.0.1:{NOTIFY_PORT}'
+    timings, statuses, duplicates = [], {}, 0
+
+    async def post(session: ClientSession, i: int):
+        nonlocal duplicates
+        payment = i - 1 if i % DUPLICATE_EVERY == 0 and i else i
+        payload = {'user_id': 900000000000 + payment, 'amount': 29990, 'status': 'success',
+                   'payment_id': f'load-{payment}'}
+        started = time.perf_counter()
+        async with session.post(f'{base}/payment-notify', json=payload) as response:
+            body = await response.json()
+        timings.append((time.perf_counter() - started) * 1000)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        duplicates += bool(body.get('duplicate'))
+
+    async with ClientSession(connector=TCPConnector(limit=500)) as session:
+        await wait_ready(session, f'{base}/health')
+        await wait_ready(session, f'http://127.0.0.1:{TELEGRAM_PORT}/delivered')
+
+        started = time.perf_counter()
+        tasks = []
+        for i in range(total):
+            # So'rovlar rejalashtirilgan vaqtda yuboriladi (ochiq tsikl)
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(post(session, i)))
+        await asyncio.gather(*tasks)
+        sent_seconds = time.perf_counter() - started
+
+        # Navbat bo'shaguncha kutish
+        while True:
+            async with session.get(f'{base}/metrics') as response:
+                metrics = await response.json()
+            if not metrics['queue_depth'] and metrics['sent'] + metrics['blocked'] + metrics['failed'] >= metrics['received']:
+                break
+            await asyncio.sleep(0.05)
+        drained_seconds = time.perf_counter() - started
+        async with session.get(f'http://127.0.0.1:{TELEGRAM_PORT}/delivered') as response:
+            delivered = await response.json()
+
+    timings.sort()
+    accepted = statuses.get(200, 0) - duplicates
+    print("\n📊 Natijalar:")
+    print(f"   Yuborish: {sent_seconds:.2f} s ({total / sent_seconds:.0f} so'rov/s), "
+          f"navbat bo'shadi: {drained_seconds:.2f} s")
+    print(f"   Kechikish: p50 {statistics.median(timings):.1f} ms   "
+          f"p95 {timings[int(len(timings) * 0.95) - 1]:.1f} ms   p99 {timings[int(len(timings) * 0.99) - 1]:.1f} ms")
+    print(f"   HTTP: {dict(sorted(statuses.items()))}, qabul: {accepted}, takroriy: {duplicates}")
+    print(f"   Telegram sendMessage: {delivered['total']}, ikki marta yetgan: {delivered['twice']}")
+    print(f"   {metrics}")
+    ok = delivered['total'] == accepted and not delivered['twice']
+    print(f"\n{'✅' if ok else '❌'} Har bir noyob xabar Telegram'ga bir marta yetdi: {ok}")
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    print("🚀 Payment notify yuklama testi")
+    print("=" * 78)
+    print(f"📤 {total} ta xabar, {rate:.0f}/s, har {DUPLICATE_EVERY}-si takroriy")
+    # Soxta Telegram, server va yuklama generatori alohida jarayonlarda - bir-birining CPU sini olmaydi
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=run_telegram, daemon=True),
+        context.Process(target=run_notify_server, args=(rate,), daemon=True),
+    ]
+    for process in processes:
+        process.start()
+    try:
+        asyncio.run(run_load(total, rate))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+    print("=" * 78)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,15 +5,16 @@ Faqat moliyaviy funksiyalar
 """
 
 import asyncio
+import time
+from contextlib import contextmanager
 from typing import Optional, Union
 import logging
 from datetime import datetime, timedelta
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
+from aiogram import Bot, Dispatcher, Router, types
 from aiogram.types import ReplyKeyboardMarkup, ReplyKeyboardRemove, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery, Contact, WebAppInfo, FSInputFile
+from aiogram.exceptions import TelegramForbiddenError
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from config import (
     BOT_TOKEN,
@@ -31,17 +32,44 @@ from config import (
     PLUS_PACKAGES,
     PAYMENT_PLUS_WEBAPP_URL,
     PAYMENT_PRO_WEBAPP_URL,
+    AI_STREAMING,
+    PRO_MONTHLY_COST_LIMIT,
+    PRO_RESERVE_TEXT_COST,
+    PRO_RESERVE_VOICE_COST,
+    USD_TO_UZS,
+    STT_PRICE_USD_PER_MINUTE,
 )
 from database import db
 from financial_module import FinancialModule
 from reports_module import ReportsModule
-from ai_chat import AIChat, AIChatFree
+from ai_chat import AIChat, AIChatFree, PRO_LIMIT_MESSAGE
 from warehouse_module import WarehouseModule
 from business_module import BusinessModule, BusinessStates, create_business_module
+from llm_gateway import llm
+from extraction_cache import extraction_cache
+from financial_context import context_store
+from metrics import ab_report, latency_report
+from response_stream import MAX_CAPTION_LENGTH, fit_message, stream_reply
+from audio_io import AudioSource, download_audio, discard_audio
+from nightly_reports import run_report_job
+from message_dispatcher import BroadcastService, MessageDispatcher
+from fsm_storage import create_fsm_storage
+from dispatch_table import DispatchTable
+from reminder_scheduler import KIND_30MIN, ReminderScheduler, reminder_datetime
 
 # Bot va dispatcher
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+dp = Dispatcher(storage=create_fsm_storage(db))
+# Callback va xabar handlerlari kalit bo'yicha jadvalda (dispatch_table.py) - bitta router
+callbacks = DispatchTable(lambda callback_query: callback_query.data)
+messages = DispatchTable(lambda message: message.text)
+dispatch_router = Router(name='dispatch_table')
+callbacks.register(dispatch_router.callback_query)
+messages.register(dispatch_router.message)
+dp.include_router(dispatch_router)
+# Ommaviy xabarlar uchun Telegram limitlariga mos dispetcher
+outbox = MessageDispatcher(bot)
+broadcasts = BroadcastService(db, outbox)
 
 # Modullar
 financial_module = FinancialModule()
@@ -148,6 +176,7 @@ async def ensure_tariff_valid(user_id: int) -> None:
                     )
                 except Exception as deactivate_err:
                     logging.error(f"Tarifni o'chirishda qo'shimcha xato: {deactivate_err}")
+                db.invalidate_user_cache(user_id)
                 # Foydalanuvchini xabardor qilish
                 try:
                     await bot.send_message(
@@ -569,13 +598,14 @@ def resolve_plus_package_code(package_code: Optional[str] = None, amount: Option
     return None
 
 # ==== ADMIN BLOK ==== (UserStates'dan keyin)
-@dp.message(Command("admin"))
+@messages.command("admin")
 async def admin_command(message: Message, state: FSMContext):
     if message.from_user.id != ADMIN_USER_ID:
         return
     kb = InlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text="📊 Statistika", callback_data="admin_stats")],
+            [InlineKeyboardButton(text="💸 LLM xarajatlari", callback_data="admin_llm_costs")],
             [InlineKeyboardButton(text="📨 Xabar yuborish", callback_data="admin_broadcast")],
             [InlineKeyboardButton(text="🎤 Speech Model Boshqarish", callback_data="admin_speech_models")],
             [InlineKeyboardButton(text="🆓 3 kunlik Sinov Boshqarish", callback_data="admin_free_trial")]
@@ -590,23 +620,24 @@ async def admin_command(message: Message, state: FSMContext):
     except Exception:
         await message.answer("Admin panel", reply_markup=kb)
 
-@dp.callback_query(lambda c: c.data == "admin_stats")
+@callbacks.exact("admin_stats")
 async def admin_stats_callback(callback_query: CallbackQuery):
     if callback_query.from_user.id != ADMIN_USER_ID:
         await callback_query.answer()
         return
-    row_users = await db.execute_one("SELECT COUNT(*) FROM users")
-    total_users = row_users[0] if row_users else 0
-    per_tariff_rows = await db.execute_query("SELECT tariff, COUNT(*) cnt FROM users GROUP BY tariff")
-    per_tariff_map = {r[0]: r[1] for r in per_tariff_rows} if per_tariff_rows else {}
-    row_paid = await db.execute_one("SELECT COALESCE(SUM(total_amount),0) FROM payments WHERE status='paid'")
-    total_paid = row_paid[0] if row_paid else 0
-    row_tx = await db.execute_one("SELECT COUNT(*) FROM transactions")
-    total_tx = row_tx[0] if row_tx else 0
+    # DictCursor - ustunlar nom bilan o'qiladi
+    row_users = await db.execute_one("SELECT COUNT(*) AS cnt FROM users")
+    total_users = row_users['cnt'] if row_users else 0
+    per_tariff_rows = await db.execute_query("SELECT tariff, COUNT(*) AS cnt FROM users GROUP BY tariff")
+    per_tariff_map = {r['tariff']: r['cnt'] for r in per_tariff_rows} if per_tariff_rows else {}
+    row_paid = await db.execute_one("SELECT COALESCE(SUM(total_amount),0) AS total FROM payments WHERE status='paid'")
+    total_paid = row_paid['total'] if row_paid else 0
+    row_tx = await db.execute_one("SELECT COUNT(*) AS cnt FROM transactions")
+    total_tx = row_tx['cnt'] if row_tx else 0
     
     # Foydalanuvchilar bizni qayerdan eshitganini olish
-    source_rows = await db.execute_query("SELECT source, COUNT(*) cnt FROM users WHERE source IS NOT NULL GROUP BY source")
-    source_map = {r[0]: r[1] for r in source_rows} if source_rows else {}
+    source_rows = await db.execute_query("SELECT source, COUNT(*) AS cnt FROM users WHERE source IS NOT NULL GROUP BY source")
+    source_map = {r['source']: r['cnt'] for r in source_rows} if source_rows else {}
     
     # Open AI API balansi
     openai_balance = "N/A"
@@ -651,6 +682,24 @@ async def admin_stats_callback(callback_query: CallbackQuery):
     except Exception as e:
         openai_balance = f"Xatolik: {str(e)[:30]}"
     
+    cache = db.cache_stats()
+    extraction = extraction_cache.stats()
+    latencies = latency_report()
+    context = context_store(db).stats()
+    context_latency = latencies.get('ai_chat.context', {})
+    latency_stages = ('stt.google', 'stt.whisper', 'stt.improve', 'audio.extraction',
+                      'ai_chat.total', 'ai_chat.stream.first_visible', 'business.stream.first_visible')
+    latency_lines = [
+        f"• {stage}: p50 {latencies[stage]['p50_ms']:,.0f} ms, p95 {latencies[stage]['p95_ms']:,.0f} ms "
+        f"({latencies[stage]['count']:,} ta)"
+        for stage in latency_stages if stage in latencies
+    ]
+    latency_lines += [
+        f"• {variant}: {stats['count']:,} ta, p50 {stats['p50_ms']:,.0f} ms, "
+        f"{stats['tokens_per_message']:,.0f} token/xabar, ${stats['cost_usd_per_message']:.4f}/xabar"
+        for variant, stats in ab_report('voice_pipeline').items()
+    ]
+    
     text = (
         "👨‍💻 Admin statistika\n\n"
         f"Jami foydalanuvchilar: {total_users:,}\n"
@@ -660,13 +709,94 @@ async def admin_stats_callback(callback_query: CallbackQuery):
         f"Jami tranzaksiyalar: {total_tx:,} ta\n\n"
         f"🤖 Open AI API balansi: {openai_balance}"
     )
+    # Texnik metrikalar alohida xabar(lar)da - rasm izohi 1024 belgidan oshmasin
+    metrics_text = (
+        "⚙️ Texnik metrikalar\n\n"
+        f"🗄 Kesh: hit {cache['hit_ratio']:.0%} "
+        f"(profil {cache['user']['hit_ratio']:.0%}, tarif {cache['tariff']['hit_ratio']:.0%}), "
+        f"tejalgan so'rovlar: {cache['queries_saved']:,} "
+        f"({cache['queries_saved_per_message']:.1f} ta/xabar)\n"
+        f"🧾 Ajratish keshi: hit {extraction['hit_ratio']:.0%} "
+        f"({extraction['hits']:,} ta, umumiy {extraction['shared_hits']:,}), "
+        f"tejalgan LLM xarajati: ~{extraction['llm_cost_saved']:,.0f} so'm "
+        f"({extraction['llm_cost_per_extraction']:,.1f} so'm/ajratish, {extraction['llm_extractions']:,} ta o'lchangan)\n"
+        f"📊 AI kontekst: p50 {context_latency.get('p50_ms', 0):,.0f} ms, "
+        f"p95 {context_latency.get('p95_ms', 0):,.0f} ms, snapshot hit {context['hit_ratio']:.0%} "
+        f"({context['incremental_updates']:,} joyida yangilangan, {context['builds']:,} qayta qurilgan)"
+        + ("\n\n🎙 Ovozli xabar bosqichlari:\n" + "\n".join(latency_lines) if latency_lines else "")
+    )
+    # Metrika nomlaridagi "_" Markdown'da ochiq qolgan belgi sifatida rad etiladi - oddiy matn
+    try:
+        await callback_query.message.edit_caption(caption=fit_message(text, MAX_CAPTION_LENGTH)[0])
+    except Exception:
+        await callback_query.message.edit_text(text)
+    for chunk in fit_message(metrics_text):
+        await callback_query.message.answer(chunk)
+    await callback_query.answer()
+
+async def format_llm_costs(month_year: str, user_id: int = None) -> str:
+    """LLM xarajatlari hisoboti: vazifa/model va top foydalanuvchilar yoki bitta foydalanuvchi"""
+    if user_id:
+        rows = await db.get_user_llm_usage(user_id, month_year)
+        pro = await db.get_or_create_pro_usage(user_id, month_year)
+        lines = [
+            f"• {r['task']} / {r['model']}: {int(r['calls']):,} ta, "
+            f"{int(r['prompt_tokens']):,}+{int(r['completion_tokens']):,} token, {float(r['cost_uzs']):,.1f} so'm"
+            for r in rows
+        ]
+        return (
+            f"💸 {user_id} - LLM xarajatlari ({month_year})\n\n"
+            + ("\n".join(lines) or "Ma'lumot yo'q") + "\n\n"
+            f"Pro hisobi: {pro['total_cost']:,.1f} / {PRO_MONTHLY_COST_LIMIT:,} so'm "
+            f"(matn {pro['text_count']:,}, ovoz {pro['voice_count']:,})"
+        )
+    by_task, top_users = await asyncio.gather(
+        db.get_llm_usage_by_task(month_year),
+        db.get_llm_top_users(month_year),
+    )
+    total = sum(float(r['cost_uzs']) for r in by_task)
+    calls = sum(int(r['calls']) for r in by_task)
+    task_lines = [
+        f"• {r['task']} / {r['model']}: {int(r['calls']):,} ta, {float(r['cost_uzs']):,.0f} so'm "
+        f"({float(r['cost_uzs']) / max(int(r['calls']), 1):,.2f} so'm/so'rov, {int(r['users']):,} foydalanuvchi)"
+        for r in by_task
+    ]
+    user_lines = [
+        f"• {r['user_id']} ({r.get('first_name') or '-'}, {r.get('tariff') or '-'}): "
+        f"{float(r['cost_uzs']):,.0f} so'm, {int(r['calls']):,} ta"
+        + (f", Pro hisobi {float(r['pro_total_cost']):,.0f} so'm" if r.get('pro_total_cost') is not None else "")
+        for r in top_users
+    ]
+    return (
+        f"💸 LLM xarajatlari ({month_year})\n"
+        f"Jami: {total:,.0f} so'm, {calls:,} ta so'rov (1 USD = {USD_TO_UZS:,.0f} so'm)\n\n"
+        "Vazifa / model bo'yicha:\n" + ("\n".join(task_lines) or "Ma'lumot yo'q") + "\n\n"
+        "Eng ko'p sarflagan foydalanuvchilar:\n" + ("\n".join(user_lines) or "Ma'lumot yo'q") + "\n\n"
+        "Foydalanuvchi bo'yicha: /llm_costs <user_id>"
+    )
+
+@callbacks.exact("admin_llm_costs")
+async def admin_llm_costs_callback(callback_query: CallbackQuery):
+    if callback_query.from_user.id != ADMIN_USER_ID:
+        await callback_query.answer()
+        return
+    text = await format_llm_costs(datetime.now().strftime('%Y-%m'))
+    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Orqaga", callback_data="admin_back")]])
     try:
-        await callback_query.message.edit_caption(caption=text, parse_mode='Markdown')
+        await callback_query.message.edit_caption(caption=text[:1024], reply_markup=kb)
     except Exception:
-        await callback_query.message.edit_text(text, parse_mode='Markdown')
+        await callback_query.message.edit_text(text, reply_markup=kb)
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == "admin_broadcast")
+@messages.command("llm_costs")
+async def llm_costs_command(message: Message):
+    if message.from_user.id != ADMIN_USER_ID:
+        return
+    args = (message.text or "").split()[1:]
+    user_id = int(args[0]) if args and args[0].isdigit() else None
+    await message.answer(await format_llm_costs(datetime.now().strftime('%Y-%m'), user_id))
+
+@callbacks.exact("admin_broadcast")
 async def admin_broadcast_callback(callback_query: CallbackQuery, state: FSMContext):
     if callback_query.from_user.id != ADMIN_USER_ID:
         await callback_query.answer()
@@ -684,7 +814,7 @@ async def admin_broadcast_callback(callback_query: CallbackQuery, state: FSMCont
     await state.set_state(UserStates.admin_broadcast_audience)
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data in {"admin_bc_all","admin_bc_by_tariff"}, UserStates.admin_broadcast_audience)
+@callbacks.exact("admin_bc_all", "admin_bc_by_tariff", state=UserStates.admin_broadcast_audience)
 async def admin_broadcast_audience_selected(callback_query: CallbackQuery, state: FSMContext):
     if callback_query.from_user.id != ADMIN_USER_ID:
         await callback_query.answer()
@@ -705,7 +835,7 @@ async def admin_broadcast_audience_selected(callback_query: CallbackQuery, state
         await state.set_state(UserStates.admin_broadcast_text)
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("admin_bc_tariff_"), UserStates.admin_broadcast_audience)
+@callbacks.prefix("admin_bc_tariff_", state=UserStates.admin_broadcast_audience)
 async def admin_broadcast_choose_tariff(callback_query: CallbackQuery, state: FSMContext):
     if callback_query.from_user.id != ADMIN_USER_ID:
         await callback_query.answer()
@@ -719,7 +849,7 @@ async def admin_broadcast_choose_tariff(callback_query: CallbackQuery, state: FS
     await state.set_state(UserStates.admin_broadcast_text)
     await callback_query.answer()
 
-@dp.message(UserStates.admin_broadcast_text)
+@messages.any(state=UserStates.admin_broadcast_text)
 async def admin_broadcast_text_handler(message: Message, state: FSMContext):
     if message.from_user.id != ADMIN_USER_ID:
         return
@@ -727,23 +857,37 @@ async def admin_broadcast_text_handler(message: Message, state: FSMContext):
     choice = data.get('bc_choice')
     tariff = data.get('bc_tariff')
     text = message.text
-    if choice == 'admin_bc_all':
-        rows = await db.fetch_all("SELECT user_id FROM users")
-    else:
-        rows = await db.fetch_all("SELECT user_id FROM users WHERE tariff=%s", (tariff,))
-    user_ids = [r['user_id'] if isinstance(r, dict) else r[0] for r in rows]
-    sent = 0
-    for uid in user_ids:
+    broadcast_id = await broadcasts.create(
+        text, tariff=None if choice == 'admin_bc_all' else tariff, created_by=message.from_user.id
+    )
+    progress = await broadcasts.progress(broadcast_id)
+    status_msg = await message.answer(
+        f"📤 Broadcast #{broadcast_id} boshlandi: {progress.get('total', 0):,} ta foydalanuvchi"
+    )
+    await state.clear()
+    asyncio.create_task(run_admin_broadcast(broadcast_id, status_msg))
+
+async def run_admin_broadcast(broadcast_id: int, status_msg: Message):
+    """Broadcast'ni fonda yuborish va admin xabarida jarayonni yangilab borish"""
+    async def on_progress(progress: dict):
         try:
-            await bot.send_message(chat_id=uid, text=text)
-            sent += 1
+            await status_msg.edit_text(
+                f"📤 Broadcast #{broadcast_id}: {progress['sent'] + progress['failed']:,}/{progress['total']:,} "
+                f"(yuborildi {progress['sent']:,}, xato {progress['failed']:,})"
+            )
         except Exception:
             pass
-    await message.answer(f"Yuborildi: {sent} ta foydalanuvchiga")
-    await state.clear()
+    try:
+        progress = await broadcasts.run(broadcast_id, on_progress)
+        await status_msg.answer(
+            f"✅ Broadcast #{broadcast_id} tugadi. Yuborildi: {progress.get('sent', 0):,} ta foydalanuvchiga, "
+            f"xato/bloklagan: {progress.get('failed', 0):,}"
+        )
+    except Exception as e:
+        logging.error(f"Broadcast #{broadcast_id} xatolik: {e}")
 
 # Speech Model boshqarish
-@dp.callback_query(lambda c: c.data == "admin_speech_models")
+@callbacks.exact("admin_speech_models")
 async def admin_speech_models_callback(callback_query: CallbackQuery):
     if callback_query.from_user.id != ADMIN_USER_ID:
         await callback_query.answer()
@@ -792,7 +936,7 @@ Quyidagi tugmalardan foydalaning:"""
         pass
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == "admin_toggle_google")
+@callbacks.exact("admin_toggle_google")
 async def admin_toggle_google_callback(callback_query: CallbackQuery):
     if callback_query.from_user.id != ADMIN_USER_ID:
         await callback_query.answer()
@@ -818,7 +962,7 @@ async def admin_toggle_google_callback(callback_query: CallbackQuery):
     )
     await admin_speech_models_callback(callback_query)
 
-@dp.callback_query(lambda c: c.data == "admin_toggle_elevenlabs")
+@callbacks.exact("admin_toggle_elevenlabs")
 async def admin_toggle_elevenlabs_callback(callback_query: CallbackQuery):
     if callback_query.from_user.id != ADMIN_USER_ID:
         await callback_query.answer()
@@ -845,7 +989,7 @@ async def admin_toggle_elevenlabs_callback(callback_query: CallbackQuery):
     await admin_speech_models_callback(callback_query)
 
 
-@dp.callback_query(lambda c: c.data == "admin_back")
+@callbacks.exact("admin_back")
 async def admin_back_callback(callback_query: CallbackQuery):
     if callback_query.from_user.id != ADMIN_USER_ID:
         await callback_query.answer()
@@ -855,6 +999,7 @@ async def admin_back_callback(callback_query: CallbackQuery):
     kb = InlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text="📊 Statistika", callback_data="admin_stats")],
+            [InlineKeyboardButton(text="💸 LLM xarajatlari", callback_data="admin_llm_costs")],
             [InlineKeyboardButton(text="📨 Xabar yuborish", callback_data="admin_broadcast")],
             [InlineKeyboardButton(text="🎤 Speech Model Boshqarish", callback_data="admin_speech_models")],
             [InlineKeyboardButton(text="🆓 3 kunlik Sinov Boshqarish", callback_data="admin_free_trial")]
@@ -865,7 +1010,7 @@ async def admin_back_callback(callback_query: CallbackQuery):
     await callback_query.answer()
 
 # Bepul sinov boshqarish (3 kunlik)
-@dp.callback_query(lambda c: c.data == "admin_free_trial")
+@callbacks.exact("admin_free_trial")
 async def admin_free_trial_callback(callback_query: CallbackQuery):
     if callback_query.from_user.id != ADMIN_USER_ID:
         await callback_query.answer()
@@ -910,7 +1055,7 @@ async def admin_free_trial_callback(callback_query: CallbackQuery):
     await callback_query.answer()
 
 # 3 kunlik sinov toggle
-@dp.callback_query(lambda c: c.data.startswith("admin_toggle_trial_"))
+@callbacks.prefix("admin_toggle_trial_")
 async def admin_toggle_trial_callback(callback_query: CallbackQuery):
     if callback_query.from_user.id != ADMIN_USER_ID:
         await callback_query.answer()
@@ -928,7 +1073,7 @@ async def admin_toggle_trial_callback(callback_query: CallbackQuery):
     await admin_free_trial_callback(callback_query)
 
 # Barcha sinovlarni yoqish
-@dp.callback_query(lambda c: c.data == "admin_enable_all_trials")
+@callbacks.exact("admin_enable_all_trials")
 async def admin_enable_all_trials_callback(callback_query: CallbackQuery):
     if callback_query.from_user.id != ADMIN_USER_ID:
         await callback_query.answer()
@@ -945,7 +1090,7 @@ async def admin_enable_all_trials_callback(callback_query: CallbackQuery):
     await admin_free_trial_callback(callback_query)
 
 # Barcha sinovlarni o'chirish
-@dp.callback_query(lambda c: c.data == "admin_disable_all_trials")
+@callbacks.exact("admin_disable_all_trials")
 async def admin_disable_all_trials_callback(callback_query: CallbackQuery):
     if callback_query.from_user.id != ADMIN_USER_ID:
         await callback_query.answer()
@@ -1154,7 +1299,7 @@ async def get_user_name(user_id: int) -> str:
         return "Xojayin"
 
 # Start komandasi
-@dp.message(Command("start"))
+@messages.command("start")
 async def start_command(message: types.Message, state: FSMContext):
     """Start komandasi"""
     user_id = message.from_user.id
@@ -1180,6 +1325,7 @@ async def start_command(message: types.Message, state: FSMContext):
                 "INSERT INTO users (user_id, username, first_name, tariff) VALUES (%s, %s, %s, 'NONE') ON DUPLICATE KEY UPDATE username = %s, first_name = %s",
                 (user_id, username, first_name, username, first_name)
             )
+            db.invalidate_user_cache(user_id)
     except Exception as e:
         logging.error(f"Foydalanuvchi qo'shishda xatolik: {e}")
     
@@ -1397,7 +1543,7 @@ def get_personal_tariff_menu():
     return keyboard
 
 # Telefon raqam qabul qilish
-@dp.message(lambda message: message.contact, UserStates.waiting_for_phone)
+@messages.any(lambda message: message.contact, state=UserStates.waiting_for_phone)
 async def process_phone(message: types.Message, state: FSMContext):
     """Telefon raqamni qabul qilish"""
     user_id = message.from_user.id
@@ -1408,6 +1554,7 @@ async def process_phone(message: types.Message, state: FSMContext):
         "UPDATE users SET phone = %s WHERE user_id = %s",
         (phone, user_id)
     )
+    db.invalidate_user_cache(user_id)
     
     # Eski xabarlarni o'chirish
     try:
@@ -1440,7 +1587,7 @@ async def process_phone(message: types.Message, state: FSMContext):
     await state.set_state(None)
 
 # waiting_for_phone state uchun universal handler - contact bo'lmagan xabarlar uchun
-@dp.message(UserStates.waiting_for_phone)
+@messages.any(state=UserStates.waiting_for_phone)
 async def handle_waiting_for_phone_message(message: types.Message, state: FSMContext):
     """Telefon raqam so'rash - har qanday xabar yozilsa yana telefon raqam so'rash xabari yuboriladi"""
     user_id = message.from_user.id
@@ -1492,7 +1639,7 @@ async def handle_waiting_for_phone_message(message: types.Message, state: FSMCon
     )
 
 # Ism qabul qilish
-@dp.message(UserStates.waiting_for_name)
+@messages.any(state=UserStates.waiting_for_name)
 async def process_name(message: types.Message, state: FSMContext):
     """Ismni qabul qilish"""
     user_id = message.from_user.id
@@ -1505,6 +1652,7 @@ async def process_name(message: types.Message, state: FSMContext):
             "UPDATE users SET name = %s WHERE user_id = %s",
             (name, user_id)
         )
+        db.invalidate_user_cache(user_id)
         
         # Eski xabarlarni o'chirish
         try:
@@ -1544,6 +1692,7 @@ async def process_name(message: types.Message, state: FSMContext):
         "UPDATE users SET name = %s WHERE user_id = %s",
         (name, user_id)
     )
+    db.invalidate_user_cache(user_id)
     
     # Eski xabarlarni o'chirish
     try:
@@ -1564,7 +1713,7 @@ async def process_name(message: types.Message, state: FSMContext):
     await state.set_state(UserStates.waiting_for_source)
 
 # Tur tanlash handlerlari
-@dp.callback_query(lambda c: c.data.startswith("account_type_"))
+@callbacks.prefix("account_type_")
 async def process_account_type(callback_query: CallbackQuery, state: FSMContext):
     """Hisob turini qabul qilish"""
     user_id = callback_query.from_user.id
@@ -1672,7 +1821,7 @@ async def process_account_type(callback_query: CallbackQuery, state: FSMContext)
     await callback_query.answer()
 
 # Plus/Pro/Business tarif bepul sinov aktivlashtirish - TO'LIQ QAYTA YOZILGAN
-@dp.callback_query(lambda c: c.data.startswith("trial_tariff_"))
+@callbacks.prefix("trial_tariff_")
 async def process_trial_tariff(callback_query: CallbackQuery, state: FSMContext):
     """Plus, Pro yoki Business tarifni 3 kunlik bepul sinov bilan aktivlashtirish"""
     user_id = callback_query.from_user.id
@@ -1794,6 +1943,8 @@ async def process_trial_tariff(callback_query: CallbackQuery, state: FSMContext)
         if not plus_package_created:
             logging.error(f"PLUS paket yaratish BUTUNLAY MUVAFFAQIYATSIZ user_id={user_id}")
     
+    db.invalidate_user_cache(user_id)
+    
     # Xabar yuborish
     try:
         await callback_query.message.delete()
@@ -1837,7 +1988,7 @@ async def process_trial_tariff(callback_query: CallbackQuery, state: FSMContext)
     await state.set_state(UserStates.onboarding_balance)
 
 # Boshlash tugmasini bosish
-@dp.callback_query(lambda c: c.data == "start_onboarding")
+@callbacks.exact("start_onboarding")
 async def start_onboarding(callback_query: CallbackQuery, state: FSMContext):
     """Onboarding bosqichi boshlash"""
     try:
@@ -1857,7 +2008,7 @@ async def start_onboarding(callback_query: CallbackQuery, state: FSMContext):
     await state.set_state(UserStates.onboarding_balance)
 
 # Aktivlashtirish tugmalari
-@dp.callback_query(lambda c: c.data.startswith("activate_"))
+@callbacks.prefix("activate_")
 async def activate_account_type(callback_query: CallbackQuery):
     """Aktivlashtirish tugmasi bosilganda"""
     account_type = callback_query.data.split("_")[1]  # oila yoki biznes
@@ -1869,7 +2020,7 @@ async def activate_account_type(callback_query: CallbackQuery):
     )
 
 # Orqaga tugmasi
-@dp.callback_query(lambda c: c.data == "back_to_account_type")
+@callbacks.exact("back_to_account_type")
 async def back_to_account_type(callback_query: CallbackQuery, state: FSMContext):
     """Hisob turi tanlash sahifasiga qaytish"""
     await callback_query.message.delete()
@@ -1886,7 +2037,7 @@ async def back_to_account_type(callback_query: CallbackQuery, state: FSMContext)
     await state.set_state(UserStates.waiting_for_account_type)
 
 # Onboarding: 1-qadam — naqd balans
-@dp.message(UserStates.waiting_for_initial_cash)
+@messages.any(state=UserStates.waiting_for_initial_cash)
 async def onboarding_initial_cash(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     txt = message.text.replace(' ', '').replace(',', '').replace("'", '')
@@ -1920,7 +2071,7 @@ async def onboarding_initial_cash(message: types.Message, state: FSMContext):
         pass
 
 # Onboarding: 2-qadam — karta balans
-@dp.message(UserStates.waiting_for_initial_card)
+@messages.any(state=UserStates.waiting_for_initial_card)
 async def onboarding_initial_card(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     txt = message.text.replace(' ', '').replace(',', '').replace("'", '')
@@ -1974,7 +2125,7 @@ async def onboarding_initial_card(message: types.Message, state: FSMContext):
     await state.set_state(UserStates.onboarding_waiting_for_debt_action)
 
 # Onboarding: qarzlar menyusi tugmalari
-@dp.message(lambda m: m.text in ["➕ Qarzni qo'shish", "✅ Tayyor"], UserStates.onboarding_waiting_for_debt_action)
+@messages.exact("➕ Qarzni qo'shish", "✅ Tayyor", state=UserStates.onboarding_waiting_for_debt_action)
 async def onboarding_debt_action(message: types.Message, state: FSMContext):
     if message.text == "✅ Tayyor":
         data = await state.get_data()
@@ -1983,6 +2134,7 @@ async def onboarding_debt_action(message: types.Message, state: FSMContext):
 
         # Tanlangan tarifni aktiv qilish
         await db.execute_query("UPDATE users SET tariff = %s WHERE user_id = %s", (tariff, user_id))
+        db.invalidate_user_cache(user_id)
 
         # Yakuniy menyu
         user_name = await get_user_name(user_id)
@@ -2013,7 +2165,7 @@ async def onboarding_debt_action(message: types.Message, state: FSMContext):
 
 
 # Ism qabul qilish
-@dp.message(UserStates.waiting_for_name)
+@messages.any(state=UserStates.waiting_for_name)
 async def process_name(message: types.Message, state: FSMContext):
     """Ismni qabul qilish"""
     user_id = message.from_user.id
@@ -2037,6 +2189,7 @@ async def process_name(message: types.Message, state: FSMContext):
         "UPDATE users SET name = %s WHERE user_id = %s",
         (name, user_id)
     )
+    db.invalidate_user_cache(user_id)
     
     # Avval reply keyboardni olib tashlaymiz (minimal xabar bilan)
     _greet = await message.answer("Tanishganimdan Xursandman 🙂", reply_markup=ReplyKeyboardRemove())
@@ -2069,7 +2222,7 @@ async def process_name(message: types.Message, state: FSMContext):
 
 # Manba tanlash
 # So'rov noma qabul qilish - faqat callback
-@dp.callback_query(lambda c: c.data.startswith("source_"), UserStates.waiting_for_source)
+@callbacks.prefix("source_", state=UserStates.waiting_for_source)
 async def process_source(callback_query: CallbackQuery, state: FSMContext):
     """Manbani qabul qilish"""
     user_id = callback_query.from_user.id
@@ -2080,6 +2233,7 @@ async def process_source(callback_query: CallbackQuery, state: FSMContext):
         "UPDATE users SET source = %s WHERE user_id = %s",
         (source, user_id)
     )
+    db.invalidate_user_cache(user_id)
     
     # Xabarni o'chirish va yangi xabar yuborish
     try:
@@ -2101,7 +2255,7 @@ async def process_source(callback_query: CallbackQuery, state: FSMContext):
     await state.set_state(UserStates.waiting_for_account_type)
 
 # Help komandasi
-@dp.message(Command("help"))
+@messages.command("help")
 async def help_command(message: types.Message):
     """Yordam komandasi"""
     help_text = get_help_text()
@@ -2148,7 +2302,7 @@ Tabiiy til bilan yozing yoki gapiring. AI tushunadi va saqlaydi!
 # /balance va /balans buyruqlari olib tashlandi - endi 📊 Hisobotlar tugmasi orqali ko'rish mumkin
 
 # Bepul tarif - Kirim qo'shish
-@dp.message(lambda message: message.text == "➕ Kirim")
+@messages.exact("➕ Kirim")
 async def add_income(message: types.Message, state: FSMContext):
     """Kirim qo'shish"""
     user_tariff = await get_user_tariff(message.from_user.id)
@@ -2165,7 +2319,7 @@ async def add_income(message: types.Message, state: FSMContext):
     await state.update_data(transaction_type="income")
 
 # Bepul tarif - Chiqim qo'shish
-@dp.message(lambda message: message.text == "➖ Chiqim")
+@messages.exact("➖ Chiqim")
 async def add_expense(message: types.Message, state: FSMContext):
     """Chiqim qo'shish"""
     user_tariff = await get_user_tariff(message.from_user.id)
@@ -2191,7 +2345,7 @@ async def add_expense(message: types.Message, state: FSMContext):
 # Qarz ko'rish funksiyalari - o'chirildi
 
 # Qarz turini qabul qilish
-@dp.callback_query(UserStates.waiting_for_debt_type, lambda c: c.data.startswith("debt_type_"))
+@callbacks.prefix("debt_type_", state=UserStates.waiting_for_debt_type)
 async def process_debt_type(callback_query: CallbackQuery, state: FSMContext):
     """Qarz turini qabul qilish"""
     debt_type = callback_query.data.replace("debt_type_", "")
@@ -2236,7 +2390,7 @@ async def process_debt_type(callback_query: CallbackQuery, state: FSMContext):
     await callback_query.answer()
 
 # Qarz olgan odamni ismini qabul qilish
-@dp.message(UserStates.waiting_for_debt_person)
+@messages.any(state=UserStates.waiting_for_debt_person)
 async def process_debt_person(message: types.Message, state: FSMContext):
     """Qarz olgan odamni ismini qabul qilish"""
     debt_person = message.text.strip()
@@ -2258,7 +2412,7 @@ async def process_debt_person(message: types.Message, state: FSMContext):
     await state.set_state(UserStates.waiting_for_amount)
 
 # Qarz ismni tahrirlash
-@dp.message(UserStates.waiting_for_debt_edit_name)
+@messages.any(state=UserStates.waiting_for_debt_edit_name)
 async def process_debt_edit_name(message: types.Message, state: FSMContext):
     """Qarz ismini tahrirlash"""
     user_id = message.from_user.id
@@ -2294,7 +2448,7 @@ async def process_debt_edit_name(message: types.Message, state: FSMContext):
         await state.clear()
 
 # Summa tahrirlash
-@dp.message(UserStates.waiting_for_trans_edit_amount)
+@messages.any(state=UserStates.waiting_for_trans_edit_amount)
 async def process_trans_edit_amount(message: types.Message, state: FSMContext):
     """Tranzaksiya summasini tahrirlash"""
     user_id = message.from_user.id
@@ -2312,11 +2466,8 @@ async def process_trans_edit_amount(message: types.Message, state: FSMContext):
             await state.clear()
             return
         
-        # Database da UPDATE qilish
-        await db.execute_query(
-            "UPDATE transactions SET amount = %s WHERE id = %s AND user_id = %s",
-            (amount, trans_id, user_id)
-        )
+        # Database da UPDATE qilish (yig'ma balans bilan birga)
+        await db.update_transaction_amount(trans_id, user_id, amount)
         
         await message.answer(
             f"✅ **Summa yangilandi!**\n\nYangi summa: {amount:,.0f} so'm",
@@ -2331,7 +2482,7 @@ async def process_trans_edit_amount(message: types.Message, state: FSMContext):
         await message.answer("❌ Noto'g'ri summa format! Iltimos, raqam kiriting.")
 
 # Izoh tahrirlash
-@dp.message(UserStates.waiting_for_trans_edit_description)
+@messages.any(state=UserStates.waiting_for_trans_edit_description)
 async def process_trans_edit_description(message: types.Message, state: FSMContext):
     """Tranzaksiya izohini tahrirlash"""
     user_id = message.from_user.id
@@ -2350,6 +2501,7 @@ async def process_trans_edit_description(message: types.Message, state: FSMConte
         "UPDATE transactions SET description = %s WHERE id = %s AND user_id = %s",
         (description, trans_id, user_id)
     )
+    db.notify_financial_change(user_id)
     
     await message.answer(
         f"✅ **Izoh yangilandi!**\n\nYangi izoh: {description}",
@@ -2361,7 +2513,7 @@ async def process_trans_edit_description(message: types.Message, state: FSMConte
     await state.clear()
 
 # Qarz qaytarish sanasini tahrirlash
-@dp.message(UserStates.waiting_for_debt_edit_date)
+@messages.any(state=UserStates.waiting_for_debt_edit_date)
 async def process_debt_edit_date(message: types.Message, state: FSMContext):
     """Qarz qaytarish sanasini tahrirlash"""
     user_id = message.from_user.id
@@ -2403,7 +2555,7 @@ async def process_debt_edit_date(message: types.Message, state: FSMContext):
         await state.clear()
 
 # Bekor qilish funksiyasi
-@dp.message(lambda message: message.text == "❌ Bekor qilish")
+@messages.exact("❌ Bekor qilish")
 async def cancel_operation(message: types.Message, state: FSMContext):
     """Amalni bekor qilish"""
     user_tariff = await get_user_tariff(message.from_user.id)
@@ -2427,7 +2579,7 @@ async def cancel_operation(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Summa qabul qilish
-@dp.message(UserStates.waiting_for_amount)
+@messages.any(state=UserStates.waiting_for_amount)
 async def process_amount(message: types.Message, state: FSMContext):
     """Summani qabul qilish"""
     try:
@@ -2518,7 +2670,7 @@ async def process_amount(message: types.Message, state: FSMContext):
 
 # Tavsif funksiyasi olib tashlandi - endi to'g'ridan-to'g'ri kategoriya so'raladi
 
-@dp.message(UserStates.waiting_for_debt_due_date)
+@messages.any(state=UserStates.waiting_for_debt_due_date)
 async def process_debt_due_date(message: types.Message, state: FSMContext):
     text = message.text.strip()
     due_date = None
@@ -2539,7 +2691,7 @@ async def process_debt_due_date(message: types.Message, state: FSMContext):
     await state.set_state(UserStates.waiting_for_category)
 
 # Kategoriya tanlash
-@dp.callback_query(lambda c: c.data.startswith("cat_"), UserStates.waiting_for_category)
+@callbacks.prefix("cat_", state=UserStates.waiting_for_category)
 async def process_category(callback_query: CallbackQuery, state: FSMContext):
     """Kategoriyani qabul qilish"""
     user_id = callback_query.from_user.id
@@ -2589,38 +2741,38 @@ async def process_category(callback_query: CallbackQuery, state: FSMContext):
                     return
 
             # Qarz berish qaydini saqlaymiz (valyuta bilan)
-            insert_id = await db.execute_insert(
-                "INSERT INTO transactions (user_id, transaction_type, amount, category, currency, description, due_date, debt_direction) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
-                (user_id, transaction_type, amount, category, currency, description, due_date, debt_direction)
+            insert_id = await db.insert_transaction(
+                user_id, transaction_type, amount, category, currency=currency,
+                description=description, debt_direction=debt_direction, due_date=due_date
             )
 
             # Onboarding tugagan bo'lsa, balansdan chiqim yozamiz (valyuta bilan)
             if not is_onboarding:
-                await db.execute_query(
-                    "INSERT INTO transactions (user_id, transaction_type, amount, category, currency, description) VALUES (%s, %s, %s, %s, %s, %s)",
-                    (user_id, 'expense', amount, f"Qarz berish: {category}", currency, f"Qarz berish - {description}")
+                await db.insert_transaction(
+                    user_id, 'expense', amount, f"Qarz berish: {category}", currency=currency,
+                    description=f"Qarz berish - {description}"
                 )
 
         # Qarz olish (borrowed): balansga kirim yozish faqat onboarding tugaganidan keyin
         elif transaction_type == 'debt' and debt_type == 'borrowed':
             # Qarz olish qaydini saqlaymiz (valyuta bilan)
-            insert_id = await db.execute_insert(
-                "INSERT INTO transactions (user_id, transaction_type, amount, category, currency, description, due_date, debt_direction) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
-                (user_id, transaction_type, amount, category, currency, description, due_date, debt_direction)
+            insert_id = await db.insert_transaction(
+                user_id, transaction_type, amount, category, currency=currency,
+                description=description, debt_direction=debt_direction, due_date=due_date
             )
 
             # Onboarding tugagan bo'lsa, balansga kirim yozamiz (valyuta bilan)
             if not is_onboarding:
-                await db.execute_query(
-                    "INSERT INTO transactions (user_id, transaction_type, amount, category, currency, description) VALUES (%s, %s, %s, %s, %s, %s)",
-                    (user_id, 'income', amount, f"Qarz olish: {category}", currency, f"Qarz olish - {description}")
+                await db.insert_transaction(
+                    user_id, 'income', amount, f"Qarz olish: {category}", currency=currency,
+                    description=f"Qarz olish - {description}"
                 )
 
         else:
             # Oddiy tranzaksiya (kirim, chiqim) - valyuta bilan
-            insert_id = await db.execute_insert(
-                "INSERT INTO transactions (user_id, transaction_type, amount, category, currency, description, due_date, debt_direction) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
-                (user_id, transaction_type, amount, category, currency, description, due_date, debt_direction)
+            insert_id = await db.insert_transaction(
+                user_id, transaction_type, amount, category, currency=currency,
+                description=description, debt_direction=debt_direction, due_date=due_date
             )
         
         type_emoji = {"income": "📈", "expense": "📉", "debt": "💳"}.get(transaction_type, "❓")
@@ -2719,7 +2871,7 @@ async def process_category(callback_query: CallbackQuery, state: FSMContext):
         await state.clear()
 
 # Hisobotlar menyusi
-@dp.message(lambda message: message.text == "📊 Hisobotlar")
+@messages.exact("📊 Hisobotlar")
 async def reports_menu(message: types.Message, state: FSMContext):
     """Hisobotlar menyusi - tushunarli va qulay ko'rsatish"""
     user_id = message.from_user.id
@@ -2885,7 +3037,7 @@ async def reports_menu(message: types.Message, state: FSMContext):
     )
 
 # Valyuta kurslari callback
-@dp.callback_query(lambda c: c.data == "currency_rates")
+@callbacks.exact("currency_rates")
 async def currency_rates_callback(callback_query: CallbackQuery):
     """Valyuta kurslarini ko'rsatish"""
     try:
@@ -2918,7 +3070,7 @@ async def currency_rates_callback(callback_query: CallbackQuery):
         logging.error(f"Currency rates error: {e}")
         await callback_query.answer("Xatolik yuz berdi", show_alert=True)
 
-@dp.callback_query(lambda c: c.data == "back_to_reports")
+@callbacks.exact("back_to_reports")
 async def back_to_reports_callback(callback_query: CallbackQuery):
     """Hisobotlarga qaytish"""
     try:
@@ -2987,7 +3139,7 @@ async def back_to_reports_callback(callback_query: CallbackQuery):
         await callback_query.answer("Xatolik yuz berdi", show_alert=True)
 
 # Profil menyusi
-@dp.message(lambda message: message.text == "👤 Profil")
+@messages.exact("👤 Profil")
 async def profile_handler(message: Message, state: FSMContext):
     """Profil menyusini ko'rsatish"""
     user_id = message.from_user.id
@@ -3065,8 +3217,8 @@ async def profile_handler(message: Message, state: FSMContext):
             monthly_row = await db.execute_one(
                 """SELECT COUNT(*) as count FROM transactions 
                    WHERE user_id = %s 
-                   AND MONTH(created_at) = MONTH(NOW())
-                   AND YEAR(created_at) = YEAR(NOW())""",
+                   AND created_at >= DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY)
+                   AND created_at < DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY) + INTERVAL 1 MONTH""",
                 (user_id,)
             )
             monthly_count = monthly_row.get('count', 0) if monthly_row else 0
@@ -3087,8 +3239,8 @@ async def profile_handler(message: Message, state: FSMContext):
                 SELECT COUNT(*) as count
                 FROM transactions 
                 WHERE user_id = %s 
-                AND MONTH(created_at) = MONTH(NOW())
-                AND YEAR(created_at) = YEAR(NOW())
+                AND created_at >= DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY)
+                AND created_at < DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY) + INTERVAL 1 MONTH
                 """,
                 (user_id,)
             )
@@ -3099,8 +3251,8 @@ async def profile_handler(message: Message, state: FSMContext):
                 SELECT COUNT(*) as count
                 FROM transactions 
                 WHERE user_id = %s 
-                AND MONTH(created_at) = MONTH(NOW())
-                AND YEAR(created_at) = YEAR(NOW())
+                AND created_at >= DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY)
+                AND created_at < DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY) + INTERVAL 1 MONTH
                 AND description LIKE '%voice%'
                 """,
                 (user_id,)
@@ -3148,7 +3300,7 @@ async def profile_handler(message: Message, state: FSMContext):
         await message.answer(profile_text, reply_markup=profile_kb)
 
 # Profil callback handlerlari
-@dp.callback_query(lambda c: c.data == "settings")
+@callbacks.exact("settings")
 async def settings_callback(callback_query: CallbackQuery):
     """Sozlamalar menyusini ko'rsatish"""
     text = "🚧 <b>Tez orada</b>"
@@ -3162,7 +3314,7 @@ async def settings_callback(callback_query: CallbackQuery):
         await callback_query.message.edit_text(text, reply_markup=keyboard, parse_mode='HTML')
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == "settings_language")
+@callbacks.exact("settings_language")
 async def settings_language_callback(callback_query: CallbackQuery):
     """Til tanlash menyusini ko'rsatish"""
     # Til tanlash - bitta tugma orqali, qulay va sodda
@@ -3180,7 +3332,7 @@ async def settings_language_callback(callback_query: CallbackQuery):
         await callback_query.message.edit_text(text, reply_markup=keyboard, parse_mode='Markdown')
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == "help_menu")
+@callbacks.exact("help_menu")
 async def help_menu_callback(callback_query: CallbackQuery):
     """Yordam sahifasini ko'rsatish"""
     help_text = get_help_text()
@@ -3193,7 +3345,7 @@ async def help_menu_callback(callback_query: CallbackQuery):
         await callback_query.message.edit_text(help_text, reply_markup=keyboard, parse_mode='HTML')
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == "back_to_profile")
+@callbacks.exact("back_to_profile")
 async def back_to_profile_callback(callback_query: CallbackQuery):
     """Profilga qaytish"""
     user_id = callback_query.from_user.id
@@ -3220,7 +3372,7 @@ async def back_to_profile_callback(callback_query: CallbackQuery):
         await callback_query.message.edit_text(profile_text, reply_markup=keyboard, parse_mode='HTML')
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == "profile_stats")
+@callbacks.exact("profile_stats")
 async def profile_stats_callback(callback_query: CallbackQuery):
     """Foydalanuvchi shaxsiy statistika: jami tranzaksiyalar soni"""
     user_id = callback_query.from_user.id
@@ -3252,7 +3404,7 @@ async def profile_stats_callback(callback_query: CallbackQuery):
         await callback_query.message.edit_text(text, reply_markup=get_profile_menu(user_tariff), parse_mode='Markdown')
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == "start_onboarding")
+@callbacks.exact("start_onboarding")
 async def start_onboarding_callback(callback_query: CallbackQuery, state: FSMContext):
     """Yangi onboarding boshlash"""
     user_id = callback_query.from_user.id
@@ -3296,7 +3448,7 @@ async def start_onboarding_callback(callback_query: CallbackQuery, state: FSMCon
     await callback_query.answer()
 
 # Yangi onboarding handlerlari
-@dp.message(UserStates.onboarding_balance)
+@messages.any(state=UserStates.onboarding_balance)
 async def process_onboarding_balance(message: types.Message, state: FSMContext):
     """Onboarding balans qabul qilish"""
     user_id = message.from_user.id
@@ -3505,7 +3657,7 @@ async def _handle_onboarding_debt_entry(
     await state.set_state(UserStates.onboarding_waiting_for_debt_action)
 
 
-@dp.callback_query(lambda c: c.data == "onboarding_no_debts")
+@callbacks.exact("onboarding_no_debts")
 async def onboarding_no_debts(callback_query: CallbackQuery, state: FSMContext):
     """Qarzlar yo'q - onboarding tugatish"""
     user_id = callback_query.from_user.id
@@ -3521,7 +3673,7 @@ async def onboarding_no_debts(callback_query: CallbackQuery, state: FSMContext):
     await callback_query.answer()
 
 # Qarz bosqichida matnli javoblar uchun fallback
-@dp.message(UserStates.onboarding_waiting_for_debt_action)
+@messages.any(state=UserStates.onboarding_waiting_for_debt_action)
 async def onboarding_debt_action_text(message: types.Message, state: FSMContext):
     """Foydalanuvchi tugma o'rniga matn yuborgan holatlarni ko'rib chiqish"""
     user_id = message.from_user.id
@@ -3550,7 +3702,7 @@ async def onboarding_debt_action_text(message: types.Message, state: FSMContext)
     await _handle_onboarding_debt_entry(message, state, debt_type, text)
 
 # Qarz qo'shishdan keyin keyingi bosqichga o'tish
-@dp.callback_query(lambda c: c.data == "onboarding_move_to_next")
+@callbacks.exact("onboarding_move_to_next")
 async def onboarding_move_to_next(callback_query: CallbackQuery, state: FSMContext):
     """Qarzlar qo'shildi, keyingi bosqich - qarz olganlar"""
     user_id = callback_query.from_user.id
@@ -3578,7 +3730,7 @@ async def onboarding_move_to_next(callback_query: CallbackQuery, state: FSMConte
     )
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == "onboarding_debt_lent")
+@callbacks.exact("onboarding_debt_lent")
 async def onboarding_debt_lent(callback_query: CallbackQuery, state: FSMContext):
     """Qarz bergan - AI bilan qarzlar qo'shish"""
     user_id = callback_query.from_user.id
@@ -3605,7 +3757,7 @@ async def onboarding_debt_lent(callback_query: CallbackQuery, state: FSMContext)
     await callback_query.answer()
 
 # Qarz OLGAN handler
-@dp.callback_query(lambda c: c.data == "onboarding_debt_borrowed")
+@callbacks.exact("onboarding_debt_borrowed")
 async def onboarding_debt_borrowed(callback_query: CallbackQuery, state: FSMContext):
     """Qarz olgan - AI bilan qarzlar qo'shish"""
     user_id = callback_query.from_user.id
@@ -3631,7 +3783,7 @@ async def onboarding_debt_borrowed(callback_query: CallbackQuery, state: FSMCont
     await state.update_data(debt_type='borrowed')
     await callback_query.answer()
 
-@dp.message(UserStates.onboarding_debt_waiting_for_person)
+@messages.any(state=UserStates.onboarding_debt_waiting_for_person)
 async def process_onboarding_debt_person(message: types.Message, state: FSMContext):
     """Onboarding qarz - AI bilan pars qilish"""
     data = await state.get_data()
@@ -3639,7 +3791,7 @@ async def process_onboarding_debt_person(message: types.Message, state: FSMConte
     await _handle_onboarding_debt_entry(message, state, debt_type, message.text or "")
 
 # Onboarding yakunlash
-@dp.callback_query(lambda c: c.data == "onboarding_complete_final")
+@callbacks.exact("onboarding_complete_final")
 async def onboarding_complete_final(callback_query: CallbackQuery, state: FSMContext):
     """Onboarding tugadi - final"""
     user_id = callback_query.from_user.id
@@ -3654,7 +3806,7 @@ async def onboarding_complete_final(callback_query: CallbackQuery, state: FSMCon
     await state.clear()
     await callback_query.answer()
 
-@dp.message(UserStates.onboarding_debt_waiting_for_amount)
+@messages.any(state=UserStates.onboarding_debt_waiting_for_amount)
 async def process_onboarding_debt_amount(message: types.Message, state: FSMContext):
     """Onboarding qarz miqdorini qabul qilish"""
     user_id = message.from_user.id
@@ -3705,7 +3857,7 @@ async def process_onboarding_debt_amount(message: types.Message, state: FSMConte
     await state.update_data(onboarding_debt_amount_msg_id=_msg.message_id)
     await state.set_state(UserStates.onboarding_waiting_for_debt_action)
 
-@dp.callback_query(lambda c: c.data == "back_to_transaction")
+@callbacks.exact("back_to_transaction")
 async def back_to_transaction_callback(callback_query: CallbackQuery, state: FSMContext):
     """Tranzaksiyaga qaytish"""
     # Oddiy javob
@@ -3717,7 +3869,7 @@ async def back_to_transaction_callback(callback_query: CallbackQuery, state: FSM
         pass
     return
 
-@dp.callback_query(lambda c: c.data == "back_to_profile")
+@callbacks.exact("back_to_profile")
 async def back_to_profile_callback(callback_query: CallbackQuery):
     """Profil menyusiga qaytish"""
     user_id = callback_query.from_user.id
@@ -3738,8 +3890,8 @@ async def back_to_profile_callback(callback_query: CallbackQuery):
                 SELECT COUNT(*) as count
                 FROM transactions 
                 WHERE user_id = %s 
-                AND MONTH(created_at) = MONTH(NOW())
-                AND YEAR(created_at) = YEAR(NOW())
+                AND created_at >= DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY)
+                AND created_at < DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY) + INTERVAL 1 MONTH
                 """,
                 (user_id,)
             )
@@ -3750,8 +3902,8 @@ async def back_to_profile_callback(callback_query: CallbackQuery):
                 SELECT COUNT(*) as count
                 FROM transactions 
                 WHERE user_id = %s 
-                AND MONTH(created_at) = MONTH(NOW())
-                AND YEAR(created_at) = YEAR(NOW())
+                AND created_at >= DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY)
+                AND created_at < DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY) + INTERVAL 1 MONTH
                 AND description LIKE '%voice%'
                 """,
                 (user_id,)
@@ -3781,8 +3933,8 @@ async def back_to_profile_callback(callback_query: CallbackQuery):
                 SELECT COUNT(*) as count
                 FROM transactions 
                 WHERE user_id = %s 
-                AND MONTH(created_at) = MONTH(NOW())
-                AND YEAR(created_at) = YEAR(NOW())
+                AND created_at >= DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY)
+                AND created_at < DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY) + INTERVAL 1 MONTH
                 """,
                 (user_id,)
             )
@@ -3793,8 +3945,8 @@ async def back_to_profile_callback(callback_query: CallbackQuery):
                 SELECT COUNT(*) as count
                 FROM transactions 
                 WHERE user_id = %s 
-                AND MONTH(created_at) = MONTH(NOW())
-                AND YEAR(created_at) = YEAR(NOW())
+                AND created_at >= DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY)
+                AND created_at < DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY) + INTERVAL 1 MONTH
                 AND description LIKE '%voice%'
                 """,
                 (user_id,)
@@ -3838,12 +3990,12 @@ async def back_to_profile_callback(callback_query: CallbackQuery):
         await callback_query.message.edit_text(profile_text, reply_markup=keyboard, parse_mode='Markdown')
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == "change_tariff")
+@callbacks.exact("change_tariff")
 async def change_tariff_callback(callback_query: CallbackQuery):
     # Endi bu bo'lim olib tashlangan
     await callback_query.answer("Bu bo'lim olib tashlangan.", show_alert=True)
 
-@dp.callback_query(lambda c: c.data == "tariff_info")
+@callbacks.exact("tariff_info")
 async def tariff_info_callback(callback_query: CallbackQuery):
     """Tarif ma'lumotlarini ko'rsatish"""
     user_id = callback_query.from_user.id
@@ -3903,7 +4055,7 @@ async def tariff_info_callback(callback_query: CallbackQuery):
         await callback_query.message.edit_text(tariff_text, reply_markup=keyboard, parse_mode='Markdown')
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == "switch_tariff")
+@callbacks.exact("switch_tariff")
 async def switch_tariff_callback(callback_query: CallbackQuery):
     """Tarifni o'zgartirish menyusini ko'rsatish"""
     user_id = callback_query.from_user.id
@@ -3947,7 +4099,7 @@ async def switch_tariff_callback(callback_query: CallbackQuery):
         )
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("test_activate_"))
+@callbacks.prefix("test_activate_")
 async def test_activate_business_callback(callback_query: CallbackQuery):
     """Test rejimida Business tarifini aktiv qilish"""
     user_id = callback_query.from_user.id
@@ -3974,6 +4126,7 @@ async def test_activate_business_callback(callback_query: CallbackQuery):
             "INSERT INTO user_subscriptions (user_id, tariff, is_active, expires_at) VALUES (%s, %s, %s, %s)",
             (user_id, tariff_code, True, expires_at)
         )
+        db.invalidate_user_cache(user_id)
         
         # Payments jadvaliga qo'shish (test uchun 0 so'm)
         await db.execute_query(
@@ -4003,7 +4156,7 @@ async def test_activate_business_callback(callback_query: CallbackQuery):
         logging.error(f"Test tarif aktivlashtirishda xatolik: {e}")
         await callback_query.answer("❌ Xatolik yuz berdi!", show_alert=True)
 
-@dp.callback_query(lambda c: c.data.startswith("activate_tariff_"))
+@callbacks.prefix("activate_tariff_")
 async def activate_tariff_callback(callback_query: CallbackQuery):
     """Tanlangan tarifni aktiv qilish"""
     user_id = callback_query.from_user.id
@@ -4037,7 +4190,7 @@ async def activate_tariff_callback(callback_query: CallbackQuery):
     
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("back_to_profile"))
+@callbacks.prefix("back_to_profile")
 async def back_to_profile_callback_handler(callback_query: CallbackQuery):
     """Profilga qaytish - duplicated, redirecting to main handler"""
     # Ignore this duplicate, use the first one
@@ -4059,7 +4212,7 @@ async def back_to_profile_callback_handler(callback_query: CallbackQuery):
     )
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == "buy_new_tariff")
+@callbacks.exact("buy_new_tariff")
 async def buy_new_tariff_callback(callback_query: CallbackQuery):
     """Yangi tarif sotib olish menyusini ko'rsatish"""
     try:
@@ -4079,7 +4232,7 @@ async def buy_new_tariff_callback(callback_query: CallbackQuery):
         )
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == "help_tariff")
+@callbacks.exact("help_tariff")
 async def help_tariff_callback(callback_query: CallbackQuery):
     """Yordam xabarini ko'rsatish"""
     help_text = (
@@ -4117,7 +4270,7 @@ async def help_tariff_callback(callback_query: CallbackQuery):
     await callback_query.answer()
 
 # Muddat tanlash handleri
-@dp.callback_query(lambda c: c.data.startswith("duration_"), UserStates.waiting_for_subscription_duration)
+@callbacks.prefix("duration_", state=UserStates.waiting_for_subscription_duration)
 async def process_subscription_duration(callback_query: CallbackQuery, state: FSMContext):
     """Obuna muddatini qabul qilish"""
     user_id = callback_query.from_user.id
@@ -4184,7 +4337,7 @@ async def process_subscription_duration(callback_query: CallbackQuery, state: FS
     await callback_query.answer()
 
 # To'lov usuli tanlash handleri
-@dp.callback_query(lambda c: c.data.startswith("payment_"), UserStates.waiting_for_payment_method)
+@callbacks.prefix("payment_", state=UserStates.waiting_for_payment_method)
 async def process_payment_method(callback_query: CallbackQuery, state: FSMContext):
     """To'lov usulini qabul qilish"""
     user_id = callback_query.from_user.id
@@ -4284,7 +4437,7 @@ async def process_payment_method(callback_query: CallbackQuery, state: FSMContex
             _pending_clear(PENDING_BUSINESS_PAYMENTS, user_id)
 
 # To'lov usulini tanlash (yangi)
-@dp.callback_query(lambda c: c.data and c.data.startswith("select_payment_") and c.data not in ["select_payment_early_access"])
+@callbacks.prefix("select_payment_", exclude=("select_payment_early_access",))
 async def select_payment_method(callback_query: CallbackQuery, state: FSMContext):
     """To'lov usulini tanlash"""
     user_id = callback_query.from_user.id
@@ -4461,13 +4614,13 @@ async def select_payment_method(callback_query: CallbackQuery, state: FSMContext
 
 # Boshqa to'lov usullari uchun handlerlar
 
-@dp.callback_query(lambda c: c.data and c.data.startswith("select_payment_") and c.data not in ["select_payment_telegram_click", "select_payment_telegram_stars", "select_payment_early_access"])
+@callbacks.prefix("select_payment_", exclude=("select_payment_telegram_click", "select_payment_telegram_stars", "select_payment_early_access"))
 async def select_other_payment_methods(callback_query: CallbackQuery, state: FSMContext):
     """Boshqa to'lov usullari uchun handler"""
     await callback_query.answer("🚧 Bu to'lov usuli tez orada qo'shiladi!\n\nIltimos, boshqa to'lov usulini tanlang.", show_alert=True)
 
 # Qayta to'lov usulini tanlash
-@dp.callback_query(lambda c: c.data and c.data.startswith("back_to_payment_method_"))
+@callbacks.prefix("back_to_payment_method_")
 async def back_to_payment_method(callback_query: CallbackQuery, state: FSMContext):
     """To'lov usulini qayta tanlash"""
     user_id = callback_query.from_user.id
@@ -4566,7 +4719,7 @@ async def back_to_payment_method(callback_query: CallbackQuery, state: FSMContex
     await callback_query.answer()
 
 # Orqaga qaytish handlerlari
-@dp.callback_query(lambda c: c.data == "back_to_tariff_selection")
+@callbacks.exact("back_to_tariff_selection")
 async def back_to_tariff_selection(callback_query: CallbackQuery, state: FSMContext):
     """Tarif tanlashga qaytish"""
     await callback_query.message.edit_text(
@@ -4576,7 +4729,7 @@ async def back_to_tariff_selection(callback_query: CallbackQuery, state: FSMCont
     await state.clear()
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == "back_to_duration_selection")
+@callbacks.exact("back_to_duration_selection")
 async def back_to_duration_selection(callback_query: CallbackQuery, state: FSMContext):
     """Muddat tanlashga qaytish"""
     data = await state.get_data()
@@ -4608,28 +4761,13 @@ async def back_to_duration_selection(callback_query: CallbackQuery, state: FSMCo
     await state.set_state(UserStates.waiting_for_subscription_duration)
     await callback_query.answer()
 
-@dp.callback_query(lambda c: not c.data.startswith("trans_") and not c.data.startswith("accept_employee_") and not c.data.startswith("reject_employee") and not c.data.startswith("leave_team") and not c.data.startswith("confirm_leave_team") and not c.data.startswith("biz_") and not c.data.startswith("debt_add_") and not c.data.startswith("debt_edit_") and not c.data.startswith("debt_date_"))
+@callbacks.any(exclude_prefix=("trans_", "accept_employee_", "reject_employee", "leave_team", "confirm_leave_team",
+                               "biz_", "debt_add_", "debt_edit_", "debt_date_"))
 async def process_all_callbacks(callback_query: CallbackQuery, state: FSMContext):
     print(f"DEBUG: Non-transaction callback received: {callback_query.data}")
     # Avtomatik tarif muddatini tekshirish
     await ensure_tariff_valid(callback_query.from_user.id)
-    # Bugungi qarz eslatmalarini yuborish (agar bo'lsa)
-    try:
-        user_id = callback_query.from_user.id
-        rows = await db.execute_query(
-            "SELECT tr.id, tr.amount, tr.debt_direction, tr.due_date FROM transactions tr JOIN debt_reminders dr ON dr.transaction_id = tr.id AND dr.user_id = tr.user_id WHERE dr.user_id = %s AND dr.reminder_date = CURDATE()",
-            (user_id,)
-        )
-        for (tx_id, amount, direction, due_date) in rows:
-            dir_text = "qarz qaytarish" if direction == 'borrowed' else "qarz qaytarilishini kutish"
-            await callback_query.message.answer(
-                f"🔔 Eslatma: Bugun {dir_text} kuni!\n"
-                f"Summa: {float(amount):,.0f} so'm\n"
-                f"Sana: {due_date}",
-                parse_mode='Markdown'
-            )
-    except Exception as e:
-        logging.error(f"Eslatma yuborishda xatolik: {e}")
+    # Qarz eslatmalari endi send_debt_reminders (09:00) orqali yuboriladi
     
     # Tarif tanlash callbacklari
     if callback_query.data.startswith("tariff_"):
@@ -4758,6 +4896,7 @@ async def process_all_callbacks(callback_query: CallbackQuery, state: FSMContext
                     "UPDATE users SET tariff = %s, tariff_expires_at = NULL WHERE user_id = %s",
                     ("FREE", user_id)
                 )
+                db.invalidate_user_cache(user_id)
                 
                 # Xabarni o'chirish yoki yangi xabar yuborish
                 try:
@@ -4819,7 +4958,7 @@ async def process_all_callbacks(callback_query: CallbackQuery, state: FSMContext
         return
 
 # Tarif tanlash (faqat onboarding paytida) - oxirida qo'yilgan
-@dp.callback_query(lambda c: c.data.startswith("tariff_"), UserStates.waiting_for_tariff)
+@callbacks.prefix("tariff_", state=UserStates.waiting_for_tariff)
 async def process_tariff_onboarding_only(callback_query: CallbackQuery, state: FSMContext):
     """Tarifni qabul qilish (onboarding)"""
     user_id = callback_query.from_user.id
@@ -4960,7 +5099,7 @@ async def business_reports_handler(message: types.Message, state: FSMContext):
 
 
 # Business sahifasiga o'tish callback
-@dp.callback_query(lambda c: c.data == "go_to_business")
+@callbacks.exact("go_to_business")
 async def go_to_business_callback(callback: types.CallbackQuery, state: FSMContext):
     """Hisobotlardan Business sahifasiga o'tish"""
     user_id = callback.from_user.id
@@ -4981,7 +5120,7 @@ async def go_to_business_callback(callback: types.CallbackQuery, state: FSMConte
     )
 
 # 📦 Ombor handler
-@dp.message(lambda message: message.text == "📦 Ombor")
+@messages.exact("📦 Ombor")
 async def warehouse_menu_handler(message: types.Message, state: FSMContext):
     """Ombor menyusi"""
     user_id = message.from_user.id
@@ -5002,7 +5141,7 @@ async def warehouse_menu_handler(message: types.Message, state: FSMContext):
     )
 
 # 🤖 AI Chat handler - REJIM BOSHLASH
-@dp.message(lambda message: message.text == "🤖 AI Chat")
+@messages.exact("🤖 AI Chat")
 async def ai_chat_start_handler(message: types.Message, state: FSMContext):
     """AI Chat rejimini boshlash"""
     user_id = message.from_user.id
@@ -5028,7 +5167,7 @@ async def ai_chat_start_handler(message: types.Message, state: FSMContext):
     )
 
 # 🛑 AI Chat to'xtatish
-@dp.message(lambda message: message.text == "🛑 AI Chatni to'xtatish")
+@messages.exact("🛑 AI Chatni to'xtatish")
 async def ai_chat_stop_handler(message: types.Message, state: FSMContext):
     """AI Chat rejimini to'xtatish"""
     await state.clear()
@@ -5040,7 +5179,7 @@ async def ai_chat_stop_handler(message: types.Message, state: FSMContext):
     )
 
 # AI Chat rejimida xabarlar
-@dp.message(BusinessStates.ai_chat_mode)
+@messages.any(state=BusinessStates.ai_chat_mode)
 async def ai_chat_message_handler(message: types.Message, state: FSMContext):
     """AI Chat rejimida xabarlarni qayta ishlash"""
     user_id = message.from_user.id
@@ -5053,6 +5192,15 @@ async def ai_chat_message_handler(message: types.Message, state: FSMContext):
     processing_msg = await message.answer("🤔 O'ylayapman...")
     
     try:
+        if AI_STREAMING:
+            # "O'ylayapman..." xabari javob bilan bosqichma-bosqich tahrirlanadi
+            await stream_reply(
+                message.bot, message.chat.id,
+                business_module.ai_chat_response_stream(user_id, text),
+                placeholder=processing_msg, prefix="🤖 AI Javob:\n\n", metric='business.stream'
+            )
+            return
+        
         # AI dan javob olish
         response = await business_module.ai_chat_response(user_id, text)
         
@@ -5065,7 +5213,7 @@ async def ai_chat_message_handler(message: types.Message, state: FSMContext):
         await processing_msg.edit_text("❌ Xatolik yuz berdi. Qaytadan urinib ko'ring.")
 
 # 👤 Profil handler (Business uchun)
-@dp.message(lambda message: message.text == "👤 Profil")
+@messages.exact("👤 Profil")
 async def business_profile_handler(message: types.Message, state: FSMContext):
     """Profil - Business uchun kengaytirilgan"""
     user_id = message.from_user.id
@@ -5083,7 +5231,7 @@ async def business_profile_handler(message: types.Message, state: FSMContext):
     )
 
 # Business callbacks - biz_ prefiksi bilan
-@dp.callback_query(lambda c: c.data.startswith("biz_"))
+@callbacks.prefix("biz_")
 async def business_callback_handler(callback_query: CallbackQuery, state: FSMContext):
     """Barcha biznes callbacklarni qayta ishlash"""
     user_id = callback_query.from_user.id
@@ -5268,7 +5416,7 @@ async def business_callback_handler(callback_query: CallbackQuery, state: FSMCon
         await callback_query.answer("❌ Xatolik yuz berdi!", show_alert=True)
 
 # Xodim qo'shish - Telegram ID
-@dp.message(BusinessStates.waiting_for_employee_telegram_id)
+@messages.any(state=BusinessStates.waiting_for_employee_telegram_id)
 async def process_employee_telegram_id(message: types.Message, state: FSMContext):
     """Xodim Telegram ID qabul qilish"""
     try:
@@ -5286,7 +5434,7 @@ async def process_employee_telegram_id(message: types.Message, state: FSMContext
         await message.answer("❌ Noto'g'ri format. Faqat raqam kiriting (Telegram ID).")
 
 # Xodim qo'shish - Ism
-@dp.message(BusinessStates.waiting_for_employee_name)
+@messages.any(state=BusinessStates.waiting_for_employee_name)
 async def process_employee_name(message: types.Message, state: FSMContext):
     """Xodim ismini qabul qilish"""
     name = message.text.strip()
@@ -5306,7 +5454,7 @@ async def process_employee_name(message: types.Message, state: FSMContext):
     await state.set_state(BusinessStates.waiting_for_employee_role)
 
 # Xodim role callback
-@dp.callback_query(lambda c: c.data.startswith("emp_role_"))
+@callbacks.prefix("emp_role_")
 async def process_employee_role_callback(callback_query: CallbackQuery, state: FSMContext):
     """Xodim rolini qabul qilish va saqlash"""
     user_id = callback_query.from_user.id
@@ -5329,7 +5477,7 @@ async def process_employee_role_callback(callback_query: CallbackQuery, state: F
 
 # ================== /BIZNES HANDLERLARI ==================
 
-@dp.message(lambda message: message.text == "➕ Xodim qo'shish")
+@messages.exact("➕ Xodim qo'shish")
 async def add_employee_handler(message: types.Message, state: FSMContext):
     """Xodim qo'shish"""
     user_id = message.from_user.id
@@ -5347,7 +5495,7 @@ async def add_employee_handler(message: types.Message, state: FSMContext):
     )
     await state.set_state(UserStates.waiting_for_employee_id)
 
-@dp.message(UserStates.waiting_for_employee_id)
+@messages.any(state=UserStates.waiting_for_employee_id)
 async def process_employee_id(message: types.Message, state: FSMContext):
     """Xodim ID sini qabul qilish"""
     user_id = message.from_user.id
@@ -5398,7 +5546,7 @@ async def process_employee_id(message: types.Message, state: FSMContext):
     
     await state.clear()
 
-@dp.callback_query(lambda c: c.data.startswith("accept_employee_"))
+@callbacks.prefix("accept_employee_")
 async def accept_employee_invite(callback_query: CallbackQuery):
     """Xodim taklifini qabul qilish"""
     print(f"DEBUG: accept_employee callback received: {callback_query.data}")
@@ -5415,6 +5563,7 @@ async def accept_employee_invite(callback_query: CallbackQuery):
             "UPDATE users SET tariff = 'EMPLOYEE', manager_id = %s WHERE user_id = %s",
             (manager_id, user_id)
         )
+        db.invalidate_user_cache(user_id)
         print("DEBUG: Database updated successfully")
         
         await callback_query.message.edit_text(
@@ -5448,7 +5597,7 @@ async def accept_employee_invite(callback_query: CallbackQuery):
         logging.error(f"Xodim qo'shishda xatolik: {e}")
         await callback_query.answer("❌ Xatolik yuz berdi!", show_alert=True)
 
-@dp.callback_query(lambda c: c.data == "reject_employee")
+@callbacks.exact("reject_employee")
 async def reject_employee_invite(callback_query: CallbackQuery):
     """Xodim taklifini rad etish"""
     await callback_query.answer()
@@ -5459,7 +5608,7 @@ async def reject_employee_invite(callback_query: CallbackQuery):
     )
 
 # Warehouse (Ombor) callback handlerlar
-@dp.callback_query(lambda c: c.data.startswith("warehouse_"))
+@callbacks.prefix("warehouse_")
 async def warehouse_callback_handler(callback_query: CallbackQuery, state: FSMContext):
     """Ombor callback handlerlari"""
     user_id = callback_query.from_user.id
@@ -5571,7 +5720,7 @@ async def warehouse_callback_handler(callback_query: CallbackQuery, state: FSMCo
         )
         await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("warehouse_select_product_"))
+@callbacks.prefix("warehouse_select_product_")
 async def warehouse_select_product_handler(callback_query: CallbackQuery, state: FSMContext):
     """Tovar tanlash va kirim/chiqim qo'shish"""
     user_id = callback_query.from_user.id
@@ -5602,7 +5751,7 @@ async def warehouse_select_product_handler(callback_query: CallbackQuery, state:
     await state.set_state(UserStates.waiting_for_warehouse_movement)
     await callback_query.answer()
 
-@dp.message(UserStates.waiting_for_product_info)
+@messages.any(state=UserStates.waiting_for_product_info)
 async def process_product_info(message: types.Message, state: FSMContext):
     """Tovar ma'lumotlarini qabul qilish"""
     user_id = message.from_user.id
@@ -5649,7 +5798,7 @@ async def process_product_info(message: types.Message, state: FSMContext):
         logging.error(f"Tovar qo'shishda xatolik: {e}")
         await message.answer(f"❌ Xatolik: {str(e)}\n\nIltimos, to'g'ri formatda yuboring.")
 
-@dp.message(UserStates.waiting_for_warehouse_movement)
+@messages.any(state=UserStates.waiting_for_warehouse_movement)
 async def process_warehouse_movement(message: types.Message, state: FSMContext):
     """Kirim/chiqim ma'lumotlarini qabul qilish"""
     user_id = message.from_user.id
@@ -5698,7 +5847,7 @@ async def process_warehouse_movement(message: types.Message, state: FSMContext):
         logging.error(f"Kirim/chiqim qo'shishda xatolik: {e}")
         await message.answer(f"❌ Xatolik: {str(e)}\n\nIltimos, to'g'ri formatda yuboring.")
 
-@dp.callback_query(lambda c: c.data == "leave_team")
+@callbacks.exact("leave_team")
 async def leave_team_callback(callback_query: CallbackQuery):
     """Jamoadan chiqish"""
     await callback_query.answer()
@@ -5726,7 +5875,7 @@ async def leave_team_callback(callback_query: CallbackQuery):
         reply_markup=keyboard
     )
 
-@dp.callback_query(lambda c: c.data == "confirm_leave_team")
+@callbacks.exact("confirm_leave_team")
 async def confirm_leave_team_callback(callback_query: CallbackQuery):
     """Jamoadan chiqishni tasdiqlash"""
     await callback_query.answer()
@@ -5739,6 +5888,7 @@ async def confirm_leave_team_callback(callback_query: CallbackQuery):
             "UPDATE users SET tariff = 'NONE', manager_id = NULL WHERE user_id = %s",
             (user_id,)
         )
+        db.invalidate_user_cache(user_id)
         
         await callback_query.message.edit_text(
             "✅ **Jamoadan chiqdingiz!**\n\n"
@@ -5783,7 +5933,7 @@ async def check_registration_complete(user_id: int) -> bool:
         logging.error(f"Registration check error: {e}")
         return False
 
-@dp.message(lambda message: message.text and not message.text.startswith('/') and message.text not in [
+@messages.any(lambda message: message.text and not message.text.startswith('/') and message.text not in [
     "📊 Hisobotlar", "👤 Profil", "➕ Kirim", "➖ Chiqim", "💳 Qarzlar", 
     "➕ Xodim qo'shish", "❌ Bekor qilish", "📦 Ombor", "🤖 AI Chat", 
     "🛑 AI Chatni to'xtatish", "👥 Xodimlar", "🏪 Filiallar"
@@ -5791,6 +5941,7 @@ async def check_registration_complete(user_id: int) -> bool:
 async def process_financial_message(message: types.Message, state: FSMContext):
     """MAX va FREE tariflar uchun AI chat"""
     user_id = message.from_user.id
+    db.count_message()
     current_state = await state.get_state()
     
     # waiting_for_phone state'da bo'lsa, uni ignore qilamiz (alohida handler bor)
@@ -5864,12 +6015,21 @@ async def process_financial_message(message: types.Message, state: FSMContext):
             if result.get('success'):
                 if result.get('type') == 'question':
                     # Savol - AI Chat javob beradi
-                    response = await business_module.ai_chat_response(user_id, result.get('question', message.text))
-                    await message.answer(
-                        f"🤖 **AI Javob:**\n\n{response}",
-                        parse_mode='Markdown',
-                        reply_markup=get_business_menu()
-                    )
+                    question = result.get('question', message.text)
+                    if AI_STREAMING:
+                        await stream_reply(
+                            message.bot, message.chat.id,
+                            business_module.ai_chat_response_stream(user_id, question),
+                            prefix="🤖 AI Javob:\n\n", reply_markup=get_business_menu(),
+                            metric='business.stream'
+                        )
+                    else:
+                        response = await business_module.ai_chat_response(user_id, question)
+                        await message.answer(
+                            f"🤖 **AI Javob:**\n\n{response}",
+                            parse_mode='Markdown',
+                            reply_markup=get_business_menu()
+                        )
                 else:
                     # Amaliyot (kirim/chiqim/qarz/ombor)
                     await message.answer(
@@ -5902,8 +6062,8 @@ async def process_financial_message(message: types.Message, state: FSMContext):
             monthly_row = await db.execute_one(
                 """SELECT COUNT(*) as count FROM transactions 
                    WHERE user_id = %s 
-                   AND MONTH(created_at) = MONTH(NOW())
-                   AND YEAR(created_at) = YEAR(NOW())""",
+                   AND created_at >= DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY)
+                   AND created_at < DATE_SUB(CURDATE(), INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY) + INTERVAL 1 MONTH""",
                 (user_id,)
             )
             monthly_count = monthly_row.get('count', 0) if monthly_row else 0
@@ -6234,13 +6394,28 @@ async def process_financial_message(message: types.Message, state: FSMContext):
     
     try:
         if user_tariff in ['PRO', 'MAX']:
-            # 1. Avval tranzaksiyani aniqlashga harakat qilamiz (financial_module orqali)
-            financial_result = await financial_module.process_ai_input_advanced(text, user_id)
-            has_transaction = financial_result.get('success') and 'transaction_data' in financial_result
-            
-            # 2. Eslatmani aniqlashga harakat qilamiz (har doim tekshiramiz, hatto tranzaksiya aniqlangan bo'lsa ham)
-            reminder_result = await ai_chat.detect_and_save_reminder(user_id, text)
-            has_reminder = reminder_result is not None
+            # Pro: limitdan oldindan band qilinadi (SQL shartida) - limit tugagan bo'lsa aniqlash boshlanmaydi
+            is_pro = user_tariff == 'PRO'
+            if is_pro and not await db.reserve_pro_usage(user_id, 'text', PRO_RESERVE_TEXT_COST):
+                await message.answer(PRO_LIMIT_MESSAGE, parse_mode='Markdown')
+                return
+            has_transaction = has_reminder = False
+            try:
+                with llm.track_usage() as detection_usage:
+                    # 1. Avval tranzaksiyani aniqlashga harakat qilamiz (financial_module orqali)
+                    financial_result = await financial_module.process_ai_input_advanced(text, user_id)
+                    has_transaction = financial_result.get('success') and 'transaction_data' in financial_result
+                    
+                    # 2. Eslatmani aniqlashga harakat qilamiz (har doim tekshiramiz, hatto tranzaksiya aniqlangan bo'lsa ham)
+                    reminder_result = await ai_chat.detect_and_save_reminder(user_id, text)
+                    has_reminder = reminder_result is not None
+            finally:
+                # Band qilingan summa haqiqiy aniqlash narxiga almashtiriladi. AI chatga o'tsa xabar u yerda sanaladi
+                await db.charge_llm_usage(
+                    user_id, detection_usage, 'text', pro=is_pro,
+                    count=1 if has_transaction or has_reminder else 0,
+                    reserved=PRO_RESERVE_TEXT_COST if is_pro else 0.0
+                )
             
             # Agar eslatma aniqlangan bo'lsa va tranzaksiya ham aniqlangan bo'lsa, eslatma ustunlik qiladi
             if has_reminder and has_transaction:
@@ -6300,7 +6475,17 @@ async def process_financial_message(message: types.Message, state: FSMContext):
             # 4. Agar hech narsa aniqlanmagan bo'lsa, AI chat javob beradi
             # PRO/MAX tariflar uchun HAR QANDAY mavzu uchun AI chat - 100% AI Generate
             # (ai_chat.generate_response ichida detect_and_save_reminder ham chaqiriladi)
-            ai_messages = await ai_chat.generate_response(user_id, text)
+            if AI_STREAMING:
+                # Javob token kelishi bilan ko'rinadi, gaplar bo'yicha bir nechta xabarga bo'linadi
+                ai_messages = await stream_reply(
+                    message.bot, message.chat.id,
+                    ai_chat.generate_response_stream(user_id, text),
+                    split_final=lambda response: ai_chat._split_response_smart(response, text),
+                    split_stable=lambda response: ai_chat._split_response_stable(response, text),
+                    metric='ai_chat.stream'
+                )
+            else:
+                ai_messages = await ai_chat.generate_response(user_id, text)
             
             # Pro userlar uchun emoji reaksiya (moliyadan yiroq mavzular uchun)
             if user_tariff == 'PRO' and ai_messages:
@@ -6362,9 +6547,11 @@ async def process_financial_message(message: types.Message, state: FSMContext):
                             pass
             
             # Har bir xabarni 1-3 soniya orasida yuborish (HAR QANDAY mavzu uchun AI javobi)
-            for msg in ai_messages:
-                await message.answer(msg)  # parse_mode olib tashlandi - emoji ishlatiladi
-                await asyncio.sleep(1.5)
+            # Oqim rejimida xabarlar allaqachon yuborilgan
+            if not AI_STREAMING:
+                for msg in ai_messages:
+                    await message.answer(msg)  # parse_mode olib tashlandi - emoji ishlatiladi
+                    await asyncio.sleep(1.5)
         
     except Exception as e:
         logging.error(f"AI chat xatolik: {e}")
@@ -6373,12 +6560,12 @@ async def process_financial_message(message: types.Message, state: FSMContext):
 async def process_audio_with_financial_module(
     message: types.Message,
     state: FSMContext,
-    audio_path: str,
+    audio: AudioSource,
     user_id: int,
     processing_msg=None
 ):
     try:
-        audio_result = await financial_module.process_audio_input(audio_path, user_id)
+        audio_result = await financial_module.process_audio_input(audio, user_id)
         
         if processing_msg:
             try:
@@ -6510,10 +6697,11 @@ async def process_audio_with_financial_module(
         return None
 
 # Audio xabarlarni qayta ishlash (Premium)
-@dp.message(lambda message: message.voice or message.audio)
+@messages.any(lambda message: message.voice or message.audio)
 async def process_audio_message(message: types.Message, state: FSMContext):
     """Audio xabarlarni qayta ishlash (Premium)"""
     user_id = message.from_user.id
+    db.count_message()
     # Avtomatik tarif muddatini tekshirish
     await ensure_tariff_valid(user_id)
     user_tariff = await get_user_tariff(user_id)
@@ -6551,18 +6739,12 @@ async def process_audio_message(message: types.Message, state: FSMContext):
     
     # Plus tarifda cheksiz foydalanish mumkin (oylik obuna)
     
+    audio = None
     try:
-        # Audio faylni yuklab olish
+        # Audio faylni xotiraga yuklab olish (katta audio - vaqtinchalik faylga)
         file_id = message.voice.file_id if message.voice else message.audio.file_id
         file = await bot.get_file(file_id)
-        
-        # Audio faylni saqlash
-        import os
-        audio_dir = "temp_audio"
-        os.makedirs(audio_dir, exist_ok=True)
-        
-        audio_path = f"{audio_dir}/audio_{user_id}_{datetime.now().timestamp()}.ogg"
-        await bot.download_file(file.file_path, audio_path)
+        audio = await download_audio(bot, file, user_id)
         
         # AI ishlayotganini ko'rsatish
         await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
@@ -6579,47 +6761,42 @@ async def process_audio_message(message: types.Message, state: FSMContext):
             )
             return
         
-        # Pro tarifida limit tekshiruvi
+        # Kvota ish boshlanishidan oldin SQL shartida band qilinadi - parallel ovozli xabarlar
+        # limitdan ortiq xizmat ololmaydi. Pro: taxminiy xarajat, keyin haqiqiy narx bilan almashtiriladi
         month_year = None
+        reserved = 0.0
         if user_tariff == 'PRO':
             from datetime import datetime as dt
             month_year = dt.now().strftime('%Y-%m')
-            usage = await db.get_or_create_pro_usage(user_id, month_year)
-            
-            if usage['total_cost'] >= 40000:
+            if not await db.reserve_pro_usage(user_id, 'voice', PRO_RESERVE_VOICE_COST, month_year):
                 await processing_msg.delete()
-                await message.answer(
-                    f"⚠️ **Xarajat limiti tugadi!**\n\n"
-                    f"Hozirgi oyda API xarajatlari 40,000 so'mdan oshdi.\n"
-                    f"Keyingi oyni kutishingiz kerak. Yoki Plus paketga o'ting.",
-                    parse_mode='Markdown'
-                )
+                await message.answer(PRO_LIMIT_MESSAGE, parse_mode='Markdown')
                 return
-        
-        # Financial module audio qayta ishlash (GOOGLE yoki ELEVENLABS tanlaydi)
-        audio_result = await process_audio_with_financial_module(message, state, audio_path, user_id, processing_msg)
-        
-        # Pro tarifida ovozli xarajatni tracking qilish
-        if user_tariff == 'PRO' and audio_result and audio_result.get('success'):
-            if not month_year:
-                from datetime import datetime as dt
-                month_year = dt.now().strftime('%Y-%m')
-            # Ovozli xabar uchun xarajat (taxminan 20-30 so'm - speech-to-text va AI)
-            estimated_voice_cost = 25.0
-            await db.increment_pro_usage(user_id, 'voice', estimated_voice_cost, month_year)
-            
-            # Limit tekshiruvi keyin
-            updated_usage = await db.get_or_create_pro_usage(user_id, month_year)
-            if updated_usage['total_cost'] >= 40000:
+            reserved = PRO_RESERVE_VOICE_COST
+        elif user_tariff == 'PLUS':
+            if not await db.increment_plus_usage(user_id, 'voice'):
+                await processing_msg.delete()
                 await message.answer(
-                    f"⚠️ Xarajat limiti tugadi! Keyingi oyni kutishingiz kerak.",
-                    parse_mode='Markdown'
+                    "⚠️ Plus paketingizdagi ovozli xabarlar tugadi.\n\n"
+                    "Balans AI bilan davom etish uchun paket tanlang:",
+                    reply_markup=get_plus_purchase_keyboard()
                 )
+                return
         
-        if user_tariff == 'PLUS':
-            # Paket qoldig'i haqida ogohlantirish o'chirildi
-            if audio_result and audio_result.get('success'):
-                await db.increment_plus_usage(user_id, 'voice')
+        audio_result = None
+        try:
+            # Financial module audio qayta ishlash (GOOGLE yoki ELEVENLABS tanlaydi)
+            with llm.track_usage() as voice_usage:
+                audio_result = await process_audio_with_financial_module(message, state, audio, user_id, processing_msg)
+        finally:
+            # Ovozli xabar xarajati: haqiqiy LLM tokenlari + speech-to-text (davomiylik bo'yicha)
+            duration = (message.voice or message.audio).duration or 0
+            stt_cost = duration / 60 * STT_PRICE_USD_PER_MINUTE * USD_TO_UZS
+            await db.charge_llm_usage(user_id, voice_usage, 'voice', extra_cost=stt_cost,
+                                      month_year=month_year, pro=user_tariff == 'PRO', reserved=reserved)
+            # Plus: muvaffaqiyatsiz xabar uchun band qilingan birlik qaytariladi
+            if user_tariff == 'PLUS' and not (audio_result and audio_result.get('success')):
+                await db.release_plus_usage(user_id, 'voice')
         
     except Exception as e:
         logging.error(f"Audio xabarni qayta ishlashda xatolik: {e}")
@@ -6628,13 +6805,16 @@ async def process_audio_message(message: types.Message, state: FSMContext):
             "❌ Texnik xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring.",
             parse_mode='Markdown'
         )
+    finally:
+        if audio is not None:
+            discard_audio(audio)
 
 # Balans buyrug'i
 # /balance buyrug'i olib tashlandi - endi 📊 Hisobotlar tugmasi orqali ko'rish mumkin
 
 # ==================== ONBOARDING FINAL STEP HANDLERS ====================
 
-@dp.callback_query(lambda c: c.data == "start_income_setup")
+@callbacks.exact("start_income_setup")
 async def start_income_setup(callback_query: CallbackQuery, state: FSMContext):
     """Daromad sozlamalarini boshlash"""
     await callback_query.message.edit_text(
@@ -6657,7 +6837,7 @@ async def start_income_setup(callback_query: CallbackQuery, state: FSMContext):
     await state.set_state(UserStates.waiting_for_income_type)
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == "skip_income_setup")
+@callbacks.exact("skip_income_setup")
 async def skip_income_setup(callback_query: CallbackQuery):
     """Daromad sozlamalarini o'tkazib yuborish"""
     await callback_query.message.edit_text(
@@ -6672,7 +6852,7 @@ async def skip_income_setup(callback_query: CallbackQuery):
     )
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("income_type_"), UserStates.waiting_for_income_type)
+@callbacks.prefix("income_type_", state=UserStates.waiting_for_income_type)
 async def process_income_type(callback_query: CallbackQuery, state: FSMContext):
     """Daromad turini qabul qilish"""
     income_type = callback_query.data.replace("income_type_", "")
@@ -6758,7 +6938,7 @@ async def process_income_type(callback_query: CallbackQuery, state: FSMContext):
 
 # Bu handler'ni o'chirib tashlaymiz va fayl oxiriga qo'yamiz
 
-@dp.callback_query(lambda c: c.data.startswith("weekday_"), UserStates.waiting_for_income_weekday)
+@callbacks.prefix("weekday_", state=UserStates.waiting_for_income_weekday)
 async def process_income_weekday(callback_query: CallbackQuery, state: FSMContext):
     """Haftalik daromad kunini qabul qilish"""
     weekday = int(callback_query.data.replace("weekday_", ""))
@@ -6774,7 +6954,7 @@ async def process_income_weekday(callback_query: CallbackQuery, state: FSMContex
     await state.set_state(UserStates.waiting_for_income_amount)
     await callback_query.answer()
 
-@dp.message(UserStates.waiting_for_income_month)
+@messages.any(state=UserStates.waiting_for_income_month)
 async def process_income_month(message: types.Message, state: FSMContext):
     """Yillik daromad oyini qabul qilish"""
     await state.update_data(income_month=message.text)
@@ -6785,7 +6965,7 @@ async def process_income_month(message: types.Message, state: FSMContext):
     )
     await state.set_state(UserStates.waiting_for_income_day)
 
-@dp.message(UserStates.waiting_for_income_day)
+@messages.any(state=UserStates.waiting_for_income_day)
 async def process_income_day(message: types.Message, state: FSMContext):
     """Yillik daromad kunini qabul qilish"""
     try:
@@ -6809,7 +6989,7 @@ async def process_income_day(message: types.Message, state: FSMContext):
             parse_mode="Markdown"
         )
 
-@dp.message(UserStates.waiting_for_income_amount)
+@messages.any(state=UserStates.waiting_for_income_amount)
 async def process_income_amount(message: types.Message, state: FSMContext):
     """Daromad miqdorini qabul qilish - AI yordamida"""
     text = message.text
@@ -6822,14 +7002,9 @@ async def process_income_amount(message: types.Message, state: FSMContext):
     
     try:
         # OpenAI API yordamida matnni tahlil qilish
-        import openai
-        from config import OPENAI_API_KEY
-        
-        openai.api_key = OPENAI_API_KEY
-        
-        response = await openai.ChatCompletion.acreate(
-            model="gpt-4o",
-            messages=[
+        ai_response = await llm.complete(
+            'salary_parse',
+            [
                 {
                     "role": "system",
                     "content": "Siz matndan faqat raqamni ajratib olishingiz kerak. Foydalanuvchi oylik maosh miqdorini aytdi. Faqat raqamni qaytaring (faqat raqam, hech qanday matn yo'q). Agar raqam topilmasa, 'ERROR' yozing."
@@ -6842,8 +7017,7 @@ async def process_income_amount(message: types.Message, state: FSMContext):
             max_tokens=20,
             temperature=0.1
         )
-        
-        ai_response = response.choices[0].message.content.strip()
+        ai_response = ai_response.strip()
         
         # Bajarilmoqda xabarini o'chirish
         try:
@@ -6932,7 +7106,7 @@ async def process_income_amount(message: types.Message, state: FSMContext):
             parse_mode="Markdown"
         )
 
-@dp.callback_query(lambda c: c.data == "back_to_main")
+@callbacks.exact("back_to_main")
 async def back_to_main_menu(callback_query: CallbackQuery):
     """Asosiy menyuga qaytish"""
     await callback_query.message.edit_text(
@@ -6949,7 +7123,7 @@ async def back_to_main_menu(callback_query: CallbackQuery):
 
 # ==================== INCOME DATE HANDLER ====================
 
-@dp.message(UserStates.waiting_for_income_date)
+@messages.any(state=UserStates.waiting_for_income_date)
 async def process_income_date(message: types.Message, state: FSMContext):
     """Oylik daromad sanasini qabul qilish - AI yordamida"""
     text = message.text
@@ -7023,7 +7197,7 @@ async def process_income_date(message: types.Message, state: FSMContext):
 
 # ==================== TRANSACTION CONFIRMATION HANDLERS ====================
 
-@dp.callback_query(lambda c: c.data.startswith("debt_add_date_") or c.data.startswith("debt_add_name_"))
+@callbacks.prefix("debt_add_date_", "debt_add_name_")
 async def handle_debt_add_callback(callback_query: CallbackQuery, state: FSMContext):
     """Qarz qo'shimcha tugmalar uchun handler (debt_add_date_, debt_add_name_)"""
     user_id = callback_query.from_user.id
@@ -7081,7 +7255,7 @@ async def handle_debt_add_callback(callback_query: CallbackQuery, state: FSMCont
         logging.error(f"debt_add callback handler xatolik: {e}")
         await callback_query.answer("❌ Xatolik yuz berdi", show_alert=True)
 
-@dp.callback_query(lambda c: c.data.startswith("debt_date_"))
+@callbacks.prefix("debt_date_")
 async def handle_debt_date_callback(callback_query: CallbackQuery, state: FSMContext):
     """Qarz sana tanlash tugmalari uchun handler"""
     callback_data = callback_query.data
@@ -7204,7 +7378,7 @@ async def handle_debt_date_callback(callback_query: CallbackQuery, state: FSMCon
                 # Eslatma yaratish
                 try:
                     await db.execute_insert(
-                        "INSERT INTO debt_reminders (user_id, transaction_id, reminder_date) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE reminder_date = %s",
+                        "INSERT INTO debt_reminders (user_id, transaction_id, reminder_date) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE reminder_date = %s, sent_at = NULL",
                         (callback_query.from_user.id, trans_id, due_date_str, due_date_str)
                     )
                 except Exception as e:
@@ -7323,7 +7497,7 @@ async def handle_debt_date_callback(callback_query: CallbackQuery, state: FSMCon
         logging.error(f"debt_date callback handler xatolik: {e}")
         await callback_query.answer("❌ Xatolik yuz berdi", show_alert=True)
 
-@dp.callback_query(lambda c: c.data.startswith("trans_"))
+@callbacks.prefix("trans_")
 async def handle_transaction_callback(callback_query: CallbackQuery, state: FSMContext):
     """Tranzaksiya tugmalari uchun umumiy handler"""
     print(f"DEBUG: Transaction callback received: {callback_query.data}")
@@ -7561,6 +7735,7 @@ async def handle_transaction_callback(callback_query: CallbackQuery, state: FSMC
                     "DELETE FROM reminders WHERE id = %s AND user_id = %s",
                     (reminder_id, user_id)
                 )
+                await db.notify_reminder_changed(reminder_id, removed=True)
                 await callback_query.message.edit_text(
                     "✅ **Eslatma o'chirildi!**",
                     parse_mode='Markdown'
@@ -7781,7 +7956,7 @@ async def process_pre_checkout_query(pre_checkout_q: types.PreCheckoutQuery):
         )
 
 
-@dp.message(lambda m: m.successful_payment is not None)
+@messages.any(lambda m: m.successful_payment is not None)
 async def process_successful_payment(message: types.Message, state: FSMContext):
     """To'lov muvaffaqiyatli yakunlangach ishlov berish"""
     try:
@@ -7805,6 +7980,8 @@ async def process_successful_payment(message: types.Message, state: FSMContext):
             pass
         
         payload = message.successful_payment.invoice_payload or ""
+        # Tarif o'zgaradi - keshdagi profil va tarif qayta o'qilsin
+        db.invalidate_user_cache(user_id)
         if payload.startswith("plus:"):
             # Payload format (legacy): plus:user_id:timestamp:extra...
             parts = payload.split(":")
@@ -8088,25 +8265,70 @@ async def load_config_from_db():
         logging.error(f"Config yuklash xatolik: {e}")
         print("⚠️ Sozlamalar yuklashda xatolik, default qiymatlar ishlatiladi")
 
+class StartupTimer:
+    """Ishga tushish bosqichlari vaqtini o'lchash va hisobot chiqarish.
+
+    Oxirgi bosqich - birinchi getUpdates javobi; u bot sessiyasiga
+    vaqtincha ulanadigan request middleware orqali o'lchanadi.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name: str):
+        stage_started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.perf_counter() - stage_started))
+
+    def track_first_poll(self, bot: Bot):
+        """Birinchi getUpdates tugaganda hisobotni chiqarish"""
+        polling_started = time.perf_counter()
+
+        async def first_poll_middleware(make_request, bot, method):
+            response = await make_request(bot, method)
+            if type(method).__name__ == 'GetUpdates':
+                bot.session.middleware.unregister(first_poll_middleware)
+                self.stages.append(("Birinchi poll", time.perf_counter() - polling_started))
+                self.report()
+            return response
+
+        bot.session.middleware(first_poll_middleware)
+
+    def report(self):
+        total = time.perf_counter() - self.started
+        lines = [f"   {name:<24} {elapsed * 1000:>9.1f} ms" for name, elapsed in self.stages]
+        logging.info("⏱ Ishga tushish vaqti:\n" + "\n".join(lines) + f"\n   {'Jami':<24} {total * 1000:>9.1f} ms")
+
+
 async def start_bot():
     """Bot ishga tushirish"""
+    timer = StartupTimer()
     try:
         print("📊 Ma'lumotlar bazasini ulash...")
         # Ma'lumotlar bazasini ulash
-        await db.create_pool()
+        with timer.stage("DB pool"):
+            await db.create_pool()
         print("✅ Ma'lumotlar bazasi ulandi!")
         
         print("📋 Jadvallarni yaratish...")
-        # Jadvallarni yaratish
-        await db.create_tables()
+        # Jadvallarni yaratish (sxema dolzarb bo'lsa, faqat versiya tekshiriladi)
+        with timer.stage("Sxema tekshiruvi"):
+            await db.create_tables()
         print("✅ Jadvallar yaratildi!")
         
         print("⚙️ Sozlamalarni yuklash...")
         # Bazadan sozlamalarni yuklash
-        await load_config_from_db()
+        with timer.stage("load_config_from_db"):
+            await load_config_from_db()
+        await broadcasts.resume_pending()
         
         print("🤖 Bot polling ni boshlash...")
         # Bot ishga tushirish
+        timer.track_first_poll(bot)
         await dp.start_polling(bot)
     except Exception as e:
         print(f"❌ Bot ishga tushishda xatolik: {e}")
@@ -8115,10 +8337,12 @@ async def start_bot():
     finally:
         if hasattr(bot, 'session'):
             await bot.session.close()
+        await dp.storage.close()
+        await llm.close()
 
 # ==================== ONBOARDING HANDLERS (SINOVCHILAR UCHUN) ====================
 
-@dp.message(OnboardingState.waiting_for_income)
+@messages.any(state=OnboardingState.waiting_for_income)
 async def onboarding_income_handler(message: types.Message, state: FSMContext):
     """Onboarding: Oylik daromad qabul qilish"""
     user_id = message.from_user.id
@@ -8193,7 +8417,7 @@ async def onboarding_income_handler(message: types.Message, state: FSMContext):
     
     await state.set_state(OnboardingState.waiting_for_debts)
 
-@dp.callback_query(lambda c: c.data == "onboarding_no_debts")
+@callbacks.exact("onboarding_no_debts")
 async def onboarding_no_debts_handler(callback_query: CallbackQuery, state: FSMContext):
     """Onboarding: Qarzlar yo'q"""
     user_id = callback_query.from_user.id
@@ -8211,6 +8435,7 @@ async def onboarding_no_debts_handler(callback_query: CallbackQuery, state: FSMC
     data = await state.get_data()
     tariff = data.get('onboarding_tariff', 'NONE')
     await db.execute_query("UPDATE users SET tariff = %s WHERE user_id = %s", (tariff, user_id))
+    db.invalidate_user_cache(user_id)
     
     # Onboarding yakunlash
     await callback_query.message.edit_text(
@@ -8229,7 +8454,7 @@ async def onboarding_no_debts_handler(callback_query: CallbackQuery, state: FSMC
     await state.clear()
     await callback_query.answer("✅ Onboarding yakunlandi!")
 
-@dp.callback_query(lambda c: c.data == "onboarding_debt_lent")
+@callbacks.exact("onboarding_debt_lent")
 async def onboarding_debt_lent_handler(callback_query: CallbackQuery, state: FSMContext):
     """Onboarding: Qarz bergan"""
     await callback_query.message.edit_text(
@@ -8243,7 +8468,7 @@ async def onboarding_debt_lent_handler(callback_query: CallbackQuery, state: FSM
     await state.set_state(OnboardingState.waiting_for_debts)
     await callback_query.answer("Qarz ma'lumotlarini kiriting")
 
-@dp.callback_query(lambda c: c.data == "onboarding_debt_borrowed")
+@callbacks.exact("onboarding_debt_borrowed")
 async def onboarding_debt_borrowed_handler(callback_query: CallbackQuery, state: FSMContext):
     """Onboarding: Qarz olgan"""
     await callback_query.message.edit_text(
@@ -8257,7 +8482,7 @@ async def onboarding_debt_borrowed_handler(callback_query: CallbackQuery, state:
     await state.set_state(OnboardingState.waiting_for_debts)
     await callback_query.answer("Qarz ma'lumotlarini kiriting")
 
-@dp.message(OnboardingState.waiting_for_debts)
+@messages.any(state=OnboardingState.waiting_for_debts)
 async def onboarding_debts_handler(message: types.Message, state: FSMContext):
     """Onboarding: Qarz ma'lumotlarini qabul qilish"""
     user_id = message.from_user.id
@@ -8290,6 +8515,7 @@ async def onboarding_debts_handler(message: types.Message, state: FSMContext):
     # Tarifni aktiv qilish
     tariff = data.get('onboarding_tariff', 'NONE')
     await db.execute_query("UPDATE users SET tariff = %s WHERE user_id = %s", (tariff, user_id))
+    db.invalidate_user_cache(user_id)
     
     # Onboarding yakunlash
     await message.answer(
@@ -8311,6 +8537,127 @@ async def onboarding_debts_handler(message: types.Message, state: FSMContext):
 
 # ==================== BACKGROUND TASKS ====================
 
+async def send_evening_report(report: dict):
+    """21:00 hisobotini bitta Pro foydalanuvchiga yuborish"""
+    user_id = report['user_id']
+    if not report['has_transactions']:
+        # Tranzaksiya yo'q bo'lsa
+        await outbox.send(
+            user_id,
+            "📋 Bugun xarajat yoki daromad qo'shmadingiz.\n\n"
+            "Agar qo'shgan bo'lsangiz, ularni hozir ayting, men yozib qo'yaman 😊"
+        )
+        return
+    
+    income, expense = report['income'], report['expense']
+    lent, borrowed = report['lent'], report['borrowed']
+    
+    # Hisobot xabari
+    text = f"📊 **Bugungi kun oxiri hisoboti:**\n\n"
+    text += f"💰 Kirim: {income:,.0f} so'm\n"
+    text += f"💸 Chiqim: {expense:,.0f} so'm\n"
+    text += f"📈 Qoldiq: {income - expense:,.0f} so'm\n\n"
+    
+    if lent > 0 or borrowed > 0:
+        text += f"💳 Qarzlar:\n"
+        if lent > 0:
+            text += f"  • Berilgan: {lent:,.0f} so'm\n"
+        if borrowed > 0:
+            text += f"  • Olingan: {borrowed:,.0f} so'm\n"
+        text += "\n"
+    
+    # AI tahlil
+    try:
+        analysis_prompt = f"Bugungi kun oxiri hisoboti:\nKirim: {income:,.0f}, Chiqim: {expense:,.0f}\nQarzlar: Berilgan {lent:,.0f}, Olingan {borrowed:,.0f}\n\nTahlil qiling va qisqa tavsiya bering (max 2 gap)."
+        analysis = await ai_chat.generate_response(user_id, analysis_prompt)
+        if analysis and len(analysis) > 0:
+            text += f"{analysis[0]}\n"
+    except Exception as e:
+        logging.error(f"Error generating daily analysis: {e}")
+    
+    await outbox.send(user_id, text, parse_mode='Markdown')
+
+async def send_midnight_analysis(report: dict):
+    """00:00 kun tahlilini bitta foydalanuvchiga yuborish"""
+    user_id = report['user_id']
+    day = report['day']
+    tx_count = report['count']
+    income, expense = report['income'], report['expense']
+    lent, borrowed = report['debt_lent'], report['debt_borrowed']
+    
+    # Tahlil xabari
+    analysis = f"📊 **Kun tahlili** ({day.strftime('%d.%m.%Y')})\n\n"
+    analysis += f"📈 Tranzaksiyalar: {tx_count} ta\n"
+    analysis += f"💰 Kirimlar: {income:,.0f} so'm\n"
+    analysis += f"💸 Chiqimlar: {expense:,.0f} so'm\n"
+    analysis += f"📊 Qoldiq: {income - expense:,.0f} so'm\n"
+    
+    if lent > 0 or borrowed > 0:
+        analysis += f"\n💳 Qarzlar:\n"
+        if lent > 0:
+            analysis += f"  • Berilgan: {lent:,.0f} so'm\n"
+        if borrowed > 0:
+            analysis += f"  • Olingan: {borrowed:,.0f} so'm\n"
+    
+    # AI tahlil
+    try:
+        # Keraksiz xarajatlarni aniqlash - bir kategoriyada ko'p marta yoki katta summa
+        unnecessary_categories = [
+            f"{cat['category']} ({cat['count']} marta, {cat['total']:,.0f} so'm)"
+            for cat in report['categories']
+            if cat['count'] >= 3 or cat['total'] > expense * 0.3  # 30% dan ko'p
+        ]
+        
+        # AI prompt
+        ai_prompt = f"Kun tahlili:\n"
+        ai_prompt += f"Tranzaksiyalar: {tx_count} ta\n"
+        ai_prompt += f"Kirim: {income:,.0f} so'm\n"
+        ai_prompt += f"Chiqim: {expense:,.0f} so'm\n"
+        if unnecessary_categories:
+            ai_prompt += f"Keraksiz xarajatlar: {', '.join(unnecessary_categories)}\n"
+        ai_prompt += f"\nQisqa tahlil qiling va keraksiz xarajatlar bo'lsa, ularni aytib, tejash tavsiyalari bering (max 3 gap)."
+        
+        ai_response = await ai_chat.generate_response(user_id, ai_prompt)
+        if ai_response and len(ai_response) > 0:
+            analysis += f"\n🤖 **AI Tahlili:**\n{ai_response[0]}"
+    except Exception as e:
+        logging.error(f"Error generating AI analysis for user {user_id}: {e}")
+    
+    await outbox.send(user_id, analysis, parse_mode='Markdown')
+
+async def send_morning_reminder(report: dict):
+    """09:00 tranzaksiya eslatmasini bitta foydalanuvchiga yuborish"""
+    if not report['has_transactions']:
+        # Tranzaksiya yo'q bo'lsa
+        await outbox.send(
+            report['user_id'],
+            "📋 Bugun hali tranzaksiya qo'shmadingiz.\n\n"
+            "Xarajat yoki daromad qo'shing, men yozib qo'yaman 😊"
+        )
+    else:
+        # Tranzaksiya bo'lsa ham eslatma
+        await outbox.send(
+            report['user_id'],
+            "💡 Esingizdan birortasi chiqib qolmadimi?\n\n"
+            "Agar qo'shgan bo'lsangiz, ularni hozir ayting, men yozib qo'yaman 😊"
+        )
+
+async def send_debt_reminder(report: dict):
+    """Qarz qaytarish sanasi eslatmasi - avval belgilanadi, yuborilmasa belgi qaytariladi"""
+    if not await db.mark_debt_reminder_sent(report['reminder_id']):
+        return
+    dir_text = "qarz qaytarish" if report['direction'] == 'borrowed' else "qarz qaytarilishini kutish"
+    day_text = f"{report['due_date']} - {dir_text} kuni edi!" if report['overdue'] else f"Bugun {dir_text} kuni!"
+    status = await outbox.try_send(
+        report['user_id'],
+        f"🔔 Eslatma: {day_text}\n"
+        f"Summa: {report['amount']:,.0f} so'm\n"
+        f"Sana: {report['due_date']}"
+    )
+    if status == 'failed':
+        await db.unmark_debt_reminder_sent(report['reminder_id'])
+        raise RuntimeError("qarz eslatmasi yuborilmadi")
+
 async def send_daily_reports():
     """Kunlik hisobotlarni yuborish - kechki 9 da (faqat Pro)"""
     while True:
@@ -8331,268 +8678,119 @@ async def send_daily_reports():
             wait_seconds = (next_run - now).total_seconds()
             await asyncio.sleep(wait_seconds)
             
-            # Pro userlarni olish
-            pro_users = await db.execute_query("""
-                SELECT DISTINCT user_id FROM users 
-                WHERE tariff = 'PRO' 
-                OR user_id IN (
-                    SELECT user_id FROM user_subscriptions 
-                    WHERE tariff = 'PRO' AND is_active = TRUE AND expires_at > NOW()
-                )
-            """)
-            
-            for user_row in pro_users:
-                try:
-                    user_id = user_row[0] if isinstance(user_row, tuple) else user_row.get('user_id')
-                    if not user_id:
-                        continue
-                    
-                    # Bugungi tranzaksiyalarni tekshirish
-                    today_transactions = await db.execute_query("""
-                        SELECT COUNT(*) as count FROM transactions 
-                        WHERE user_id = %s AND DATE(created_at) = CURDATE()
-                    """, (user_id,))
-                    
-                    has_transactions = today_transactions[0].get('count', 0) > 0 if today_transactions else False
-                    
-                    if not has_transactions:
-                        # Tranzaksiya yo'q bo'lsa
-                        await bot.send_message(
-                            user_id,
-                            "📋 Bugun xarajat yoki daromad qo'shmadingiz.\n\n"
-                            "Agar qo'shgan bo'lsangiz, ularni hozir ayting, men yozib qo'yaman 😊"
-                        )
-                    else:
-                        # Bugungi statistikalar
-                        today_stats = await db.execute_query("""
-                            SELECT 
-                                SUM(CASE WHEN transaction_type = 'income' THEN amount ELSE 0 END) as income,
-                                SUM(CASE WHEN transaction_type = 'expense' THEN amount ELSE 0 END) as expense
-                            FROM transactions 
-                            WHERE user_id = %s AND DATE(created_at) = CURDATE()
-                        """, (user_id,))
-                        
-                        income = float(today_stats[0].get('income', 0)) if today_stats and today_stats[0].get('income') else 0
-                        expense = float(today_stats[0].get('expense', 0)) if today_stats and today_stats[0].get('expense') else 0
-                        
-                        # Qarzlar
-                        debts = await db.execute_query("""
-                            SELECT 
-                                SUM(CASE WHEN debt_type = 'lent' THEN amount ELSE 0 END) as lent,
-                                SUM(CASE WHEN debt_type = 'borrowed' THEN amount ELSE 0 END) as borrowed
-                            FROM debts 
-                            WHERE user_id = %s AND status != 'paid'
-                        """, (user_id,))
-                        
-                        lent = float(debts[0].get('lent', 0)) if debts and debts[0].get('lent') else 0
-                        borrowed = float(debts[0].get('borrowed', 0)) if debts and debts[0].get('borrowed') else 0
-                        
-                        # Hisobot xabari
-                        report = f"📊 **Bugungi kun oxiri hisoboti:**\n\n"
-                        report += f"💰 Kirim: {income:,.0f} so'm\n"
-                        report += f"💸 Chiqim: {expense:,.0f} so'm\n"
-                        report += f"📈 Qoldiq: {income - expense:,.0f} so'm\n\n"
-                        
-                        if lent > 0 or borrowed > 0:
-                            report += f"💳 Qarzlar:\n"
-                            if lent > 0:
-                                report += f"  • Berilgan: {lent:,.0f} so'm\n"
-                            if borrowed > 0:
-                                report += f"  • Olingan: {borrowed:,.0f} so'm\n"
-                            report += "\n"
-                        
-                        # AI tahlil
-                        try:
-                            context = await ai_chat.get_user_financial_context(user_id)
-                            analysis_prompt = f"Bugungi kun oxiri hisoboti:\nKirim: {income:,.0f}, Chiqim: {expense:,.0f}\nQarzlar: Berilgan {lent:,.0f}, Olingan {borrowed:,.0f}\n\nTahlil qiling va qisqa tavsiya bering (max 2 gap)."
-                            analysis = await ai_chat.generate_response(user_id, analysis_prompt)
-                            if analysis and len(analysis) > 0:
-                                report += f"{analysis[0]}\n"
-                        except Exception as e:
-                            logging.error(f"Error generating daily analysis: {e}")
-                        
-                        await bot.send_message(user_id, report, parse_mode='Markdown')
-                    
-                    # Kichik delay
-                    await asyncio.sleep(0.5)
-                    
-                except Exception as e:
-                    logging.error(f"Error sending daily report to user {user_id}: {e}")
-                    continue
+            # Barcha Pro userlar uchun yig'indilar bir nechta GROUP BY so'rovida
+            await run_report_job(
+                'daily_reports', db,
+                lambda builder: builder.evening_reports(datetime.now().date()),
+                send_evening_report
+            )
             
         except Exception as e:
             logging.error(f"Error in daily reports task: {e}")
             await asyncio.sleep(3600)  # 1 soat kutish va qayta urinish
 
+REMINDER_TYPE_EMOJIS = {
+    'meeting': '🤝',
+    'event': '🎉',
+    'task': '📋',
+    'debt_give': '💸',
+    'debt_receive': '💰',
+    'payment': '💳',
+    'other': '🔔'
+}
+
+REMINDER_TYPE_MESSAGES = {
+    'meeting': 'Uchrashuv vaqti keldi',
+    'event': 'Tadbir vaqti keldi',
+    'task': 'Vazifa vaqti keldi',
+    'debt_give': 'Qarz berish vaqti',
+    'debt_receive': 'Qarz olish vaqti',
+    'payment': 'To\'lov vaqti',
+    'other': 'Eslatma vaqti'
+}
+
+
+def format_reminder_30min(reminder: dict) -> str:
+    """Tadbirdan 30 minut oldingi eslatma matni"""
+    time_str = reminder_datetime(reminder).strftime('%H:%M')
+    
+    message = f"⏰ **30 daqiqa qoldi!**\n\n"
+    message += f"📌 {reminder.get('title')}\n"
+    if reminder.get('person_name'):
+        message += f"👤 {reminder.get('person_name')} bilan\n"
+    if reminder.get('location'):
+        message += f"📍 {reminder.get('location')}\n"
+    message += f"🕐 Soat {time_str} da\n"
+    if reminder.get('description'):
+        message += f"\n📝 {reminder.get('description')[:200]}\n"
+    amount = reminder.get('amount')
+    if amount and float(amount) > 0:
+        message += f"\n💰 {float(amount):,.0f} {reminder.get('currency') or 'UZS'}\n"
+    return message
+
+
+def format_reminder_exact(reminder: dict) -> str:
+    """Tadbir vaqtidagi eslatma matni"""
+    reminder_type = reminder.get('reminder_type')
+    emoji = REMINDER_TYPE_EMOJIS.get(reminder_type, '🔔')
+    message = f"{emoji} **{REMINDER_TYPE_MESSAGES.get(reminder_type, 'Eslatma vaqti')}!**\n\n"
+    message += f"📌 {reminder.get('title')}\n"
+    if reminder.get('person_name'):
+        message += f"👤 {reminder.get('person_name')} bilan\n"
+    if reminder.get('location'):
+        message += f"📍 {reminder.get('location')}\n"
+    if reminder.get('description'):
+        message += f"\n📝 {reminder.get('description')[:200]}\n"
+    amount = reminder.get('amount')
+    if amount and float(amount) > 0:
+        message += f"\n💰 {float(amount):,.0f} {reminder.get('currency') or 'UZS'}\n"
+    # Takrorlanadigan eslatma uchun
+    if reminder.get('is_recurring'):
+        message += "\n🔄 Takrorlanadigan eslatma"
+    return message
+
+
+async def fire_reminder(kind: str, reminder: dict):
+    """Rejalashtiruvchi taymeri: bayroqni egallab, bildirishnomani yuborish.
+    
+    Yuborilmasa bayroq qaytariladi va xatolik ko'tariladi - rejalashtiruvchi qayta urinadi.
+    """
+    reminder_id = reminder['id']
+    exact = kind != KIND_30MIN
+    claimed = (await db.mark_notification_exact_sent(reminder_id) if exact
+               else await db.mark_notification_30min_sent(reminder_id))
+    if not claimed:
+        return
+    text = format_reminder_exact(reminder) if exact else format_reminder_30min(reminder)
+    try:
+        await outbox.send(reminder['user_id'], text, parse_mode='Markdown')
+    except TelegramForbiddenError:
+        # Foydalanuvchi botni bloklagan - qayta urinish foydasiz
+        return
+    except Exception:
+        await db.unmark_notification_sent(reminder_id, exact)
+        raise
+    
+    # Agar takrorlanadigan eslatma bo'lsa, keyingi eslatmani yaratish
+    if exact and reminder.get('is_recurring'):
+        try:
+            await db.create_next_recurring_reminder(reminder_id)
+        except Exception as e:
+            logging.error(f"Error creating next recurring reminder: {e}")
+
+
+reminder_scheduler = ReminderScheduler(db, fire_reminder)
+
+
 async def send_reminders():
-    """DONA AI Eslatmalar tizimi - har minutda tekshirish
+    """DONA AI Eslatmalar tizimi - xotiradagi taymerlar bilan
     
     2 ta bildirishnoma yuboriladi:
     1. Tadbirdan 30 minut oldin
     2. Tadbir vaqtida
     """
-    while True:
-        try:
-            from datetime import datetime, time as dt_time
-            
-            # 30 minut oldin bildirishnomalar
-            reminders_30min = await db.get_reminders_for_30min_notification()
-            
-            for reminder_row in reminders_30min:
-                try:
-                    # Reminder ma'lumotlarini olish
-                    if isinstance(reminder_row, tuple):
-                        reminder_id = reminder_row[0]
-                        user_id = reminder_row[1]
-                        reminder_type = reminder_row[2]
-                        title = reminder_row[3]
-                        description = reminder_row[4]
-                        reminder_date = reminder_row[5]
-                        reminder_time = reminder_row[6]
-                        amount = reminder_row[7]
-                        currency = reminder_row[8]
-                        person_name = reminder_row[9]
-                        location = reminder_row[10] if len(reminder_row) > 10 else None
-                        user_name = reminder_row[-1] if len(reminder_row) > 15 else None
-                    else:
-                        reminder_id = reminder_row.get('id')
-                        user_id = reminder_row.get('user_id')
-                        reminder_type = reminder_row.get('reminder_type')
-                        title = reminder_row.get('title')
-                        description = reminder_row.get('description')
-                        reminder_date = reminder_row.get('reminder_date')
-                        reminder_time = reminder_row.get('reminder_time')
-                        amount = reminder_row.get('amount')
-                        currency = reminder_row.get('currency')
-                        person_name = reminder_row.get('person_name')
-                        location = reminder_row.get('location')
-                        user_name = reminder_row.get('user_name')
-                    
-                    # Vaqtni formatlash
-                    time_str = str(reminder_time)[:5] if reminder_time else "09:00"
-                    
-                    # 30 minut oldin eslatma xabari
-                    message = f"⏰ **30 daqiqa qoldi!**\n\n"
-                    message += f"📌 {title}\n"
-                    if person_name:
-                        message += f"👤 {person_name} bilan\n"
-                    if location:
-                        message += f"📍 {location}\n"
-                    message += f"🕐 Soat {time_str} da\n"
-                    if description:
-                        message += f"\n📝 {description[:200]}\n"
-                    if amount and float(amount) > 0:
-                        message += f"\n💰 {float(amount):,.0f} {currency or 'UZS'}\n"
-                    
-                    await bot.send_message(user_id, message, parse_mode='Markdown')
-                    
-                    # Bildirishnoma yuborilganini belgilash
-                    await db.mark_notification_30min_sent(reminder_id)
-                    
-                    await asyncio.sleep(0.3)
-                    
-                except Exception as e:
-                    logging.error(f"Error sending 30min reminder {reminder_id}: {e}")
-                    continue
-            
-            # Aniq vaqtda bildirishnomalar
-            reminders_exact = await db.get_reminders_for_exact_notification()
-            
-            for reminder_row in reminders_exact:
-                try:
-                    # Reminder ma'lumotlarini olish
-                    if isinstance(reminder_row, tuple):
-                        reminder_id = reminder_row[0]
-                        user_id = reminder_row[1]
-                        reminder_type = reminder_row[2]
-                        title = reminder_row[3]
-                        description = reminder_row[4]
-                        reminder_date = reminder_row[5]
-                        reminder_time = reminder_row[6]
-                        amount = reminder_row[7]
-                        currency = reminder_row[8]
-                        person_name = reminder_row[9]
-                        location = reminder_row[10] if len(reminder_row) > 10 else None
-                        is_recurring = reminder_row[11] if len(reminder_row) > 11 else False
-                        recurrence_pattern = reminder_row[12] if len(reminder_row) > 12 else None
-                    else:
-                        reminder_id = reminder_row.get('id')
-                        user_id = reminder_row.get('user_id')
-                        reminder_type = reminder_row.get('reminder_type')
-                        title = reminder_row.get('title')
-                        description = reminder_row.get('description')
-                        reminder_date = reminder_row.get('reminder_date')
-                        reminder_time = reminder_row.get('reminder_time')
-                        amount = reminder_row.get('amount')
-                        currency = reminder_row.get('currency')
-                        person_name = reminder_row.get('person_name')
-                        location = reminder_row.get('location')
-                        is_recurring = reminder_row.get('is_recurring', False)
-                        recurrence_pattern = reminder_row.get('recurrence_pattern')
-                    
-                    # Eslatma turiga qarab emoji
-                    type_emojis = {
-                        'meeting': '🤝',
-                        'event': '🎉',
-                        'task': '📋',
-                        'debt_give': '💸',
-                        'debt_receive': '💰',
-                        'payment': '💳',
-                        'other': '🔔'
-                    }
-                    emoji = type_emojis.get(reminder_type, '🔔')
-                    
-                    # Eslatma turiga qarab xabar
-                    type_messages = {
-                        'meeting': 'Uchrashuv vaqti keldi',
-                        'event': 'Tadbir vaqti keldi',
-                        'task': 'Vazifa vaqti keldi',
-                        'debt_give': 'Qarz berish vaqti',
-                        'debt_receive': 'Qarz olish vaqti',
-                        'payment': 'To\'lov vaqti',
-                        'other': 'Eslatma vaqti'
-                    }
-                    
-                    # Aniq vaqtda eslatma xabari
-                    message = f"{emoji} **{type_messages.get(reminder_type, 'Eslatma vaqti')}!**\n\n"
-                    message += f"📌 {title}\n"
-                    if person_name:
-                        message += f"👤 {person_name} bilan\n"
-                    if location:
-                        message += f"📍 {location}\n"
-                    if description:
-                        message += f"\n📝 {description[:200]}\n"
-                    if amount and float(amount) > 0:
-                        message += f"\n💰 {float(amount):,.0f} {currency or 'UZS'}\n"
-                    
-                    # Takrorlanadigan eslatma uchun
-                    if is_recurring:
-                        message += "\n🔄 Takrorlanadigan eslatma"
-                    
-                    await bot.send_message(user_id, message, parse_mode='Markdown')
-                    
-                    # Bildirishnoma yuborilganini belgilash
-                    await db.mark_notification_exact_sent(reminder_id)
-                    
-                    # Agar takrorlanadigan eslatma bo'lsa, keyingi eslatmani yaratish
-                    if is_recurring:
-                        try:
-                            await db.create_next_recurring_reminder(reminder_id)
-                        except Exception as e:
-                            logging.error(f"Error creating next recurring reminder: {e}")
-                    
-                    await asyncio.sleep(0.3)
-                    
-                except Exception as e:
-                    logging.error(f"Error sending exact reminder {reminder_id}: {e}")
-                    continue
-            
-            # Har minutda tekshirish
-            await asyncio.sleep(60)
-                    
-        except Exception as e:
-            logging.error(f"Error in reminders task: {e}")
-            await asyncio.sleep(60)
+    reminder_scheduler.attach()
+    await reminder_scheduler.run()
 
 async def send_daily_reminder_9am():
     """Har kuni 9:00 da barcha userlar uchun tranzaksiya eslatmasi"""
@@ -8614,60 +8812,47 @@ async def send_daily_reminder_9am():
             wait_seconds = (next_run - now).total_seconds()
             await asyncio.sleep(wait_seconds)
             
-            # Barcha aktiv userlarni olish (tarif bo'lganlar)
-            active_users = await db.execute_query("""
-                SELECT DISTINCT user_id FROM users 
-                WHERE tariff NOT IN ('NONE', 'FREE', NULL)
-                OR user_id IN (
-                    SELECT user_id FROM user_subscriptions 
-                    WHERE is_active = TRUE AND expires_at > NOW()
-                )
-                OR user_id IN (
-                    SELECT user_id FROM plus_package_purchases 
-                    WHERE status = 'active' 
-                    AND (text_used < text_limit OR voice_used < voice_limit)
-                )
-            """)
+            # Barcha aktiv userlar (tarif bo'lganlar) - bugungi tranzaksiyalar bitta GROUP BY so'rovida
+            await run_report_job(
+                'daily_reminder_9am', db,
+                lambda builder: builder.morning_reminders(datetime.now().date()),
+                send_morning_reminder
+            )
             
-            for user_row in active_users:
-                try:
-                    user_id = user_row[0] if isinstance(user_row, tuple) else user_row.get('user_id')
-                    if not user_id:
-                        continue
-                    
-                    # Bugungi tranzaksiyalarni tekshirish
-                    today_transactions = await db.execute_one("""
-                        SELECT COUNT(*) FROM transactions 
-                        WHERE user_id = %s AND DATE(created_at) = CURDATE()
-                    """, (user_id,))
-                    
-                    has_transactions = today_transactions[0] > 0 if today_transactions else False
-                    
-                    if not has_transactions:
-                        # Tranzaksiya yo'q bo'lsa
-                        await bot.send_message(
-                            user_id,
-                            "📋 Bugun hali tranzaksiya qo'shmadingiz.\n\n"
-                            "Xarajat yoki daromad qo'shing, men yozib qo'yaman 😊"
-                        )
-                    else:
-                        # Tranzaksiya bo'lsa ham eslatma
-                        await bot.send_message(
-                            user_id,
-                            "💡 Esingizdan birortasi chiqib qolmadimi?\n\n"
-                            "Agar qo'shgan bo'lsangiz, ularni hozir ayting, men yozib qo'yaman 😊"
-                        )
-                    
-                    await asyncio.sleep(0.5)
-                    
-                except Exception as e:
-                    logging.error(f"Error sending daily reminder to user {user_id}: {e}")
-                    continue
-                    
         except Exception as e:
             logging.error(f"Error in daily reminder task: {e}")
             await asyncio.sleep(3600)
 
+async def send_debt_reminders():
+    """Har kuni 9:00 da qarz qaytarish sanasi kelgan eslatmalar (har biri bir marta)"""
+    # Bot 09:00 dan keyin ishga tushsa bugungi eslatmalar darhol yuboriladi
+    catch_up = True
+    while True:
+        try:
+            from datetime import datetime
+            now = datetime.now()
+            
+            # Keyingi 09:00 ni hisoblash
+            next_run = now.replace(hour=9, minute=0, second=0, microsecond=0)
+            if now >= next_run:
+                next_run = now if catch_up else next_run + timedelta(days=1)
+            catch_up = False
+            
+            # Keyingi ishlash vaqtigacha kutish
+            wait_seconds = (next_run - now).total_seconds()
+            await asyncio.sleep(wait_seconds)
+            
+            # Sanasi kelgan, yuborilmagan eslatmalar - bitta so'rovda (sent_at IS NULL)
+            await run_report_job(
+                'debt_reminders', db,
+                lambda builder: builder.debt_reminders(datetime.now().date()),
+                send_debt_reminder
+            )
+            
+        except Exception as e:
+            logging.error(f"Error in debt reminder task: {e}")
+            await asyncio.sleep(3600)
+
 async def send_daily_analysis_midnight():
     """Har kuni 00:00 da kun tahlili yuborish"""
     while True:
@@ -8688,139 +8873,60 @@ async def send_daily_analysis_midnight():
             wait_seconds = (next_run - now).total_seconds()
             await asyncio.sleep(wait_seconds)
             
-            # Barcha aktiv userlarni olish
-            active_users = await db.execute_query("""
-                SELECT DISTINCT user_id FROM users 
-                WHERE tariff NOT IN ('NONE', 'FREE', NULL)
-                OR user_id IN (
-                    SELECT user_id FROM user_subscriptions 
-                    WHERE is_active = TRUE AND expires_at > NOW()
-                )
-                OR user_id IN (
-                    SELECT user_id FROM plus_package_purchases 
-                    WHERE status = 'active' 
-                    AND (text_used < text_limit OR voice_used < voice_limit)
-                )
-            """)
+            # O'tgan kun (00:00 da ishlaydi) - barcha aktiv userlar bo'yicha to'plamli hisob
+            yesterday = (datetime.now() - timedelta(days=1)).date()
+            await run_report_job(
+                'daily_analysis_midnight', db,
+                lambda builder: builder.midnight_reports(yesterday),
+                send_midnight_analysis
+            )
             
-            for user_row in active_users:
-                try:
-                    user_id = user_row[0] if isinstance(user_row, tuple) else user_row.get('user_id')
-                    if not user_id:
-                        continue
-                    
-                    # O'tgan kun (00:00 da ishlaydi, demak o'tgan kun) tranzaksiyalarni olish
-                    now = datetime.now()
-                    yesterday = (now - timedelta(days=1)).date()
-                    
-                    # O'tgan kun statistikasi
-                    yesterday_stats = await db.execute_one("""
-                        SELECT 
-                            COUNT(*) as count,
-                            SUM(CASE WHEN transaction_type = 'income' THEN amount ELSE 0 END) as income,
-                            SUM(CASE WHEN transaction_type = 'expense' THEN amount ELSE 0 END) as expense,
-                            SUM(CASE WHEN transaction_type = 'debt' THEN amount ELSE 0 END) as debt
-                        FROM transactions 
-                        WHERE user_id = %s AND DATE(created_at) = %s
-                    """, (user_id, yesterday))
-                    
-                    if not yesterday_stats or yesterday_stats.get('count', 0) == 0:
-                        # Hech nima bo'lmagan bo'lsa, yuborilmaydi
-                        continue
-                    
-                    tx_count = yesterday_stats.get('count', 0) if yesterday_stats.get('count') else 0
-                    income = float(yesterday_stats.get('income', 0)) if yesterday_stats.get('income') else 0
-                    expense = float(yesterday_stats.get('expense', 0)) if yesterday_stats.get('expense') else 0
-                    debt = float(yesterday_stats.get('debt', 0)) if yesterday_stats.get('debt') else 0
-                    
-                    # Qarzlar (debt_reminders jadvalidan)
-                    debts_info = await db.execute_query("""
-                        SELECT 
-                            SUM(CASE WHEN debt_direction = 'lent' THEN amount ELSE 0 END) as lent,
-                            SUM(CASE WHEN debt_direction = 'borrowed' THEN amount ELSE 0 END) as borrowed
-                        FROM transactions 
-                        WHERE user_id = %s AND transaction_type = 'debt' AND DATE(created_at) = %s
-                    """, (user_id, yesterday))
-                    
-                    lent = float(debts_info[0].get('lent', 0)) if debts_info and debts_info[0].get('lent') else 0
-                    borrowed = float(debts_info[0].get('borrowed', 0)) if debts_info and debts_info[0].get('borrowed') else 0
-                    
-                    # Kategoriyalar bo'yicha xarajatlar (keraksiz xarajatlarni aniqlash uchun)
-                    category_expenses = await db.execute_query("""
-                        SELECT category, SUM(amount) as total, COUNT(*) as count
-                        FROM transactions
-                        WHERE user_id = %s AND transaction_type = 'expense' AND DATE(created_at) = %s
-                        GROUP BY category
-                        ORDER BY total DESC
-                    """, (user_id, yesterday))
-                    
-                    # Tahlil xabari
-                    analysis = f"📊 **Kun tahlili** ({yesterday.strftime('%d.%m.%Y')})\n\n"
-                    analysis += f"📈 Tranzaksiyalar: {tx_count} ta\n"
-                    analysis += f"💰 Kirimlar: {income:,.0f} so'm\n"
-                    analysis += f"💸 Chiqimlar: {expense:,.0f} so'm\n"
-                    analysis += f"📊 Qoldiq: {income - expense:,.0f} so'm\n"
-                    
-                    if lent > 0 or borrowed > 0:
-                        analysis += f"\n💳 Qarzlar:\n"
-                        if lent > 0:
-                            analysis += f"  • Berilgan: {lent:,.0f} so'm\n"
-                        if borrowed > 0:
-                            analysis += f"  • Olingan: {borrowed:,.0f} so'm\n"
-                    
-                    # AI tahlil
-                    try:
-                        # Keraksiz xarajatlarni aniqlash
-                        unnecessary_categories = []
-                        if category_expenses:
-                            for cat_row in category_expenses:
-                                cat_name = cat_row.get('category')
-                                cat_total = float(cat_row.get('total', 0))
-                                cat_count = int(cat_row.get('count', 0))
-                                
-                                # Agar bir kategoriyada ko'p marta yoki katta summa bo'lsa
-                                if cat_count >= 3 or cat_total > expense * 0.3:  # 30% dan ko'p
-                                    unnecessary_categories.append(f"{cat_name} ({cat_count} marta, {cat_total:,.0f} so'm)")
-                        
-                        # AI prompt
-                        ai_prompt = f"Kun tahlili:\n"
-                        ai_prompt += f"Tranzaksiyalar: {tx_count} ta\n"
-                        ai_prompt += f"Kirim: {income:,.0f} so'm\n"
-                        ai_prompt += f"Chiqim: {expense:,.0f} so'm\n"
-                        if unnecessary_categories:
-                            ai_prompt += f"Keraksiz xarajatlar: {', '.join(unnecessary_categories)}\n"
-                        ai_prompt += f"\nQisqa tahlil qiling va keraksiz xarajatlar bo'lsa, ularni aytib, tejash tavsiyalari bering (max 3 gap)."
-                        
-                        ai_response = await ai_chat.generate_response(user_id, ai_prompt)
-                        if ai_response and len(ai_response) > 0:
-                            analysis += f"\n🤖 **AI Tahlili:**\n{ai_response[0]}"
-                    except Exception as e:
-                        logging.error(f"Error generating AI analysis for user {user_id}: {e}")
-                    
-                    await bot.send_message(user_id, analysis, parse_mode='Markdown')
-                    
-                    await asyncio.sleep(0.5)
-                    
-                except Exception as e:
-                    logging.error(f"Error sending daily analysis to user {user_id}: {e}")
-                    continue
-                    
         except Exception as e:
             logging.error(f"Error in daily analysis task: {e}")
             await asyncio.sleep(3600)
 
+async def cleanup_chat_history():
+    """Har kuni 04:00 da AI chat tarixidan eski xabarlarni o'chirish (retention)"""
+    while True:
+        try:
+            now = datetime.now()
+            next_run = now.replace(hour=4, minute=0, second=0, microsecond=0)
+            if now >= next_run:
+                next_run += timedelta(days=1)
+            await asyncio.sleep((next_run - now).total_seconds())
+            
+            deleted = await ai_chat.purge_chat_history()
+            logging.info(f"AI chat tarixi tozalandi: {deleted} ta eski xabar o'chirildi")
+        except Exception as e:
+            logging.error(f"Error in chat history cleanup task: {e}")
+            await asyncio.sleep(3600)
+
+
+def start_background_tasks():
+    """Kunlik hisobotlar va eslatmalar - bir nechta worker bo'lsa faqat bittasida"""
+    asyncio.create_task(send_daily_reports())  # Pro userlar uchun kechki 21:00
+    asyncio.create_task(send_reminders())  # Eslatmalar 09:00
+    asyncio.create_task(send_daily_reminder_9am())  # Har kuni 9:00 da tranzaksiya eslatmasi
+    asyncio.create_task(send_debt_reminders())  # Har kuni 9:00 da qarz qaytarish eslatmalari
+    asyncio.create_task(send_daily_analysis_midnight())  # Har kuni 00:00 da kun tahlili
+    asyncio.create_task(cleanup_chat_history())  # Har kuni 04:00 da chat tarixi retention
+
+
 async def main():
     """Asosiy dastur - bot va background tasklarni ishga tushirish"""
     try:
         print("🚀 Bot ishga tushmoqda...")
+        timer = StartupTimer()
         
         # Avval database pool yaratish
         print("📊 Ma'lumotlar bazasini ulash...")
-        await db.create_pool()
+        with timer.stage("DB pool"):
+            await db.create_pool()
         print("✅ Ma'lumotlar bazasi ulandi!")
         
         print("📋 Jadvallarni yaratish...")
-        await db.create_tables()
+        with timer.stage("Sxema tekshiruvi"):
+            await db.create_tables()
         print("✅ Jadvallar yaratildi!")
         
         # Business modulga OpenAI client ulash
@@ -8829,17 +8935,19 @@ async def main():
         print("✅ Business AI parser sozlandi!")
         
         print("⚙️ Sozlamalarni yuklash...")
-        await load_config_from_db()
+        with timer.stage("load_config_from_db"):
+            await load_config_from_db()
         print("✅ Sozlamalar bazadan yuklandi!")
         
+        # Qayta ishga tushishdan oldin tugallanmagan broadcast'lar
+        await broadcasts.resume_pending()
+        
         # Database pool yaratilgandan keyin background tasklarni ishga tushirish
-        asyncio.create_task(send_daily_reports())  # Pro userlar uchun kechki 21:00
-        asyncio.create_task(send_reminders())  # Eslatmalar 09:00
-        asyncio.create_task(send_daily_reminder_9am())  # Har kuni 9:00 da tranzaksiya eslatmasi
-        asyncio.create_task(send_daily_analysis_midnight())  # Har kuni 00:00 da kun tahlili
+        start_background_tasks()
         
         # Botni ishga tushirish (blocking)
         print("🤖 Bot polling ni boshlash...")
+        timer.track_first_poll(bot)
         await dp.start_polling(bot)
     except Exception as e:
         print(f"❌ Bot ishga tushishda xatolik: {e}")
@@ -8847,6 +8955,8 @@ async def main():
     finally:
         if hasattr(bot, 'session'):
             await bot.session.close()
+        await dp.storage.close()
+        await llm.close()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
@@ -6,22 +6,22 @@ Faqat moliyaviy funksiyalar
 
 import asyncio
 import logging
-from datetime import datetime
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from config import BOT_TOKEN, TARIFFS, CATEGORIES
 from database import db
+from fsm_storage import create_fsm_storage
 from financial_module import FinancialModule
+from audio_io import download_audio, discard_audio
 from reports_module import ReportsModule
 
 # Bot va dispatcher
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+dp = Dispatcher(storage=create_fsm_storage(db))
 
 # Modullar
 financial_module = FinancialModule()
@@ -311,6 +311,7 @@ async def process_tariff_selection(callback_query: CallbackQuery):
         "UPDATE users SET tariff = %s WHERE user_id = %s",
         (tariff, user_id)
     )
+    db.invalidate_user_cache(user_id)
     
     tariff_name = TARIFFS.get(tariff, "Nomalum")
     message = f"✅ Tarif '{tariff_name}' ga o'zgartirildi!"
@@ -373,25 +374,15 @@ async def process_audio_message(message: types.Message, state: FSMContext):
         file_id = message.voice.file_id if message.voice else message.audio.file_id
         file = await bot.get_file(file_id)
         
-        # Audio faylni saqlash
-        import os
-        audio_dir = "temp_audio"
-        os.makedirs(audio_dir, exist_ok=True)
-        
-        audio_path = f"{audio_dir}/audio_{user_id}_{datetime.now().timestamp()}.ogg"
-        await bot.download_file(file.file_path, audio_path)
-        
-        # Audio faylni qayta ishlash
-        result = await financial_module.process_audio_input(audio_path, user_id)
+        # Audio xotiraga yuklanadi (katta audio - vaqtinchalik faylga)
+        audio = await download_audio(bot, file, user_id)
+        try:
+            result = await financial_module.process_audio_input(audio, user_id)
+        finally:
+            discard_audio(audio)
         
         # Natijani yuborish
         await message.answer(result['message'], parse_mode='Markdown')
-        
-        # Audio faylni o'chirish
-        try:
-            os.remove(audio_path)
-        except:
-            pass
             
     except Exception as e:
         logging.error(f"Audio qayta ishlashda xatolik: {e}")
@@ -409,6 +400,7 @@ async def main():
         # Bot ishga tushirish
         await dp.start_polling(bot)
     finally:
+        await dp.storage.close()
         await bot.session.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+user_balances yig'ma jadvalini tekshirish va qayta hisoblash
+
+Ishga tushirish:
+    python3 manage_balances.py verify [user_id]
+    python3 manage_balances.py rebuild [user_id]
+"""
+
+import asyncio
+import sys
+
+from database import db
+
+
+async def verify(user_id=None) -> bool:
+    """Yig'ma jadval va transactions o'rtasidagi farqlarni chiqarish"""
+    print("🔍 user_balances tekshirilmoqda...")
+    drift = await db.verify_user_balances(user_id)
+    if not drift:
+        print("✅ Farq topilmadi")
+        return True
+
+    print(f"⚠️  {len(drift)} ta farq topildi:")
+    for row in drift[:50]:
+        direction = f"/{row['debt_direction']}" if row['debt_direction'] else ""
+        print(
+            f"   user={row['user_id']} {row['currency']} {row['transaction_type']}{direction}: "
+            f"saqlangan={row['stored']:,.2f} ({row['stored_count']} ta), "
+            f"haqiqiy={row['actual']:,.2f} ({row['actual_count']} ta)"
+        )
+    if len(drift) > 50:
+        print(f"   ... va yana {len(drift) - 50} ta")
+    print("💡 Tuzatish uchun: python3 manage_balances.py rebuild")
+    return False
+
+
+async def rebuild(user_id=None) -> bool:
+    """Yig'ma jadvalni transactions dan qayta hisoblash"""
+    print("🔄 user_balances qayta hisoblanmoqda...")
+    await db.rebuild_user_balances(user_id)
+    print("✅ Tayyor")
+    return True
+
+
+async def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('verify', 'rebuild'):
+        print(__doc__)
+        return False
+
+    command = sys.argv[1]
+    user_id = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    await db.create_pool()
+    try:
+        if command == 'verify':
+            return await verify(user_id)
+        return await rebuild(user_id)
+    finally:
+        await db.close_pool()
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    sys.exit(0 if success else 1)
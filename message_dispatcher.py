@@ -0,0 +1,247 @@
+"""
+Chiquvchi xabarlar uchun umumiy dispetcher
+
+Barcha ommaviy yuborishlar (admin broadcast, kunlik hisobotlar, eslatmalar)
+bot.send_message ni to'g'ridan-to'g'ri emas, shu dispetcher orqali chaqiradi:
+- umumiy token-bucket (Telegram: ~30 xabar/soniya bot bo'yicha)
+- har bir chat uchun minimal oraliq (Telegram: ~1 xabar/soniya bitta chatga)
+- bir vaqtdagi so'rovlar soni cheklovi
+- 429 (RetryAfter) kelsa butun dispetcher ko'rsatilgan vaqtga to'xtaydi va qayta uriniladi
+
+Admin broadcast'lar broadcasts / broadcast_recipients jadvallarida saqlanadi:
+har bir qabul qiluvchining holati partiyalar bilan yoziladi, bot qayta
+ishga tushganda tugallanmagan broadcast'lar qolgan joyidan davom etadi.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+# Telegram limitlaridan biroz past
+GLOBAL_RATE_PER_SECOND = 25
+PER_CHAT_INTERVAL = 1.0
+MAX_CONCURRENCY = 20
+MAX_RETRIES = 3
+
+# Broadcast: bir partiyada olinadigan qabul qiluvchilar soni
+BROADCAST_BATCH_SIZE = 500
+
+
+class TokenBucket:
+    """Soniyasiga rate ta token, capacity gacha yig'iladi"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Lock ostida kutiladi - navbat tartibi saqlanadi
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """429 RetryAfter: shu vaqtgacha hech kimga token berilmaydi"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class MessageDispatcher:
+    """Telegram limitlariga mos, qayta urinishli xabar yuboruvchi"""
+
+    def __init__(self, bot, rate: float = GLOBAL_RATE_PER_SECOND, per_chat_interval: float = PER_CHAT_INTERVAL,
+                 concurrency: int = MAX_CONCURRENCY, max_retries: int = MAX_RETRIES):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._chat_next = {}
+        self.stats = {'sent': 0, 'failed': 0, 'blocked': 0, 'retry_after': 0}
+
+    async def _wait_chat_slot(self, chat_id: int):
+        """Bitta chatga xabarlar orasida per_chat_interval saqlash.
+
+        Yuborishdan darhol oldin chaqiriladi - belgilangan vaqt haqiqiy yuborish vaqtiga teng.
+        """
+        while True:
+            now = time.monotonic()
+            next_at = self._chat_next.get(chat_id, 0.0)
+            if next_at <= now:
+                self._chat_next[chat_id] = now + self.per_chat_interval
+                if len(self._chat_next) > 10000:
+                    self._chat_next = {cid: t for cid, t in self._chat_next.items() if t > now}
+                return
+            await asyncio.sleep(next_at - now)
+
+    async def send(self, chat_id: int, text: str, **kwargs):
+        """bot.send_message bilan bir xil: Message qaytaradi, oxirgi xatolikni ko'taradi"""
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            backoff = 0.0
+            async with self._semaphore:
+                await self._wait_chat_slot(chat_id)
+                try:
+                    message = await self.bot.send_message(chat_id, text, **kwargs)
+                    self.stats['sent'] += 1
+                    return message
+                except TelegramRetryAfter as e:
+                    self.stats['retry_after'] += 1
+                    logging.warning(f"Telegram 429: {e.retry_after} s kutilmoqda (chat {chat_id})")
+                    self.bucket.pause(e.retry_after)
+                    last_error = e
+                except (TelegramNetworkError, TelegramServerError) as e:
+                    last_error = e
+                    backoff = 2 ** attempt
+                except TelegramForbiddenError:
+                    # Foydalanuvchi botni bloklagan - qayta urinish foydasiz
+                    self.stats['blocked'] += 1
+                    raise
+                except TelegramBadRequest:
+                    self.stats['failed'] += 1
+                    raise
+            if backoff:
+                await asyncio.sleep(backoff)
+        self.stats['failed'] += 1
+        raise last_error
+
+    async def try_send(self, chat_id: int, text: str, **kwargs) -> str:
+        """Xatolik ko'tarmaydigan variant: 'sent' | 'blocked' | 'failed'"""
+        try:
+            await self.send(chat_id, text, **kwargs)
+            return 'sent'
+        except TelegramForbiddenError:
+            return 'blocked'
+        except Exception as e:
+            logging.warning(f"Xabar yuborilmadi (chat {chat_id}): {e}")
+            return 'failed'
+
+
+class BroadcastService:
+    """Davom ettiriladigan admin broadcast'lari (holat bazada)"""
+
+    def __init__(self, db, dispatcher: MessageDispatcher):
+        self.db = db
+        self.dispatcher = dispatcher
+        self._running = set()
+
+    async def create(self, text: str, tariff: Optional[str] = None, created_by: int = None) -> int:
+        """Broadcast va qabul qiluvchilar ro'yxatini yaratish (bitta INSERT ... SELECT)"""
+        broadcast_id = await self.db.execute_insert(
+            "INSERT INTO broadcasts (text, tariff, created_by) VALUES (%s, %s, %s)",
+            (text, tariff, created_by)
+        )
+        if tariff:
+            await self.db.execute_query(
+                "INSERT IGNORE INTO broadcast_recipients (broadcast_id, user_id) "
+                "SELECT %s, user_id FROM users WHERE tariff = %s",
+                (broadcast_id, tariff)
+            )
+        else:
+            await self.db.execute_query(
+                "INSERT IGNORE INTO broadcast_recipients (broadcast_id, user_id) "
+                "SELECT %s, user_id FROM users",
+                (broadcast_id,)
+            )
+        await self.db.execute_query(
+            "UPDATE broadcasts SET total = (SELECT COUNT(*) FROM broadcast_recipients WHERE broadcast_id = %s) "
+            "WHERE id = %s",
+            (broadcast_id, broadcast_id)
+        )
+        return broadcast_id
+
+    async def progress(self, broadcast_id: int) -> dict:
+        row = await self.db.execute_one(
+            "SELECT id, status, total, sent, failed FROM broadcasts WHERE id = %s",
+            (broadcast_id,)
+        )
+        return row or {}
+
+    async def run(self, broadcast_id: int,
+                  on_progress: Callable[[dict], Awaitable[None]] = None) -> dict:
+        """Kutilayotgan qabul qiluvchilarga partiyalab yuborish; qayta chaqirilsa davom etadi"""
+        if broadcast_id in self._running:
+            return await self.progress(broadcast_id)
+        self._running.add(broadcast_id)
+        try:
+            broadcast = await self.db.execute_one(
+                "SELECT text FROM broadcasts WHERE id = %s AND status = 'running'",
+                (broadcast_id,)
+            )
+            if not broadcast:
+                return await self.progress(broadcast_id)
+            text = broadcast['text']
+            last_user_id = 0
+            while True:
+                rows = await self.db.execute_query(
+                    """
+                    SELECT user_id FROM broadcast_recipients
+                    WHERE broadcast_id = %s AND status = 'pending' AND user_id > %s
+                    ORDER BY user_id LIMIT %s
+                    """,
+                    (broadcast_id, last_user_id, BROADCAST_BATCH_SIZE)
+                )
+                if not rows:
+                    break
+                user_ids = [row['user_id'] for row in rows]
+                last_user_id = user_ids[-1]
+                results = await asyncio.gather(*[self.dispatcher.try_send(uid, text) for uid in user_ids])
+                await self._save_batch(broadcast_id, user_ids, results)
+                if on_progress:
+                    await on_progress(await self.progress(broadcast_id))
+            await self.db.execute_query(
+                "UPDATE broadcasts SET status = 'done', finished_at = NOW() WHERE id = %s",
+                (broadcast_id,)
+            )
+            return await self.progress(broadcast_id)
+        finally:
+            self._running.discard(broadcast_id)
+
+    async def _save_batch(self, broadcast_id: int, user_ids: list, results: list):
+        by_status = {}
+        for user_id, status in zip(user_ids, results):
+            by_status.setdefault(status, []).append(user_id)
+        async with self.db.transaction() as cursor:
+            for status, ids in by_status.items():
+                placeholders = ', '.join(['%s'] * len(ids))
+                await cursor.execute(
+                    f"UPDATE broadcast_recipients SET status = %s "
+                    f"WHERE broadcast_id = %s AND user_id IN ({placeholders})",
+                    (status, broadcast_id, *ids)
+                )
+            sent = len(by_status.get('sent', []))
+            await cursor.execute(
+                "UPDATE broadcasts SET sent = sent + %s, failed = failed + %s WHERE id = %s",
+                (sent, len(user_ids) - sent, broadcast_id)
+            )
+
+    async def resume_pending(self) -> int:
+        """Qayta ishga tushishda tugallanmagan broadcast'larni fon vazifasi sifatida davom ettirish"""
+        rows = await self.db.execute_query("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id")
+        for row in rows:
+            logging.info(f"Broadcast #{row['id']} davom ettirilmoqda")
+            asyncio.create_task(self.run(row['id']))
+        return len(rows)
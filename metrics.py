@@ -0,0 +1,136 @@
+"""
+Bosqichlar bo'yicha kechikish gistogrammalari
+
+Ovozli xabar yo'lidagi har bir bosqich (Google STT, Whisper, transkriptni
+yaxshilash, ajratish) qancha vaqt olishini jarayon ichida yig'ish uchun.
+Foydalanish:
+
+    with stage_timer('stt.google'):
+        text = await ...
+
+A/B tajribalar uchun record_variant() har bir variant bo'yicha kechikish,
+token va narxni yig'adi (masalan, ovozli xabar: merged / two_pass).
+"""
+
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+# Gistogramma chegaralari (millisekund)
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2000, 5000, 10000, 30000)
+
+
+class LatencyHistogram:
+    """Belgilangan chegaralar bo'yicha kechikishlar soni"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        # Oxirgi katak - eng katta chegaradan uzunlari
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms: float):
+        self.counts[bisect.bisect_left(self.buckets, elapsed_ms)] += 1
+        self.total += 1
+        self.sum_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def percentile(self, q: float) -> float:
+        """Taxminiy persentil - tegishli katakning yuqori chegarasi"""
+        if not self.total:
+            return 0.0
+        target = q * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return float(self.buckets[i]) if i < len(self.buckets) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.total,
+            'avg_ms': self.sum_ms / self.total if self.total else 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': self.max_ms,
+            'buckets': dict(zip([*map(str, self.buckets), 'inf'], self.counts)),
+        }
+
+
+histograms: Dict[str, LatencyHistogram] = {}
+
+
+def observe(stage: str, elapsed_ms: float):
+    histogram = histograms.get(stage)
+    if histogram is None:
+        histogram = histograms[stage] = LatencyHistogram()
+    histogram.observe(elapsed_ms)
+
+
+@contextmanager
+def stage_timer(stage: str, timings: Dict[str, float] = None):
+    """Blok bajarilish vaqtini stage gistogrammasiga yozish (xatolikda ham).
+
+    timings berilsa, shu chaqiruv vaqti unga ham yoziladi (bitta xabar logi uchun).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        observe(stage, elapsed_ms)
+        if timings is not None:
+            timings[stage] = elapsed_ms
+
+
+def latency_report() -> Dict[str, dict]:
+    return {stage: histogram.snapshot() for stage, histogram in sorted(histograms.items())}
+
+
+class VariantStats:
+    """Bitta tajriba varianti: kechikish gistogrammasi va LLM sarfi"""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.llm_calls = 0
+        self.tokens = 0
+        self.cost_usd = 0.0
+
+    def record(self, elapsed_ms: float, usage: dict):
+        self.latency.observe(elapsed_ms)
+        self.llm_calls += usage.get('calls', 0)
+        self.tokens += usage.get('prompt_tokens', 0) + usage.get('completion_tokens', 0)
+        self.cost_usd += usage.get('cost_usd', 0.0)
+
+    def snapshot(self) -> dict:
+        count = self.latency.total or 1
+        latency = self.latency.snapshot()
+        return {
+            'count': self.latency.total,
+            'avg_ms': latency['avg_ms'],
+            'p50_ms': latency['p50_ms'],
+            'p95_ms': latency['p95_ms'],
+            'llm_calls_per_message': self.llm_calls / count,
+            'tokens_per_message': self.tokens / count,
+            'cost_usd_per_message': self.cost_usd / count,
+        }
+
+
+experiments: Dict[str, Dict[str, VariantStats]] = {}
+
+
+def record_variant(experiment: str, variant: str, elapsed_ms: float, usage: dict):
+    """Bitta xabar natijasini tajriba variantiga yozish (usage - llm.track_usage() lug'ati)"""
+    variants = experiments.setdefault(experiment, {})
+    stats = variants.get(variant)
+    if stats is None:
+        stats = variants[variant] = VariantStats()
+    stats.record(elapsed_ms, usage)
+
+
+def ab_report(experiment: str) -> Dict[str, dict]:
+    return {variant: stats.snapshot() for variant, stats in sorted(experiments.get(experiment, {}).items())}
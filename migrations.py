@@ -0,0 +1,382 @@
+"""
+Versiyalangan sxema migratsiyalari
+
+create_tables() jadvallarni CREATE TABLE IF NOT EXISTS bilan yaratadi,
+eski o'rnatishlarni yangilash (ALTER TABLE, indekslar, bir martalik
+ma'lumot tuzatishlari) esa shu yerdagi migratsiyalar orqali bajariladi.
+Har bir migratsiya schema_version jadvaliga yoziladi va faqat bir marta ishlaydi.
+
+Yangi migratsiya qo'shish: funksiya yozing va MIGRATIONS ro'yxatining
+oxiriga keyingi versiya raqami bilan qo'shing. Mavjud migratsiyalarni
+o'zgartirmang - ular allaqachon ishlagan bazalarda qayta bajarilmaydi.
+
+Sxema versiyasi LATEST_VERSION ga teng bo'lsa, create_tables() DDL ni umuman
+ishga tushirmaydi. Shuning uchun yangi jadval yoki ustun ham albatta
+migratsiya sifatida qo'shilishi kerak (CREATE TABLE ni create_tables() ga
+qo'shish yetarli emas - mavjud bazalarda u bajarilmaydi).
+"""
+
+import logging
+
+
+# ============ YORDAMCHI FUNKSIYALAR ============
+
+async def column_exists(db, table: str, column: str) -> bool:
+    """Ustun mavjudligini information_schema orqali tekshirish"""
+    row = await db.execute_one(
+        """
+        SELECT COUNT(*) as count FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        """,
+        (table, column)
+    )
+    return bool(row and row.get('count'))
+
+
+async def index_exists(db, table: str, index_name: str) -> bool:
+    """Indeks mavjudligini tekshirish"""
+    row = await db.execute_one(
+        """
+        SELECT COUNT(*) as count FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        """,
+        (table, index_name)
+    )
+    return bool(row and row.get('count'))
+
+
+async def foreign_key_exists(db, table: str, column: str) -> bool:
+    """Ustunda tashqi kalit (FOREIGN KEY) borligini tekshirish"""
+    row = await db.execute_one(
+        """
+        SELECT COUNT(*) as count FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+          AND REFERENCED_TABLE_NAME IS NOT NULL
+        """,
+        (table, column)
+    )
+    return bool(row and row.get('count'))
+
+
+async def add_column_if_missing(db, table: str, column: str, definition: str) -> None:
+    """Ustun bo'lmasa qo'shish"""
+    if not await column_exists(db, table, column):
+        await db.execute_query(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        logging.info(f"{table}.{column} qo'shildi")
+
+
+async def add_index_if_missing(db, table: str, index_name: str, columns: str) -> None:
+    """Indeks bo'lmasa yaratish"""
+    if not await index_exists(db, table, index_name):
+        await db.execute_query(f"CREATE INDEX {index_name} ON {table} ({columns})")
+        logging.info(f"{table}.{index_name} indeksi yaratildi")
+
+
+async def add_foreign_key_if_missing(db, table: str, column: str, reference: str,
+                                     on_delete: str = "SET NULL", name: str = None) -> None:
+    """Tashqi kalit bo'lmasa qo'shish"""
+    if not await foreign_key_exists(db, table, column):
+        constraint = f"CONSTRAINT {name} " if name else ""
+        await db.execute_query(
+            f"ALTER TABLE {table} ADD {constraint}FOREIGN KEY ({column}) REFERENCES {reference} ON DELETE {on_delete}"
+        )
+        logging.info(f"{table}.{column} foreign key qo'shildi")
+
+
+# ============ MIGRATSIYALAR ============
+
+async def migration_001_legacy_columns(db):
+    """create_tables/add_missing_columns dagi eski ALTER zanjirlari"""
+    tariff_enum = (
+        "ENUM('NONE', 'FREE', 'PLUS', 'PRO', 'FAMILY', 'FAMILY_PLUS', 'FAMILY_PRO', "
+        "'BUSINESS', 'BUSINESS_PLUS', 'BUSINESS_PRO', 'EMPLOYEE')"
+    )
+
+    # users
+    for column, definition in [
+        ("phone", "VARCHAR(20)"),
+        ("name", "VARCHAR(255) DEFAULT 'Xojayin'"),
+        ("source", "VARCHAR(50)"),
+        ("tariff_expires_at", "DATETIME NULL"),
+        ("account_type", "VARCHAR(20) DEFAULT 'SHI'"),
+        ("manager_id", "BIGINT NULL"),
+    ]:
+        await add_column_if_missing(db, "users", column, definition)
+    await add_foreign_key_if_missing(db, "users", "manager_id", "users(user_id)")
+    await db.execute_query(f"ALTER TABLE users MODIFY COLUMN tariff {tariff_enum} DEFAULT 'NONE'")
+
+    # user_subscriptions / payments tarif enumlari
+    await db.execute_query(
+        "ALTER TABLE user_subscriptions MODIFY COLUMN tariff ENUM('PLUS', 'BUSINESS', 'PRO', 'FAMILY', "
+        "'FAMILY_PLUS', 'FAMILY_PRO', 'BUSINESS_PLUS', 'BUSINESS_PRO', 'EMPLOYEE') NOT NULL"
+    )
+    await db.execute_query(
+        "ALTER TABLE payments MODIFY COLUMN tariff ENUM('FREE', 'PLUS', 'PRO', 'FAMILY', 'FAMILY_PLUS', "
+        "'FAMILY_PRO', 'BUSINESS', 'BUSINESS_PLUS', 'BUSINESS_PRO', 'EMPLOYEE') NOT NULL"
+    )
+    # merchant_trans_id: NULL DEFAULT NULL bo'lishi kerak (avval har safar DROP/ADD qilinardi)
+    if await column_exists(db, "payments", "merchant_trans_id"):
+        await db.execute_query("ALTER TABLE payments MODIFY COLUMN merchant_trans_id VARCHAR(255) NULL DEFAULT NULL")
+    else:
+        await db.execute_query("ALTER TABLE payments ADD COLUMN merchant_trans_id VARCHAR(255) NULL DEFAULT NULL")
+
+    # plus_package_purchases
+    await add_column_if_missing(db, "plus_package_purchases", "expires_at", "DATETIME NULL")
+    await db.execute_query(
+        "ALTER TABLE plus_package_purchases MODIFY COLUMN status ENUM('active','completed') DEFAULT 'active'"
+    )
+    await db.execute_query(
+        "UPDATE plus_package_purchases SET status = 'active' "
+        "WHERE status NOT IN ('active', 'completed') OR status IS NULL"
+    )
+
+    # transactions
+    for column, definition in [
+        ("due_date", "DATE NULL"),
+        ("debt_direction", "ENUM('lent','borrowed') NULL"),
+        ("currency", "VARCHAR(10) DEFAULT 'UZS'"),
+        ("category_contact_id", "INT NULL"),
+    ]:
+        await add_column_if_missing(db, "transactions", column, definition)
+    await add_foreign_key_if_missing(db, "transactions", "category_contact_id", "contacts(id)")
+
+    # contacts
+    for column, definition in [
+        ("contact_type", "ENUM('person', 'category') DEFAULT 'person'"),
+        ("category_name", "VARCHAR(100) NULL"),
+        ("transaction_type", "ENUM('income', 'expense', 'both') NULL"),
+    ]:
+        await add_column_if_missing(db, "contacts", column, definition)
+    await add_index_if_missing(db, "contacts", "idx_contact_type", "contact_type")
+    await add_index_if_missing(db, "contacts", "idx_category_name", "category_name")
+
+    # debts
+    for column, definition in [
+        ("paid_amount", "DECIMAL(15,2) DEFAULT 0"),
+        ("contact_id", "INT NULL"),
+        ("currency", "VARCHAR(10) DEFAULT 'UZS'"),
+        ("description", "TEXT NULL"),
+    ]:
+        await add_column_if_missing(db, "debts", column, definition)
+    await add_foreign_key_if_missing(db, "debts", "contact_id", "contacts(id)", name="fk_debts_contact")
+
+    # reminders
+    for column, definition in [
+        ("location", "VARCHAR(255) NULL"),
+        ("is_recurring", "BOOLEAN DEFAULT FALSE"),
+        ("recurrence_pattern", "ENUM('daily', 'weekly', 'monthly', 'yearly') NULL"),
+        ("recurrence_day", "INT NULL"),
+        ("notification_30min_sent", "BOOLEAN DEFAULT FALSE"),
+        ("notification_exact_sent", "BOOLEAN DEFAULT FALSE"),
+    ]:
+        await add_column_if_missing(db, "reminders", column, definition)
+    await db.execute_query(
+        "ALTER TABLE reminders MODIFY COLUMN reminder_type "
+        "ENUM('debt_give', 'debt_receive', 'payment', 'meeting', 'event', 'task', 'other') NOT NULL"
+    )
+
+    # warehouse
+    await add_column_if_missing(db, "warehouse_products", "unit", "VARCHAR(50) DEFAULT 'dona'")
+    await add_column_if_missing(db, "warehouse_movements", "reason", "VARCHAR(100) DEFAULT 'other'")
+
+
+async def migration_002_legacy_data_fixes(db):
+    """Bir martalik ma'lumot tuzatishlari va default valyuta kurslari"""
+    # Premium tarifli foydalanuvchilarni FREE ga o'zgartirish
+    await db.execute_query("UPDATE users SET tariff = 'FREE' WHERE tariff = 'PREMIUM'")
+    await db.execute_query("UPDATE payments SET tariff = 'FREE' WHERE tariff = 'PREMIUM'")
+    await db.execute_query("UPDATE user_subscriptions SET tariff = 'FREE' WHERE tariff = 'PREMIUM'")
+
+    # Default kurslar - admin o'zgartirgan kurslar ustidan yozilmaydi
+    for code, rate in [('UZS', 1.0), ('USD', 12750.0), ('EUR', 13800.0), ('RUB', 135.0), ('TRY', 370.0)]:
+        await db.execute_query(
+            "INSERT IGNORE INTO currency_rates (currency_code, rate_to_uzs) VALUES (%s, %s)",
+            (code, rate)
+        )
+
+
+async def migration_003_hot_query_indexes(db):
+    """Tez-tez ishlatiladigan user_id + sana so'rovlari uchun kompozit indekslar"""
+    # Oylik limit, get_monthly_stats, get_category_stats, kunlik hisobotlar
+    await add_index_if_missing(db, "transactions", "idx_user_created", "user_id, created_at")
+    # Tur bo'yicha filtrlangan kunlik/oylik yig'indilar
+    await add_index_if_missing(db, "transactions", "idx_user_type_created", "user_id, transaction_type, created_at")
+    # Chat tarixi: oxirgi N ta xabar
+    await add_index_if_missing(db, "ai_chat_history", "idx_user_created", "user_id, created_at")
+    # Bugungi qarz eslatmalari
+    await add_index_if_missing(db, "debt_reminders", "idx_user_reminder_date", "user_id, reminder_date")
+
+
+async def migration_004_user_balances_backfill(db):
+    """user_balances ni mavjud tranzaksiyalardan to'ldirish"""
+    await db.rebuild_user_balances()
+
+
+async def migration_005_extraction_cache(db):
+    """Bot replikalari uchun umumiy tranzaksiya ajratish keshi"""
+    await db.execute_query("""
+        CREATE TABLE IF NOT EXISTS extraction_cache (
+            cache_key CHAR(64) PRIMARY KEY,
+            result TEXT NOT NULL,
+            expires_at DATETIME NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_expires_at (expires_at)
+        )
+    """)
+
+
+async def migration_006_transactions_created_at_index(db):
+    """Kunlik hisobotlar: barcha foydalanuvchilar bo'yicha bitta kun oralig'ini skanerlash"""
+    await add_index_if_missing(db, "transactions", "idx_created_at", "created_at")
+
+
+async def migration_007_broadcasts(db):
+    """Davom ettiriladigan admin broadcast'lari va qabul qiluvchilar holati"""
+    await db.execute_query("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            text TEXT NOT NULL,
+            tariff VARCHAR(50) NULL,
+            status ENUM('running', 'done', 'cancelled') DEFAULT 'running',
+            total INT DEFAULT 0,
+            sent INT DEFAULT 0,
+            failed INT DEFAULT 0,
+            created_by BIGINT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME NULL,
+            INDEX idx_status (status)
+        )
+    """)
+    await db.execute_query("""
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INT NOT NULL,
+            user_id BIGINT NOT NULL,
+            status ENUM('pending', 'sent', 'failed', 'blocked') DEFAULT 'pending',
+            PRIMARY KEY (broadcast_id, user_id),
+            INDEX idx_broadcast_status (broadcast_id, status, user_id),
+            FOREIGN KEY (broadcast_id) REFERENCES broadcasts(id) ON DELETE CASCADE
+        )
+    """)
+
+
+async def migration_008_fsm_storage(db):
+    """aiogram FSM holatlari (MySQLStorage) - qayta ishga tushishda va workerlar orasida saqlanadi"""
+    await db.execute_query("""
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            storage_key VARCHAR(128) PRIMARY KEY,
+            state VARCHAR(255) NULL,
+            data MEDIUMTEXT NULL,
+            expires_at DATETIME NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_expires (expires_at)
+        )
+    """)
+
+
+async def migration_009_ai_chat_summaries(db):
+    """AI chat: eski xabarlarning foydalanuvchi bo'yicha yig'ma xulosasi"""
+    await db.execute_query("""
+        CREATE TABLE IF NOT EXISTS ai_chat_summaries (
+            user_id BIGINT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            summarized_until_id INT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+    """)
+
+
+async def migration_010_llm_usage(db):
+    """LLM sarfi: foydalanuvchi / oy / vazifa / model bo'yicha haqiqiy tokenlar va narx"""
+    await db.execute_query("""
+        CREATE TABLE IF NOT EXISTS llm_usage (
+            user_id BIGINT NOT NULL,
+            month_year VARCHAR(7) NOT NULL,
+            task VARCHAR(32) NOT NULL,
+            model VARCHAR(64) NOT NULL,
+            calls INT NOT NULL DEFAULT 0,
+            prompt_tokens BIGINT NOT NULL DEFAULT 0,
+            completion_tokens BIGINT NOT NULL DEFAULT 0,
+            cost_uzs DECIMAL(12,4) NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, month_year, task, model),
+            INDEX idx_llm_usage_month (month_year)
+        )
+    """)
+
+
+async def migration_011_debt_reminders_sent(db):
+    """Qarz eslatmalari kunlik job orqali bir marta yuboriladi: yuborilgan vaqt belgisi"""
+    await add_column_if_missing(db, "debt_reminders", "sent_at", "DATETIME NULL")
+    await add_index_if_missing(db, "debt_reminders", "idx_reminder_date_sent", "reminder_date, sent_at")
+
+
+MIGRATIONS = [
+    (1, "legacy_columns", migration_001_legacy_columns),
+    (2, "legacy_data_fixes", migration_002_legacy_data_fixes),
+    (3, "hot_query_indexes", migration_003_hot_query_indexes),
+    (4, "user_balances_backfill", migration_004_user_balances_backfill),
+    (5, "extraction_cache", migration_005_extraction_cache),
+    (6, "transactions_created_at_index", migration_006_transactions_created_at_index),
+    (7, "broadcasts", migration_007_broadcasts),
+    (8, "fsm_storage", migration_008_fsm_storage),
+    (9, "ai_chat_summaries", migration_009_ai_chat_summaries),
+    (10, "llm_usage", migration_010_llm_usage),
+    (11, "debt_reminders_sent", migration_011_debt_reminders_sent),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version(db) -> int:
+    """Bazadagi eng so'nggi qo'llanilgan versiya (schema_version yo'q bo'lsa 0)"""
+    try:
+        row = await db.execute_one("SELECT MAX(version) as version FROM schema_version")
+    except Exception:
+        # Yangi baza - schema_version hali yaratilmagan
+        return 0
+    return (row or {}).get('version') or 0
+
+
+async def schema_is_current(db) -> bool:
+    """Sxema kod bilan bir xil versiyadami - bitta qatorli tekshiruv"""
+    return await get_schema_version(db) >= LATEST_VERSION
+
+
+async def get_applied_versions(db) -> set:
+    """Qo'llanilgan migratsiya versiyalari"""
+    rows = await db.execute_query("SELECT version FROM schema_version")
+    return {row.get('version') for row in rows}
+
+
+async def run_migrations(db) -> int:
+    """Qo'llanilmagan migratsiyalarni tartib bilan bajarish.
+
+    Xatolik bo'lsa, o'sha migratsiya yozilmaydi va keyingilari to'xtatiladi -
+    keyingi ishga tushishda qayta uriniladi. Bajarilgan migratsiyalar sonini qaytaradi.
+    """
+    await db.execute_query("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    applied = await get_applied_versions(db)
+
+    count = 0
+    for version, name, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            await migration(db)
+        except Exception as e:
+            logging.error(f"Migratsiya {version} ({name}) xatolik bilan to'xtadi: {e}")
+            raise
+        await db.execute_query(
+            "INSERT INTO schema_version (version, name) VALUES (%s, %s)",
+            (version, name)
+        )
+        logging.info(f"Migratsiya {version} ({name}) qo'llanildi")
+        count += 1
+    return count
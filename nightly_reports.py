@@ -0,0 +1,274 @@
+"""
+Kunlik hisobotlar uchun to'plamli (set-based) hisobot quruvchi
+
+send_daily_reports (21:00, Pro), send_daily_analysis_midnight (00:00) va
+send_daily_reminder_9am avval har bir foydalanuvchi uchun alohida so'rovlar
+yuborardi. Endi kunning barcha foydalanuvchilar bo'yicha yig'indilari bir
+nechta GROUP BY user_id so'rovida hisoblanadi, tayyor hisobotlar navbat
+(asyncio.Queue) orqali SENDER_WORKERS ta yuboruvchi workerga oqim sifatida
+uzatiladi. Yuborish SEND_RATE_PER_SECOND (20 xabar/s) bilan tekislanadi -
+message_dispatcher ning umumiy 25 xabar/s limitidan interaktiv javoblar
+uchun joy qoladi. Har bir ishga tushish
+oxirida vaqt, foydalanuvchilar va so'rovlar soni bilan xulosa yoziladi.
+
+send_debt_reminders (09:00) ham shu navbatdan foydalanadi: qarz eslatmalari
+avval har bir callback'da foydalanuvchi bo'yicha so'ralardi, endi kuniga bir
+marta bitta so'rovda olinadi va debt_reminders.sent_at bilan bir marta yuboriladi.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import date, timedelta
+from typing import AsyncIterator, Awaitable, Callable, Dict, List
+
+# Qarzlar so'rovida IN (...) ro'yxatining maksimal uzunligi
+USER_CHUNK_SIZE = 1000
+
+# Parallel yuboruvchi workerlar (har biri AI tahlil + xabar yuborish) va
+# ularning umumiy tezligi (xabar/soniya) - MessageDispatcher limitidan past
+SENDER_WORKERS = 10
+SEND_RATE_PER_SECOND = 20
+
+# Qarz eslatmalari: shuncha kun oldingi yuborilmay qolganlari ham yuboriladi
+DEBT_REMINDER_CATCHUP_DAYS = 3
+
+# Navbatdagi tayyor hisobotlar soni - quruvchi yuboruvchidan juda oldinlab ketmasin
+QUEUE_SIZE = 200
+
+
+class NightlyReportBuilder:
+    """Kunlik yig'indilarni barcha foydalanuvchilar uchun bir nechta so'rovda hisoblash"""
+
+    def __init__(self, db):
+        self.db = db
+        self.queries = 0
+
+    async def _query(self, query: str, params=None) -> List[dict]:
+        self.queries += 1
+        return await self.db.execute_query(query, params)
+
+    async def pro_user_ids(self) -> List[int]:
+        rows = await self._query("""
+            SELECT DISTINCT user_id FROM users
+            WHERE tariff = 'PRO'
+            OR user_id IN (
+                SELECT user_id FROM user_subscriptions
+                WHERE tariff = 'PRO' AND is_active = TRUE AND expires_at > NOW()
+            )
+        """)
+        return [row['user_id'] for row in rows if row.get('user_id')]
+
+    async def active_user_ids(self) -> List[int]:
+        rows = await self._query("""
+            SELECT DISTINCT user_id FROM users
+            WHERE tariff NOT IN ('NONE', 'FREE', NULL)
+            OR user_id IN (
+                SELECT user_id FROM user_subscriptions
+                WHERE is_active = TRUE AND expires_at > NOW()
+            )
+            OR user_id IN (
+                SELECT user_id FROM plus_package_purchases
+                WHERE status = 'active'
+                AND (text_used < text_limit OR voice_used < voice_limit)
+            )
+        """)
+        return [row['user_id'] for row in rows if row.get('user_id')]
+
+    async def day_totals(self, day: date) -> Dict[int, dict]:
+        """Kun bo'yicha har bir foydalanuvchining kirim/chiqim/qarz yig'indilari"""
+        rows = await self._query("""
+            SELECT
+                user_id,
+                COUNT(*) as count,
+                SUM(CASE WHEN transaction_type = 'income' THEN amount ELSE 0 END) as income,
+                SUM(CASE WHEN transaction_type = 'expense' THEN amount ELSE 0 END) as expense,
+                SUM(CASE WHEN transaction_type = 'debt' THEN amount ELSE 0 END) as debt,
+                SUM(CASE WHEN transaction_type = 'debt' AND debt_direction = 'lent' THEN amount ELSE 0 END) as debt_lent,
+                SUM(CASE WHEN transaction_type = 'debt' AND debt_direction = 'borrowed' THEN amount ELSE 0 END) as debt_borrowed
+            FROM transactions
+            WHERE created_at >= %s AND created_at < %s
+            GROUP BY user_id
+        """, (day, day + timedelta(days=1)))
+        return {
+            row['user_id']: {
+                'count': int(row.get('count') or 0),
+                'income': float(row.get('income') or 0),
+                'expense': float(row.get('expense') or 0),
+                'debt': float(row.get('debt') or 0),
+                'debt_lent': float(row.get('debt_lent') or 0),
+                'debt_borrowed': float(row.get('debt_borrowed') or 0),
+            }
+            for row in rows
+        }
+
+    async def day_expense_categories(self, day: date) -> Dict[int, List[dict]]:
+        """Kun bo'yicha har bir foydalanuvchining xarajat kategoriyalari (kattasidan boshlab)"""
+        rows = await self._query("""
+            SELECT user_id, category, SUM(amount) as total, COUNT(*) as count
+            FROM transactions
+            WHERE transaction_type = 'expense' AND created_at >= %s AND created_at < %s
+            GROUP BY user_id, category
+            ORDER BY user_id, total DESC
+        """, (day, day + timedelta(days=1)))
+        categories = {}
+        for row in rows:
+            categories.setdefault(row['user_id'], []).append({
+                'category': row.get('category'),
+                'total': float(row.get('total') or 0),
+                'count': int(row.get('count') or 0),
+            })
+        return categories
+
+    async def open_debts(self, user_ids: List[int]) -> Dict[int, dict]:
+        """To'lanmagan qarzlar yig'indisi (berilgan / olingan)"""
+        debts = {}
+        for i in range(0, len(user_ids), USER_CHUNK_SIZE):
+            chunk = user_ids[i:i + USER_CHUNK_SIZE]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            rows = await self._query(f"""
+                SELECT
+                    user_id,
+                    SUM(CASE WHEN debt_type = 'lent' THEN amount ELSE 0 END) as lent,
+                    SUM(CASE WHEN debt_type = 'borrowed' THEN amount ELSE 0 END) as borrowed
+                FROM debts
+                WHERE status != 'paid' AND user_id IN ({placeholders})
+                GROUP BY user_id
+            """, tuple(chunk))
+            for row in rows:
+                debts[row['user_id']] = {
+                    'lent': float(row.get('lent') or 0),
+                    'borrowed': float(row.get('borrowed') or 0),
+                }
+        return debts
+
+    async def evening_reports(self, day: date) -> AsyncIterator[dict]:
+        """21:00 Pro hisobotlari: bugungi kirim/chiqim va ochiq qarzlar"""
+        user_ids = await self.pro_user_ids()
+        totals = await self.day_totals(day)
+        debts = await self.open_debts([user_id for user_id in user_ids if user_id in totals])
+        for user_id in user_ids:
+            day_total = totals.get(user_id)
+            if not day_total:
+                yield {'user_id': user_id, 'has_transactions': False}
+                continue
+            debt = debts.get(user_id, {})
+            yield {
+                'user_id': user_id,
+                'has_transactions': True,
+                'income': day_total['income'],
+                'expense': day_total['expense'],
+                'lent': debt.get('lent', 0.0),
+                'borrowed': debt.get('borrowed', 0.0),
+            }
+
+    async def morning_reminders(self, day: date) -> AsyncIterator[dict]:
+        """09:00 eslatmasi: barcha aktiv foydalanuvchilar, bugun tranzaksiya bor/yo'qligi bilan"""
+        user_ids = await self.active_user_ids()
+        totals = await self.day_totals(day)
+        for user_id in user_ids:
+            yield {'user_id': user_id, 'has_transactions': user_id in totals}
+
+    async def debt_reminders(self, day: date) -> AsyncIterator[dict]:
+        """09:00 qarz eslatmalari: sanasi kelgan va hali yuborilmaganlar (idx_reminder_date_sent)"""
+        rows = await self._query("""
+            SELECT dr.id, dr.user_id, dr.reminder_date, tr.amount, tr.debt_direction, tr.due_date
+            FROM debt_reminders dr
+            JOIN transactions tr ON tr.id = dr.transaction_id AND tr.user_id = dr.user_id
+            WHERE dr.reminder_date BETWEEN %s AND %s AND dr.sent_at IS NULL
+            ORDER BY dr.reminder_date, dr.id
+        """, (day - timedelta(days=DEBT_REMINDER_CATCHUP_DAYS), day))
+        for row in rows:
+            yield {
+                'user_id': row['user_id'],
+                'reminder_id': row['id'],
+                'overdue': row['reminder_date'] < day,
+                'amount': float(row.get('amount') or 0),
+                'direction': row.get('debt_direction'),
+                'due_date': row.get('due_date'),
+            }
+
+    async def midnight_reports(self, day: date) -> AsyncIterator[dict]:
+        """00:00 kun tahlili: faqat o'tgan kunda tranzaksiyasi bo'lgan aktiv foydalanuvchilar"""
+        user_ids = await self.active_user_ids()
+        totals = await self.day_totals(day)
+        categories = await self.day_expense_categories(day)
+        for user_id in user_ids:
+            day_total = totals.get(user_id)
+            if not day_total or not day_total['count']:
+                continue
+            yield {
+                'user_id': user_id,
+                'day': day,
+                **day_total,
+                'categories': categories.get(user_id, []),
+            }
+
+
+async def dispatch_reports(reports: AsyncIterator[dict], send: Callable[[dict], Awaitable[None]],
+                           workers: int = SENDER_WORKERS,
+                           rate_per_second: float = SEND_RATE_PER_SECOND) -> dict:
+    """Hisobotlarni navbat orqali workerlarga uzatish. {'built', 'sent', 'failed'} qaytaradi"""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    counts = {'built': 0, 'sent': 0, 'failed': 0}
+    # Workerlar umumiy jadvaldan navbat oladi: ikki yuborish orasida kamida interval
+    interval = 1 / rate_per_second
+    next_slot = time.monotonic()
+
+    async def pace():
+        nonlocal next_slot
+        now = time.monotonic()
+        slot = max(next_slot, now)
+        next_slot = slot + interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def worker():
+        while True:
+            report = await queue.get()
+            try:
+                if report is None:
+                    return
+                await pace()
+                await send(report)
+                counts['sent'] += 1
+            except Exception as e:
+                counts['failed'] += 1
+                logging.error(f"Kunlik hisobotni yuborishda xatolik (user {report.get('user_id')}): {e}")
+            finally:
+                queue.task_done()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        async for report in reports:
+            counts['built'] += 1
+            await queue.put(report)
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return counts
+
+
+async def run_report_job(name: str, db, build: Callable[[NightlyReportBuilder], AsyncIterator[dict]],
+                         send: Callable[[dict], Awaitable[None]]) -> dict:
+    """Hisobot ishini bajarish va xulosani log qilish"""
+    started = time.perf_counter()
+    builder = NightlyReportBuilder(db)
+    counts = await dispatch_reports(build(builder), send)
+    summary = {
+        'job': name,
+        'wall_seconds': time.perf_counter() - started,
+        'users_processed': counts['built'],
+        'sent': counts['sent'],
+        'failed': counts['failed'],
+        'queries': builder.queries,
+    }
+    logging.info(
+        f"Kunlik hisobot '{name}': {summary['wall_seconds']:.1f} s, "
+        f"{summary['users_processed']} foydalanuvchi, {summary['sent']} yuborildi, "
+        f"{summary['failed']} xato, {summary['queries']} SQL so'rov"
+    )
+    return summary
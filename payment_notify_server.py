@@ -1,77 +1,200 @@
 #!/usr/bin/env python3
 """
-Mini ilova uchun payment notify server
-5005-portda ishlaydi
+Mini ilova uchun payment notify server (aiohttp)
+PAYMENT_NOTIFY_PORT (5005) portda ishlaydi
+
+Avval Flask har bir so'rovda yangi thread va yangi event loop yaratib
+bot.send_message ni chaqirardi - Bot'ning aiohttp sessiyasi birinchi loop'ga
+bog'lanib qolardi. Endi hammasi bitta event loop'da:
+
+- bitta Bot va uning sessiyasi server ishlagan butun vaqt davomida
+- POST /payment-notify xabarni cheklangan navbatga (PAYMENT_NOTIFY_QUEUE_SIZE)
+  qo'yadi va darhol javob beradi. Navbat to'la bo'lsa 503 - mini ilova
+  keyinroq qayta yuboradi
+- yuboruvchi workerlar xabarlarni message_dispatcher.MessageDispatcher
+  orqali yuboradi (Telegram tezlik limitlari, 429 va qayta urinishlar)
+- idempotency kaliti: Idempotency-Key sarlavhasi yoki body dagi
+  idempotency_key / payment_id / transaction_id. Bir xil kalit
+  PAYMENT_NOTIFY_IDEMPOTENCY_TTL ichida qayta kelsa xabar yuborilmaydi
+  ({"ok": true, "duplicate": true}). Kalit bo'lmasa user_id:amount:status
+  faqat PAYMENT_NOTIFY_DUPLICATE_WINDOW soniya ichida takroriy hisoblanadi -
+  bir xil summadagi keyingi haqiqiy to'lov xabari yo'qolmaydi. Yuborish
+  muvaffaqiyatsiz bo'lsa kalit o'chiriladi - qayta urinish xabarni yuboradi
+- GET /metrics - qabul qilingan, takroriy, rad etilgan, yuborilgan xabarlar va navbat chuqurligi
+
+Yuklama testi: python3 load_payment_notify.py
+
+Ishga tushirish:
+    python3 payment_notify_server.py
 """
 
-from flask import Flask, request, jsonify
 import asyncio
+import logging
 import sys
-import threading
+import time
 from pathlib import Path
+from typing import Optional
+
+from aiohttp import web
 
 # Project root ni path ga qo'shish
 project_dir = Path(__file__).parent
 sys.path.insert(0, str(project_dir))
 
-from aiogram import Bot
-from config import BOT_TOKEN
+from cache import TTLCache, MISSING
+from config import (
+    BOT_TOKEN,
+    PAYMENT_NOTIFY_DUPLICATE_WINDOW,
+    PAYMENT_NOTIFY_IDEMPOTENCY_TTL,
+    PAYMENT_NOTIFY_PORT,
+    PAYMENT_NOTIFY_QUEUE_SIZE,
+)
+from message_dispatcher import GLOBAL_RATE_PER_SECOND, PER_CHAT_INTERVAL, MessageDispatcher
+
+# Parallel yuboruvchi workerlar (tezlik MessageDispatcher da cheklanadi)
+SENDER_WORKERS = 20
+# Eslab qolinadigan idempotency kalitlari soni
+IDEMPOTENCY_MAXSIZE = 100000
+# To'xtashda navbatdagi xabarlarni yuborib bo'lish uchun vaqt (soniya)
+STOP_TIMEOUT = 30
+
+
+def payment_message(amount: float, status: str) -> str:
+    if status == "success":
+        return f"✅ To'lov {amount:,.0f} so'm muvaffaqiyatli amalga oshirildi!"
+    return f"⚠️ To'lov amalga oshmadi. Status: {status}"
+
+
+def idempotency_key(request: web.Request, data: dict) -> Optional[str]:
+    """Aniq to'lov ID si (sarlavha yoki body); bo'lmasa None"""
+    key = request.headers.get('Idempotency-Key')
+    for field in ('idempotency_key', 'payment_id', 'transaction_id'):
+        if key:
+            break
+        key = data.get(field)
+    return str(key) if key else None
+
 
-app = Flask(__name__)
-bot = Bot(token=BOT_TOKEN)
+class PaymentNotifier:
+    """To'lov xabarlarini qabul qilish va bitta bot sessiyasi orqali navbat bilan yuborish"""
 
+    def __init__(self, bot=None, queue_size: int = PAYMENT_NOTIFY_QUEUE_SIZE, workers: int = SENDER_WORKERS,
+                 rate: float = GLOBAL_RATE_PER_SECOND, per_chat_interval: float = PER_CHAT_INTERVAL,
+                 idempotency_ttl: float = PAYMENT_NOTIFY_IDEMPOTENCY_TTL,
+                 duplicate_window: float = PAYMENT_NOTIFY_DUPLICATE_WINDOW):
+        # bot berilmasa on_startup da yaratiladi va on_cleanup da yopiladi
+        self.bot = bot
+        self._owns_bot = bot is None
+        self.rate = rate
+        self.per_chat_interval = per_chat_interval
+        self.outbox = None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.seen = TTLCache(maxsize=IDEMPOTENCY_MAXSIZE, ttl=idempotency_ttl)
+        # ID siz xabarlar: faqat qisqa oynadagi qayta urinishlar takroriy
+        self.recent = TTLCache(maxsize=IDEMPOTENCY_MAXSIZE, ttl=duplicate_window)
+        self.workers = workers
+        self._tasks = []
+        self.started = time.monotonic()
+        self.stats = {'received': 0, 'duplicates': 0, 'rejected': 0, 'invalid': 0,
+                      'sent': 0, 'blocked': 0, 'failed': 0}
+
+    async def handle_notify(self, request: web.Request) -> web.Response:
+        """Mini ilovadan keladigan to'lov ma'lumotlarini qabul qilish"""
+        try:
+            data = await request.json()
+            user_id = int(data.get('user_id') or 0)
+            amount = float(data.get('amount') or 0)
+            status = str(data.get('status') or '')
+        except (ValueError, TypeError, AttributeError):
+            self.stats['invalid'] += 1
+            return web.json_response({"ok": False, "error": "Invalid request body"}, status=400)
 
-@app.route('/payment-notify', methods=['POST'])
-def payment_notify():
-    """Mini ilovadan keladigan to'lov ma'lumotlarini qabul qilish"""
-    try:
-        data = request.get_json()
-        
-        # Ma'lumotlarni tekshirish
-        user_id = data.get('user_id')
-        amount = data.get('amount')
-        status = data.get('status')
-        
         if not user_id or not amount or not status:
-            return jsonify({"ok": False, "error": "Missing required fields"}), 400
-        
-        # Status ga qarab xabar yuborish
-        def send_message_sync():
+            self.stats['invalid'] += 1
+            return web.json_response({"ok": False, "error": "Missing required fields"}, status=400)
+
+        key = idempotency_key(request, data)
+        seen = self.seen
+        if key is None:
+            key, seen = f"{user_id}:{amount:.2f}:{status}", self.recent
+        if seen.get(key) is not MISSING:
+            self.stats['duplicates'] += 1
+            return web.json_response({"ok": True, "duplicate": True})
+
+        try:
+            self.queue.put_nowait((seen, key, user_id, payment_message(amount, status)))
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            return web.json_response({"ok": False, "error": "Queue is full, retry later"}, status=503)
+        seen.set(key, True)
+        self.stats['received'] += 1
+        return web.json_response({"ok": True})
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
             try:
-                # Yangi event loop yaratish va ishga tushirish
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    if status == "success":
-                        message = f"✅ To'lov {amount:,} so'm muvaffaqiyatli amalga oshirildi!"
-                    else:
-                        message = f"⚠️ To'lov amalga oshmadi. Status: {status}"
-                    
-                    loop.run_until_complete(bot.send_message(chat_id=user_id, text=message))
-                    print(f"✅ Xabar yuborildi: user_id={user_id}, status={status}")
-                finally:
-                    loop.close()
-            except Exception as e:
-                print(f"❌ Xatolik: {e}")
-        
-        # Background da ishga tushirish (Flask thread pool)
-        threading.Thread(target=send_message_sync, daemon=True).start()
-        
-        return jsonify({"ok": True}), 200
-        
-    except Exception as e:
-        print(f"❌ Server xatolik: {e}")
-        return jsonify({"ok": False, "error": str(e)}), 500
-
-
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Server holatini tekshirish"""
-    return jsonify({"status": "ok", "message": "Payment notify server is running"}), 200
+                if item is None:
+                    return
+                seen, key, user_id, text = item
+                result = await self.outbox.try_send(user_id, text)
+                self.stats[result] += 1
+                if result == 'failed':
+                    # Mini ilova qayta yuborsa xabar yana navbatga tushadi
+                    seen.invalidate(key)
+                else:
+                    logging.info(f"✅ Xabar yuborildi: user_id={user_id} ({result})")
+            finally:
+                self.queue.task_done()
+
+    def metrics(self) -> dict:
+        return {
+            'uptime_seconds': round(time.monotonic() - self.started, 1),
+            **self.stats,
+            'queue_depth': self.queue.qsize(),
+            'idempotency_keys': self.seen.stats()['size'],
+        }
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.json_response(self.metrics())
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """Server holatini tekshirish"""
+        return web.json_response({"status": "ok", "message": "Payment notify server is running"})
+
+    async def on_startup(self, app: web.Application):
+        if self.bot is None:
+            from aiogram import Bot
+            self.bot = Bot(token=BOT_TOKEN)
+        self.outbox = MessageDispatcher(self.bot, rate=self.rate, per_chat_interval=self.per_chat_interval,
+                                        concurrency=self.workers)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def on_cleanup(self, app: web.Application):
+        # Navbatdagi xabarlar yuboriladi, keyin workerlar to'xtaydi
+        for _ in self._tasks:
+            await self.queue.put(None)
+        done, pending = await asyncio.wait(self._tasks, timeout=STOP_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logging.warning(f"To'xtash: {self.queue.qsize()} ta xabar yuborilmay qoldi")
+        if self._owns_bot:
+            await self.bot.session.close()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/payment-notify', self.handle_notify)
+        app.router.add_get('/metrics', self.handle_metrics)
+        app.router.add_get('/health', self.handle_health)
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     print("🚀 Payment Notify Server ishga tushmoqda...")
-    print("📡 Port: 5005")
-    print("🔗 Endpoint: http://0.0.0.0:5005/payment-notify")
-    app.run(host='0.0.0.0', port=5005, debug=False)
+    print(f"📡 Port: {PAYMENT_NOTIFY_PORT}")
+    print(f"🔗 Endpoint: http://0.0.0.0:{PAYMENT_NOTIFY_PORT}/payment-notify")
+    web.run_app(PaymentNotifier().create_app(), host='0.0.0.0', port=PAYMENT_NOTIFY_PORT)
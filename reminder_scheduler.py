@@ -0,0 +1,181 @@
+"""
+Eslatmalar uchun xotiradagi rejalashtiruvchi (min-heap)
+
+send_reminders avval har minutda ikki marta reminders jadvalini skanerlardi.
+Endi keyingi HORIZON_HOURS soatdagi eslatmalar bir marta (sana diapazoni
+bo'yicha) yuklanadi va heap'ga qo'yiladi: har bir eslatma uchun ikkita
+hodisa - 30 daqiqa oldin va aniq vaqtda. Bot navbatdagi hodisa vaqtigacha
+uxlaydi, minutlik skanerlar yo'q.
+
+Yangi/o'zgargan eslatmalar Database.reminder_listeners orqali keladi
+(create_reminder, mark_reminder_completed, create_next_recurring_reminder).
+Webhook rejimida boshqa workerlar o'zgarishlarni 0-workerga navbat orqali
+yuboradi (webhook_server._relay_reminder_changes).
+Boshqa yo'llar bilan o'zgargan qatorlar (to'g'ridan-to'g'ri SQL, boshqa
+replika) RECONCILE_INTERVAL da bir marta to'liq qayta yuklash bilan
+tuzatiladi. Yuborishdan oldin bayroq shartli UPDATE bilan "egallanadi" -
+bitta bildirishnoma ikki marta ketmaydi. Yuborish muvaffaqiyatsiz bo'lsa
+bayroq qaytariladi va FIRE_RETRY_DELAY dan keyin qayta uriniladi.
+"""
+
+import asyncio
+import heapq
+import logging
+from datetime import datetime, time as dt_time, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+# Oldindan yuklanadigan oyna
+HORIZON_HOURS = 6
+# To'liq qayta yuklash (reconciliation) oralig'i, soniya
+RECONCILE_INTERVAL = 15 * 60
+# Oldingi so'rov bilan bir xil: 30 daqiqa oldin, aniq vaqtdan 5 daqiqagacha kechikish
+NOTICE_BEFORE = timedelta(minutes=30)
+EXACT_GRACE = timedelta(minutes=5)
+
+# Yuborish muvaffaqiyatsiz bo'lsa (fire xatolik ko'tarsa) qayta urinishlar
+FIRE_RETRIES = 3
+FIRE_RETRY_DELAY = 60
+
+KIND_30MIN = '30min'
+KIND_EXACT = 'exact'
+
+
+def reminder_datetime(reminder: dict) -> Optional[datetime]:
+    """reminder_date + reminder_time (TIME ustuni aiomysql da timedelta bo'lib keladi)"""
+    reminder_date = reminder.get('reminder_date')
+    if reminder_date is None:
+        return None
+    reminder_time = reminder.get('reminder_time')
+    if isinstance(reminder_time, timedelta):
+        return datetime.combine(reminder_date, dt_time()) + reminder_time
+    if isinstance(reminder_time, dt_time):
+        return datetime.combine(reminder_date, reminder_time)
+    return datetime.combine(reminder_date, dt_time(9, 0))
+
+
+class ReminderScheduler:
+    """Heap asosidagi eslatma taymerlari"""
+
+    def __init__(self, db, fire: Callable[[str, dict], Awaitable[None]],
+                 horizon_hours: float = HORIZON_HOURS, reconcile_interval: float = RECONCILE_INTERVAL):
+        self.db = db
+        self.fire = fire
+        self.horizon = timedelta(hours=horizon_hours)
+        self.reconcile_interval = reconcile_interval
+        self._heap = []
+        # reminder_id → eng so'nggi qator; heap'dagi eskirgan yozuvlar versiya bo'yicha tashlab ketiladi
+        self._reminders: Dict[int, dict] = {}
+        self._versions: Dict[int, int] = {}
+        self._wakeup = asyncio.Event()
+        self.stats = {'loaded': 0, 'fired': 0, 'skipped': 0, 'reconciles': 0}
+
+    def attach(self):
+        """Database o'zgarishlariga obuna bo'lish"""
+        if self.on_reminder_changed not in self.db.reminder_listeners:
+            self.db.reminder_listeners.append(self.on_reminder_changed)
+
+    def __len__(self):
+        return len(self._reminders)
+
+    def schedule(self, reminder: dict, now: datetime = None):
+        """Eslatmani (qayta) rejalashtirish; oynadan tashqaridagisi e'tiborsiz qoldiriladi"""
+        reminder_id = reminder['id']
+        self.discard(reminder_id)
+        at = reminder_datetime(reminder)
+        now = now or datetime.now()
+        if at is None or reminder.get('is_completed') or at > now + self.horizon:
+            return
+        version = self._versions.get(reminder_id, 0) + 1
+        self._versions[reminder_id] = version
+        pushed = False
+        if not reminder.get('notification_30min_sent') and at >= now:
+            heapq.heappush(self._heap, (max(at - NOTICE_BEFORE, now), reminder_id, version, KIND_30MIN))
+            pushed = True
+        if not reminder.get('notification_exact_sent') and at >= now - EXACT_GRACE:
+            heapq.heappush(self._heap, (max(at, now), reminder_id, version, KIND_EXACT))
+            pushed = True
+        if pushed:
+            self._reminders[reminder_id] = reminder
+            self._wakeup.set()
+
+    def discard(self, reminder_id: int):
+        """Heap'dan olib tashlash (yozuvlar navbati kelganda versiya bo'yicha tashlanadi)"""
+        if self._reminders.pop(reminder_id, None) is not None:
+            self._versions[reminder_id] = self._versions.get(reminder_id, 0) + 1
+
+    async def on_reminder_changed(self, reminder_id: int, removed: bool = False):
+        if removed:
+            self.discard(reminder_id)
+            return
+        reminder = await self.db.get_pending_reminder(reminder_id)
+        if reminder:
+            self.schedule(reminder)
+        else:
+            self.discard(reminder_id)
+
+    async def reconcile(self):
+        """Oynadagi barcha kutilayotgan eslatmalarni bazadan qayta yuklash"""
+        now = datetime.now()
+        rows = await self.db.get_pending_reminders_between(
+            (now - EXACT_GRACE).date(), (now + self.horizon).date()
+        )
+        self._heap = []
+        self._reminders = {}
+        self._versions = {}
+        for row in rows:
+            self.schedule(row, now)
+        self.stats['loaded'] = len(self._reminders)
+        self.stats['reconciles'] += 1
+        logging.info(f"Eslatmalar rejalashtiruvchisi: {len(self._reminders)} ta eslatma, {len(self._heap)} ta taymer")
+
+    def _pop_due(self, now: datetime):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, reminder_id, version, kind = heapq.heappop(self._heap)
+            reminder = self._reminders.get(reminder_id)
+            if reminder is None or self._versions.get(reminder_id) != version:
+                self.stats['skipped'] += 1
+                continue
+            due.append((kind, reminder))
+            if kind == KIND_EXACT:
+                # Aniq vaqt - eslatmaning oxirgi hodisasi
+                self._reminders.pop(reminder_id, None)
+        return due
+
+    async def _fire(self, kind: str, reminder: dict):
+        for attempt in range(FIRE_RETRIES + 1):
+            try:
+                await self.fire(kind, reminder)
+                self.stats['fired'] += 1
+                return
+            except Exception as e:
+                logging.error(f"Eslatma {reminder.get('id')} ({kind}) yuborishda xatolik "
+                              f"(urinish {attempt + 1}/{FIRE_RETRIES + 1}): {e}")
+            if attempt < FIRE_RETRIES:
+                await asyncio.sleep(FIRE_RETRY_DELAY)
+
+    async def run(self):
+        """Asosiy sikl: navbatdagi taymergacha yoki reconciliation vaqtigacha uxlash"""
+        loop = asyncio.get_running_loop()
+        next_reconcile = 0.0
+        while True:
+            try:
+                if loop.time() >= next_reconcile:
+                    await self.reconcile()
+                    next_reconcile = loop.time() + self.reconcile_interval
+
+                for kind, reminder in self._pop_due(datetime.now()):
+                    asyncio.create_task(self._fire(kind, reminder))
+
+                timeout = next_reconcile - loop.time()
+                if self._heap:
+                    timeout = min(timeout, (self._heap[0][0] - datetime.now()).total_seconds())
+                self._wakeup.clear()
+                if timeout > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except Exception as e:
+                logging.error(f"Eslatmalar rejalashtiruvchisida xatolik: {e}")
+                await asyncio.sleep(60)
@@ -13,44 +13,16 @@ class ReportsModule:
             # Valyuta kurslarini olish
             rates = await db.get_currency_rates()
             
-            # Jami kirim - valyuta konvertatsiyasi bilan
-            income_query = """
-            SELECT amount, currency FROM transactions 
-            WHERE user_id = %s AND transaction_type = 'income'
-            """
-            income_results = await db.execute_query(income_query, (user_id,))
+            # Bitta GROUP BY so'rovdan valyuta bo'yicha summalar
+            aggregates = await db.get_balance_aggregates(user_id)
             total_income = 0.0
-            for row in income_results:
-                amount = float(row[0]) if row[0] else 0.0
-                currency = row[1] if row[1] else 'UZS'
-                rate = rates.get(currency, 1.0)
-                total_income += amount * rate
-            
-            # Jami chiqim - valyuta konvertatsiyasi bilan
-            expense_query = """
-            SELECT amount, currency FROM transactions 
-            WHERE user_id = %s AND transaction_type = 'expense'
-            """
-            expense_results = await db.execute_query(expense_query, (user_id,))
             total_expense = 0.0
-            for row in expense_results:
-                amount = float(row[0]) if row[0] else 0.0
-                currency = row[1] if row[1] else 'UZS'
-                rate = rates.get(currency, 1.0)
-                total_expense += amount * rate
-            
-            # Jami qarz - valyuta konvertatsiyasi bilan
-            debt_query = """
-            SELECT amount, currency FROM transactions 
-            WHERE user_id = %s AND transaction_type = 'debt'
-            """
-            debt_results = await db.execute_query(debt_query, (user_id,))
             total_debt = 0.0
-            for row in debt_results:
-                amount = float(row[0]) if row[0] else 0.0
-                currency = row[1] if row[1] else 'UZS'
+            for currency, bucket in aggregates.items():
                 rate = rates.get(currency, 1.0)
-                total_debt += amount * rate
+                total_income += bucket['income'] * rate
+                total_expense += bucket['expense'] * rate
+                total_debt += bucket['debt'] * rate
             
             balance = total_income - total_expense
             
@@ -0,0 +1,193 @@
+"""
+LLM javobini Telegram'ga oqim bilan chiqarish
+
+Avval foydalanuvchi to'liq javob tayyor bo'lguncha kutardi. Endi
+TelegramStreamer token bo'laklarini qabul qiladi va:
+
+- birinchi matn kelishi bilan xabar yuboradi (yoki "O'ylayapman..."
+  xabarini tahrirlaydi) - shu vaqt <metric>.first_visible gistogrammasiga
+  yoziladi
+- keyingi bo'laklar bilan xabarni EDIT_INTERVAL dan tez bo'lmagan oraliqda
+  tahrirlaydi (Telegram: bitta chatga ~1 so'rov/soniya), 429 kelsa ko'rsatilgan
+  vaqtgacha tahrirlash to'xtaydi
+- split_stable javobning o'zgarmaydigan boshini xabarlarga bo'ladi: tayyor
+  xabar yakunlanadi va davomi yangi xabarda chiqadi. Oqim tugaganda
+  split_final (masalan AIChat._split_response_smart) yakuniy bo'lishni beradi
+- MESSAGE_BREAK oqimdagi majburiy xabar chegarasi (javobdan keyingi
+  eslatma matni kabi)
+"""
+
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from metrics import observe
+
+# Bitta xabarni tahrirlashlar orasidagi minimal vaqt (soniya)
+EDIT_INTERVAL = 1.0
+# Kamida shuncha yangi belgi bo'lmasa tahrirlanmaydi
+MIN_EDIT_CHARS = 15
+# Telegram xabar chegarasi 4096 belgi
+MAX_MESSAGE_LENGTH = 4096
+# Rasm/hujjat izohi (caption) chegarasi
+MAX_CAPTION_LENGTH = 1024
+# Oqimdagi majburiy xabar chegarasi
+MESSAGE_BREAK = '\f'
+# Javob hali yozilayotganini ko'rsatuvchi belgi
+CURSOR = ' ▌'
+
+
+def _split_final(text: str) -> List[str]:
+    return [text.strip()] if text.strip() else []
+
+
+def _split_stable(text: str) -> Tuple[List[str], str]:
+    return [], text.strip()
+
+
+def fit_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Chegaradan uzun matnni bo'sh joy/qator bo'yicha bo'lish"""
+    pieces = []
+    while len(text) > limit:
+        cut = max(text.rfind('\n', 0, limit), text.rfind(' ', 0, limit))
+        if cut <= 0:
+            cut = limit
+        pieces.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+class TelegramStreamer:
+    """Token oqimini bitta yoki bir nechta Telegram xabariga chiqarish"""
+
+    def __init__(self, bot, chat_id: int,
+                 split_final: Callable[[str], List[str]] = _split_final,
+                 split_stable: Callable[[str], Tuple[List[str], str]] = _split_stable,
+                 placeholder=None, prefix: str = '', reply_markup=None,
+                 metric: str = 'stream', started: float = None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.split_final = split_final
+        self.split_stable = split_stable
+        self.prefix = prefix
+        self.reply_markup = reply_markup
+        self.metric = metric
+        self.started = started or time.perf_counter()
+        # Tahrirlanayotgan xabar (placeholder bo'lsa shu xabar)
+        self.live = placeholder
+        self.shown = ''
+        self.next_edit_at = 0.0
+        # Joriy bo'lim (MESSAGE_BREAK gacha) matni va undan yakunlangan xabarlar soni
+        self.segment = ''
+        self.committed = 0
+        self.sent: List[str] = []
+        self.first_visible_ms: Optional[float] = None
+
+    async def feed(self, delta: str):
+        *closed, tail = (self.segment + delta).split(MESSAGE_BREAK)
+        for segment in closed:
+            self.segment = segment
+            await self._close_segment()
+        self.segment = tail
+        parts, rest = self.split_stable(self.segment)
+        for part in parts[self.committed:]:
+            await self._commit(part)
+        self.committed = max(self.committed, len(parts))
+        if rest:
+            await self._preview(rest)
+
+    async def finish(self) -> List[str]:
+        """Oqim tugadi: oxirgi bo'limni yakuniy bo'lish bilan chiqarish. Yuborilgan xabarlar matni"""
+        await self._close_segment()
+        observe(f'{self.metric}.complete', (time.perf_counter() - self.started) * 1000)
+        return self.sent
+
+    async def _close_segment(self):
+        parts = self.split_final(self.segment)
+        for part in parts[self.committed:]:
+            await self._commit(part)
+        if self.live is not None and self.shown:
+            # Yakuniy bo'lishda qolmagan ko'rinish - kursorsiz qoldiriladi
+            await self._edit(self.shown.removesuffix(CURSOR), force=True)
+            self.live = None
+        self.segment = ''
+        self.committed = 0
+        self.shown = ''
+
+    def _decorate(self, text: str) -> str:
+        return self.prefix + text if not self.sent else text
+
+    async def _commit(self, text: str):
+        """Tayyor xabar: tahrirlanayotgan xabarni yakunlash yoki yangisini yuborish"""
+        pieces = fit_message(self._decorate(text))
+        for piece in pieces:
+            if self.live is not None:
+                await self._edit(piece, force=True)
+                self.live = None
+            else:
+                await self._send(piece)
+            self.sent.append(piece)
+        self.shown = ''
+
+    async def _preview(self, text: str):
+        text = fit_message(self._decorate(text))[0] + CURSOR
+        if self.live is None or not self.shown:
+            if self.live is None:
+                self.live = await self._send(text)
+            else:
+                await self._edit(text, force=True)
+            self.shown = text
+            return
+        if len(text) - len(self.shown) < MIN_EDIT_CHARS or time.monotonic() < self.next_edit_at:
+            return
+        await self._edit(text)
+
+    def _mark_visible(self):
+        if self.first_visible_ms is None:
+            self.first_visible_ms = (time.perf_counter() - self.started) * 1000
+            observe(f'{self.metric}.first_visible', self.first_visible_ms)
+
+    async def _send(self, text: str):
+        self._mark_visible()
+        try:
+            message = await self.bot.send_message(self.chat_id, text, reply_markup=self.reply_markup)
+        except TelegramRetryAfter as e:
+            logging.warning(f"Oqim: Telegram 429, {e.retry_after} s kutilmoqda (chat {self.chat_id})")
+            await asyncio.sleep(e.retry_after)
+            message = await self.bot.send_message(self.chat_id, text, reply_markup=self.reply_markup)
+        # Klaviatura faqat birinchi xabarga biriktiriladi
+        self.reply_markup = None
+        self.next_edit_at = time.monotonic() + EDIT_INTERVAL
+        return message
+
+    async def _edit(self, text: str, force: bool = False):
+        """Tahrirlash. force - yakuniy matn: 429 bo'lsa kutib qayta uriniladi"""
+        self._mark_visible()
+        while True:
+            try:
+                await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.live.message_id)
+                break
+            except TelegramRetryAfter as e:
+                self.next_edit_at = time.monotonic() + e.retry_after
+                if not force:
+                    return
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if 'not modified' not in str(e):
+                    logging.warning(f"Oqim: xabarni tahrirlab bo'lmadi (chat {self.chat_id}): {e}")
+                break
+        self.shown = text
+        self.next_edit_at = time.monotonic() + EDIT_INTERVAL
+
+
+async def stream_reply(bot, chat_id: int, chunks: AsyncIterator[str], **kwargs) -> List[str]:
+    """Oqimni oxirigacha Telegram'ga chiqarish (kwargs - TelegramStreamer parametrlari)"""
+    streamer = TelegramStreamer(bot, chat_id, **kwargs)
+    async for delta in chunks:
+        await streamer.feed(delta)
+    return await streamer.finish()
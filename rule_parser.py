@@ -0,0 +1,532 @@
+"""
+Qoidaga asoslangan tezkor tranzaksiya ajratuvchi
+
+"taksi 20 ming", "ovqatga 50k", "ish haqi 5 mln tushdi" kabi oddiy xabarlarni
+LLM ga yubormasdan tahlil qiladi. Faqat yuqori ishonchli natija qaytaradi -
+shubha bo'lsa (bir nechta summa, eslatma, qarz qaytarish, ziddiyatli tur va h.k.)
+None qaytaradi va xabar odatdagidek LLM ga o'tadi. Summaning o'zi shubhali
+bo'lsa (MIN_AMOUNTS dan kichik yoki "100 m" kabi noaniq birlik) natija
+LOW_CONFIDENCE bilan qaytadi - chaqiruvchilar FAST_PATH_CONFIDENCE dan past
+natijani avtomatik saqlamaydi, xabarni LLM ga yuboradi.
+
+Natija _extract_financial_data_with_gpt4 bilan bir xil formatda:
+{"transactions": [{...}], "total_confidence": 0.95, "source": "rules"}
+"""
+
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from config import CATEGORIES
+
+HIGH_CONFIDENCE = 0.95
+GENERIC_CONFIDENCE = 0.9
+# Summa shubhali bo'lsa (juda kichik yoki "100 m" - million yoki metr?)
+LOW_CONFIDENCE = 0.6
+# Shundan past ishonchli natija LLM siz ishlatilmaydi (avtomatik saqlash chegarasi 0.85)
+FAST_PATH_CONFIDENCE = GENERIC_CONFIDENCE
+
+# ============ SUMMALAR ============
+
+NUMBER_WORDS = {
+    'bir': 1, 'ikki': 2, 'uch': 3, "to'rt": 4, 'tort': 4, 'besh': 5, 'olti': 6,
+    'yetti': 7, 'sakkiz': 8, "to'qqiz": 9, 'toqqiz': 9,
+    "o'n": 10, 'on': 10, 'yigirma': 20, "o'ttiz": 30, 'ottiz': 30, 'qirq': 40,
+    'ellik': 50, 'oltmish': 60, 'yetmish': 70, 'sakson': 80, "to'qson": 90, 'toqson': 90,
+}
+HUNDRED_WORDS = {'yuz'}
+SCALE_WORDS = {
+    'k': 1_000, 'ming': 1_000, 'tysyach': 1_000,
+    'm': 1_000_000, 'mln': 1_000_000, 'million': 1_000_000, 'milion': 1_000_000,
+    'mlrd': 1_000_000_000, 'milliard': 1_000_000_000,
+}
+# "mingga", "mlndan" kabi qo'shimchali shakllar uchun
+SCALE_SUFFIXES = ('', 'ga', 'dan', 'da', 'ni', 'lik', 'gina')
+
+_NUMBER_RE = re.compile(
+    r"(?<![\w.,])(\d{1,3}(?:[ ,.]\d{3})+|\d+(?:[.,]\d+)?)\s*"
+    r"(mlrd|milliard|million|milion|mln|ming|k|m)?([a-z']*)"
+)
+_TIME_RE = re.compile(r"\b\d{1,2}:\d{2}\b")
+_UNIT_RE = re.compile(r"\d\s*(kg|kilo|dona|qop|litr|tonna|metr|ta)\b")
+# Yolg'iz "m" - million, metr yoki minut bo'lishi mumkin
+_AMBIGUOUS_SCALE_RE = re.compile(r"\d\s*m(?:ga|dan|da|ni|lik|gina)?$")
+# Valyuta bo'yicha real summa chegarasi: "non 5" odatda 5 ming, 5 so'm emas
+MIN_AMOUNTS = {'UZS': 1000}
+
+# ============ VALYUTALAR ============
+# _extract_financial_data_with_gpt4 promptidagi ro'yxatlar bilan bir xil
+CURRENCY_ALIASES = {
+    'UZS': ["so'm", 'som', 'sum', 'сум'],
+    'USD': ['dollar', 'dollor', 'usd', '$'],
+    'EUR': ['euro', 'evro', 'eur', '€'],
+    'RUB': ['rubl', 'rub', 'рубль'],
+    'TRY': ['lira', 'try'],
+}
+CURRENCY_SUFFIXES = ('', 'ga', 'dan', 'da', 'lik', 'ni')
+
+# ============ TUR KALIT SO'ZLARI ============
+
+INCOME_WORDS = ('tushdi', 'keldi', 'kirim', 'daromad', 'topdim', 'ishladim')
+EXPENSE_WORDS = ('xarajat', 'chiqim', 'sarfladim', "to'ladim", 'toladim', 'ketdi', 'sotib', 'xarid', 'berdim')
+DEBT_LENT_WORDS = ('berdim', 'berib', 'beraman')
+DEBT_BORROWED_WORDS = ('oldim', 'olib', 'olaman')
+DEBT_RETURN_WORDS = ('qaytardi', 'qaytardim', "to'ladi", "to'ladim", 'uzdi', 'uzdim', 'yopdi', 'yopdim')
+# Promptdagi eslatma belgilari - bunday xabarlar LLM ga qoldiriladi
+REMINDER_WORDS = ('eslat', 'kerak', 'borishim', 'ketishim', 'uchrashuv', 'meeting')
+# Vaqt/sana belgilari - eslatma bo'lishi mumkin (has_reminder_cues)
+# Prefiks bo'yicha tekshiriladi; ortiqcha mos kelish faqat bitta LLM so'rovi, tushib qolish - yo'qolgan eslatma
+REMINDER_TIME_WORDS = (
+    'ertaga', 'indin', 'bugun', 'ertalab', 'kechqurun', 'kechasi', 'tushdan', 'hafta', 'keyingi',
+    'soat', 'har', 'dars', "ko'rish", 'borish', 'safar', "qo'ng'iroq", 'unutma',
+    'dushanba', 'seshanba', 'chorshanba', 'payshanba', 'juma', 'shanba', 'yakshanba',
+    'yanvar', 'fevral', 'mart', 'aprel', 'may', 'iyun', 'iyul', 'avgust', 'sentabr', 'oktabr', 'noyabr', 'dekabr',
+    'напомн', 'забуд', 'забы', 'сегодня', 'завтра', 'послезавтра', 'утр', 'вечер', 'ночь',
+    'недел', 'понедельник', 'вторник', 'среду', 'четверг', 'пятниц', 'суббот', 'воскресен',
+    'встреч', 'позвон', 'час',
+)
+# "в 10", "к 9", "10 da" - soat so'zisiz vaqt
+_HOUR_RE = re.compile(r"(?:\b(?:в|к|до)\s+\d{1,2}\b)|(?:\b(?:[01]?\d|2[0-3])\s*(?:da|ga|gacha)\b)")
+_DATE_RE = re.compile(r"\b\d{1,2}[-.](?:[a-z]+|\d{1,2})\b")
+# Bir nechta tranzaksiya yoki sana bilan bog'liq xabarlar LLM ga qoldiriladi
+COMPLEX_WORDS = ('keyin', 'yana', 'qaytarish', 'kecha', 'ertaga', 'yil', 'oy', 'hafta')
+FILLER_WORDS = {
+    'uchun', 'bugun', 'pul', 'pulga', 'puli', 'ga', 'da', 'dan', 'men', 'menga', 'mening',
+    'bilan', 'jami', 'hammasi', 'summa', 'naqd', 'karta', 'kartadan', 'kartaga',
+}
+
+# ============ KATEGORIYALAR ============
+# Promptdagi "Kategoriya = sinonimlar" ro'yxatlari; kalitlar config.CATEGORIES dan
+CATEGORY_ALIASES = {
+    # Kirim
+    'Ish haqi': ['oylik', 'maosh', 'ish haqi', 'zarplata'],
+    'Bonus': ['bonus'],
+    'Mukofot': ['mukofot', 'sovrin'],
+    'Biznes': ['biznes'],
+    'Savdo': ['savdo'],
+    "Do'kon": ["do'kon", 'dokon', 'magazin'],
+    'Depozit': ['depozit', 'omonat'],
+    'Dividend': ['dividend', 'aksiya'],
+    'Sotuv': ['sotuv'],
+    'Ijaradan daromad': ['ijaradan'],
+    'Grant': ['grant', 'subsidiya'],
+    'Loyiha': ['loyiha'],
+    'Freelance': ['freelance', 'frilans'],
+    'Konsultatsiya': ['konsultatsiya'],
+    'Komissiya': ['komissiya'],
+    # Chiqim
+    'Ovqat': ['ovqat', 'somsa', 'lavash', 'shashlik', 'oziq-ovqat', 'sabzavot', 'meva', 'tushlik', 'nonushta'],
+    'Restoran': ['restoran', 'oshxona'],
+    'Kafe': ['kafe', 'qahvaxona', 'kofe'],
+    'Fastfood': ['fastfood', 'burger', 'pizza', 'hotdog'],
+    'Non': ['non', 'nonvoyxona'],
+    'Sut': ['sut'],
+    "Go'sht": ["go'sht", 'gosht'],
+    'Transport': ['transport'],
+    'Taksi': ['taksi', 'taxi', 'yandex', 'uber'],
+    'Benzin': ['benzin', 'propan', 'metan'],
+    "Yoqilg'i": ["yoqilg'i", 'dizel'],
+    'Metro': ['metro'],
+    'Avtobus': ['avtobus'],
+    'Kiyim': ['kiyim', 'libos'],
+    'Poyabzal': ['poyabzal', 'tufli', 'botinka', 'krossovka'],
+    'Aksessuar': ['aksessuar', 'sumka', "ko'zoynak"],
+    'Kvartira': ['kvartira'],
+    'Mebel': ['mebel', 'divan'],
+    'Kommunal': ['kommunal'],
+    'Elektr': ['elektr', 'svet'],
+    'Gaz': ['gaz'],
+    'Issiqlik': ['issiqlik', 'isitish'],
+    'Dori': ['dori', 'apteka', 'dorixona'],
+    'Shifokor': ['shifokor', 'doktor', 'vrach'],
+    'Klinika': ['klinika', 'shifoxona'],
+    'Maktab': ['maktab'],
+    'Universitet': ['universitet', 'kontrakt'],
+    'Kitob': ['kitob'],
+    'Kino': ['kino', 'kinoteatr'],
+    'Teatr': ['teatr'],
+    'Konsert': ['konsert'],
+    'Sayohat': ['sayohat'],
+    'Samolyot': ['samolyot', 'avia'],
+    'Mehmonxona': ['mehmonxona', 'hotel'],
+    'Viza': ['viza'],
+    'Kredit': ['kredit'],
+    'Internet': ['internet'],
+    'Telefon': ['telefon', 'paynet'],
+    'Sport': ['sport'],
+    'Fitnes': ['fitnes', 'zal'],
+    'Masaj': ['masaj', 'massaj'],
+    'Parikmaxona': ['parikmaxona', 'sartarosh'],
+    'Salon': ['salon'],
+    "Tug'ilgan kun": ["tug'ilgan kun"],
+    "To'y": ["to'y", 'toy'],
+}
+# So'z oxiridagi qo'shimchalar: "taksiga", "ovqatga", "dorilarga"
+WORD_SUFFIXES = ('', 'ga', 'ka', 'qa', 'da', 'dan', 'ni', 'ning', 'lar', 'larga', 'larni', 'im', 'imga', 'imdan', 'i', 'si')
+
+DEBT_CATEGORIES = {'debt_lent': 'Qarz berish', 'debt_borrowed': 'Qarz olish'}
+
+
+def normalize(text: str) -> str:
+    """Kichik harf va apostroflarni bir xil ko'rinishga keltirish"""
+    text = text.lower().strip()
+    for ch in ('‘', '’', 'ʻ', 'ʼ', '`', '´'):
+        text = text.replace(ch, "'")
+    return re.sub(r"\s+", " ", text)
+
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r"[a-zа-яё'$€-]+|\d+(?:[.,]\d+)?", text)
+
+
+VERB_SUFFIXES = ('', 'm', 'mi', 'ik', 'miz')
+
+
+@lru_cache(maxsize=None)
+def _forms(words: Tuple[str, ...], suffixes: Tuple[str, ...] = WORD_SUFFIXES) -> frozenset:
+    """So'zlarning qo'shimchali barcha shakllari - token bo'yicha O(1) tekshirish uchun"""
+    return frozenset(word + suffix for word in words for suffix in suffixes)
+
+
+def _matches_word(token: str, word: str, suffixes=WORD_SUFFIXES) -> bool:
+    return token in _forms((word,), tuple(suffixes))
+
+
+def _scale_of(word: str) -> Optional[int]:
+    for suffix in SCALE_SUFFIXES:
+        if suffix and word.endswith(suffix):
+            base = word[:-len(suffix)]
+        elif not suffix:
+            base = word
+        else:
+            continue
+        if base in SCALE_WORDS:
+            return SCALE_WORDS[base]
+    return None
+
+
+def _parse_digits(raw: str) -> float:
+    """'100 000', '1,200', '1.5', '2,5' ko'rinishidagi raqamlar"""
+    if re.fullmatch(r"\d{1,3}(?:[ ,.]\d{3})+", raw):
+        return float(re.sub(r"[ ,.]", "", raw))
+    return float(raw.replace(',', '.'))
+
+
+def extract_amounts(text: str) -> List[Tuple[float, int, int]]:
+    """Matndagi barcha summalar: (summa, boshlanish, tugash) ro'yxati"""
+    amounts = []
+    for match in _NUMBER_RE.finditer(text):
+        raw, scale_word, tail = match.group(1), match.group(2), match.group(3)
+        value = _parse_digits(raw)
+        end = match.end()
+        if scale_word:
+            scale = _scale_of(scale_word + tail)
+            if scale is None:
+                # "5 kg", "3 mashina" - summa emas, ko'paytiruvchi ham emas
+                scale = 1
+                end = match.start(2)
+            value *= scale
+        elif tail:
+            end = match.start(3)
+        else:
+            # "20 ming", "5 mln" - ko'paytiruvchi alohida so'z bo'lsa
+            rest = re.match(r"\s*([a-z']+)", text[end:])
+            if rest:
+                scale = _scale_of(rest.group(1))
+                if scale:
+                    value *= scale
+                    end += rest.end()
+        amounts.append((value, match.start(), end))
+    # Raqamli summalar o'rni bo'shliq bilan to'ldiriladi - "20 ming" dagi "ming" qayta sanalmasin
+    masked = text
+    for _, start, end in amounts:
+        masked = masked[:start] + ' ' * (end - start) + masked[end:]
+    amounts.extend(_extract_word_amounts(masked))
+    return amounts
+
+
+def _extract_word_amounts(text: str) -> List[Tuple[float, int, int]]:
+    """'yigirma besh ming', 'ikki yuz ming', 'bir million' kabi so'z bilan yozilgan summalar"""
+    amounts = []
+    total = current = 0
+    start = end = None
+    for match in re.finditer(r"[a-z']+", text):
+        word = match.group()
+        scale = _scale_of(word) if start is not None or word not in ('m', 'k') else None
+        if word in NUMBER_WORDS:
+            current += NUMBER_WORDS[word]
+        elif word in HUNDRED_WORDS:
+            current = (current or 1) * 100
+        elif scale and start is not None:
+            total += (current or 1) * scale
+            current = 0
+        elif scale and word in ('ming', 'million', 'milliard', 'mln'):
+            # Faqat "ming lira", "million so'm" - bir birlik
+            total += scale
+        else:
+            if start is not None:
+                amounts.append((float(total + current), start, end))
+                total = current = 0
+                start = None
+            continue
+        if start is None:
+            start = match.start()
+        end = match.end()
+    if start is not None:
+        amounts.append((float(total + current), start, end))
+    # "bir" yoki "o'n" yolg'iz - summa emas ("bir kafe", "o'n daqiqa")
+    return [a for a in amounts if a[0] >= 1000]
+
+
+def detect_currency(tokens: List[str]) -> Tuple[Optional[str], set]:
+    """Valyuta va unga tegishli tokenlar"""
+    found = set()
+    used = set()
+    for token in tokens:
+        for code, aliases in CURRENCY_ALIASES.items():
+            if token in _forms(tuple(aliases), CURRENCY_SUFFIXES):
+                found.add(code)
+                used.add(token)
+    if len(found) > 1:
+        return None, used
+    return (found.pop() if found else 'UZS'), used
+
+
+@lru_cache(maxsize=32)
+def _alias_index(aliases: Tuple[Tuple[str, Tuple[str, ...]], ...]):
+    """(shakl → (kategoriya, sinonim)) lug'ati va ko'p so'zli iboralar ro'yxati"""
+    index = {}
+    phrases = []
+    for category, words in aliases:
+        for word in words:
+            if ' ' in word:
+                phrases.append((re.compile(r"\b" + re.escape(word)), category, word))
+                continue
+            for form in _forms((word,)):
+                index.setdefault(form, (category, word))
+    return index, phrases
+
+
+def _find_aliases(text: str, tokens: List[str], aliases: Dict[str, List[str]]) -> Dict[str, str]:
+    """Matndagi sinonimlar: {kategoriya: topilgan so'z}"""
+    index, phrases = _alias_index(tuple((k, tuple(v)) for k, v in aliases.items()))
+    hits = {}
+    for pattern, category, word in phrases:
+        if pattern.search(text):
+            hits.setdefault(category, word)
+    for token in tokens:
+        hit = index.get(token)
+        if hit:
+            hits.setdefault(hit[0], hit[1])
+    return hits
+
+
+def _has_word(tokens: List[str], words) -> bool:
+    return not _forms(tuple(words), VERB_SUFFIXES).isdisjoint(tokens)
+
+
+def _category_type(category: str) -> Optional[str]:
+    in_income = category in CATEGORIES['income']
+    in_expense = category in CATEGORIES['expense']
+    if in_income and not in_expense:
+        return 'income'
+    if in_expense and not in_income:
+        return 'expense'
+    return None
+
+
+def _debt_person(tokens: List[str], direction: str) -> Optional[str]:
+    """'Hasanga qarz berdim' → Hasan, 'Komildan qarz oldim' / 'Ali dan' → Komil / Ali"""
+    suffixes = ('ga', 'ka', 'qa') if direction == 'debt_lent' else ('dan',)
+    skip = {'qarz', 'qarzga', 'pul', 'pulni'} | FILLER_WORDS
+    for i, token in enumerate(tokens):
+        if token in suffixes and i > 0 and not tokens[i - 1][0].isdigit():
+            return tokens[i - 1]
+        if token in skip or token[0].isdigit():
+            continue
+        for suffix in suffixes:
+            if token.endswith(suffix) and len(token) > len(suffix) + 1:
+                return token[:-len(suffix)]
+    return None
+
+
+def amount_confidence(amount: float, currency: str, amount_text: str, confidence: float) -> float:
+    """Summa shubhali bo'lsa ishonchni LOW_CONFIDENCE gacha pasaytirish"""
+    if amount < MIN_AMOUNTS.get(currency, 0) or _AMBIGUOUS_SCALE_RE.search(amount_text.strip()):
+        return min(confidence, LOW_CONFIDENCE)
+    return confidence
+
+
+def has_reminder_cues(text: str) -> bool:
+    """Xabarda eslatma belgisi (vaqt, sana, eslatma so'zi) bormi.
+
+    False bo'lsa eslatma aniqlash LLM so'rovi o'tkazib yuboriladi.
+    """
+    if not text:
+        return False
+    normalized = normalize(text)
+    if _TIME_RE.search(normalized) or _DATE_RE.search(normalized) or _HOUR_RE.search(normalized):
+        return True
+    return any(token.startswith(word) for token in tokenize(normalized)
+               for word in REMINDER_WORDS + REMINDER_TIME_WORDS)
+
+
+def parse_transaction(text: str) -> Optional[Dict]:
+    """Shaxsiy tariflar uchun tezkor tahlil - ishonch past bo'lsa None"""
+    if not text or len(text) > 120:
+        return None
+    normalized = normalize(text)
+    if _TIME_RE.search(normalized) or _UNIT_RE.search(normalized):
+        return None
+
+    amounts = extract_amounts(normalized)
+    if len(amounts) != 1:
+        return None
+    amount, amount_start, amount_end = amounts[0]
+    if amount <= 0:
+        return None
+    amount_text = normalized[amount_start:amount_end]
+
+    rest = normalized[:amount_start] + ' ' + normalized[amount_end:]
+    tokens = tokenize(rest)
+    if any(token.startswith(word) for token in tokens for word in REMINDER_WORDS):
+        return None
+    if any(token in COMPLEX_WORDS for token in tokens) or ',' in rest or ' va ' in f" {rest} ":
+        return None
+
+    currency, currency_tokens = detect_currency(tokens)
+    if not currency:
+        return None
+
+    transaction = {'amount': amount, 'currency': currency}
+
+    # Qarz: "qarz" so'zi majburiy (promptdagi qoida)
+    if any(token.startswith('qarz') for token in tokens):
+        if _has_word(tokens, DEBT_RETURN_WORDS) or "qarz to'lovi" in rest:
+            return None
+        lent = _has_word(tokens, DEBT_LENT_WORDS)
+        borrowed = _has_word(tokens, DEBT_BORROWED_WORDS)
+        if lent == borrowed:
+            return None
+        trans_type = 'debt_lent' if lent else 'debt_borrowed'
+        person = _debt_person(tokens, trans_type)
+        if not person:
+            return None
+        confidence = amount_confidence(amount, currency, amount_text, HIGH_CONFIDENCE)
+        transaction.update({
+            'type': trans_type,
+            'category': DEBT_CATEGORIES[trans_type],
+            'person_name': person.capitalize(),
+            'confidence': confidence,
+        })
+        return {'transactions': [transaction], 'total_confidence': confidence, 'source': 'rules'}
+
+    # Kategoriya: eng aniq bitta kategoriya bo'lishi kerak
+    hits = _find_aliases(rest, tokens, CATEGORY_ALIASES)
+    if len(hits) > 1:
+        return None
+
+    # "oldim" yolg'iz turni bildirmaydi: "oylik oldim" - kirim, "non oldim" - chiqim
+    income_word = _has_word(tokens, INCOME_WORDS)
+    expense_word = _has_word(tokens, EXPENSE_WORDS)
+
+    if hits:
+        category, alias = next(iter(hits.items()))
+        implied = _category_type(category)
+        explicit = None
+        if income_word != expense_word:
+            explicit = 'income' if income_word else 'expense'
+        elif income_word and expense_word:
+            return None
+        if explicit and implied and explicit != implied:
+            return None
+        trans_type = explicit or implied
+        if not trans_type:
+            return None
+        confidence = HIGH_CONFIDENCE
+        description = alias if alias != category.lower() else ''
+    else:
+        # Kategoriyasiz faqat "50 dollar xarajat", "100k kirim" kabi to'liq tanish xabarlar
+        if income_word == expense_word:
+            return None
+        known = set(INCOME_WORDS) | set(EXPENSE_WORDS) | FILLER_WORDS | currency_tokens | {'oldim', 'qildim', 'bo\'ldi'}
+        if any(token not in known and not _has_word([token], INCOME_WORDS + EXPENSE_WORDS) for token in tokens):
+            return None
+        trans_type = 'income' if income_word else 'expense'
+        category = 'Boshqa'
+        confidence = GENERIC_CONFIDENCE
+        description = ''
+
+    confidence = amount_confidence(amount, currency, amount_text, confidence)
+    transaction.update({
+        'type': trans_type,
+        'category': category,
+        'description': description,
+        'confidence': confidence,
+    })
+    return {'transactions': [transaction], 'total_confidence': confidence, 'source': 'rules'}
+
+
+def parse_business_transaction(text: str, expense_categories: Dict[str, List[str]],
+                               income_categories: Dict[str, List[str]],
+                               debt_keywords: Dict[str, List[str]],
+                               warehouse_keywords: Dict[str, List[str]]) -> Optional[Dict]:
+    """Biznes tarifi uchun tezkor tahlil (BusinessAIParser kategoriyalari bilan).
+
+    Faqat oddiy kirim/chiqim; qarz, ombor va savol xabarlari None qaytaradi.
+    """
+    if not text or len(text) > 120 or '?' in text:
+        return None
+    normalized = normalize(text)
+    if _TIME_RE.search(normalized) or _UNIT_RE.search(normalized) or 'ombor' in normalized:
+        return None
+
+    amounts = extract_amounts(normalized)
+    if len(amounts) != 1:
+        return None
+    amount, amount_start, amount_end = amounts[0]
+    rest = normalized[:amount_start] + ' ' + normalized[amount_end:]
+    tokens = tokenize(rest)
+    if any(token in COMPLEX_WORDS for token in tokens) or ',' in rest or ' va ' in f" {rest} ":
+        return None
+
+    # Qarz va ombor iboralari - LLM hal qiladi
+    debt_phrases = [p for phrases in debt_keywords.values() for p in phrases if ' ' in p or p.startswith('qarz')]
+    if any(token.startswith('qarz') for token in tokens) or any(p in rest for p in debt_phrases):
+        return None
+    if _has_word(tokens, debt_keywords.get('returned', [])):
+        return None
+    money_verbs = set(EXPENSE_WORDS) | set(INCOME_WORDS)
+    warehouse_only = [w for words in warehouse_keywords.values() for w in words if w not in money_verbs]
+    if any(_matches_word(token, w) for token in tokens for w in warehouse_only if ' ' not in w):
+        return None
+
+    currency, _ = detect_currency(tokens)
+    if currency not in ('UZS', 'USD'):
+        return None
+
+    expense_hits = _find_aliases(rest, tokens, {k: v for k, v in expense_categories.items() if v and k != 'tovar'})
+    income_hits = _find_aliases(rest, tokens, {k: v for k, v in income_categories.items() if v})
+    if len(expense_hits) + len(income_hits) != 1:
+        return None
+    if income_hits:
+        trans_type, category = 'income', next(iter(income_hits))
+    else:
+        trans_type, category = 'expense', next(iter(expense_hits))
+
+    income_word = _has_word(tokens, ('tushdi', 'keldi', 'kirim', 'daromad', 'tushum'))
+    expense_word = _has_word(tokens, ('xarajat', 'chiqim', "to'ladim", 'toladim', 'berdim', 'ketdi', 'sarfladim'))
+    if (trans_type == 'income' and expense_word) or (trans_type == 'expense' and income_word):
+        return None
+
+    return {
+        'type': trans_type,
+        'amount': amount,
+        'currency': currency,
+        'category': category,
+        'description': text.strip(),
+        'date': datetime.now().strftime('%Y-%m-%d'),
+        'confidence': amount_confidence(amount, currency, normalized[amount_start:amount_end], HIGH_CONFIDENCE),
+        'source': 'rules',
+    }
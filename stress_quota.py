@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Kvota hisoblagichlari uchun parallel stress test
+100 ta parallel increment_plus_usage va Pro xabari (reserve_pro_usage +
+charge_llm_usage, handlerlardagi kabi) limitdan ortiq sarflamasligini lokal
+MySQL'da tekshiradi.
+
+Ishga tushirish:
+    python3 stress_quota.py [parallel_soni]
+"""
+
+import asyncio
+import math
+import sys
+from datetime import datetime
+
+from config import PRO_MONTHLY_COST_LIMIT
+from database import db
+
+STRESS_USER_ID = 900000000002
+PLUS_VOICE_LIMIT = 30
+# Pro: har bir xabar shuncha band qiladi va haqiqiy narxi shuncha chiqadi (so'm)
+PRO_RESERVE_COST = 500.0
+PRO_REAL_COST = 400.0
+
+
+async def seed():
+    """Stress foydalanuvchisi, Plus paket va Pro xarajat qatorini yaratish"""
+    await cleanup()
+    await db.execute_query(
+        "INSERT IGNORE INTO users (user_id, username, first_name) VALUES (%s, 'stress', 'Stress')",
+        (STRESS_USER_ID,)
+    )
+    await db.create_plus_package_purchase(STRESS_USER_ID, 'stress', 1000, PLUS_VOICE_LIMIT)
+
+
+async def cleanup():
+    await db.execute_query("DELETE FROM plus_package_purchases WHERE user_id = %s", (STRESS_USER_ID,))
+    await db.execute_query("DELETE FROM pro_usage_tracking WHERE user_id = %s", (STRESS_USER_ID,))
+    await db.execute_query("DELETE FROM users WHERE user_id = %s", (STRESS_USER_ID,))
+
+
+async def stress_plus(parallel: int) -> bool:
+    results = await asyncio.gather(*[
+        db.increment_plus_usage(STRESS_USER_ID, 'voice') for _ in range(parallel)
+    ])
+    granted = sum(1 for ok in results if ok)
+    row = await db.execute_one(
+        "SELECT voice_used, status FROM plus_package_purchases WHERE user_id = %s",
+        (STRESS_USER_ID,)
+    )
+    expected = min(parallel, PLUS_VOICE_LIMIT)
+    ok = granted == expected and row.get('voice_used') == expected
+    status = "✅" if ok else "❌"
+    print(f"   {status} Plus: {granted}/{parallel} ruxsat, voice_used={row.get('voice_used')} "
+          f"(kutilgan {expected}), status={row.get('status')}")
+    return ok
+
+
+async def stress_pro(parallel: int) -> bool:
+    """Handlerlar yo'li: reserve_pro_usage bilan band qilish, keyin haqiqiy narx bilan hisoblash"""
+    month_year = datetime.now().strftime('%Y-%m')
+
+    async def message():
+        if not await db.reserve_pro_usage(STRESS_USER_ID, 'voice', PRO_RESERVE_COST, month_year):
+            return False
+        await db.charge_llm_usage(STRESS_USER_ID, {}, 'voice', extra_cost=PRO_REAL_COST,
+                                  month_year=month_year, reserved=PRO_RESERVE_COST)
+        return True
+
+    results = await asyncio.gather(*[message() for _ in range(parallel)])
+    granted = sum(1 for ok in results if ok)
+    usage = await db.get_or_create_pro_usage(STRESS_USER_ID, month_year)
+    # total_cost < limit bo'lganda band qilinadi: oxirgi ruxsat limitdan bitta band qilishgacha oshiradi
+    expected = min(parallel, math.ceil(PRO_MONTHLY_COST_LIMIT / PRO_RESERVE_COST))
+    ok = (granted == expected and usage['voice_count'] == expected
+          and usage['total_cost'] == expected * PRO_REAL_COST)
+    status = "✅" if ok else "❌"
+    print(f"   {status} Pro: {granted}/{parallel} ruxsat, voice_count={usage['voice_count']} "
+          f"total_cost={usage['total_cost']:,.2f} (kutilgan {expected} ta)")
+    return ok
+
+
+async def main():
+    parallel = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    print(f"🔥 Kvota stress testi ({parallel} ta parallel chaqiruv)")
+    print("=" * 60)
+    await db.create_pool()
+    try:
+        await seed()
+        plus_ok = await stress_plus(parallel)
+        pro_ok = await stress_pro(parallel)
+    finally:
+        await cleanup()
+        await db.close_pool()
+
+    print("=" * 60)
+    success = plus_ok and pro_ok
+    print("🎉 Limitdan ortiq sarf yo'q!" if success else "❌ Kvota buzildi!")
+    return success
+
+
+if __name__ == "__main__":
+    success = asyncio.run(main())
+    sys.exit(0 if success else 1)
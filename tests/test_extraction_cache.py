@@ -0,0 +1,30 @@
+import asyncio
+
+from extraction_cache import ExtractionCache
+
+RESULT = {'transactions': [{'type': 'expense', 'amount': 25000, 'category': 'ovqat'}], 'total_confidence': 0.9}
+
+
+def _usage(calls, cost_uzs):
+    return {'calls': calls, 'prompt_tokens': 0, 'completion_tokens': 0, 'cost_usd': 0.0,
+            'cost_uzs': cost_uzs, 'tasks': {}}
+
+
+def test_saved_cost_uses_measured_llm_cost():
+    cache = ExtractionCache()
+    assert cache.stats()['llm_cost_saved'] == 0.0
+
+    cache.record_llm_cost(_usage(1, 4.0))
+    cache.record_llm_cost(_usage(2, 8.0))
+    # Javob bermagan (so'rov yuborilmagan) ajratish o'rtachani buzmaydi
+    cache.record_llm_cost(_usage(0, 0.0))
+    key = cache.key("Kofe 25000 so'm")
+    asyncio.run(cache.set(key, RESULT))
+    assert asyncio.run(cache.get(cache.key('kofe 25 ming'))) == RESULT
+    assert asyncio.run(cache.get(key)) == RESULT
+
+    stats = cache.stats()
+    assert stats['hits'] == 2
+    assert stats['llm_extractions'] == 2
+    assert stats['llm_cost_per_extraction'] == 6.0
+    assert stats['llm_cost_saved'] == 12.0
@@ -0,0 +1,95 @@
+import asyncio
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import MySQLStorage, dumps_data, loads_data
+
+SAMPLE = {
+    'due_date': date(2026, 10, 18),
+    'created_at': datetime(2026, 10, 18, 9, 30, 15),
+    'remind_at': time(21, 0),
+    'delay': timedelta(minutes=90),
+    'amount': Decimal('25000.50'),
+    'pair': (1, 'a'),
+    'tags': {'kafe', 'tushlik'},
+    'by_id': {7: 'x', (1, 2): [date(2026, 1, 1)]},
+    'items': [{'amount': Decimal('1.10'), 'when': date(2026, 2, 3)}],
+    'plain': {'text': 'salom', 'count': 3, 'ratio': 0.5, 'flag': True, 'none': None},
+}
+
+
+def test_round_trip_keeps_types():
+    restored = loads_data(dumps_data(SAMPLE))
+    assert restored == SAMPLE
+    assert type(restored['created_at']) is datetime
+    assert type(restored['due_date']) is date
+    assert type(restored['amount']) is Decimal
+    assert type(restored['pair']) is tuple
+    assert type(restored['tags']) is set
+    assert type(restored['items'][0]['amount']) is Decimal
+
+
+def test_plain_json_is_unchanged():
+    raw = dumps_data(SAMPLE['plain'])
+    assert '__fsm__' not in raw
+    assert loads_data(raw) == SAMPLE['plain']
+
+
+def test_empty_data():
+    assert loads_data(None) == {}
+    assert loads_data(dumps_data({})) == {}
+
+
+class FakeCursor:
+    def __init__(self, table):
+        self.table = table
+
+    async def execute(self, query, params):
+        if query.lstrip().startswith('DELETE'):
+            for key in params:
+                self.table.pop(key, None)
+            return
+        for i in range(0, len(params), 4):
+            key, state, data, _ = params[i:i + 4]
+            self.table[key] = {'state': state, 'data': data}
+
+
+class FakeTransaction:
+    def __init__(self, table):
+        self.table = table
+
+    async def __aenter__(self):
+        return FakeCursor(self.table)
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeDB:
+    pool = True
+
+    def __init__(self):
+        self.table = {}
+
+    def transaction(self):
+        return FakeTransaction(self.table)
+
+    async def execute_one(self, query, params):
+        return self.table.get(params[0])
+
+
+def test_storage_round_trip_through_database():
+    async def scenario():
+        db = FakeDB()
+        key = StorageKey(bot_id=1, chat_id=2, user_id=2)
+        storage = MySQLStorage(db)
+        await storage.set_data(key, SAMPLE)
+        await storage.close()
+
+        # Yangi jarayon: lokal kesh bo'sh, data bazadan o'qiladi
+        fresh = MySQLStorage(db)
+        return await fresh.get_data(key)
+
+    assert asyncio.run(scenario()) == SAMPLE
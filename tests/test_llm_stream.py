@@ -0,0 +1,93 @@
+"""stream_chat ni o'rnatilgan openai SDK bilan OpenAI formatidagi lokal SSE serverga qarshi tekshirish"""
+import asyncio
+import json
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from openai import AsyncOpenAI
+
+from llm_gateway import LLMGateway
+
+MODEL = 'gpt-4o-mini'
+
+
+def _chunk(content=None, usage=None, finish=None):
+    choices = [] if usage else [{'index': 0, 'delta': {'content': content} if content else {},
+                                 'finish_reason': finish}]
+    return {'id': 'chatcmpl-1', 'object': 'chat.completion.chunk', 'created': 1, 'model': MODEL,
+            'choices': choices, **({'usage': usage} if usage else {})}
+
+
+async def _serve(handler, scenario):
+    app = web.Application()
+    app.router.add_post('/v1/chat/completions', handler)
+    server = TestServer(app)
+    await server.start_server()
+    gateway = LLMGateway()
+    gateway._clients['openai'] = AsyncOpenAI(api_key='test', base_url=str(server.make_url('/v1')), max_retries=0)
+    try:
+        return await scenario(gateway)
+    finally:
+        await gateway._clients['openai'].close()
+        await server.close()
+
+
+def test_stream_chat_yields_deltas_and_records_usage():
+    requests = []
+
+    async def completions(request):
+        requests.append(await request.json())
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        chunks = [_chunk('Sa'), _chunk('lom'), _chunk(finish='stop'),
+                  _chunk(usage={'prompt_tokens': 12, 'completion_tokens': 2, 'total_tokens': 14})]
+        for chunk in chunks:
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def scenario(gateway):
+        with gateway.track_usage() as usage:
+            parts = [part async for part in gateway.stream_chat(
+                [{'role': 'user', 'content': 'salom'}], model=MODEL, provider='openai', task='chat')]
+        return parts, usage
+
+    parts, usage = asyncio.run(_serve(completions, scenario))
+    assert parts == ['Sa', 'lom']
+    assert requests[0]['stream'] is True
+    assert requests[0]['stream_options'] == {'include_usage': True}
+    assert (usage['calls'], usage['prompt_tokens'], usage['completion_tokens']) == (1, 12, 2)
+    assert usage['tasks'][('chat', MODEL)]['calls'] == 1
+
+
+def test_stream_chat_estimates_usage_without_usage_chunk():
+    async def completions(request):
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        await response.write(f"data: {json.dumps(_chunk('12345678'))}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def scenario(gateway):
+        with gateway.track_usage() as usage:
+            parts = [part async for part in gateway.stream_chat(
+                [{'role': 'user', 'content': 'x' * 40}], model=MODEL, provider='openai')]
+        return parts, usage
+
+    parts, usage = asyncio.run(_serve(completions, scenario))
+    assert parts == ['12345678']
+    assert (usage['prompt_tokens'], usage['completion_tokens']) == (10, 2)
+
+
+def test_stream_chat_falls_back_to_complete_before_first_chunk():
+    async def completions(request):
+        return web.json_response({'error': {'message': 'stream_options unsupported'}}, status=400)
+
+    async def scenario(gateway):
+        async def complete(task, messages, **params):
+            return 'oqimsiz javob'
+        gateway.complete = complete
+        return [part async for part in gateway.stream_chat(
+            [{'role': 'user', 'content': 'salom'}], model=MODEL, provider='openai')]
+
+    assert asyncio.run(_serve(completions, scenario)) == ['oqimsiz javob']
@@ -0,0 +1,30 @@
+import asyncio
+import time
+
+from nightly_reports import dispatch_reports
+
+
+async def _reports(count):
+    for user_id in range(count):
+        yield {'user_id': user_id}
+
+
+def test_dispatch_is_paced_across_workers():
+    stamps = []
+
+    async def send(report):
+        stamps.append(time.monotonic())
+
+    counts = asyncio.run(dispatch_reports(_reports(21), send, workers=10, rate_per_second=50))
+    assert counts == {'built': 21, 'sent': 21, 'failed': 0}
+    # 21 ta xabar 50/s da: birinchisi darhol, oxirgisi ~0.4 s dan keyin
+    assert stamps[-1] - stamps[0] >= 0.38
+
+
+def test_failed_send_is_counted():
+    async def send(report):
+        if report['user_id'] == 1:
+            raise RuntimeError('blocked')
+
+    counts = asyncio.run(dispatch_reports(_reports(3), send, workers=2, rate_per_second=1000))
+    assert counts == {'built': 3, 'sent': 2, 'failed': 1}
@@ -0,0 +1,102 @@
+import asyncio
+from types import SimpleNamespace
+
+import response_stream
+from response_stream import CURSOR, MAX_MESSAGE_LENGTH, MESSAGE_BREAK, TelegramStreamer, fit_message
+
+
+class FakeBot:
+    """Yuborilgan va tahrirlangan xabarlarni yozib boradigan soxta bot"""
+
+    def __init__(self):
+        self.messages = {}
+        self.sends = 0
+        self.edits = 0
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        self.sends += 1
+        message_id = len(self.messages) + 1
+        self.messages[message_id] = text
+        return SimpleNamespace(message_id=message_id)
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        self.edits += 1
+        self.messages[message_id] = text
+
+    def texts(self):
+        return [self.messages[key] for key in sorted(self.messages)]
+
+
+def _stream(deltas, monkeypatch, **kwargs):
+    # Tahrirlash oralig'ini kutmaslik - har bir bo'lak darhol ko'rinadi
+    monkeypatch.setattr(response_stream, 'EDIT_INTERVAL', 0)
+    monkeypatch.setattr(response_stream, 'MIN_EDIT_CHARS', 1)
+    bot = FakeBot()
+
+    async def run():
+        streamer = TelegramStreamer(bot, 1, **kwargs)
+        for delta in deltas:
+            await streamer.feed(delta)
+        return streamer, await streamer.finish()
+
+    streamer, sent = asyncio.run(run())
+    return bot, streamer, sent
+
+
+def test_feed_edits_one_message_and_finish_removes_cursor(monkeypatch):
+    bot, streamer, sent = _stream(['Bugun ', 'xarajatlaringiz ', "50 000 so'm"], monkeypatch)
+    assert sent == ["Bugun xarajatlaringiz 50 000 so'm"]
+    assert bot.sends == 1 and bot.edits >= 2
+    assert bot.texts() == ["Bugun xarajatlaringiz 50 000 so'm"]
+    assert streamer.first_visible_ms is not None
+
+
+def test_preview_shows_cursor_while_streaming(monkeypatch):
+    monkeypatch.setattr(response_stream, 'EDIT_INTERVAL', 0)
+    bot = FakeBot()
+
+    async def run():
+        streamer = TelegramStreamer(bot, 1)
+        await streamer.feed('Salom')
+        return bot.texts()
+
+    assert asyncio.run(run()) == ['Salom' + CURSOR]
+
+
+def test_message_break_starts_new_message(monkeypatch):
+    bot, _, sent = _stream(['Birinchi', f' javob{MESSAGE_BREAK}Ikki', 'nchi javob'], monkeypatch)
+    assert sent == ['Birinchi javob', 'Ikkinchi javob']
+    assert bot.texts() == sent
+
+
+def test_prefix_only_on_first_message(monkeypatch):
+    _, _, sent = _stream([f'bir{MESSAGE_BREAK}ikki'], monkeypatch, prefix='🤖 ')
+    assert sent == ['🤖 bir', 'ikki']
+
+
+def test_long_answer_is_split_at_telegram_limit(monkeypatch):
+    text = ' '.join(['soz'] * 2000)
+    bot, _, sent = _stream([text[:3000], text[3000:]], monkeypatch)
+    assert len(sent) == 2
+    assert all(len(piece) <= MAX_MESSAGE_LENGTH for piece in bot.texts())
+    assert ' '.join(sent) == text
+
+
+def test_split_stable_commits_finished_parts(monkeypatch):
+    def split_stable(text):
+        *done, rest = text.split('\n\n')
+        return done, rest
+
+    def split_final(text):
+        return [part for part in text.split('\n\n') if part]
+
+    bot, _, sent = _stream(['1-qism\n\n2-', 'qism\n\n3-qism'], monkeypatch,
+                           split_stable=split_stable, split_final=split_final)
+    assert sent == ['1-qism', '2-qism', '3-qism']
+    assert bot.texts() == sent
+
+
+def test_fit_message_respects_limit():
+    pieces = fit_message('a ' * 700, 1024)
+    assert all(len(piece) <= 1024 for piece in pieces)
+    assert ' '.join(pieces).split() == ['a'] * 700
@@ -0,0 +1,62 @@
+import pytest
+
+from rule_parser import (
+    FAST_PATH_CONFIDENCE, HIGH_CONFIDENCE, LOW_CONFIDENCE, has_reminder_cues, parse_business_transaction,
+    parse_transaction,
+)
+
+
+@pytest.mark.parametrize('text, amount', [
+    ('taksi 20 ming', 20000),
+    ('ovqatga 50k', 50000),
+    ('oylik 5 mln tushdi', 5000000),
+    ("taksi 1500 so'm", 1500),
+    ('kofe 5 dollar', 5),
+])
+def test_clear_amounts_keep_high_confidence(text, amount):
+    result = parse_transaction(text)
+    assert result['transactions'][0]['amount'] == amount
+    assert result['total_confidence'] >= FAST_PATH_CONFIDENCE
+
+
+@pytest.mark.parametrize('text', [
+    'non 5',
+    "taksi 500 so'm",
+    'taksi 100 m',
+    'taksi 100 mga',
+    'Aliga 100 m qarz berdim',
+])
+def test_suspicious_amounts_get_low_confidence(text):
+    result = parse_transaction(text)
+    assert result['total_confidence'] == LOW_CONFIDENCE
+    assert result['transactions'][0]['confidence'] == LOW_CONFIDENCE
+    assert result['total_confidence'] < FAST_PATH_CONFIDENCE
+
+
+def test_mln_is_not_ambiguous():
+    assert parse_transaction('taksi 2 mln')['total_confidence'] == HIGH_CONFIDENCE
+
+
+def test_business_parser_lowers_confidence_for_ambiguous_amount():
+    categories = {'transport': ['taksi']}
+    args = (categories, {}, {}, {})
+    assert parse_business_transaction('taksi 20 ming', *args)['confidence'] == HIGH_CONFIDENCE
+    assert parse_business_transaction('taksi 100 m', *args)['confidence'] == LOW_CONFIDENCE
+
+
+@pytest.mark.parametrize('text', [
+    'Напомни позвонить маме',
+    'Завтра в 10 встреча с клиентом',
+    'bugun kechqurun dorixonaga borish',
+    'Keyingi hafta Toshkentga safar',
+    'Не забудь купить хлеб',
+    'ertaga soat 11:00 bankka boramiz',
+    '10 da dars',
+])
+def test_reminder_cues_found(text):
+    assert has_reminder_cues(text)
+
+
+@pytest.mark.parametrize('text', ['taksi 20 ming', 'ovqatga 50k', 'oylik 5 mln tushdi', "kofe 25000 so'm"])
+def test_plain_transactions_have_no_reminder_cues(text):
+    assert not has_reminder_cues(text)
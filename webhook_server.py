@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Webhook rejimi: aiohttp qabul qiluvchi + worker jarayonlar havzasi
+
+dp.start_polling bitta jarayonda ishlaydi - bitta foydalanuvchining uzoq LLM
+so'rovi bilan band bo'lgan yadro qolganlarni ham sekinlashtiradi. Bu rejimda:
+
+- qabul qiluvchi (shu jarayon) Telegram webhook'ini qabul qiladi va
+  yangilanishni from_user.id bo'yicha tanlangan workerning cheklangan
+  navbatiga qo'yadi. Navbat to'la bo'lsa 503 qaytariladi - Telegram keyinroq
+  qayta yuboradi
+- har bir worker alohida jarayon: main.py dagi dp/handlerlar bilan
+  yangilanishlarni qayta ishlaydi. Bitta foydalanuvchi yangilanishlari
+  doim bitta workerga tushadi va ketma-ket bajariladi, turli
+  foydalanuvchilar parallel (WEBHOOK_WORKER_CONCURRENCY)
+- kunlik hisobotlar, eslatmalar va broadcast'lar faqat 0-workerda. Boshqa
+  workerlarda yaratilgan/o'zgargan eslatmalar reminder_changes navbati
+  orqali 0-workerdagi rejalashtiruvchiga darhol yetkaziladi
+- GET /metrics - qabul qilingan/rad etilgan yangilanishlar, soniyadagi
+  o'tkazuvchanlik va har bir worker navbati chuqurligi (JSON)
+
+FSM holatlari workerlar orasida fsm_storage (MySQL) orqali saqlanadi.
+
+Ishga tushirish:
+    WEBHOOK_BASE_URL=https://your-domain.com WEBHOOK_SECRET=... python3 webhook_server.py
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import queue
+import sys
+import time
+from collections import deque
+from pathlib import Path
+
+from aiohttp import web
+
+# Loyiha papkasini Python pathiga qo'shish
+project_dir = Path(__file__).parent
+sys.path.insert(0, str(project_dir))
+
+from config import (
+    BOT_TOKEN,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_SECRET,
+    WEBHOOK_WORKER_CONCURRENCY,
+    WEBHOOK_WORKERS,
+)
+
+# O'tkazuvchanlik shu oynada hisoblanadi (soniya)
+THROUGHPUT_WINDOW = 60
+METRICS_SAMPLE_INTERVAL = 5
+WORKER_STOP_TIMEOUT = 30
+
+# Worker jarayonlari uchun umumiy hisoblagichlar indekslari
+PROCESSED, ERRORS, IN_FLIGHT = range(3)
+
+
+def update_user_id(update: dict) -> int:
+    """Yangilanish egasi: from_user.id, bo'lmasa chat.id, bo'lmasa update_id"""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if user and user.get('id'):
+            return user['id']
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat and chat.get('id'):
+            return chat['id']
+    return update.get('update_id', 0)
+
+
+def worker_index(update: dict, workers: int) -> int:
+    return update_user_id(update) % workers
+
+
+class UserOrderedRunner:
+    """Bitta foydalanuvchi yangilanishlarini ketma-ket, turli foydalanuvchilarni parallel bajarish"""
+
+    def __init__(self, handle, concurrency: int):
+        self.handle = handle
+        self.slots = asyncio.Semaphore(concurrency)
+        self._tails = {}
+
+    async def submit(self, user_id: int, update: dict):
+        # Slot bo'shaguncha navbatdan yangi yangilanish olinmaydi - xotira cheklangan
+        await self.slots.acquire()
+        previous = self._tails.get(user_id)
+        task = asyncio.create_task(self._run(previous, update))
+        self._tails[user_id] = task
+        task.add_done_callback(lambda done: self._finished(user_id, done))
+
+    def _finished(self, user_id: int, task: asyncio.Task):
+        self.slots.release()
+        if self._tails.get(user_id) is task:
+            del self._tails[user_id]
+
+    async def _run(self, previous, update: dict):
+        if previous is not None:
+            await asyncio.wait([previous])
+        await self.handle(update)
+
+    async def drain(self):
+        if self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+
+async def _relay_reminder_changes(db, reminder_changes):
+    """0-worker: boshqa workerlardan kelgan eslatma o'zgarishlarini rejalashtiruvchiga uzatish"""
+    loop = asyncio.get_running_loop()
+    while True:
+        change = await loop.run_in_executor(None, reminder_changes.get)
+        if change is None:
+            return
+        await db.notify_reminder_changed(*change)
+
+
+async def _worker_loop(index: int, updates, counters, reminder_changes):
+    # main.py faqat worker jarayonida import qilinadi - qabul qiluvchi yengil qoladi
+    import main as bot_app
+    from aiogram.types import Update
+
+    await bot_app.db.create_pool()
+    bot_app.business_module.set_openai_client(bot_app.ai_chat.openai_client)
+    await bot_app.load_config_from_db()
+    relay = None
+    if index == 0:
+        await bot_app.broadcasts.resume_pending()
+        bot_app.start_background_tasks()
+        relay = asyncio.create_task(_relay_reminder_changes(bot_app.db, reminder_changes))
+    else:
+        # Rejalashtiruvchi faqat 0-workerda - o'zgarishlar unga yuboriladi
+        async def forward_reminder_change(reminder_id: int, removed: bool = False):
+            reminder_changes.put((reminder_id, removed))
+
+        bot_app.db.reminder_listeners.append(forward_reminder_change)
+
+    async def handle(data: dict):
+        counters[IN_FLIGHT] += 1
+        try:
+            update = Update.model_validate(data, context={"bot": bot_app.bot})
+            await bot_app.dp.feed_update(bot_app.bot, update)
+            counters[PROCESSED] += 1
+        except Exception as e:
+            counters[ERRORS] += 1
+            logging.error(f"Worker {index}: yangilanish {data.get('update_id')} xatolik bilan tugadi: {e}")
+        finally:
+            counters[IN_FLIGHT] -= 1
+
+    runner = UserOrderedRunner(handle, WEBHOOK_WORKER_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    logging.info(f"Worker {index} tayyor")
+    try:
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            await runner.submit(update_user_id(data), data)
+        await runner.drain()
+    finally:
+        if relay is not None:
+            # Executor'dagi get() ni bo'shatish - aks holda jarayon to'xtamaydi
+            reminder_changes.put(None)
+            await relay
+        await bot_app.dp.storage.close()
+        await bot_app.bot.session.close()
+        await bot_app.llm.close()
+        await bot_app.db.close_pool()
+
+
+def run_worker(index: int, updates, counters, reminder_changes):
+    """Worker jarayoni kirish nuqtasi (spawn)"""
+    logging.basicConfig(level=logging.INFO, format=f"[worker {index}] %(levelname)s %(message)s")
+    try:
+        asyncio.run(_worker_loop(index, updates, counters, reminder_changes))
+    except KeyboardInterrupt:
+        pass
+
+
+class WebhookIngress:
+    """Webhook qabul qiluvchi: yangilanishlarni workerlar navbatiga taqsimlash"""
+
+    def __init__(self, workers: int = WEBHOOK_WORKERS, queue_size: int = WEBHOOK_QUEUE_SIZE):
+        context = multiprocessing.get_context('spawn')
+        self.queues = [context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.counters = [context.Array('q', 3) for _ in range(workers)]
+        # Eslatma o'zgarishlari (reminder_id, removed) - 0-workerdagi rejalashtiruvchiga
+        self.reminder_changes = context.Queue()
+        self.processes = [
+            context.Process(target=run_worker, args=(i, self.queues[i], self.counters[i], self.reminder_changes),
+                            daemon=True)
+            for i in range(workers)
+        ]
+        self.started = time.monotonic()
+        self.received = 0
+        self.rejected = 0
+        self._samples = deque(maxlen=THROUGHPUT_WINDOW // METRICS_SAMPLE_INTERVAL + 1)
+        self._sampler = None
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        try:
+            self.queues[worker_index(data, len(self.queues))].put_nowait(data)
+        except queue.Full:
+            self.rejected += 1
+            return web.Response(status=503)
+        self.received += 1
+        return web.Response()
+
+    def _processed_total(self) -> int:
+        return sum(counters[PROCESSED] for counters in self.counters)
+
+    async def _sample(self):
+        while True:
+            self._samples.append((time.monotonic(), self._processed_total()))
+            await asyncio.sleep(METRICS_SAMPLE_INTERVAL)
+
+    def metrics(self) -> dict:
+        throughput = 0.0
+        if len(self._samples) > 1:
+            (first_at, first_total), (last_at, last_total) = self._samples[0], self._samples[-1]
+            if last_at > first_at:
+                throughput = (last_total - first_total) / (last_at - first_at)
+        workers = []
+        for i, (updates, counters) in enumerate(zip(self.queues, self.counters)):
+            workers.append({
+                'worker': i,
+                'alive': self.processes[i].is_alive(),
+                'queue_depth': updates.qsize(),
+                'in_flight': counters[IN_FLIGHT],
+                'processed': counters[PROCESSED],
+                'errors': counters[ERRORS],
+            })
+        return {
+            'uptime_seconds': round(time.monotonic() - self.started, 1),
+            'received': self.received,
+            'rejected': self.rejected,
+            'processed': self._processed_total(),
+            'updates_per_second': round(throughput, 2),
+            'queue_depth': sum(w['queue_depth'] for w in workers),
+            'workers': workers,
+        }
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.json_response(self.metrics())
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        alive = all(process.is_alive() for process in self.processes)
+        return web.json_response({'status': 'ok' if alive else 'degraded'}, status=200 if alive else 503)
+
+    async def on_startup(self, app: web.Application):
+        from aiogram import Bot
+        from database import db
+
+        # Migratsiyalar workerlardan oldin bir marta
+        await db.create_pool()
+        await db.create_tables()
+        await db.close_pool()
+
+        for process in self.processes:
+            process.start()
+        self._sampler = asyncio.create_task(self._sample())
+
+        if WEBHOOK_BASE_URL:
+            bot = Bot(token=BOT_TOKEN)
+            try:
+                await bot.set_webhook(url=f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET)
+                logging.info(f"Webhook o'rnatildi: {WEBHOOK_BASE_URL}{WEBHOOK_PATH}")
+            finally:
+                await bot.session.close()
+        else:
+            logging.warning("WEBHOOK_BASE_URL sozlanmagan - webhook Telegram'da o'rnatilmadi")
+
+    async def on_cleanup(self, app: web.Application):
+        if self._sampler:
+            self._sampler.cancel()
+        # Navbatdagi yangilanishlar tugatiladi, keyin workerlar to'xtaydi
+        for updates in self.queues:
+            try:
+                updates.put_nowait(None)
+            except queue.Full:
+                # To'la navbat - worker join vaqtidan keyin to'xtatiladi
+                pass
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle_update)
+        app.router.add_get('/metrics', self.handle_metrics)
+        app.router.add_get('/health', self.handle_health)
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    ingress = WebhookIngress()
+    print(f"🚀 Webhook server: 0.0.0.0:{WEBHOOK_PORT}{WEBHOOK_PATH}, {len(ingress.processes)} worker")
+    web.run_app(ingress.create_app(), host='0.0.0.0', port=WEBHOOK_PORT)